@@ -10,9 +10,9 @@ Created on Fri Aug 16 17:05:10 2019
 import os
 import time
 import numpy as np
-from . import geometry, diag, io, lyapounov, propagation, hamiltonian, wavefunction, measurement, timing
+from . import geometry, diag, io, lyapounov, propagation, hamiltonian, wavefunction, measurement, timing, kernels, scheduler
 
-__all__ = ["diag","io","lyapounov","propagation","geometry","hamiltonian","wavefunction","measurement","timing"]
+__all__ = ["diag","io","lyapounov","propagation","geometry","hamiltonian","wavefunction","measurement","timing","kernels","scheduler"]
 
 
 
@@ -10,6 +10,9 @@
 //#include <immintrin.h>
 #include <complex.h>
 #include <time.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 #undef TIMING
 #define SIZE 64
@@ -22,20 +25,44 @@ void elementary_clenshaw_step_real_1d(const int dim_x, const int boundary_condit
 
 void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, const int b_x, const int b_y, const double * restrict wfc, const double * restrict psi, double * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3_x, const double c3_y);
 
+void elementary_clenshaw_step_real_3d(const int dim_x, const int dim_y, const int dim_z, const int b_x, const int b_y, const int b_z, const double * restrict wfc, const double * restrict psi, double * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3_x, const double c3_y, const double c3_z);
+
 void elementary_clenshaw_step_complex_1d(const int dim_x, const int boundary_condition, const double complex * restrict wfc, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3);
 
 void elementary_clenshaw_step_complex_2d(const int dim_x, const int dim_y, const int b_x, const int b_y, const double complex * restrict wfc, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3_x, const double c3_y);
 
 void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y, const int dim_z, const int b_x, const int b_y, const int b_z, const double complex * restrict wfc, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3_x, const double c3_y, const double c3_z);
 
+double chebyshev_complex_batched(const int dimension, const int * restrict tab_dim, const int max_order,  const int * restrict tab_boundary_condition, const int batch_size, double complex * restrict wfc, double complex * restrict psi, double complex * restrict psi_old,  const double * restrict disorder, const double * restrict tab_coef, const double * tab_tunneling, const double two_over_delta_e, const double two_e0_over_delta_e, const double g_times_delta_t, const double e0_times_delta_t);
+
+void elementary_clenshaw_step_complex_batched_1d(const int dim_x, const int boundary_condition, const int batch_size, const double complex * restrict wfc, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3);
+
+void elementary_clenshaw_step_complex_batched_2d(const int dim_x, const int dim_y, const int b_x, const int b_y, const int batch_size, const double complex * restrict wfc, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3_x, const double c3_y);
+
 void chebyshev_kpm_step(const int dimension, const int * restrict tab_dim, const int * restrict tab_boundary_condition, double complex * restrict psi, double complex * restrict psi_old,  const double * restrict disorder, const double * tab_tunneling, const double c1, const double c2);
 
+void chebyshev_kpm_step_block(const int dimension, const int * restrict tab_dim, const int * restrict tab_boundary_condition, const int block_size, double complex * restrict psi, double complex * restrict psi_old,  const double * restrict disorder, const double * tab_tunneling, const double c1, const double c2);
+
 void chebyshev_kpm_step_1d(const int dim_x, const int boundary_condition, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x);
 
 void chebyshev_kpm_step_2d(const int dim_x, const int dim_y, const int b_x, const int b_y,  const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x, const double c3_y);
 
 void chebyshev_kpm_step_3d(const int dim_x, const int dim_y, const int dim_z, const int b_x, const int b_y, const int b_z, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x, const double c3_y, const double c3_z);
 
+void chebyshev_kpm_step_block_1d(const int dim_x, const int boundary_condition, const int block_size, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x);
+
+void chebyshev_kpm_step_block_2d(const int dim_x, const int dim_y, const int b_x, const int b_y, const int block_size, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x, const double c3_y);
+
+void chebyshev_kpm_step_block_3d(const int dim_x, const int dim_y, const int dim_z, const int b_x, const int b_y, const int b_z, const int block_size, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x, const double c3_y, const double c3_z);
+
+int chebyshev_set_number_of_threads(const int number_of_threads);
+
+// Number of OpenMP threads used by the kernels, 1 by default (and always 1 when compiled without OpenMP)
+static int chebyshev_number_of_threads = 1;
+
+// Minimum number of sites for a 1d loop to be split among threads, below the threading overhead dominates
+#define MIN_SIZE_FOR_THREADS 4096
+
 uint64_t timespecDiff(struct timespec *timeA_p, struct timespec *timeB_p)
 {
   return ((timeA_p->tv_sec * 1000000000) + timeA_p->tv_nsec) -
@@ -44,6 +71,37 @@ uint64_t timespecDiff(struct timespec *timeA_p, struct timespec *timeB_p)
 
 // DO NOT ADD static to the specific routines as the Python code checks whether they exist 
 
+// Sets the number of threads used by the kernels. A non-positive value uses all available processors
+// Returns the number of threads actually used
+int chebyshev_set_number_of_threads(const int number_of_threads)
+{
+#ifdef _OPENMP
+  chebyshev_number_of_threads = (number_of_threads>0) ? number_of_threads : omp_get_num_procs();
+#else
+  chebyshev_number_of_threads = 1;
+#endif
+  return(chebyshev_number_of_threads);
+}
+
+// Computes the range [i_start,i_end[ of the chunk of [n_start,n_end[ handled by the current thread
+// Chunks are contiguous and their sizes differ by at most 1
+static inline void get_chunk(const int n_start, const int n_end, int * restrict i_start, int * restrict i_end)
+{
+#ifdef _OPENMP
+  int number_of_threads = omp_get_num_threads();
+  int thread_id = omp_get_thread_num();
+#else
+  int number_of_threads = 1;
+  int thread_id = 0;
+#endif
+  int n = (n_end>n_start) ? n_end-n_start : 0;
+  int chunk = n/number_of_threads;
+  int remainder = n%number_of_threads;
+  *i_start = n_start + thread_id*chunk + ((thread_id<remainder) ? thread_id : remainder);
+  *i_end = *i_start + chunk + ((thread_id<remainder) ? 1 : 0);
+  return;
+}
+
 // The following pragma (Intel only) has been tested at some point, but seems useless
 //#pragma distribute_point
 
@@ -65,8 +123,13 @@ double chebyshev_real(const int dimension, const int * restrict tab_dim, const i
   for (i=0;i<dimension;i++) {
     ntot *= tab_dim[i];
   }
-  for (i=0;i<2*ntot;i++) {
-    psi[i] = tab_coef[max_order] * wfc[i];
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && ntot>MIN_SIZE_FOR_THREADS) private(i)
+  {
+    int i_start, i_end;
+    get_chunk(0, 2*ntot, &i_start, &i_end);
+    for (i=i_start; i<i_end; i++) {
+      psi[i] = tab_coef[max_order] * wfc[i];
+    }
   }
   c1 = 2.0*two_over_delta_e;
   c2 = 2.0*two_e0_over_delta_e;
@@ -107,7 +170,7 @@ double chebyshev_real(const int dimension, const int * restrict tab_dim, const i
     c3_y = tab_tunneling[1]*two_over_delta_e;
     elementary_clenshaw_step_real_2d(dim_x, dim_y, b_x, b_y, wfc, psi_old, psi, disorder, tab_coef[0], 1, c1, c2, c3_x, c3_y);
   }
-/*  if (dimension==3) {
+  if (dimension==3) {
     int dim_x = tab_dim[0];
     int dim_y = tab_dim[1];
     int dim_z = tab_dim[2];
@@ -118,7 +181,7 @@ double chebyshev_real(const int dimension, const int * restrict tab_dim, const i
     double c3_y = 2.0*tab_tunneling[1]*two_over_delta_e;
     double c3_z = 2.0*tab_tunneling[2]*two_over_delta_e;
 //    printf("%d %d %d %d %f %f %f %f\n",dim_x,dim_y,b_x,b_y,c1,c2,c3_x,c3_y);
-    elementary_clenshaw_step_real_3d(dim_x, dim_y, dim_z, b_x, b_y, b_z, wfc, psi, psi_old, disorder, tab_coef[max_order-1], 0, c1, c2, c3_x, c3_y), c3_z;
+    elementary_clenshaw_step_real_3d(dim_x, dim_y, dim_z, b_x, b_y, b_z, wfc, psi, psi_old, disorder, tab_coef[max_order-1], 0, c1, c2, c3_x, c3_y, c3_z);
 // WARNING: max_order MUST be an even number, otherwise disaster guaranteed
     for (order=max_order-2;order>1;order-=2) {
 //      printf("order %d %f\n",order,tab_coef[order]);
@@ -130,14 +193,18 @@ double chebyshev_real(const int dimension, const int * restrict tab_dim, const i
     c2 = two_e0_over_delta_e;
     c3_x = tab_tunneling[0]*two_over_delta_e;
     c3_y = tab_tunneling[1]*two_over_delta_e;
+    c3_z = tab_tunneling[2]*two_over_delta_e;
     elementary_clenshaw_step_real_3d(dim_x, dim_y, dim_z, b_x, b_y, b_z, wfc, psi_old, psi, disorder, tab_coef[0], 1, c1, c2, c3_x, c3_y, c3_z);
   }
-*/
 
 // apply nonlinear shift
   if (g_times_delta_t==0.0) {
     cos_phase=cos(e0_times_delta_t);
     sin_phase=sin(e0_times_delta_t);
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && ntot>MIN_SIZE_FOR_THREADS) private(i)
+    {
+      int i_start, i_end;
+      get_chunk(0, ntot, &i_start, &i_end);
  #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -153,11 +220,16 @@ double chebyshev_real(const int dimension, const int * restrict tab_dim, const i
     #endif
   #endif
 #endif
-    for (i=0;i<ntot;i++) {
-      wfc[i] = psi[i]*cos_phase+psi[i+ntot]*sin_phase;
-      wfc[i+ntot] = psi[i+ntot]*cos_phase-psi[i]*sin_phase;
-   }
+      for (i=i_start; i<i_end; i++) {
+        wfc[i] = psi[i]*cos_phase+psi[i+ntot]*sin_phase;
+        wfc[i+ntot] = psi[i+ntot]*cos_phase-psi[i]*sin_phase;
+     }
+    }
   } else {
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && ntot>MIN_SIZE_FOR_THREADS) private(i,phase,argument) reduction(max:nonlinear_phase)
+    {
+      int i_start, i_end;
+      get_chunk(0, ntot, &i_start, &i_end);
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -173,13 +245,14 @@ double chebyshev_real(const int dimension, const int * restrict tab_dim, const i
     #endif
   #endif
 #endif 
-    for (i=0;i<ntot;i++) {
-      phase = g_times_delta_t*(psi[i]*psi[i]+psi[i+ntot]*psi[i+ntot]);
+      for (i=i_start; i<i_end; i++) {
+        phase = g_times_delta_t*(psi[i]*psi[i]+psi[i+ntot]*psi[i+ntot]);
 //      phase=0.0;
-      nonlinear_phase = (nonlinear_phase > fabs(phase)) ? nonlinear_phase : fabs(phase);
-      argument =  e0_times_delta_t+phase;
-      wfc[i] = psi[i]*cos(argument)+psi[i+ntot]*sin(argument);
-      wfc[i+ntot] = psi[i+ntot]*cos(argument)-psi[i]*sin(argument);
+        nonlinear_phase = (nonlinear_phase > fabs(phase)) ? nonlinear_phase : fabs(phase);
+        argument =  e0_times_delta_t+phase;
+        wfc[i] = psi[i]*cos(argument)+psi[i+ntot]*sin(argument);
+        wfc[i+ntot] = psi[i+ntot]*cos(argument)-psi[i]*sin(argument);
+      }
     }
   }
 //  printf("done\n");
@@ -207,8 +280,13 @@ double chebyshev_complex(const int dimension, const int * restrict tab_dim, cons
   for (i=0;i<dimension;i++) {
     ntot *= tab_dim[i];
   }
-  for (i=0;i<ntot;i++) {
-    psi[i] = tab_coef[max_order] * wfc[i];
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && ntot>MIN_SIZE_FOR_THREADS) private(i)
+  {
+    int i_start, i_end;
+    get_chunk(0, ntot, &i_start, &i_end);
+    for (i=i_start; i<i_end; i++) {
+      psi[i] = tab_coef[max_order] * wfc[i];
+    }
   }
   c1 = 2.0*two_over_delta_e;
   c2 = 2.0*two_e0_over_delta_e;
@@ -283,6 +361,10 @@ double chebyshev_complex(const int dimension, const int * restrict tab_dim, cons
   if (g_times_delta_t==0.0) {
     complex_argument=cos(e0_times_delta_t)-I*sin(e0_times_delta_t);
 //    complex_argument = 1.0;
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && ntot>MIN_SIZE_FOR_THREADS) private(i)
+    {
+      int i_start, i_end;
+      get_chunk(0, ntot, &i_start, &i_end);
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -298,10 +380,15 @@ double chebyshev_complex(const int dimension, const int * restrict tab_dim, cons
     #endif
   #endif
 #endif
-    for (i=0;i<ntot;i++) {
-      wfc[i] = psi[i]*complex_argument;
+      for (i=i_start; i<i_end; i++) {
+        wfc[i] = psi[i]*complex_argument;
+      }
     }
   } else {
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && ntot>MIN_SIZE_FOR_THREADS) private(i,phase,argument) reduction(max:nonlinear_phase)
+    {
+      int i_start, i_end;
+      get_chunk(0, ntot, &i_start, &i_end);
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -317,11 +404,12 @@ double chebyshev_complex(const int dimension, const int * restrict tab_dim, cons
     #endif
   #endif
 #endif
-    for (i=0;i<ntot;i++) {
-      phase = g_times_delta_t*(creal(psi[i])*creal(psi[i])+cimag(psi[i])*cimag(psi[i]));
-      nonlinear_phase = (nonlinear_phase > fabs(phase)) ? nonlinear_phase : fabs(phase);
-      argument =  e0_times_delta_t+phase;
-      wfc[i] = psi[i]*(cos(argument)-I*sin(argument));
+      for (i=i_start; i<i_end; i++) {
+        phase = g_times_delta_t*(creal(psi[i])*creal(psi[i])+cimag(psi[i])*cimag(psi[i]));
+        nonlinear_phase = (nonlinear_phase > fabs(phase)) ? nonlinear_phase : fabs(phase);
+        argument =  e0_times_delta_t+phase;
+        wfc[i] = psi[i]*(cos(argument)-I*sin(argument));
+      }
     }
   }
 #ifdef TIMING
@@ -364,6 +452,10 @@ inline void elementary_clenshaw_step_real_1d(const int dim_x, const int boundary
     }
   }
   if (add_real) {
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && dim_x>MIN_SIZE_FOR_THREADS) private(i)
+    {
+      int i_start, i_end;
+      get_chunk(1, dim_x-1, &i_start, &i_end);
  #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -379,9 +471,14 @@ inline void elementary_clenshaw_step_real_1d(const int dim_x, const int boundary
     #endif
   #endif
 #endif
-    for (i=1;i<dim_x-1;i++) {
-      psi_old[i]=(c1*disorder[i]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+c_coef*wfc[i]-psi_old[i];
+      for (i=i_start; i<i_end; i++) {
+        psi_old[i]=(c1*disorder[i]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+c_coef*wfc[i]-psi_old[i];
+      }
     }
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && dim_x>MIN_SIZE_FOR_THREADS) private(i)
+    {
+      int i_start, i_end;
+      get_chunk(dim_x+1, 2*dim_x-1, &i_start, &i_end);
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -397,10 +494,15 @@ inline void elementary_clenshaw_step_real_1d(const int dim_x, const int boundary
     #endif
   #endif
 #endif
-    for (i=dim_x+1;i<2*dim_x-1;i++) {
-      psi_old[i]=(c1*disorder[i-dim_x]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+c_coef*wfc[i]-psi_old[i];
+      for (i=i_start; i<i_end; i++) {
+        psi_old[i]=(c1*disorder[i-dim_x]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+c_coef*wfc[i]-psi_old[i];
+      }
     }
   } else {
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && dim_x>MIN_SIZE_FOR_THREADS) private(i)
+    {
+      int i_start, i_end;
+      get_chunk(1, dim_x-1, &i_start, &i_end);
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -416,10 +518,15 @@ inline void elementary_clenshaw_step_real_1d(const int dim_x, const int boundary
     #endif
   #endif
 #endif      
-    for (i=1;i<dim_x-1;i++) {
-      psi_old[i]=(c1*disorder[i]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])-c_coef*wfc[i+dim_x]-psi_old[i];
+      for (i=i_start; i<i_end; i++) {
+        psi_old[i]=(c1*disorder[i]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])-c_coef*wfc[i+dim_x]-psi_old[i];
+      }
     }
 //#pragma distribute_point
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && dim_x>MIN_SIZE_FOR_THREADS) private(i)
+    {
+      int i_start, i_end;
+      get_chunk(dim_x+1, 2*dim_x-1, &i_start, &i_end);
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -435,8 +542,9 @@ inline void elementary_clenshaw_step_real_1d(const int dim_x, const int boundary
     #endif
   #endif
 #endif
-    for (i=dim_x+1;i<2*dim_x-1;i++) {
-      psi_old[i]=(c1*disorder[i-dim_x]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+c_coef*wfc[i-dim_x]-psi_old[i];
+      for (i=i_start; i<i_end; i++) {
+        psi_old[i]=(c1*disorder[i-dim_x]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+c_coef*wfc[i-dim_x]-psi_old[i];
+      }
     }
   }
   return;
@@ -448,11 +556,21 @@ inline void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, c
   int ntot = dim_x*dim_y;
   double *p_old,*p_current,*p_new,*p_temp;
 
-  p_old = (double *) calloc ((2*dim_y+4),sizeof(double));
-  p_current = (double *) calloc ((2*dim_y+4),sizeof(double));
-  p_new = (double *) calloc ((2*dim_y+4),sizeof(double));
+// The rows along x are split in contiguous chunks, one per thread, each thread using its own temporary rows
+// Without OpenMP (or with a single thread), there is a single chunk containing all rows
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1) private(i,j,i_low,p_old,p_current,p_new,p_temp)
+  {
+  int i_start, i_end, i_previous, b_previous;
+  get_chunk(0, dim_x, &i_start, &i_end);
+// The row preceding the chunk is the last row if periodic boundary conditions along x and the chunk is the first one
+  i_previous = (i_start>0) ? i_start-1 : dim_x-1;
+  b_previous = (i_start>0) ? 1 : b_x;
+  if (i_start<i_end) {
+    p_old = (double *) calloc ((2*dim_y+4),sizeof(double));
+    p_current = (double *) calloc ((2*dim_y+4),sizeof(double));
+    p_new = (double *) calloc ((2*dim_y+4),sizeof(double));
 
-// If periodic boundary conditions along x, initialize p_current to the last row, otherwise 0
+// Initialize p_current to the row preceding the chunk (last row if periodic boundary conditions along x, 0 if open)
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -468,9 +586,9 @@ inline void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, c
     #endif
   #endif
 #endif
-  for (i=0;i<dim_y;i++) {
-    p_current[i+1] = b_x*psi[i+(dim_x-1)*dim_y];
-  }
+    for (i=0;i<dim_y;i++) {
+      p_current[i+1] = b_previous*psi[i+i_previous*dim_y];
+    }
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -486,9 +604,9 @@ inline void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, c
     #endif
   #endif
 #endif
-  for (i=0;i<dim_y;i++) {
-    p_current[dim_y+i+3] = b_x*psi[ntot+i+(dim_x-1)*dim_y];
-  }
+    for (i=0;i<dim_y;i++) {
+      p_current[dim_y+i+3] = b_previous*psi[ntot+i+i_previous*dim_y];
+    }
 
 // Initialize the next row, which will become the current row in the first iteration of the loop
 #ifdef __INTEL_LLVM_COMPILER
@@ -506,9 +624,9 @@ inline void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, c
     #endif
   #endif
 #endif
-  for (i=0;i<dim_y;i++) {
-    p_new[i+1] = psi[i];
-  }
+    for (i=0;i<dim_y;i++) {
+      p_new[i+1] = psi[i+i_start*dim_y];
+    }
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -524,22 +642,22 @@ inline void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, c
     #endif
   #endif
 #endif
-  for (i=0;i<dim_y;i++) {
-    p_new[dim_y+i+3] = psi[ntot+i];
-  }
+    for (i=0;i<dim_y;i++) {
+      p_new[dim_y+i+3] = psi[ntot+i+i_start*dim_y];
+    }
 // If periodic boundary condition along y, copy the first and last components
-  p_new[0]=b_y*p_new[dim_y];
-  p_new[dim_y+1]=b_y*p_new[1];
-  p_new[dim_y+2]=b_y*p_new[2*dim_y+2];
-  p_new[2*dim_y+3]=b_y*p_new[dim_y+3];
+    p_new[0]=b_y*p_new[dim_y];
+    p_new[dim_y+1]=b_y*p_new[1];
+    p_new[dim_y+2]=b_y*p_new[2*dim_y+2];
+    p_new[2*dim_y+3]=b_y*p_new[dim_y+3];
 // Starts iteration along the rows
-  for (i=0; i<dim_x; i++) {
+    for (i=i_start; i<i_end; i++) {
 //    printf("i %d\n",i);
-    p_temp=p_old;
-    p_old=p_current;
-    p_current=p_new;
-    p_new=p_temp;
-    if (i<dim_x-1) {
+      p_temp=p_old;
+      p_old=p_current;
+      p_current=p_new;
+      p_new=p_temp;
+      if (i<dim_x-1) {
 // The generic row
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
@@ -556,9 +674,9 @@ inline void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, c
     #endif
   #endif
 #endif
-      for (j=0; j<dim_y; j++) {
-        p_new[j+1]=psi[j+(i+1)*dim_y];
-      }
+        for (j=0; j<dim_y; j++) {
+          p_new[j+1]=psi[j+(i+1)*dim_y];
+        }
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -574,10 +692,10 @@ inline void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, c
     #endif
   #endif
 #endif
-      for (j=0; j<dim_y; j++) {
-        p_new[j+dim_y+3]=psi[ntot+j+(i+1)*dim_y];
-      }
-    } else {
+        for (j=0; j<dim_y; j++) {
+          p_new[j+dim_y+3]=psi[ntot+j+(i+1)*dim_y];
+        }
+      } else {
 // If in last row, put in p_new the first row if periodic along x, 0 otherwise )
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
@@ -594,9 +712,9 @@ inline void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, c
     #endif
   #endif
 #endif
-      for (j=0;j<dim_y;j++) {
-        p_new[j+1] = b_x*psi[j];
-      }
+        for (j=0;j<dim_y;j++) {
+          p_new[j+1] = b_x*psi[j];
+        }
 
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
@@ -613,18 +731,18 @@ inline void elementary_clenshaw_step_real_2d(const int dim_x, const int dim_y, c
     #endif
   #endif
 #endif
-for (j=0;j<dim_y;j++) {
-        p_new[j+dim_y+3] = b_x*psi[ntot+j];
+  for (j=0;j<dim_y;j++) {
+          p_new[j+dim_y+3] = b_x*psi[ntot+j];
+        }
       }
-    }
 // If periodic boundary condition along y, copy the first and last components
-    p_new[0]=b_y*p_new[dim_y];
-    p_new[dim_y+1]=b_y*p_new[1];
-    p_new[dim_y+2]=b_y*p_new[2*dim_y+2];
-    p_new[2*dim_y+3]=b_y*p_new[dim_y+3];
-    i_low=i*dim_y;
+      p_new[0]=b_y*p_new[dim_y];
+      p_new[dim_y+1]=b_y*p_new[1];
+      p_new[dim_y+2]=b_y*p_new[2*dim_y+2];
+      p_new[2*dim_y+3]=b_y*p_new[dim_y+3];
+      i_low=i*dim_y;
 // Ready to treat the current row
-    if (add_real) {
+      if (add_real) {
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -640,11 +758,11 @@ for (j=0;j<dim_y;j++) {
     #endif
   #endif
 #endif
-        for (j=0; j<dim_y; j++) {
-        psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[j+1] - c3_y*(p_current[j+2]+ p_current[j]) - c3_x*(p_old[j+1]+p_new[j+1]) + c_coef*wfc[i_low] - psi_old[i_low];
-        i_low++;
-      }
-      i_low=ntot+i*dim_y;
+          for (j=0; j<dim_y; j++) {
+          psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[j+1] - c3_y*(p_current[j+2]+ p_current[j]) - c3_x*(p_old[j+1]+p_new[j+1]) + c_coef*wfc[i_low] - psi_old[i_low];
+          i_low++;
+        }
+        i_low=ntot+i*dim_y;
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -660,11 +778,11 @@ for (j=0;j<dim_y;j++) {
     #endif
   #endif
 #endif
-      for (j=0; j<dim_y; j++) {
-        psi_old[i_low] = (c1*disorder[i_low-ntot]-c2)*p_current[j+dim_y+3] - c3_y*(p_current[j+dim_y+4]+ p_current[j+dim_y+2]) - c3_x*(p_old[j+dim_y+3]+p_new[j+dim_y+3]) + c_coef*wfc[i_low] - psi_old[i_low];
-        i_low++;
-      }
-    } else {
+        for (j=0; j<dim_y; j++) {
+          psi_old[i_low] = (c1*disorder[i_low-ntot]-c2)*p_current[j+dim_y+3] - c3_y*(p_current[j+dim_y+4]+ p_current[j+dim_y+2]) - c3_x*(p_old[j+dim_y+3]+p_new[j+dim_y+3]) + c_coef*wfc[i_low] - psi_old[i_low];
+          i_low++;
+        }
+      } else {
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -680,11 +798,11 @@ for (j=0;j<dim_y;j++) {
     #endif
   #endif
 #endif
-        for (j=0; j<dim_y; j++) {
-        psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[j+1] - c3_y*(p_current[j+2]+ p_current[j]) - c3_x*(p_old[j+1]+p_new[j+1]) - c_coef*wfc[ntot+i_low] - psi_old[i_low];
-        i_low++;
-      }
-      i_low=ntot+i*dim_y;
+          for (j=0; j<dim_y; j++) {
+          psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[j+1] - c3_y*(p_current[j+2]+ p_current[j]) - c3_x*(p_old[j+1]+p_new[j+1]) - c_coef*wfc[ntot+i_low] - psi_old[i_low];
+          i_low++;
+        }
+        i_low=ntot+i*dim_y;
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -700,18 +818,99 @@ for (j=0;j<dim_y;j++) {
     #endif
   #endif
 #endif
-      for (j=0; j<dim_y; j++) {
-        psi_old[i_low] = (c1*disorder[i_low-ntot]-c2)*p_current[j+dim_y+3] - c3_y*(p_current[j+dim_y+4]+ p_current[j+dim_y+2]) - c3_x*(p_old[j+dim_y+3]+p_new[j+dim_y+3]) + c_coef*wfc[i_low-ntot] - psi_old[i_low];
-        i_low++;
+        for (j=0; j<dim_y; j++) {
+          psi_old[i_low] = (c1*disorder[i_low-ntot]-c2)*p_current[j+dim_y+3] - c3_y*(p_current[j+dim_y+4]+ p_current[j+dim_y+2]) - c3_x*(p_old[j+dim_y+3]+p_new[j+dim_y+3]) + c_coef*wfc[i_low-ntot] - psi_old[i_low];
+          i_low++;
+        }
       }
     }
-  }
 //  printf("out %f %f %f %f %f %f\n",creal(psi[0]),cimag(psi[0]),creal(psi_old[0]),cimag(psi_old[0]),creal(wfc[0]), cimag(wfc[0]));
 
-  free(p_new);
-  free(p_current);
-  free(p_old);
+    free(p_new);
+    free(p_current);
+    free(p_old);
+  }
+  }
+
+  return;
+}
 
+inline void elementary_clenshaw_step_real_3d(const int dim_x, const int dim_y, const int dim_z, const int b_x, const int b_y, const int b_z, const double * restrict wfc, const double * restrict psi, double * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3_x, const double c3_y, const double c3_z)
+{
+  int i, j, k, component, i_low, i_site, i_minus, i_plus, j_minus, j_plus, source_offset;
+  double b_x_minus, b_x_plus, b_y_minus, b_y_plus, source_coef;
+  const int dim_transverse = dim_y*dim_z;
+  const int ntot = dim_x*dim_transverse;
+// The real part is stored in [0,ntot[, the imaginary part in [ntot,2*ntot[
+// Both parts obey the same recursion, only the source term mixes them:
+// if add_real, c_coef*wfc is added, otherwise I*c_coef*wfc, i.e. -c_coef*Im(wfc) to the real part and +c_coef*Re(wfc) to the imaginary part
+// Neighbours along x and y are accessed directly in psi (with wrapped indices, multiplied by 0 for open boundary conditions)
+// The boundaries along z are treated separately, so that the inner loop along z vectorizes
+// The planes along x are split in contiguous chunks, one per thread
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1) private(i,j,k,component,i_low,i_site,i_minus,i_plus,j_minus,j_plus,source_offset,b_x_minus,b_x_plus,b_y_minus,b_y_plus,source_coef)
+  {
+  int i_start, i_end;
+  get_chunk(0, dim_x, &i_start, &i_end);
+  for (component=0; component<2; component++) {
+    if (add_real) {
+      source_offset = component*ntot;
+      source_coef = c_coef;
+    } else {
+      source_offset = (1-component)*ntot;
+      source_coef = (component==0) ? -c_coef : c_coef;
+    }
+    for (i=i_start; i<i_end; i++) {
+      i_minus = ((i>0) ? i-1 : dim_x-1)*dim_transverse;
+      i_plus = ((i<dim_x-1) ? i+1 : 0)*dim_transverse;
+      b_x_minus = (i>0) ? 1.0 : b_x;
+      b_x_plus = (i<dim_x-1) ? 1.0 : b_x;
+      for (j=0; j<dim_y; j++) {
+        j_minus = ((j>0) ? j-1 : dim_y-1)*dim_z;
+        j_plus = ((j<dim_y-1) ? j+1 : 0)*dim_z;
+        b_y_minus = (j>0) ? 1.0 : b_y;
+        b_y_plus = (j<dim_y-1) ? 1.0 : b_y;
+        i_site = i*dim_transverse+j*dim_z;
+        i_low = component*ntot+i_site;
+// First site along z
+        psi_old[i_low] = (c1*disorder[i_site]-c2)*psi[i_low]
+          - c3_z*(((dim_z>1) ? psi[i_low+1] : b_z*psi[i_low])+b_z*psi[i_low+dim_z-1])
+          - c3_y*(b_y_plus*psi[component*ntot+i*dim_transverse+j_plus]+b_y_minus*psi[component*ntot+i*dim_transverse+j_minus])
+          - c3_x*(b_x_plus*psi[component*ntot+i_plus+j*dim_z]+b_x_minus*psi[component*ntot+i_minus+j*dim_z])
+          + source_coef*wfc[source_offset+i_site] - psi_old[i_low];
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable) 
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else      
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+        for (k=1; k<dim_z-1; k++) {
+          psi_old[i_low+k] = (c1*disorder[i_site+k]-c2)*psi[i_low+k]
+            - c3_z*(psi[i_low+k+1]+psi[i_low+k-1])
+            - c3_y*(b_y_plus*psi[component*ntot+i*dim_transverse+j_plus+k]+b_y_minus*psi[component*ntot+i*dim_transverse+j_minus+k])
+            - c3_x*(b_x_plus*psi[component*ntot+i_plus+j*dim_z+k]+b_x_minus*psi[component*ntot+i_minus+j*dim_z+k])
+            + source_coef*wfc[source_offset+i_site+k] - psi_old[i_low+k];
+        }
+// Last site along z
+        if (dim_z>1) {
+          k = dim_z-1;
+          psi_old[i_low+k] = (c1*disorder[i_site+k]-c2)*psi[i_low+k]
+            - c3_z*(b_z*psi[i_low]+psi[i_low+k-1])
+            - c3_y*(b_y_plus*psi[component*ntot+i*dim_transverse+j_plus+k]+b_y_minus*psi[component*ntot+i*dim_transverse+j_minus+k])
+            - c3_x*(b_x_plus*psi[component*ntot+i_plus+j*dim_z+k]+b_x_minus*psi[component*ntot+i_minus+j*dim_z+k])
+            + source_coef*wfc[source_offset+i_site+k] - psi_old[i_low+k];
+        }
+      }
+    }
+  }
+  }
   return;
 }
 
@@ -739,6 +938,10 @@ inline void elementary_clenshaw_step_complex_1d(const int dim_x, const int bound
     }
   }
   if (add_real) {
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && dim_x>MIN_SIZE_FOR_THREADS) private(i)
+    {
+      int i_start, i_end;
+      get_chunk(1, dim_x-1, &i_start, &i_end);
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -754,11 +957,16 @@ inline void elementary_clenshaw_step_complex_1d(const int dim_x, const int bound
     #endif
   #endif
 #endif
-      for (i=1;i<dim_x-1;i++) {
+      for (i=i_start; i<i_end; i++) {
 //    printf("i %d\n",i);
-      psi_old[i]=(c1*disorder[i]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+c_coef*wfc[i]-psi_old[i];
+        psi_old[i]=(c1*disorder[i]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+c_coef*wfc[i]-psi_old[i];
+      }
     }
   } else {
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && dim_x>MIN_SIZE_FOR_THREADS) private(i)
+    {
+      int i_start, i_end;
+      get_chunk(1, dim_x-1, &i_start, &i_end);
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -774,8 +982,9 @@ inline void elementary_clenshaw_step_complex_1d(const int dim_x, const int bound
     #endif
   #endif
 #endif      
-    for (i=1;i<dim_x-1;i++) {
-      psi_old[i]=(c1*disorder[i]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+I*c_coef*wfc[i]-psi_old[i];
+      for (i=i_start; i<i_end; i++) {
+        psi_old[i]=(c1*disorder[i]-c2)*psi[i]-c3*(psi[i+1]+psi[i-1])+I*c_coef*wfc[i]-psi_old[i];
+      }
     }
   }
 //  printf("%f %f %f %f %f %f\n",psi[0],psi_old[0],wfc[0]);
@@ -802,11 +1011,21 @@ inline void elementary_clenshaw_step_complex_2d(const int dim_x, const int dim_y
 #endif
 */
 
-  p_old = (double complex *) calloc ((dim_y+2),sizeof(double complex));
-  p_current = (double complex *) calloc ((dim_y+2),sizeof(double complex));
-  p_new = (double complex *) calloc ((dim_y+2),sizeof(double complex));
+// The rows along x are split in contiguous chunks, one per thread, each thread using its own temporary rows
+// Without OpenMP (or with a single thread), there is a single chunk containing all rows
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1) private(i,j,i_low,p_old,p_current,p_new,p_temp)
+  {
+  int i_start, i_end, i_previous, b_previous;
+  get_chunk(0, dim_x, &i_start, &i_end);
+// The row preceding the chunk is the last row if periodic boundary conditions along x and the chunk is the first one
+  i_previous = (i_start>0) ? i_start-1 : dim_x-1;
+  b_previous = (i_start>0) ? 1 : b_x;
+  if (i_start<i_end) {
+    p_old = (double complex *) calloc ((dim_y+2),sizeof(double complex));
+    p_current = (double complex *) calloc ((dim_y+2),sizeof(double complex));
+    p_new = (double complex *) calloc ((dim_y+2),sizeof(double complex));
 
-// If periodic boundary conditions along x, initialize p_current to the last row, otherwise 0
+// Initialize p_current to the row preceding the chunk (last row if periodic boundary conditions along x, 0 if open)
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -822,9 +1041,9 @@ inline void elementary_clenshaw_step_complex_2d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif  
-  for (i=0;i<dim_y;i++) {
-    p_current[i+1] = b_x*psi[i+(dim_x-1)*dim_y];
-  }
+    for (i=0;i<dim_y;i++) {
+      p_current[i+1] = b_previous*psi[i+i_previous*dim_y];
+    }
 // Initialize the next row, which will become the current row in the first iteration of the loop
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
@@ -841,20 +1060,20 @@ inline void elementary_clenshaw_step_complex_2d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif
-  for (i=0;i<dim_y;i++) {
-    p_new[i+1] = psi[i];
-  }
+    for (i=0;i<dim_y;i++) {
+      p_new[i+1] = psi[i+i_start*dim_y];
+    }
 // If periodic boundary condition along y, copy the first and last components
-  p_new[0]=b_y*p_new[dim_y];
-  p_new[dim_y+1]=b_y*p_new[1];
+    p_new[0]=b_y*p_new[dim_y];
+    p_new[dim_y+1]=b_y*p_new[1];
 // Starts iteration along the rows
-  for (i=0; i<dim_x; i++) {
+    for (i=i_start; i<i_end; i++) {
 //    printf("i %d\n",i);
-    p_temp=p_old;
-    p_old=p_current;
-    p_current=p_new;
-    p_new=p_temp;
-    if (i<dim_x-1) {
+      p_temp=p_old;
+      p_old=p_current;
+      p_current=p_new;
+      p_new=p_temp;
+      if (i<dim_x-1) {
 // The generic row
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
@@ -871,10 +1090,10 @@ inline void elementary_clenshaw_step_complex_2d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif
-        for (j=0; j<dim_y; j++) {
-        p_new[j+1]=psi[j+(i+1)*dim_y];
-      }
-    } else {
+          for (j=0; j<dim_y; j++) {
+          p_new[j+1]=psi[j+(i+1)*dim_y];
+        }
+      } else {
 // If in last row, put in p_new the first row if periodic along x, 0 otherwise )
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
@@ -891,16 +1110,16 @@ inline void elementary_clenshaw_step_complex_2d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif
-        for (j=0;j<dim_y;j++) {
-        p_new[j+1] = b_x*psi[j];
+          for (j=0;j<dim_y;j++) {
+          p_new[j+1] = b_x*psi[j];
+        }
       }
-    }
 // If periodic boundary condition along y, copy the first and last components
-    p_new[0]=b_y*p_new[dim_y];
-    p_new[dim_y+1]=b_y*p_new[1];
-    i_low=i*dim_y;
+      p_new[0]=b_y*p_new[dim_y];
+      p_new[dim_y+1]=b_y*p_new[1];
+      i_low=i*dim_y;
 // Ready to treat the current row
-    if (add_real) {
+      if (add_real) {
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -916,11 +1135,11 @@ inline void elementary_clenshaw_step_complex_2d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif
-      for (j=0; j<dim_y; j++) {
-        psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[j+1] - c3_y*(p_current[j+2]+ p_current[j]) - c3_x*(p_old[j+1]+p_new[j+1]) + c_coef*wfc[i_low] - psi_old[i_low];
-        i_low++;
-      }
-    } else {
+        for (j=0; j<dim_y; j++) {
+          psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[j+1] - c3_y*(p_current[j+2]+ p_current[j]) - c3_x*(p_old[j+1]+p_new[j+1]) + c_coef*wfc[i_low] - psi_old[i_low];
+          i_low++;
+        }
+      } else {
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -936,16 +1155,18 @@ inline void elementary_clenshaw_step_complex_2d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif
-      for (j=0; j<dim_y; j++) {
-        psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[j+1] - c3_y*(p_current[j+2]+ p_current[j]) - c3_x*(p_old[j+1]+p_new[j+1]) + I*c_coef*wfc[i_low] - psi_old[i_low];
-        i_low++;
+        for (j=0; j<dim_y; j++) {
+          psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[j+1] - c3_y*(p_current[j+2]+ p_current[j]) - c3_x*(p_old[j+1]+p_new[j+1]) + I*c_coef*wfc[i_low] - psi_old[i_low];
+          i_low++;
+        }
       }
     }
+    
+    free(p_new);
+    free(p_current);
+    free(p_old);
+  }
   }
-  
-  free(p_new);
-  free(p_current);
-  free(p_old);
 
   return;
 }
@@ -963,16 +1184,26 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
 //  int ntot = dim_x*dim_y;
 //  printf("using elementary_clenshaw_step_complex_3d\n");
   double complex *p_old,*p_current,*p_new,*p_temp;
-  
-  p_old = (double complex *) calloc ((dim_y+2)*(dim_z+2),sizeof(double complex));
-  p_current = (double complex *) calloc ((dim_y+2)*(dim_z+2),sizeof(double complex));
-  p_new = (double complex *) calloc ((dim_y+2)*(dim_z+2),sizeof(double complex));
   dim_transverse = dim_y*dim_z;
   
-// If periodic boundary conditions along x, initialize p_current to the last plane, otherwise 0
-  for (j=0;j<dim_y;j++) {
-    pos_psi = (dim_x-1)*dim_transverse+j*dim_z;
-    pos_current = (j+1)*(dim_z+2)+1;
+// The planes along x are split in contiguous chunks, one per thread, each thread using its own temporary planes
+// Without OpenMP (or with a single thread), there is a single chunk containing all planes
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1) private(i,j,k,i_low,pos_psi,pos_current,pos_current_1,pos_current_2,pos_current_3,pos_current_4,pos_current_5,pos_new,pos_new_1,pos_new_2,pos_new_3,pos_new_4,pos_old,p_old,p_current,p_new,p_temp)
+  {
+  int i_start, i_end, i_previous, b_previous;
+  get_chunk(0, dim_x, &i_start, &i_end);
+// The plane preceding the chunk is the last plane if periodic boundary conditions along x and the chunk is the first one
+  i_previous = (i_start>0) ? i_start-1 : dim_x-1;
+  b_previous = (i_start>0) ? 1 : b_x;
+  if (i_start<i_end) {
+    p_old = (double complex *) calloc ((dim_y+2)*(dim_z+2),sizeof(double complex));
+    p_current = (double complex *) calloc ((dim_y+2)*(dim_z+2),sizeof(double complex));
+    p_new = (double complex *) calloc ((dim_y+2)*(dim_z+2),sizeof(double complex));
+    
+// Initialize p_current to the plane preceding the chunk (last plane if periodic boundary conditions along x, 0 if open)
+    for (j=0;j<dim_y;j++) {
+      pos_psi = i_previous*dim_transverse+j*dim_z;
+      pos_current = (j+1)*(dim_z+2)+1;
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
 //  //#pragma unroll
@@ -988,14 +1219,14 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif       
-    for (k=0;k<dim_z;k++) {
-      p_current[pos_current+k] = b_x*psi[pos_psi+k];
-    }  
-  }
+      for (k=0;k<dim_z;k++) {
+        p_current[pos_current+k] = b_previous*psi[pos_psi+k];
+      }  
+    }
 // Initialize the next plane, which will become the current plane in the first iteration of the loop
-  for (j=0;j<dim_y;j++) {
-    pos_psi = j*dim_z;
-    pos_new = (j+1)*(dim_z+2)+1;
+    for (j=0;j<dim_y;j++) {
+      pos_psi = i_start*dim_transverse+j*dim_z;
+      pos_new = (j+1)*(dim_z+2)+1;
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
 //  //#pragma unroll
@@ -1011,15 +1242,15 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif       
-    for (k=0;k<dim_z;k++) {
-      p_new[pos_new+k] = psi[pos_psi+k];
-    }  
-  }
+      for (k=0;k<dim_z;k++) {
+        p_new[pos_new+k] = psi[pos_psi+k];
+      }  
+    }
 // If periodic boundary condition along y, copy the first and last row along z
-  pos_new_1 = 1;
-  pos_new_2 = dim_y*(dim_z+2)+1;
-  pos_new_3 = (dim_y+1)*(dim_z+2)+1;
-  pos_new_4 = dim_z+3;
+    pos_new_1 = 1;
+    pos_new_2 = dim_y*(dim_z+2)+1;
+    pos_new_3 = (dim_y+1)*(dim_z+2)+1;
+    pos_new_4 = dim_z+3;
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
 //  //#pragma unroll
@@ -1035,15 +1266,15 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif       
-  for (k=0;k<dim_z;k++) {
-    p_new[pos_new_1+k] = b_y*p_new[pos_new_2+k];
-    p_new[pos_new_3+k] = b_y*p_new[pos_new_4+k];
-  }
+    for (k=0;k<dim_z;k++) {
+      p_new[pos_new_1+k] = b_y*p_new[pos_new_2+k];
+      p_new[pos_new_3+k] = b_y*p_new[pos_new_4+k];
+    }
 // If periodic boundary condition along z, copy the first and last row along y
-  pos_new_1 = dim_z+2;
-  pos_new_2 = 2*dim_z+2;
-  pos_new_3 = 2*dim_z+3;
-  pos_new_4 = dim_z+3;
+    pos_new_1 = dim_z+2;
+    pos_new_2 = 2*dim_z+2;
+    pos_new_3 = 2*dim_z+3;
+    pos_new_4 = dim_z+3;
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
 //  //#pragma unroll
@@ -1059,22 +1290,22 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif       
-  for (k=0;k<dim_z;k++) {
-    p_new[pos_new_1+k*(dim_z+2)] = b_z*p_new[pos_new_2+k*(dim_z+2)];
-    p_new[pos_new_3+k*(dim_z+2)] = b_z*p_new[pos_new_4+k*(dim_z+2)];
-  }
+    for (k=0;k<dim_y;k++) {
+      p_new[pos_new_1+k*(dim_z+2)] = b_z*p_new[pos_new_2+k*(dim_z+2)];
+      p_new[pos_new_3+k*(dim_z+2)] = b_z*p_new[pos_new_4+k*(dim_z+2)];
+    }
 // Starts iteration along the rows
-  for (i=0; i<dim_x; i++) {
+    for (i=i_start; i<i_end; i++) {
 //    printf("i %d\n",i);
-    p_temp=p_old;
-    p_old=p_current;
-    p_current=p_new;
-    p_new=p_temp;
-    if (i<dim_x-1) {
+      p_temp=p_old;
+      p_old=p_current;
+      p_current=p_new;
+      p_new=p_temp;
+      if (i<dim_x-1) {
 // The generic plane
-      for (j=0;j<dim_y;j++) {
-        pos_psi = (i+1)*dim_transverse+j*dim_z;
-        pos_new = (j+1)*(dim_z+2)+1;
+        for (j=0;j<dim_y;j++) {
+          pos_psi = (i+1)*dim_transverse+j*dim_z;
+          pos_new = (j+1)*(dim_z+2)+1;
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
 //  //#pragma unroll
@@ -1090,15 +1321,15 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif       
-        for (k=0;k<dim_z;k++) {
-          p_new[pos_new+k] = psi[pos_psi+k];
-        }  
-      }     
-    } else {
+          for (k=0;k<dim_z;k++) {
+            p_new[pos_new+k] = psi[pos_psi+k];
+          }  
+        }     
+      } else {
 // If in last row, put in p_new the first row if periodic along x, 0 otherwise )
-      for (j=0;j<dim_y;j++) {
-        pos_psi = j*dim_z;
-        pos_new = (j+1)*(dim_z+2)+1;
+        for (j=0;j<dim_y;j++) {
+          pos_psi = j*dim_z;
+          pos_new = (j+1)*(dim_z+2)+1;
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
 //  //#pragma unroll
@@ -1114,16 +1345,16 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif               
-        for (k=0;k<dim_z;k++) {
-          p_new[pos_new+k] = b_x*psi[pos_psi+k];
-        }  
+          for (k=0;k<dim_z;k++) {
+            p_new[pos_new+k] = b_x*psi[pos_psi+k];
+          }  
+        }
       }
-    }
 // If periodic boundary condition along y, copy the first and last row along z
-    pos_new_1 = 1;
-    pos_new_2 = dim_y*(dim_z+2)+1;
-    pos_new_3 = (dim_y+1)*(dim_z+2)+1;
-    pos_new_4 = dim_z+3;
+      pos_new_1 = 1;
+      pos_new_2 = dim_y*(dim_z+2)+1;
+      pos_new_3 = (dim_y+1)*(dim_z+2)+1;
+      pos_new_4 = dim_z+3;
  #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
 //  //#pragma unroll
@@ -1139,15 +1370,15 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif       
-    for (k=0;k<dim_z;k++) {
-      p_new[pos_new_1+k] = b_y*p_new[pos_new_2+k];
-      p_new[pos_new_3+k] = b_y*p_new[pos_new_4+k];
-    }
+      for (k=0;k<dim_z;k++) {
+        p_new[pos_new_1+k] = b_y*p_new[pos_new_2+k];
+        p_new[pos_new_3+k] = b_y*p_new[pos_new_4+k];
+      }
 // If periodic boundary condition along z, copy the first and last row along y
-    pos_new_1 = dim_z+2;
-    pos_new_2 = 2*dim_z+2;
-    pos_new_3 = 2*dim_z+3;
-    pos_new_4 = dim_z+3;
+      pos_new_1 = dim_z+2;
+      pos_new_2 = 2*dim_z+2;
+      pos_new_3 = 2*dim_z+3;
+      pos_new_4 = dim_z+3;
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
 //  //#pragma unroll
@@ -1163,22 +1394,22 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif           
-    for (k=0;k<dim_z;k++) {
-      p_new[pos_new_1+k*(dim_z+2)] = b_z*p_new[pos_new_2+k*(dim_z+2)];
-      p_new[pos_new_3+k*(dim_z+2)] = b_z*p_new[pos_new_4+k*(dim_z+2)];
-    }
-    for (j=0;j<dim_y;j++) {      
-      i_low=i*dim_transverse+j*dim_z;
-      pos_current_1 = (j+1)*(dim_z+2)+1;
+      for (k=0;k<dim_y;k++) {
+        p_new[pos_new_1+k*(dim_z+2)] = b_z*p_new[pos_new_2+k*(dim_z+2)];
+        p_new[pos_new_3+k*(dim_z+2)] = b_z*p_new[pos_new_4+k*(dim_z+2)];
+      }
+      for (j=0;j<dim_y;j++) {      
+        i_low=i*dim_transverse+j*dim_z;
+        pos_current_1 = (j+1)*(dim_z+2)+1;
 //      pos_current_2 = (j+2)*(dim_z+2)+1;
 //      pos_current_3 = j*(dim_z+2)+1;
 //      pos_current_4 = (j+1)*(dim_z+2)+2;
 //      pos_current_5 = (j+1)*(dim_z+2);
 //      pos_old = (j+1)*(dim_z+2)+1;
 //      pos_new = (j+1)*(dim_z+2)+1;
-  
+    
 // Ready to treat the current row
-      if (add_real) {
+        if (add_real) {
 #ifdef __INTEL_LLVM_COMPILER
   #pragma vector
   //#pragma unroll
@@ -1194,20 +1425,20 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif            
-          for (k=0; k<dim_z; k++) {
-/*          psi_old[i_low+k] = (c1*disorder[i_low+k]-c2)*p_current[pos_current_1+k] 
-            - c3_y*(p_current[pos_current_2+k]+ p_current[pos_current_3+k]) 
-            - c3_z*(p_current[pos_current_4+k]+ p_current[pos_current_5+k])
-            - c3_x*(p_old[pos_old+k]+p_new[pos_new+k]) 
-            + c_coef*wfc[i_low+k] - psi_old[i_low+k];*/
-          psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[pos_current_1] 
-            - c3_y*(p_current[pos_current_1-dim_z-2]+ p_current[pos_current_1+dim_z+2]) 
-            - c3_z*(p_current[pos_current_1+1]+ p_current[pos_current_1-1])
-            - c3_x*(p_old[pos_current_1]+p_new[pos_current_1]) 
-            + c_coef*wfc[i_low] - psi_old[i_low];
-          i_low++;  
-          pos_current_1++;        }  
-      } else {
+            for (k=0; k<dim_z; k++) {
+  /*          psi_old[i_low+k] = (c1*disorder[i_low+k]-c2)*p_current[pos_current_1+k] 
+              - c3_y*(p_current[pos_current_2+k]+ p_current[pos_current_3+k]) 
+              - c3_z*(p_current[pos_current_4+k]+ p_current[pos_current_5+k])
+              - c3_x*(p_old[pos_old+k]+p_new[pos_new+k]) 
+              + c_coef*wfc[i_low+k] - psi_old[i_low+k];*/
+            psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[pos_current_1] 
+              - c3_y*(p_current[pos_current_1-dim_z-2]+ p_current[pos_current_1+dim_z+2]) 
+              - c3_z*(p_current[pos_current_1+1]+ p_current[pos_current_1-1])
+              - c3_x*(p_old[pos_current_1]+p_new[pos_current_1]) 
+              + c_coef*wfc[i_low] - psi_old[i_low];
+            i_low++;  
+            pos_current_1++;        }  
+        } else {
 #ifdef __INTEL_LLVM_COMPILER
   #pragma clang loop vectorize(enable) 
 //  //#pragma unroll
@@ -1223,26 +1454,28 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
     #endif
   #endif
 #endif          
-        for (k=0; k<dim_z; k++) {
- /*        psi_old[i_low+k] = (c1*disorder[i_low+k]-c2)*p_current[pos_current_1+k] 
-            - c3_y*(p_current[pos_current_2+k]+ p_current[pos_current_3+k]) 
-            - c3_z*(p_current[pos_current_4+k]+ p_current[pos_current_5+k])
-            - c3_x*(p_old[pos_old+k]+p_new[pos_new+k]) 
-            + I*c_coef*wfc[i_low+k] - psi_old[i_low+k]; */
-          psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[pos_current_1] 
-            - c3_y*(p_current[pos_current_1-dim_z-2]+ p_current[pos_current_1+dim_z+2]) 
-            - c3_z*(p_current[pos_current_1+1]+ p_current[pos_current_1-1])
-            - c3_x*(p_old[pos_current_1]+p_new[pos_current_1]) 
-            + I*c_coef*wfc[i_low] - psi_old[i_low];
-          i_low++;  
-          pos_current_1++;
-        }  
-      }
-    }    
-  }  
-  free(p_new);
-  free(p_current);
-  free(p_old);
+          for (k=0; k<dim_z; k++) {
+   /*        psi_old[i_low+k] = (c1*disorder[i_low+k]-c2)*p_current[pos_current_1+k] 
+              - c3_y*(p_current[pos_current_2+k]+ p_current[pos_current_3+k]) 
+              - c3_z*(p_current[pos_current_4+k]+ p_current[pos_current_5+k])
+              - c3_x*(p_old[pos_old+k]+p_new[pos_new+k]) 
+              + I*c_coef*wfc[i_low+k] - psi_old[i_low+k]; */
+            psi_old[i_low] = (c1*disorder[i_low]-c2)*p_current[pos_current_1] 
+              - c3_y*(p_current[pos_current_1-dim_z-2]+ p_current[pos_current_1+dim_z+2]) 
+              - c3_z*(p_current[pos_current_1+1]+ p_current[pos_current_1-1])
+              - c3_x*(p_old[pos_current_1]+p_new[pos_current_1]) 
+              + I*c_coef*wfc[i_low] - psi_old[i_low];
+            i_low++;  
+            pos_current_1++;
+          }  
+        }
+      }    
+    }  
+    free(p_new);
+    free(p_current);
+    free(p_old);
+  }
+  }
 //  printf("psi_old\n");
 //  for (i=0;i<dim_x*dim_y*dim_z;i++) {
 //    printf("%lg %lg\n",creal(psi_old[i]),cimag(psi_old[i]));
@@ -1250,6 +1483,212 @@ inline void elementary_clenshaw_step_complex_3d(const int dim_x, const int dim_y
   return;
 }
 
+// Batched version of chebyshev_complex, propagating batch_size independent realizations at once
+// The arrays wfc, psi, psi_old and disorder are interleaved: the value for realization k at site i is stored at index i*batch_size+k
+// The innermost loop is thus along the realizations, which makes it possible to reuse each neighbour load for all realizations
+// All realizations must share the same tab_coef, i.e. the same energy bounds
+double chebyshev_complex_batched(const int dimension, const int * restrict tab_dim, const int max_order,  const int * restrict tab_boundary_condition, const int batch_size, double complex * restrict wfc, double complex * restrict psi, double complex * restrict psi_old,  const double * restrict disorder, const double * restrict tab_coef, const double * tab_tunneling, const double two_over_delta_e, const double two_e0_over_delta_e, const double g_times_delta_t, const double e0_times_delta_t)
+{
+  int i, order;
+  double argument;
+  double complex complex_argument;
+  double phase;
+  double c1, c2, c3;
+  double nonlinear_phase=0.;
+  int ntot=batch_size;
+  for (i=0;i<dimension;i++) {
+    ntot *= tab_dim[i];
+  }
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && ntot>MIN_SIZE_FOR_THREADS) private(i)
+  {
+    int i_start, i_end;
+    get_chunk(0, ntot, &i_start, &i_end);
+    for (i=i_start; i<i_end; i++) {
+      psi[i] = tab_coef[max_order] * wfc[i];
+    }
+  }
+  c1 = 2.0*two_over_delta_e;
+  c2 = 2.0*two_e0_over_delta_e;
+  if (dimension==1) {
+    int dim_x = tab_dim[0];
+    int boundary_condition = tab_boundary_condition[0];
+    c3 = 2.0*tab_tunneling[0]*two_over_delta_e;
+    elementary_clenshaw_step_complex_batched_1d(dim_x, boundary_condition, batch_size, wfc, psi, psi_old, disorder, tab_coef[max_order-1], 0, c1, c2, c3);
+// WARNING: max_order MUST be an even number, otherwise disaster guaranteed
+    for (order=max_order-2;order>1;order-=2) {
+      elementary_clenshaw_step_complex_batched_1d(dim_x, boundary_condition, batch_size, wfc, psi_old, psi, disorder, tab_coef[order], 1, c1, c2, c3);
+      elementary_clenshaw_step_complex_batched_1d(dim_x, boundary_condition, batch_size, wfc, psi, psi_old, disorder, tab_coef[order-1], 0, c1, c2, c3);
+    }
+    c1 = two_over_delta_e;
+    c2 = two_e0_over_delta_e;
+    c3 = tab_tunneling[0]*two_over_delta_e;
+    elementary_clenshaw_step_complex_batched_1d(dim_x, boundary_condition, batch_size, wfc, psi_old, psi, disorder, tab_coef[0], 1, c1, c2, c3);
+  }
+  if (dimension==2) {
+    int dim_x = tab_dim[0];
+    int dim_y = tab_dim[1];
+    int b_x = tab_boundary_condition[0];
+    int b_y = tab_boundary_condition[1];
+    double c3_x = 2.0*tab_tunneling[0]*two_over_delta_e;
+    double c3_y = 2.0*tab_tunneling[1]*two_over_delta_e;
+    elementary_clenshaw_step_complex_batched_2d(dim_x, dim_y, b_x, b_y, batch_size, wfc, psi, psi_old, disorder, tab_coef[max_order-1], 0, c1, c2, c3_x, c3_y);
+// WARNING: max_order MUST be an even number, otherwise disaster guaranteed
+    for (order=max_order-2;order>1;order-=2) {
+      elementary_clenshaw_step_complex_batched_2d(dim_x, dim_y, b_x, b_y, batch_size, wfc, psi_old, psi, disorder, tab_coef[order], 1, c1, c2, c3_x, c3_y);
+      elementary_clenshaw_step_complex_batched_2d(dim_x, dim_y, b_x, b_y, batch_size, wfc, psi, psi_old, disorder, tab_coef[order-1], 0, c1, c2, c3_x, c3_y);
+    }
+    c1 = two_over_delta_e;
+    c2 = two_e0_over_delta_e;
+    c3_x = tab_tunneling[0]*two_over_delta_e;
+    c3_y = tab_tunneling[1]*two_over_delta_e;
+    elementary_clenshaw_step_complex_batched_2d(dim_x, dim_y, b_x, b_y, batch_size, wfc, psi_old, psi, disorder, tab_coef[0], 1, c1, c2, c3_x, c3_y);
+  }
+
+// apply nonlinear shift
+  if (g_times_delta_t==0.0) {
+    complex_argument=cos(e0_times_delta_t)-I*sin(e0_times_delta_t);
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && ntot>MIN_SIZE_FOR_THREADS) private(i)
+    {
+      int i_start, i_end;
+      get_chunk(0, ntot, &i_start, &i_end);
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable) 
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else      
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+      for (i=i_start; i<i_end; i++) {
+        wfc[i] = psi[i]*complex_argument;
+      }
+    }
+  } else {
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && ntot>MIN_SIZE_FOR_THREADS) private(i,phase,argument) reduction(max:nonlinear_phase)
+    {
+      int i_start, i_end;
+      get_chunk(0, ntot, &i_start, &i_end);
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable) 
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else      
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+      for (i=i_start; i<i_end; i++) {
+        phase = g_times_delta_t*(creal(psi[i])*creal(psi[i])+cimag(psi[i])*cimag(psi[i]));
+        nonlinear_phase = (nonlinear_phase > fabs(phase)) ? nonlinear_phase : fabs(phase);
+        argument =  e0_times_delta_t+phase;
+        wfc[i] = psi[i]*(cos(argument)-I*sin(argument));
+      }
+    }
+  }
+  return(nonlinear_phase);
+}
+
+inline void elementary_clenshaw_step_complex_batched_1d(const int dim_x, const int boundary_condition, const int batch_size, const double complex * restrict wfc, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3)
+{
+  int i, k, i_low, i_minus, i_plus;
+  double b_minus, b_plus;
+  double complex complex_coef = add_real ? c_coef : I*c_coef;
+// boundary_condition=1 is periodic
+// boundary_condition=0 is open
+// For open boundary conditions, the missing neighbour is replaced by the (wrapped) site, multiplied by 0
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && dim_x*batch_size>MIN_SIZE_FOR_THREADS) private(i,k,i_low,i_minus,i_plus,b_minus,b_plus)
+  {
+    int i_start, i_end;
+    get_chunk(0, dim_x, &i_start, &i_end);
+    for (i=i_start; i<i_end; i++) {
+      i_minus = (i>0) ? i-1 : dim_x-1;
+      i_plus = (i<dim_x-1) ? i+1 : 0;
+      b_minus = (i>0) ? 1.0 : boundary_condition;
+      b_plus = (i<dim_x-1) ? 1.0 : boundary_condition;
+      i_low = i*batch_size;
+      i_minus *= batch_size;
+      i_plus *= batch_size;
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable) 
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else      
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+      for (k=0; k<batch_size; k++) {
+        psi_old[i_low+k] = (c1*disorder[i_low+k]-c2)*psi[i_low+k] - c3*(b_plus*psi[i_plus+k]+b_minus*psi[i_minus+k]) + complex_coef*wfc[i_low+k] - psi_old[i_low+k];
+      }
+    }
+  }
+  return;
+}
+
+inline void elementary_clenshaw_step_complex_batched_2d(const int dim_x, const int dim_y, const int b_x, const int b_y, const int batch_size, const double complex * restrict wfc, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c_coef, const int add_real, const double c1, const double c2, const double c3_x, const double c3_y)
+{
+  int i, j, k, i_low, i_minus, i_plus, j_minus, j_plus;
+  double b_x_minus, b_x_plus, b_y_minus, b_y_plus;
+  double complex complex_coef = add_real ? c_coef : I*c_coef;
+  const int row_size = dim_y*batch_size;
+// For open boundary conditions, the missing neighbours are replaced by the (wrapped) sites, multiplied by 0
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1) private(i,j,k,i_low,i_minus,i_plus,j_minus,j_plus,b_x_minus,b_x_plus,b_y_minus,b_y_plus)
+  {
+    int i_start, i_end;
+    get_chunk(0, dim_x, &i_start, &i_end);
+    for (i=i_start; i<i_end; i++) {
+      i_minus = ((i>0) ? i-1 : dim_x-1)*row_size;
+      i_plus = ((i<dim_x-1) ? i+1 : 0)*row_size;
+      b_x_minus = (i>0) ? 1.0 : b_x;
+      b_x_plus = (i<dim_x-1) ? 1.0 : b_x;
+      for (j=0; j<dim_y; j++) {
+        j_minus = ((j>0) ? j-1 : dim_y-1)*batch_size;
+        j_plus = ((j<dim_y-1) ? j+1 : 0)*batch_size;
+        b_y_minus = (j>0) ? 1.0 : b_y;
+        b_y_plus = (j<dim_y-1) ? 1.0 : b_y;
+        i_low = i*row_size+j*batch_size;
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable) 
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else      
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+        for (k=0; k<batch_size; k++) {
+          psi_old[i_low+k] = (c1*disorder[i_low+k]-c2)*psi[i_low+k]
+            - c3_y*(b_y_plus*psi[i*row_size+j_plus+k]+b_y_minus*psi[i*row_size+j_minus+k])
+            - c3_x*(b_x_plus*psi[i_plus+j*batch_size+k]+b_x_minus*psi[i_minus+j*batch_size+k])
+            + complex_coef*wfc[i_low+k] - psi_old[i_low+k];
+        }
+      }
+    }
+  }
+  return;
+}
+
 void chebyshev_kpm_step(const int dimension, const int * restrict tab_dim, const int * restrict tab_boundary_condition, double complex * restrict psi, double complex * restrict psi_old,  const double * restrict disorder, const double * tab_tunneling, const double c1, const double c2)
 {
   double c3_x, c3_y, c3_z;
@@ -1294,6 +1733,41 @@ void chebyshev_kpm_step(const int dimension, const int * restrict tab_dim, const
   return;
 }
 
+// Block version of chebyshev_kpm_step, for block_size independent vectors sharing the same disorder
+// psi and psi_old are (ntot,block_size) arrays, the vectors being interleaved: component r of site i is at index i*block_size+r
+// The innermost loop runs over the vectors, so that the disorder and the neighbours of each site are read once for the whole block
+void chebyshev_kpm_step_block(const int dimension, const int * restrict tab_dim, const int * restrict tab_boundary_condition, const int block_size, double complex * restrict psi, double complex * restrict psi_old,  const double * restrict disorder, const double * tab_tunneling, const double c1, const double c2)
+{
+  if (dimension==1) {
+    int dim_x = tab_dim[0];
+    int boundary_condition = tab_boundary_condition[0];
+    double c3_x = c1*tab_tunneling[0];
+    chebyshev_kpm_step_block_1d(dim_x, boundary_condition, block_size, psi, psi_old, disorder, c1, c2, c3_x);
+  }
+  if (dimension==2) {
+    int dim_x = tab_dim[0];
+    int dim_y = tab_dim[1];
+    int b_x = tab_boundary_condition[0];
+    int b_y = tab_boundary_condition[1];
+    double c3_x = c1*tab_tunneling[0];
+    double c3_y = c1*tab_tunneling[1];
+    chebyshev_kpm_step_block_2d(dim_x, dim_y, b_x, b_y, block_size, psi, psi_old, disorder, c1, c2, c3_x, c3_y);
+  }
+  if (dimension==3) {
+    int dim_x = tab_dim[0];
+    int dim_y = tab_dim[1];
+    int dim_z = tab_dim[2];
+    int b_x = tab_boundary_condition[0];
+    int b_y = tab_boundary_condition[1];
+    int b_z = tab_boundary_condition[2];
+    double c3_x = c1*tab_tunneling[0];
+    double c3_y = c1*tab_tunneling[1];
+    double c3_z = c1*tab_tunneling[2];
+    chebyshev_kpm_step_block_3d(dim_x, dim_y, dim_z, b_x, b_y, b_z, block_size, psi, psi_old, disorder, c1, c2, c3_x, c3_y, c3_z);
+  }
+  return;
+}
+
 inline void chebyshev_kpm_step_1d(const int dim_x, const int boundary_condition, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x)
 {
   int i;
@@ -1583,7 +2057,7 @@ inline void chebyshev_kpm_step_3d(const int dim_x, const int dim_y, const int di
     #endif
   #endif
 #endif       
-  for (k=0;k<dim_z;k++) {
+  for (k=0;k<dim_y;k++) {
     p_new[pos_new_1+k*(dim_z+2)] = b_z*p_new[pos_new_2+k*(dim_z+2)];
     p_new[pos_new_3+k*(dim_z+2)] = b_z*p_new[pos_new_4+k*(dim_z+2)];
   }
@@ -1687,7 +2161,7 @@ inline void chebyshev_kpm_step_3d(const int dim_x, const int dim_y, const int di
     #endif
   #endif
 #endif           
-    for (k=0;k<dim_z;k++) {
+    for (k=0;k<dim_y;k++) {
       p_new[pos_new_1+k*(dim_z+2)] = b_z*p_new[pos_new_2+k*(dim_z+2)];
       p_new[pos_new_3+k*(dim_z+2)] = b_z*p_new[pos_new_4+k*(dim_z+2)];
     }
@@ -1742,3 +2216,145 @@ inline void chebyshev_kpm_step_3d(const int dim_x, const int dim_y, const int di
 //  }  
   return;
 }
+
+// The sites are distributed among threads, for open boundary conditions the missing neighbours
+// are replaced by the (wrapped) sites, multiplied by 0
+inline void chebyshev_kpm_step_block_1d(const int dim_x, const int boundary_condition, const int block_size, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x)
+{
+  int i, r, i_low, i_minus, i_plus;
+  double b_minus, b_plus, diagonal;
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1 && dim_x*block_size>MIN_SIZE_FOR_THREADS) private(i,r,i_low,i_minus,i_plus,b_minus,b_plus,diagonal)
+  {
+    int i_start, i_end;
+    get_chunk(0, dim_x, &i_start, &i_end);
+    for (i=i_start; i<i_end; i++) {
+      i_minus = ((i>0) ? i-1 : dim_x-1)*block_size;
+      i_plus = ((i<dim_x-1) ? i+1 : 0)*block_size;
+      b_minus = (i>0) ? 1.0 : boundary_condition;
+      b_plus = (i<dim_x-1) ? 1.0 : boundary_condition;
+      i_low = i*block_size;
+      diagonal = c1*disorder[i]-c2;
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable) 
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else      
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+      for (r=0; r<block_size; r++) {
+        psi_old[i_low+r] = diagonal*psi[i_low+r] - c3_x*(b_plus*psi[i_plus+r]+b_minus*psi[i_minus+r]) - psi_old[i_low+r];
+      }
+    }
+  }
+  return;
+}
+
+inline void chebyshev_kpm_step_block_2d(const int dim_x, const int dim_y, const int b_x, const int b_y, const int block_size, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x, const double c3_y)
+{
+  int i, j, r, i_low, i_minus, i_plus, j_minus, j_plus;
+  double b_x_minus, b_x_plus, b_y_minus, b_y_plus, diagonal;
+  const int row_size = dim_y*block_size;
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1) private(i,j,r,i_low,i_minus,i_plus,j_minus,j_plus,b_x_minus,b_x_plus,b_y_minus,b_y_plus,diagonal)
+  {
+    int i_start, i_end;
+    get_chunk(0, dim_x, &i_start, &i_end);
+    for (i=i_start; i<i_end; i++) {
+      i_minus = ((i>0) ? i-1 : dim_x-1)*row_size;
+      i_plus = ((i<dim_x-1) ? i+1 : 0)*row_size;
+      b_x_minus = (i>0) ? 1.0 : b_x;
+      b_x_plus = (i<dim_x-1) ? 1.0 : b_x;
+      for (j=0; j<dim_y; j++) {
+        j_minus = ((j>0) ? j-1 : dim_y-1)*block_size;
+        j_plus = ((j<dim_y-1) ? j+1 : 0)*block_size;
+        b_y_minus = (j>0) ? 1.0 : b_y;
+        b_y_plus = (j<dim_y-1) ? 1.0 : b_y;
+        i_low = i*row_size+j*block_size;
+        diagonal = c1*disorder[i*dim_y+j]-c2;
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable) 
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else      
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+        for (r=0; r<block_size; r++) {
+          psi_old[i_low+r] = diagonal*psi[i_low+r]
+            - c3_y*(b_y_plus*psi[i*row_size+j_plus+r]+b_y_minus*psi[i*row_size+j_minus+r])
+            - c3_x*(b_x_plus*psi[i_plus+j*block_size+r]+b_x_minus*psi[i_minus+j*block_size+r])
+            - psi_old[i_low+r];
+        }
+      }
+    }
+  }
+  return;
+}
+
+inline void chebyshev_kpm_step_block_3d(const int dim_x, const int dim_y, const int dim_z, const int b_x, const int b_y, const int b_z, const int block_size, const double complex * restrict psi, double complex * restrict psi_old, const double * restrict disorder, const double c1, const double c2, const double c3_x, const double c3_y, const double c3_z)
+{
+  int i, j, k, r, i_site, i_low, i_minus, i_plus, j_minus, j_plus, k_minus, k_plus;
+  double b_x_minus, b_x_plus, b_y_minus, b_y_plus, b_z_minus, b_z_plus, diagonal;
+  const int row_size = dim_z*block_size;
+  const int plane_size = dim_y*row_size;
+#pragma omp parallel num_threads(chebyshev_number_of_threads) if(chebyshev_number_of_threads>1) private(i,j,k,r,i_site,i_low,i_minus,i_plus,j_minus,j_plus,k_minus,k_plus,b_x_minus,b_x_plus,b_y_minus,b_y_plus,b_z_minus,b_z_plus,diagonal)
+  {
+    int i_start, i_end;
+    get_chunk(0, dim_x, &i_start, &i_end);
+    for (i=i_start; i<i_end; i++) {
+      i_minus = ((i>0) ? i-1 : dim_x-1)*plane_size;
+      i_plus = ((i<dim_x-1) ? i+1 : 0)*plane_size;
+      b_x_minus = (i>0) ? 1.0 : b_x;
+      b_x_plus = (i<dim_x-1) ? 1.0 : b_x;
+      for (j=0; j<dim_y; j++) {
+        j_minus = ((j>0) ? j-1 : dim_y-1)*row_size;
+        j_plus = ((j<dim_y-1) ? j+1 : 0)*row_size;
+        b_y_minus = (j>0) ? 1.0 : b_y;
+        b_y_plus = (j<dim_y-1) ? 1.0 : b_y;
+        for (k=0; k<dim_z; k++) {
+          k_minus = ((k>0) ? k-1 : dim_z-1)*block_size;
+          k_plus = ((k<dim_z-1) ? k+1 : 0)*block_size;
+          b_z_minus = (k>0) ? 1.0 : b_z;
+          b_z_plus = (k<dim_z-1) ? 1.0 : b_z;
+          i_site = (i*dim_y+j)*dim_z+k;
+          i_low = i_site*block_size;
+          diagonal = c1*disorder[i_site]-c2;
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable) 
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else      
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+          for (r=0; r<block_size; r++) {
+            psi_old[i_low+r] = diagonal*psi[i_low+r]
+              - c3_z*(b_z_plus*psi[i*plane_size+j*row_size+k_plus+r]+b_z_minus*psi[i*plane_size+j*row_size+k_minus+r])
+              - c3_y*(b_y_plus*psi[i*plane_size+j_plus+k*block_size+r]+b_y_minus*psi[i*plane_size+j_minus+k*block_size+r])
+              - c3_x*(b_x_plus*psi[i_plus+j*row_size+k*block_size+r]+b_x_minus*psi[i_minus+j*row_size+k*block_size+r])
+              - psi_old[i_low+r];
+          }
+        }
+      }
+    }
+  }
+  return;
+}
@@ -45,6 +45,62 @@ double core_lyapounov(const int dim_x, const int loop_step, const double * restr
   return(gamma);
 }
 
+// Same as core_lyapounov, but for number_of_energies energies simultaneously, on the same disorder configuration
+// The loop over energies is the innermost one, so that it can be vectorized
+// The results are returned in tab_gamma
+void core_lyapounov_multi_energy(const int dim_x, const int loop_step, const double * restrict disorder, const int number_of_energies, const double * restrict tab_energy, const double inv_tunneling, double * restrict tab_gamma)
+{
+  int i, j, jmax, m;
+  double local_disorder;
+  double * restrict psi_cur;
+  double * restrict psi_old;
+  double * restrict scaled_energy;
+  psi_cur = (double *) malloc (number_of_energies*sizeof(double));
+  psi_old = (double *) malloc (number_of_energies*sizeof(double));
+  scaled_energy = (double *) malloc (number_of_energies*sizeof(double));
+  for (m=0;m<number_of_energies;m++) {
+    psi_cur[m]=1.0;
+    psi_old[m]=M_PI/sqrt(13.0);
+    scaled_energy[m]=inv_tunneling*tab_energy[m];
+    tab_gamma[m]=0.0;
+  }
+  for (i=0;i<dim_x;i+=loop_step) {
+    jmax=min(i+loop_step,dim_x);
+    for(j=i;j<jmax;j++) {
+      local_disorder=inv_tunneling*disorder[j];
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+  #pragma unroll
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable)
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+      for (m=0;m<number_of_energies;m++) {
+        double psi_new=psi_cur[m]*(local_disorder-scaled_energy[m])-psi_old[m];
+        psi_old[m]=psi_cur[m];
+        psi_cur[m]=psi_new;
+      }
+    }
+    for (m=0;m<number_of_energies;m++) {
+      tab_gamma[m]+=log(fabs(psi_cur[m]));
+      psi_old[m]/=psi_cur[m];
+      psi_cur[m]=1.0;
+    }
+  }
+  free(psi_cur);
+  free(psi_old);
+  free(scaled_energy);
+  return;
+}
+
 double core_lyapounov_non_diagonal_disorder(const int dim_x, const int loop_step, const double * restrict disorder, const int b, const double * restrict non_diagonal_disorder, const double energy, const double tunneling)
 {
   double gamma=0.0;	 
@@ -80,6 +136,112 @@ double core_lyapounov_non_diagonal_disorder(const int dim_x, const int loop_step
   return(gamma);
 }
 
+// Same as core_lyapounov, but for batch_size independent disorder realizations simultaneously
+// disorder is an interleaved (dim_x,batch_size) array: the realization index is the fastest one,
+// so that the innermost loop over realizations can be vectorized
+// The results are returned in tab_gamma
+void core_lyapounov_batched(const int dim_x, const int loop_step, const int batch_size, const double * restrict disorder, const double energy, const double inv_tunneling, double * restrict tab_gamma)
+{
+  int i, j, jmax, k;
+  double scaled_energy=inv_tunneling*energy;
+  double * restrict psi_cur;
+  double * restrict psi_old;
+  psi_cur = (double *) malloc (batch_size*sizeof(double));
+  psi_old = (double *) malloc (batch_size*sizeof(double));
+  for (k=0;k<batch_size;k++) {
+    psi_cur[k]=1.0;
+    psi_old[k]=M_PI/sqrt(13.0);
+    tab_gamma[k]=0.0;
+  }
+  for (i=0;i<dim_x;i+=loop_step) {
+    jmax=min(i+loop_step,dim_x);
+    for(j=i;j<jmax;j++) {
+      const double * restrict local_disorder=disorder+j*batch_size;
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+  #pragma unroll
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable)
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+      for (k=0;k<batch_size;k++) {
+        double psi_new=psi_cur[k]*(inv_tunneling*local_disorder[k]-scaled_energy)-psi_old[k];
+        psi_old[k]=psi_cur[k];
+        psi_cur[k]=psi_new;
+      }
+    }
+    for (k=0;k<batch_size;k++) {
+      tab_gamma[k]+=log(fabs(psi_cur[k]));
+      psi_old[k]/=psi_cur[k];
+      psi_cur[k]=1.0;
+    }
+  }
+  free(psi_cur);
+  free(psi_old);
+  return;
+}
+
+// Same as core_lyapounov_non_diagonal_disorder (b=1 only), but for batch_size independent disorder realizations simultaneously
+// disorder is an interleaved (dim_x,batch_size) array, non_diagonal_disorder an interleaved (dim_x+1,batch_size) array
+// The results are returned in tab_gamma
+void core_lyapounov_non_diagonal_disorder_batched(const int dim_x, const int loop_step, const int batch_size, const double * restrict disorder, const double * restrict non_diagonal_disorder, const double energy, const double tunneling, double * restrict tab_gamma)
+{
+  int i, j, jmax, k;
+  double * restrict psi_cur;
+  double * restrict psi_old;
+  psi_cur = (double *) malloc (batch_size*sizeof(double));
+  psi_old = (double *) malloc (batch_size*sizeof(double));
+  for (k=0;k<batch_size;k++) {
+    psi_cur[k]=1.0;
+    psi_old[k]=M_PI/sqrt(13.0);
+    tab_gamma[k]=0.0;
+  }
+  for (i=0;i<dim_x;i+=loop_step) {
+    jmax=min(i+loop_step,dim_x);
+    for(j=i;j<jmax;j++) {
+      const double * restrict local_disorder=disorder+j*batch_size;
+      const double * restrict left_hopping=non_diagonal_disorder+j*batch_size;
+      const double * restrict right_hopping=non_diagonal_disorder+(j+1)*batch_size;
+#ifdef __INTEL_LLVM_COMPILER
+  #pragma vector
+  #pragma unroll
+#else
+  #ifdef __clang__
+    #pragma clang loop vectorize(enable)
+  #else
+    #ifdef __ICC
+      #pragma vector always
+      #pragma ivdep
+    #else
+      #pragma GCC ivdep
+    #endif
+  #endif
+#endif
+      for (k=0;k<batch_size;k++) {
+        double psi_new=(psi_cur[k]*(local_disorder[k]-energy)+psi_old[k]*(left_hopping[k]-tunneling))/(tunneling-right_hopping[k]);
+        psi_old[k]=psi_cur[k];
+        psi_cur[k]=psi_new;
+      }
+    }
+    for (k=0;k<batch_size;k++) {
+      tab_gamma[k]+=log(fabs(psi_cur[k]));
+      psi_old[k]/=psi_cur[k];
+      psi_cur[k]=1.0;
+    }
+  }
+  free(psi_cur);
+  free(psi_old);
+  return;
+}
+
 
 void update_A_2d(const int dim_y, const double * restrict disorder, const double tunneling_x, const double tunneling_y, const double energy, const int nrescale, const int i, double * restrict An, double * restrict An_old)
 {
@@ -7,95 +7,527 @@ Created on Thu Dec 12 16:33:12 2019
 """
 
 import numpy as np
+import scipy.linalg
+import anderson
+from anderson import kernels
 import scipy.sparse.linalg as sparse_linalg
-# import scipy.sparse
+import scipy.sparse
+
+def numba_decorator(x):
+  try:
+    import numba
+    return numba.jit(nopython=True,fastmath=True,cache=True)(x)
+  except:
+    print('numba package not found, this will use the slower regular Python version')
+    return(x)
+  pass
+
+"""
+Number of eigenvalues below each energy of tab_energy for a tridiagonal matrix (diagonal d, off-diagonal e),
+with an optional corner element coupling the first and last sites (periodic boundary conditions)
+The first n-1 sites are eliminated one after the other (Sturm sequence), the last site is eliminated
+at the end, so that the corner element only adds a coupling to the last site
+By the Sylvester law of inertia, the number of negative pivots is the number of eigenvalues below energy
+All energies are processed together in the inner loop, which vectorizes
+"""
+@numba_decorator
+def sturm_count_tridiagonal(d, e, corner, tab_energy):
+  n = d.size
+  number_of_energies = tab_energy.size
+  tiny = 1.e-300
+  count = np.zeros(number_of_energies,dtype=np.int64)
+  last = d[n-1]-tab_energy
+  pivot = d[0]-tab_energy
+# Coupling between the current site and the last one
+  coupling = np.full(number_of_energies,corner+(e[0] if n==2 else 0.0))
+  for i in range(n-1):
+    next_coupling = e[n-2] if i+1==n-2 else 0.0
+# The pivot computed at i=n-2 is not used
+    for j in range(number_of_energies):
+      current_pivot = pivot[j] if pivot[j]!=0.0 else tiny
+      count[j] += current_pivot<0.0
+      inverse_pivot = 1.0/current_pivot
+      ratio = e[i]*inverse_pivot
+      last[j] -= coupling[j]*coupling[j]*inverse_pivot
+      pivot[j] = d[i+1]-tab_energy[j]-e[i]*ratio
+      coupling[j] = next_coupling-ratio*coupling[j]
+  for j in range(number_of_energies):
+    if last[j]<0.0:
+      count[j] += 1
+  return count
+
+"""
+Diagonal of the inverse Z of a Hermitian positive definite matrix C=L D L^H (selected inversion)
+L is unit lower triangular, in CSC format (indptr, indices, data) with sorted row indices, d is the diagonal of D
+Z is the solution of Z = D^{-1} L^{-1} + (I-L^H) Z, that is, for i<=j (Takahashi equations):
+  Z_ij = delta_ij/d_i - sum_{k>i} conj(L_ki) Z_kj
+Only the k in the structure of column i of L contribute, and the needed Z_kj are all in the structure
+of L (filled graph), so that Z is computed column by column, from the last one, on the structure of L only
+The lower part of Z is stored with the same structure as L, the diagonal apart
+"""
+@numba_decorator
+def selected_inversion_diagonal(indptr, indices, data, d):
+  n = d.size
+  z = np.zeros(data.size,dtype=data.dtype)
+  diagonal = np.zeros(n,dtype=data.dtype)
+# s[j] accumulates the sum over k of conj(L_ki) Z_kj, for j in the structure of column i
+  s = np.zeros(n,dtype=data.dtype)
+  for i in range(n-1,-1,-1):
+    start = indptr[i]
+    end = indptr[i+1]
+    while start<end and indices[start]<=i:
+      start += 1
+    for p in range(start,end):
+      s[indices[p]] = 0.0
+    for q in range(start,end):
+      k = indices[q]
+      s[k] += np.conj(data[q])*diagonal[k]
+# Merge the structure of column k with the structure of column i below k, Z_jk being stored in column k
+      r = indptr[k]
+      for p in range(q+1,end):
+        j = indices[p]
+        while r<indptr[k+1]-1 and indices[r]<j:
+          r += 1
+        if indices[r]==j:
+          s[j] += np.conj(data[q]*z[r])
+          s[k] += np.conj(data[p])*z[r]
+    for p in range(start,end):
+      z[p] = -np.conj(s[indices[p]])
+    sum_i = 0.0j
+    for p in range(start,end):
+      sum_i += np.conj(data[p])*z[p]
+    diagonal[i] = 1.0/d[i]-sum_i
+  return diagonal
 
 class Diagonalization:
-  def __init__(self,targeted_energy,method='sparse',number_of_eigenvalues=1,IPR_min=0.0,IPR_max=1.0,number_of_bins=1):
+  def __init__(self,targeted_energy,method='sparse',number_of_eigenvalues=1,IPR_min=0.0,IPR_max=1.0,number_of_bins=1,chebyshev_degree=0,tab_targeted_energy=None,pivot=0.0,mpi_version=False,comm=None):
     self.targeted_energy = targeted_energy
+# Several targeted energies may be processed for each disorder configuration, targeted_energy is then the first one
+    if tab_targeted_energy is None:
+      self.tab_targeted_energy = np.array([targeted_energy])
+    else:
+      self.tab_targeted_energy = np.array(tab_targeted_energy,dtype=np.float64)
+    self.multi_energy = self.tab_targeted_energy.size>1
     self.method = method
     self.IPR_min = IPR_min
     self.IPR_max = IPR_max
     self.number_of_bins = number_of_bins
     self.number_of_eigenvalues = number_of_eigenvalues
+# Degree of the polynomial filter for method 'chebyshev', 0 for an automatic choice
+    self.chebyshev_degree = chebyshev_degree
+# Parameters of the Chebyshev filtered subspace iteration
+    self.subspace_size = max(2*number_of_eigenvalues,number_of_eigenvalues+8)
+    self.chebyshev_tolerance = 1.e-10
+    self.chebyshev_max_iterations = 100
+    self.chebyshev_kpm_block_kernel = None
+    if method=='chebyshev':
+      self.chebyshev_kpm_block_kernel = kernels.get_kernel('chebyshev','chebyshev_kpm_step_block')
+# Pivot for the landscape functions
+    self.pivot = pivot
+# Parameters of the preconditioned conjugate gradient for the landscape, and its last solution (used as initial guess)
+    self.landscape_tolerance = 1.e-10
+    self.landscape_max_iterations = 10000
+    self.landscape_iterations = 0
+    self.landscape_guess = None
+# Used to abort all MPI processes if the calculation cannot be done
+    self.mpi_version = mpi_version
+    self.comm = comm
 
-  def compute_IPR(self, i, H):
-    H.generate_disorder(seed=i+1234)
-    if self.method=='lapack':
-      matrix = H.generate_full_matrix()
-#    print(matrix)
-      w, v = np.linalg.eigh(matrix)
-#    print(w)
-#      index = np.abs(w-self.targeted_energy).argmin()
-      index_array = np.argsort(abs(w-self.targeted_energy))
-#    print(index_array[0:self.number_of_eigenvalues])
-      imin = np.min(index_array[0:self.number_of_eigenvalues])
-      imax = np.max(index_array[0:self.number_of_eigenvalues])+1
-    if self.method=='sparse':
-      H.generate_sparse_matrix()
-      w, v = sparse_linalg.eigsh(H.sparse_matrix,k=self.number_of_eigenvalues,sigma=self.targeted_energy,mode='normal')
-      imin = 0
-      imax = self.number_of_eigenvalues
-# The sparse_linalg.eigsh is complete bullshit for complex hermitian matrices, it requires to sort the eigenvalues
-      if (H.spin_one_half):
-        index_array = np.argsort(w)
-        w = w[index_array]
+  """
+  Stops the calculation with message, aborting all MPI processes if any
+  """
+  def abort(self, message):
+    anderson.io.my_abort(self.mpi_version,self.comm,message)
+
+  """
+  Applies psi_old <- c1*H*psi-c2*psi-psi_old on a block of vectors (one per column), i.e. one step
+  of the Chebyshev recursion for suitable c1 and c2, using the same routines than the KPM spectral function
+  """
+  def chebyshev_step_block(self, H, psi, psi_old, c1, c2):
+    if self.chebyshev_kpm_block_kernel is not None and not H.spin_one_half:
+      self.chebyshev_kpm_block_kernel(H.dimension, H.array_tab_dim, H.array_boundary_condition,\
+        psi.shape[1], psi, psi_old, H.disorder.ravel(), H.array_tunneling, c1, c2)
+    else:
+      for r in range(psi.shape[1]):
+# The spin-orbit routine expects a flat array
+        wfc = np.ascontiguousarray(psi[:,r])
+        if not H.spin_one_half:
+          wfc = wfc.reshape(H.tab_dim)
+        psi_old[:,r] = c1*H.apply_h(wfc).ravel()-c2*psi[:,r]-psi_old[:,r]
+    return
+
+  """
+  Interior eigensolver using only the action of H on vectors (method 'chebyshev'), with O(ntot) memory
+  A block of subspace_size vectors is repeatedly filtered by a polynomial of H peaked at targeted_energy
+  (the Jackson damped Chebyshev expansion of a delta function), orthonormalized and rotated
+  to the Ritz vectors (Rayleigh-Ritz), until the number_of_eigenvalues Ritz pairs closest to targeted_energy
+  have a residual smaller than chebyshev_tolerance (relative to the spectral width)
+  Returns the eigenvalues in increasing order and the normalized eigenvectors (None if not requested)
+  """
+  def compute_chebyshev_eigenpairs(self, H, targeted_energy, want_eigenvectors):
+    n = H.hs_dim
+    k = min(self.number_of_eigenvalues,n)
+    subspace_size = min(self.subspace_size,n)
+    H.energy_range()
+# The filter is peaked at targeted_energy, it cannot select the eigenvalues closest to an energy outside the spectrum
+    if targeted_energy<H.e_min or targeted_energy>H.e_max:
+      self.abort('Targeted energy '+str(targeted_energy)+' outside the spectral bounds ['+str(H.e_min)+','+str(H.e_max)+'], the chebyshev method cannot be used, I stop!\n')
+# Small margin, so that the spectrum is strictly inside [-1,1] after rescaling
+    margin = 1.e-3*(H.e_max-H.e_min)
+    e_min = H.e_min-margin
+    e_max = H.e_max+margin
+    half_width = 0.5*(e_max-e_min)
+    c1 = 1.0/half_width
+    c2 = 0.5*c1*(e_max+e_min)
+    x_0 = (targeted_energy-0.5*(e_max+e_min))/half_width
+# The width of the filter, about pi*sqrt(1-x_0**2)/degree, should contain about a quarter of the subspace_size
+# eigenvalues (optimal in numerical experiments)
+# Unless the degree is prescribed, the first filter uses a flat density of states estimate, and the density
+# of states at targeted_energy is measured along the way (KPM with the initial random vectors) to set the next degrees
+    degree = self.chebyshev_degree
+    if degree<=0:
+      degree = max(10,int(2.0*np.pi*np.sqrt(1.0-x_0**2)*n/subspace_size))
+    rng = np.random.default_rng(H.seed)
+# The vectors are the columns of psi, the layout expected by chebyshev_kpm_step_block
+    psi = np.zeros((n,subspace_size),dtype=np.complex128)
+    psi.real = rng.standard_normal((subspace_size,n)).T
+    if not H.is_real:
+      psi.imag = rng.standard_normal((subspace_size,n)).T
+    for iteration in range(self.chebyshev_max_iterations):
+      measure_density_of_states = iteration==0 and self.chebyshev_degree<=0
+      tab_coefficient = 2.0*anderson.propagation.kpm_damping_kernel(degree)*np.cos(np.arange(degree+1)*np.arccos(x_0))
+      tab_coefficient[0] *= 0.5
+# Polynomial filter, using the Chebyshev recursion T_{j+1}(H)=2H T_j(H)-T_{j-1}(H), H being rescaled in [-1,1]
+      if measure_density_of_states:
+        initial_psi = psi.copy()
+        tab_mu = np.zeros(degree+1)
+        tab_mu[0] = 1.0
+        mu_factor = 1.0/np.vdot(psi,psi).real
+      psi_old = np.zeros_like(psi)
+      self.chebyshev_step_block(H, psi, psi_old, c1, c2)
+      filtered_psi = tab_coefficient[0]*psi+tab_coefficient[1]*psi_old
+      if measure_density_of_states:
+        tab_mu[1] = np.vdot(initial_psi,psi_old).real*mu_factor
+      for j in range(2,degree+1):
+        psi, psi_old = psi_old, psi
+        self.chebyshev_step_block(H, psi, psi_old, 2.0*c1, 2.0*c2)
+        filtered_psi += tab_coefficient[j]*psi_old
+        if measure_density_of_states:
+          tab_mu[j] = np.vdot(initial_psi,psi_old).real*mu_factor
+# Density of states at x_0 is sum(tab_coefficient*tab_mu)/(pi*sqrt(1-x_0**2)), normalized to 1 on [-1,1]
+      if measure_density_of_states:
+        degree = max(10,int(4.0*n*max(np.dot(tab_coefficient,tab_mu),0.0)/subspace_size))
+# Orthonormalization and Rayleigh-Ritz
+      psi = np.ascontiguousarray(np.linalg.qr(filtered_psi)[0])
+      h_psi = np.zeros_like(psi)
+      self.chebyshev_step_block(H, psi, h_psi, 1.0, 0.0)
+      projected_matrix = np.conj(psi.T) @ h_psi
+      if H.is_real:
+        projected_matrix = projected_matrix.real
+      w, rotation = np.linalg.eigh(projected_matrix)
+      psi = psi @ rotation
+      h_psi = h_psi @ rotation
+# Each interval [w-residual,w+residual] contains an eigenvalue of H: ranking the Ritz pairs by the largest
+# distance to targeted_energy in this interval discards the unconverged mixtures of eigenvectors lying
+# on both sides of targeted_energy, whose Ritz values may be close to targeted_energy
+      residual = np.linalg.norm(h_psi-psi*w,axis=0)
+      index_array = np.argsort(abs(w-targeted_energy)+residual)[0:k]
+      if np.max(residual[index_array])<self.chebyshev_tolerance*half_width:
+        break
+    else:
+      self.abort('Chebyshev filtered subspace iteration not converged after '+str(self.chebyshev_max_iterations)+' iterations, maximum residual = '+str(np.max(residual[index_array]))+', I stop!\n')
+    index_array = np.sort(index_array)
+    if not want_eigenvectors:
+      return w[index_array], None
+    v = psi[:,index_array]
+    if H.is_real:
+      v = v.real
+    return w[index_array], v
+
+  """
+  Indices [imin,imax) of the number_of_eigenvalues eigenvalues of w (sorted) closest to targeted_energy, a contiguous range
+  """
+  def closest_eigenvalues(self, w, targeted_energy):
+    k = min(self.number_of_eigenvalues,w.size)
+    index_array = np.argsort(abs(w-targeted_energy))
+    imin = np.min(index_array[0:k])
+    imax = np.max(index_array[0:k])+1
+    return imin, imax
+
+  """
+  Dense diagonalization (method 'lapack'), when the eigenvectors are needed
+  Only the eigenpairs in the index window around the targeted energies are computed (MRRR Lapack driver),
+  the number of eigenvalues below a targeted energy being given by the inertia of the LDL^T factorization
+  of H-targeted_energy (much cheaper than the eigenvectors)
+  The window spans the lowest and highest targeted energies, so that the reduction to tridiagonal form is done once
+  Returns a list of (eigenvalues, eigenvectors) pairs, one per targeted energy, each with the number_of_eigenvalues
+  eigenvalues closest to the targeted energy in increasing order
+  """
+  def compute_lapack_eigenpairs(self, H):
+    matrix = H.generate_full_matrix()
+    n = matrix.shape[0]
+    k = min(self.number_of_eigenvalues,n)
+    tab_n_below = []
+    for energy in np.unique([np.min(self.tab_targeted_energy),np.max(self.tab_targeted_energy)]):
+      lu, d, perm = scipy.linalg.ldl(matrix-energy*np.eye(n),hermitian=True,check_finite=False)
+# d is block diagonal, with 1x1 and 2x2 Hermitian blocks, hence equivalent to a real tridiagonal matrix
+      tab_n_below.append(np.count_nonzero(scipy.linalg.eigvalsh_tridiagonal(d.diagonal().real,np.abs(d.diagonal(1)))<0.0))
+    index_min = max(0,tab_n_below[0]-k)
+    index_max = min(n,tab_n_below[-1]+k)
+    w, v = scipy.linalg.eigh(matrix,subset_by_index=[index_min,index_max-1],driver='evr',overwrite_a=True,check_finite=False)
+    list_of_eigenpairs = []
+    for targeted_energy in self.tab_targeted_energy:
+      imin, imax = self.closest_eigenvalues(w,targeted_energy)
+      list_of_eigenpairs.append((w[imin:imax],v[:,imin:imax]))
+    return list_of_eigenpairs
+
+  """
+  Shift-invert Lanczos (method 'sparse'), with a sparse LU factorization of H-targeted_energy
+  As H-targeted_energy is Hermitian, the factorization uses a symmetric fill-reducing ordering (minimum degree
+  on the pattern of H, the same for all targeted energies) with pivots preferably on the diagonal,
+  and each solve is followed by one step of iterative refinement
+  When there are several targeted energies, the ordering computed for the first factorization is reused:
+  the matrix is symmetrically permuted once, and the next factorizations keep this ordering
+  Returns a list of (eigenvalues in increasing order, eigenvectors or None) pairs, one per targeted energy
+  """
+  def compute_sparse_eigenpairs(self, H, want_eigenvectors):
+    H.generate_sparse_matrix()
+    matrix = H.sparse_matrix.tocsc()
+    n = matrix.shape[0]
+    identity = scipy.sparse.identity(n,dtype=matrix.dtype,format='csc')
+    order = None
+    list_of_eigenpairs = []
+    for targeted_energy in self.tab_targeted_energy:
+      if order is None:
+        shifted_matrix = matrix-targeted_energy*identity
+        lu = sparse_linalg.splu(shifted_matrix,permc_spec='MMD_AT_PLUS_A',diag_pivot_thresh=0.001,options=dict(SymmetricMode=True))
+        if self.multi_energy:
+# Row and column order[j] of the matrix becomes row and column j of the permuted matrix
+          order = np.argsort(lu.perm_c)
+          permuted_matrix = matrix[order][:,order].tocsc()
+        def solve(x, lu=lu, shifted_matrix=shifted_matrix):
+          x = x.ravel()
+          y = lu.solve(x)
+          return y+lu.solve(x-shifted_matrix@y)
+      else:
+        shifted_matrix = permuted_matrix-targeted_energy*identity
+        lu = sparse_linalg.splu(shifted_matrix,permc_spec='NATURAL',diag_pivot_thresh=0.001,options=dict(SymmetricMode=True))
+        def solve(x, lu=lu, shifted_matrix=shifted_matrix):
+          x = x.ravel()[order]
+          y = lu.solve(x)
+          y += lu.solve(x-shifted_matrix@y)
+          result = np.empty_like(y)
+          result[order] = y
+          return result
+      operator = sparse_linalg.LinearOperator((n,n),matvec=solve,dtype=matrix.dtype)
+      if want_eigenvectors:
+        w, v = sparse_linalg.eigsh(matrix,k=self.number_of_eigenvalues,sigma=targeted_energy,OPinv=operator,mode='normal')
+      else:
+        w = sparse_linalg.eigsh(matrix,k=self.number_of_eigenvalues,sigma=targeted_energy,OPinv=operator,mode='normal',return_eigenvectors=False)
+        v = None
+# The sparse_linalg.eigsh does not sort the eigenvalues for complex hermitian matrices
+      index_array = np.argsort(w)
+      w = w[index_array]
+      if want_eigenvectors:
         v = v[:,index_array]
-  # The normalization (division by delta_vol) ensures that IPR is roughly the inverse of the localization length
-    if H.spin_one_half:
-      IPR = np.sum(np.abs(v[:,imin:imax])**4,axis=0)/H.delta_vol
+      list_of_eigenpairs.append((w,v))
+    return list_of_eigenpairs
+
+  """
+  Lapack band storage (as expected by gbtrf) of a Hamiltonian which is block tridiagonal along x
+  With periodic boundary conditions, the slices along x are reordered as 0,dim_x-1,1,dim_x-2... so that the matrix is banded
+  Returns the band matrix, the bandwidth, and the position of each site in the new ordering
+  """
+  def generate_band_matrix(self, matrix, dim_x, periodic):
+    n = matrix.shape[0]
+    m = n//dim_x
+    if periodic:
+      order = np.empty(dim_x,dtype=int)
+      order[0::2] = np.arange((dim_x+1)//2)
+      order[1::2] = dim_x-1-np.arange(dim_x//2)
     else:
-      IPR = np.sum(v[:,imin:imax]**4,axis=0)/H.delta_vol
-    return w[imin:imax], IPR
+      order = np.arange(dim_x)
+    position = np.empty(n,dtype=int)
+    position[(order[:,None]*m+np.arange(m)).ravel()] = np.arange(n)
+    coo = matrix.tocoo()
+    row = position[coo.row]
+    col = position[coo.col]
+    bandwidth = np.max(np.abs(row-col))
+# bandwidth additional rows are needed for the fill-in of the LU factorization
+    band_matrix = np.zeros((3*bandwidth+1,n),dtype=matrix.dtype)
+    band_matrix[2*bandwidth+row-col,col] = coo.data
+    return band_matrix, bandwidth, position
 
-  def compute_tab_r(self, i, H):
-    H.generate_disorder(seed=i+1234)
+  """
+  Structured diagonalization for 1d and quasi-1d systems (method 'banded')
+  The Hamiltonian is block tridiagonal along the first dimension x, with blocks of size ntot/dim_x
+  (times 2 with spin), i.e. 1 in 1d and dim_y for a dim_x*dim_y strip
+  Only the number_of_eigenvalues eigenvalues closest to each targeted energy are computed, and the eigenvectors only if requested
+  For a 1d system without spin, the eigenvalues are computed by bisection using Sturm counts (number of
+  eigenvalues below an energy), with a cost proportional to dim_x, and the eigenvectors by inverse iteration
+  using the Lapack tridiagonal (open boundary conditions) or band (periodic boundary conditions) solvers
+  The bisections for all targeted energies are done together, each targeted energy bracketing the eigenvalues around it
+  Otherwise, shift-invert Lanczos is used, with a Lapack band factorization of H-targeted_energy, the band matrix
+  being built once for all targeted energies
+  Returns a list of (eigenvalues in increasing order, normalized eigenvectors or None) pairs, one per targeted energy
+  """
+  def compute_banded_eigenpairs(self, H, want_eigenvectors):
+    H.generate_sparse_matrix()
+    matrix = H.sparse_matrix
+    n = matrix.shape[0]
+    k = min(self.number_of_eigenvalues,n)
+    dim_x = H.tab_dim[0]
+# For dim_x=2, the periodic hopping is already summed with the regular one
+    periodic = H.tab_boundary_condition[0]=='periodic' and dim_x>2
+    if n>dim_x:
+      band_matrix, bandwidth, position = self.generate_band_matrix(matrix,dim_x,periodic)
+      gbtrf, gbtrs = scipy.linalg.get_lapack_funcs(('gbtrf','gbtrs'),(band_matrix,))
+      list_of_eigenpairs = []
+      for targeted_energy in self.tab_targeted_energy:
+        shifted_matrix = band_matrix.copy()
+        shifted_matrix[2*bandwidth] -= targeted_energy
+        lu, ipiv, info = gbtrf(shifted_matrix,bandwidth,bandwidth,overwrite_ab=True)
+        def solve(x, lu=lu, ipiv=ipiv):
+          y = np.empty_like(x)
+          y[position] = x.ravel()
+          y, info = gbtrs(lu,bandwidth,bandwidth,y,ipiv)
+          return y[position]
+        operator = sparse_linalg.LinearOperator((n,n),matvec=solve,dtype=matrix.dtype)
+        if want_eigenvectors:
+          w, v = sparse_linalg.eigsh(matrix,k=k,sigma=targeted_energy,OPinv=operator,mode='normal')
+        else:
+          w = sparse_linalg.eigsh(matrix,k=k,sigma=targeted_energy,OPinv=operator,mode='normal',return_eigenvectors=False)
+          v = None
+        index_array = np.argsort(w)
+        w = w[index_array]
+        if want_eigenvectors:
+          v = v[:,index_array]
+        list_of_eigenpairs.append((w,v))
+      return list_of_eigenpairs
+    d = matrix.diagonal().real.copy()
+    e = np.append(matrix.diagonal(1).real,matrix[n-1,0].real if periodic else 0.0)
+# The k eigenvalues closest to a targeted energy have indices between n_below-k and n_below+k-1
+# The eigenvalues are computed once for the union of these index windows
+    tab_targeted_energy = np.sort(self.tab_targeted_energy)
+    tab_n_below = sturm_count_tridiagonal(d,e,e[n-1],tab_targeted_energy)
+    tab_index = np.unique(np.concatenate([np.arange(max(0,n_below-k),min(n,n_below+k)) for n_below in tab_n_below]))
+# Gershgorin bounds of the spectrum
+    radius = np.abs(e)+np.roll(np.abs(e),1)
+    e_min = np.min(d-radius)
+    e_max = np.max(d+radius)
+    tolerance = 4.0*np.finfo(np.float64).eps*max(abs(e_min),abs(e_max),1.0)
+# Bisection, simultaneously for all eigenvalues in the index windows
+# The eigenvalue of index tab_index[j] is always in [tab_left[j],tab_right[j]], initially bracketed
+# by the closest targeted energies (or the Gershgorin bounds)
+    number_of_targets_below = np.searchsorted(tab_n_below,tab_index,side='right')
+    tab_left = np.append(e_min-tolerance,tab_targeted_energy)[number_of_targets_below]
+    tab_right = np.append(tab_targeted_energy,e_max+tolerance)[number_of_targets_below]
+    while np.max(tab_right-tab_left)>tolerance:
+      tab_middle = 0.5*(tab_left+tab_right)
+      below = sturm_count_tridiagonal(d,e,e[n-1],tab_middle)>tab_index
+      tab_right = np.where(below,tab_middle,tab_right)
+      tab_left = np.where(below,tab_left,tab_middle)
+    w = 0.5*(tab_left+tab_right)
+# Keep the k closest eigenvalues to each targeted energy, a contiguous range in its index window
+    list_of_ranges = []
+    for targeted_energy in self.tab_targeted_energy:
+      n_below = tab_n_below[np.searchsorted(tab_targeted_energy,targeted_energy)]
+      start = np.searchsorted(tab_index,max(0,n_below-k))
+      end = np.searchsorted(tab_index,min(n,n_below+k))
+      imin, imax = self.closest_eigenvalues(w[start:end],targeted_energy)
+      list_of_ranges.append((start+imin,start+imax))
+    if not want_eigenvectors:
+      return [(w[imin:imax],None) for imin, imax in list_of_ranges]
+# The eigenvectors are computed only for the kept eigenvalues
+    kept = np.unique(np.concatenate([np.arange(imin,imax) for imin, imax in list_of_ranges]))
+    w_kept = w[kept]
+    if not periodic:
+      iblock = np.zeros(n,dtype=np.intc)
+      iblock[0:w_kept.size] = 1
+      isplit = np.zeros(n,dtype=np.intc)
+      isplit[0] = n
+      v, info = scipy.linalg.lapack.dstein(d,e[:-1],w_kept,iblock,isplit)
+    else:
+# Inverse iteration, each vector is orthogonalized against the previous ones (needed for quasi-degenerate eigenvalues)
+      band_matrix, bandwidth, position = self.generate_band_matrix(matrix,dim_x,periodic)
+      gbtrf, gbtrs = scipy.linalg.get_lapack_funcs(('gbtrf','gbtrs'),(band_matrix,))
+      v = np.zeros((n,w_kept.size))
+      rng = np.random.default_rng(1234)
+      for j in range(w_kept.size):
+# The shift is slightly off the eigenvalue, so that the matrix is not exactly singular
+        shifted_matrix = band_matrix.copy()
+        shifted_matrix[2*bandwidth] -= w_kept[j]+1000.0*tolerance
+        lu, ipiv, info = gbtrf(shifted_matrix,bandwidth,bandwidth,overwrite_ab=True)
+        x = rng.standard_normal(n)
+        for iteration in range(3):
+          x, info = gbtrs(lu,bandwidth,bandwidth,x,ipiv)
+          x -= v[:,0:j] @ (v[:,0:j].T @ x)
+          x /= np.linalg.norm(x)
+        v[:,j] = x
+      v = v[position]
+    list_of_eigenpairs = []
+    for imin, imax in list_of_ranges:
+      column = np.searchsorted(kept,imin)
+      list_of_eigenpairs.append((w[imin:imax],v[:,column:column+imax-imin]))
+    return list_of_eigenpairs
+  """
+  Eigenpairs closest to each targeted energy, for the current disorder configuration
+  The matrix is built once, and shared with all targeted energies
+  Returns a list of (eigenvalues in increasing order, eigenvectors or None) pairs, one per targeted energy
+  """
+  def compute_eigenpairs(self, H, want_eigenvectors):
     if self.method=='lapack':
+      if want_eigenvectors:
+        return self.compute_lapack_eigenpairs(H)
       matrix = H.generate_full_matrix()
-#    print(matrix)
       w = np.linalg.eigvalsh(matrix)
-      index_array = np.argsort(abs(w-self.targeted_energy))
-#    print(index_array[0:self.number_of_eigenvalues])
-      imin = np.min(index_array[0:self.number_of_eigenvalues])
-      imax = np.max(index_array[0:self.number_of_eigenvalues])+1
+      list_of_eigenpairs = []
+      for targeted_energy in self.tab_targeted_energy:
+        imin, imax = self.closest_eigenvalues(w,targeted_energy)
+        list_of_eigenpairs.append((w[imin:imax],None))
+      return list_of_eigenpairs
     if self.method=='sparse':
-      H.generate_sparse_matrix()
-#      print(H.sparse_matrix.dtype)
-#      matrix2 = H.generate_sparse_complex_matrix(1j)
-      w = sparse_linalg.eigsh(H.sparse_matrix,k=self.number_of_eigenvalues,sigma=self.targeted_energy,mode='normal',return_eigenvectors=False)
-# The sparse_linalg.eigsh is complete bullshit for complex hermitian matrices, it requires to sort the eigenvalues
-      if (H.spin_one_half):
-        w = np.sort(w)
-      imin = 0
-      imax = self.number_of_eigenvalues
-    tab_r = np.zeros(imax-2-imin)
-    for j in range(imin,imax-2):
-      r = (w[j+2]-w[j+1])/(w[j+1]-w[j])
-      if r>1.0: r=1.0/r
-      tab_r[j-imin] = r
-    return (w[imin+1:imax-1],tab_r)
+      return self.compute_sparse_eigenpairs(H,want_eigenvectors)
+    if self.method=='banded':
+      return self.compute_banded_eigenpairs(H,want_eigenvectors)
+    if self.method=='chebyshev':
+      return [self.compute_chebyshev_eigenpairs(H,targeted_energy,want_eigenvectors) for targeted_energy in self.tab_targeted_energy]
+
+# In the following routines, the results for the successive targeted energies are concatenated
+  def compute_IPR(self, i, H):
+    H.generate_disorder(seed=i+1234)
+    list_of_energies = []
+    list_of_IPR = []
+    for w, v in self.compute_eigenpairs(H,True):
+  # The normalization (division by delta_vol) ensures that IPR is roughly the inverse of the localization length
+      if H.spin_one_half:
+        IPR = np.sum(np.abs(v)**4,axis=0)/H.delta_vol
+      else:
+        IPR = np.sum(v**4,axis=0)/H.delta_vol
+      list_of_energies.append(w)
+      list_of_IPR.append(IPR)
+    return np.concatenate(list_of_energies), np.concatenate(list_of_IPR)
+
+  def compute_tab_r(self, i, H):
+    H.generate_disorder(seed=i+1234)
+    list_of_energies = []
+    list_of_r = []
+    for w, v in self.compute_eigenpairs(H,False):
+      tab_r = np.zeros(w.size-2)
+      for j in range(w.size-2):
+        r = (w[j+2]-w[j+1])/(w[j+1]-w[j])
+        if r>1.0: r=1.0/r
+        tab_r[j] = r
+      list_of_energies.append(w[1:-1])
+      list_of_r.append(tab_r)
+    return np.concatenate(list_of_energies), np.concatenate(list_of_r)
 
   def compute_wavefunction(self,i,H):
     H.generate_disorder(seed=i+1234)
-    if self.method=='lapack':
-      matrix = H.generate_full_matrix()
-#    print(matrix)
-      w, v = np.linalg.eigh(matrix)
-      index_array = np.argsort(abs(w-self.targeted_energy))
-#    print(index_array[0:self.number_of_eigenvalues])
-      imin = np.min(index_array[0:self.number_of_eigenvalues])
-      imax = np.max(index_array[0:self.number_of_eigenvalues])+1
-    if self.method=='sparse':
-      H.generate_sparse_matrix()
-      w, v = sparse_linalg.eigsh(H.sparse_matrix,k=self.number_of_eigenvalues,sigma=self.targeted_energy,mode='normal')
-      imin = 0
-      imax = self.number_of_eigenvalues
-# The sparse_linalg.eigsh is complete bullshit for complex hermitian matrices, it requires to sort the eigenvalues
-      if (H.spin_one_half):
-        index_array = np.argsort(w)
-        w = w[index_array]
-        v = v[:,index_array]
-    return w[imin:imax],v[:,imin:imax]/np.sqrt(H.delta_vol)
+    list_of_eigenpairs = self.compute_eigenpairs(H,True)
+    w = np.concatenate([w for w, v in list_of_eigenpairs])
+    v = np.hstack([v for w, v in list_of_eigenpairs])
+    return w,v/np.sqrt(H.delta_vol)
 
   def compute_full_spectrum(self,i,H):
     H.generate_disorder(seed=i+1234)
@@ -106,79 +538,115 @@ class Diagonalization:
 
   def compute_spectrum(self,i,H):
     H.generate_disorder(seed=i+1234)
-    if self.method=='lapack':
-      matrix = H.generate_full_matrix()
-#    print(matrix)
-      w = np.linalg.eigvalsh(matrix)
-      index_array = np.argsort(abs(w-self.targeted_energy))
-#    print(index_array[0:self.number_of_eigenvalues])
-      imin = np.min(index_array[0:self.number_of_eigenvalues])
-      imax = np.max(index_array[0:self.number_of_eigenvalues])+1
-      return w[imin:imax]
-# Old, less efficient, code
-      """
-# identify the closest eigenvalue
-      index = np.abs(w-self.targeted_energy).argmin()
-      index_right = index+1
-      index_left = index-1
-# search the next ones either on the left of right sides
-      for i in range(k-1):
-        if abs(w[index_right]-self.targeted_energy)>abs(w[index_left]-self.targeted_energy):
-          index_left -=1
-        else:
-          index_right += 1
-      return w[index_left+1:index_right]
-      """
-    if self.method=='sparse':
-      H.generate_sparse_matrix()
-      w = sparse_linalg.eigsh(H.sparse_matrix,k=self.number_of_eigenvalues,sigma=self.targeted_energy,mode='normal',return_eigenvectors=False)
-# The sparse_linalg.eigsh is complete bullshit for complex hermitian matrices, it requires to sort the eigenvalues
-      if (H.spin_one_half):
-        w = np.sort(w)
-      return w
+    return np.concatenate([w for w, v in self.compute_eigenpairs(H,False)])
 
+  """
+  Factorization of H-pivot, done once per disorder configuration
+  Returns a function solving (H-pivot)x=b, b being either a vector or a block of right-hand sides (one per column)
+  """
+  def factorize_landscape_matrix(self, H, pivot):
+    if self.method=='lapack':
+      lu_and_pivots = scipy.linalg.lu_factor(H.generate_full_complex_matrix(pivot),overwrite_a=True,check_finite=False)
+      return lambda b: scipy.linalg.lu_solve(lu_and_pivots,b,check_finite=False)
+    return sparse_linalg.splu(H.generate_sparse_complex_matrix(pivot).tocsc()).solve
 
+  """
+  Landscape 1/|(H-pivot)^{-1} initial_state|+Re(pivot)
+  initial_state may also be a list of wavefunctions, processed as a single block of right-hand sides,
+  the landscapes being then returned one per line
+  """
   def compute_landscape(self,i,H,initial_state,pivot):
     H.generate_disorder(seed=i+1234)
-    if self.method=='lapack':
-      matrix = H.generate_full_complex_matrix(pivot)
-      print(matrix[0,0])
-      landscape = 1.0/np.abs(np.linalg.solve(matrix,initial_state.wfc))+pivot.real
-    if self.method=='sparse':
-      matrix = H.generate_sparse_matrix()
-# The following line is obviously less efficient
-#    matrix = H.generate_full_matrix()
-# The following line uses a CSR storage for the sparse matrix and is slightly less efficient
-#    matrix = scipy.sparse.csr_matrix(matrix)
-      landscape = 1.0/np.abs(sparse_linalg.spsolve(matrix,initial_state.wfc))+self.targeted_energy
-    return landscape
+    solve = self.factorize_landscape_matrix(H,pivot)
+    if isinstance(initial_state,list):
+      tab_u = solve(np.column_stack([state.wfc.ravel() for state in initial_state])).T
+      return (1.0/np.abs(tab_u)+np.real(pivot)).reshape([len(initial_state)]+list(H.tab_extended_dim))
+    landscape = 1.0/np.abs(solve(initial_state.wfc.ravel()))+np.real(pivot)
+    return landscape.reshape(H.tab_extended_dim)
 
+  """
+  Landscape sqrt(diag((H-pivot)^{-1}(H-pivot^*)^{-1})), i.e. the norm of each line of (H-pivot)^{-1}
+  With method 'lapack', it is computed from the eigenpairs (w_n,v_n) of H as sum_n |v_n|^2/|w_n-pivot|^2
+  Otherwise, (H-pivot^*)(H-pivot) is Hermitian positive definite, and the diagonal of its inverse is obtained
+  from its sparse LDL^H factorization by selected inversion, at a cost comparable to the factorization
+  (instead of one solve per site)
+  """
   def compute_landscape_2(self,i,H,pivot):
     H.generate_disorder(seed=i+1234)
     if self.method=='lapack':
-      matrix = H.generate_full_complex_matrix(pivot)
-      landscape = np.zeros(H.dim_x,dtype=np.complex128)
-#      print(matrix[0,0])
-      for i in range(H.dim_x):
-        init = np.zeros(H.dim_x,dtype=np.complex128)
-        init[i] = 1.0
-        init2 = np.linalg.solve(matrix,init)
-        landscape[i] = np.linalg.solve(np.conj(matrix),init2)[i]
-#        print(landscape[i])
-      landscape = np.sqrt(np.real(landscape))
-    if self.method=='sparse':
-      matrix = H.generate_sparse_complex_matrix(pivot)
-      landscape = np.zeros(H.dim_x,dtype=np.complex128)
-      for i in range(H.dim_x):
-        init = np.zeros(H.dim_x,dtype=np.complex128)
-        init[i] = 1.0
-        init2 = sparse_linalg.spsolve(matrix,init)
-        landscape[i] = sparse_linalg.spsolve(np.conj(matrix),init2)[i]
-#        print(landscape[i])
-      landscape = np.sqrt(np.real(landscape))
-# The following line is obviously less efficient
-#    matrix = H.generate_full_matrix()
-# The following line uses a CSR storage for the sparse matrix and is slightly less efficient
-#    matrix = scipy.sparse.csr_matrix(matrix)
-
-    return landscape
\ No newline at end of file
+      w, v = np.linalg.eigh(H.generate_full_matrix())
+      landscape = (np.abs(v)**2) @ (1.0/np.abs(w-pivot)**2)
+    else:
+      matrix = H.generate_sparse_complex_matrix(pivot).tocsc()
+      positive_matrix = (matrix.conj().T @ matrix).tocsc()
+# Symmetric ordering, and no pivoting (positive definite matrix): the permuted matrix is L U, with U = D L^H
+      lu = sparse_linalg.splu(positive_matrix,permc_spec='MMD_AT_PLUS_A',diag_pivot_thresh=0.0,options=dict(SymmetricMode=True))
+      lower = lu.L.tocsc()
+      lower.sort_indices()
+      diagonal = selected_inversion_diagonal(lower.indptr,lower.indices,lower.data.astype(np.complex128),lu.U.diagonal().astype(np.complex128))
+# Row and column order[j] of positive_matrix are row and column j of the permuted matrix
+      landscape = np.empty(diagonal.size)
+      landscape[np.argsort(lu.perm_c)] = diagonal.real
+    return np.sqrt(landscape).reshape(H.tab_extended_dim)
+
+  """
+  Landscape u solution of (H-pivot)u=initial_state (u=(H-pivot)^{-1}.1 if initial_state is None),
+  computed with a Jacobi preconditioned conjugate gradient using only H.apply_h, so that no matrix is built
+  H-pivot must be positive definite, i.e. the pivot real and below the spectrum, as for the Filoche-Mayboroda landscape
+  The solution of the previous call (other disorder realization or other pivot) is used as initial guess,
+  after rescaling to minimize the energy norm of the error
+  Returns the effective potential 1/|u|+pivot, like compute_landscape
+  """
+  def compute_landscape_iterative(self,i,H,pivot,initial_state=None):
+    H.generate_disorder(seed=i+1234)
+    if np.imag(pivot)!=0.0:
+      self.abort('The iterative landscape solver requires a real pivot, I stop!\n')
+    pivot = np.real(pivot)
+    if initial_state is None:
+      right_hand_side = np.ones(H.hs_dim)
+    else:
+      right_hand_side = initial_state.wfc.ravel()
+    dtype = np.complex128 if H.spin_one_half else right_hand_side.dtype
+    right_hand_side = right_hand_side.astype(dtype)
+# Diagonal of H, used for the Jacobi preconditioner
+    if H.spin_one_half or not H.has_specific_apply_h_routine:
+      H.generate_sparse_matrix()
+      diagonal = H.sparse_matrix.diagonal().real-pivot
+    else:
+      diagonal = H.disorder.ravel()-pivot
+    if np.min(diagonal)<=0.0:
+      self.abort('H-pivot is not positive definite, the pivot must be below the spectrum, I stop!\n')
+    apply_matrix = lambda x: H.apply_h(x)-pivot*x
+    x = np.zeros(H.hs_dim,dtype=dtype)
+    residual = right_hand_side.copy()
+    if self.landscape_guess is not None and self.landscape_guess.size==H.hs_dim:
+      guess = self.landscape_guess.astype(dtype)
+      matrix_times_guess = apply_matrix(guess)
+      guess_norm = np.vdot(guess,matrix_times_guess).real
+      if guess_norm>0.0:
+        scale = np.vdot(guess,right_hand_side)/guess_norm
+        x = scale*guess
+        residual -= scale*matrix_times_guess
+    tolerance = self.landscape_tolerance*np.linalg.norm(right_hand_side)
+    z = residual/diagonal
+    p = z.copy()
+    rz = np.vdot(residual,z).real
+    iteration = 0
+    while np.linalg.norm(residual)>tolerance and iteration<self.landscape_max_iterations:
+      matrix_times_p = apply_matrix(p)
+      p_norm = np.vdot(p,matrix_times_p).real
+      if p_norm<=0.0:
+        self.abort('H-pivot is not positive definite, the pivot must be below the spectrum, I stop!\n')
+      alpha = rz/p_norm
+      x += alpha*p
+      residual -= alpha*matrix_times_p
+      z = residual/diagonal
+      rz_new = np.vdot(residual,z).real
+      p = z+(rz_new/rz)*p
+      rz = rz_new
+      iteration += 1
+    if np.linalg.norm(residual)>tolerance:
+      self.abort('Conjugate gradient for the landscape not converged after '+str(iteration)+' iterations, relative residual = '+str(np.linalg.norm(residual)/np.linalg.norm(right_hand_side))+', I stop!\n')
+    self.landscape_iterations = iteration
+    self.landscape_guess = x
+    return (1.0/np.abs(x)+pivot).reshape(H.tab_extended_dim)
@@ -8,12 +8,14 @@ Created on Sun Nov 22 19:26:01 2020
 
 import copy
 import numpy as np
+import scipy.special
+from concurrent.futures import ThreadPoolExecutor
 
 """
 The class Geometry defines the geometry of the system, including the local Hilbert space on each site (currently limited to spin 1/2 systems) with no reference to the Hamiltonian
 """
 class Geometry:
-  def __init__(self, dimension, tab_dim ,tab_delta, spin_one_half=False, reproducible_randomness=True, custom_seed=0, use_mkl_random=True, use_mkl_fft=True):
+  def __init__(self, dimension, tab_dim ,tab_delta, spin_one_half=False, reproducible_randomness=True, custom_seed=0, use_mkl_random=True, use_mkl_fft=True, counter_based_random=False, random_number_of_threads=1):
     self.dimension = dimension
     self.tab_dim = tab_dim
 #    self.tab_hs_dim = copy.deepcopy(tab_dim)
@@ -49,12 +51,19 @@ class Geometry:
     self.use_mkl_fft = use_mkl_fft
     self.reproducible_randomness = reproducible_randomness
     self.custom_seed = custom_seed
+    self.counter_based_random = counter_based_random
+    self.random_number_of_threads = random_number_of_threads
     self.define_random_number_generator()
     return
 
-# If possible, use the MKL random number generator
-# Otherwise, use Numpy random number generator  
-  def define_random_number_generator(self): 
+# If required, use the counter-based generator (see Counter_Based_Random below)
+# Otherwise, if possible, use the MKL random number generator
+# Otherwise, use Numpy random number generator
+# purpose is either 'disorder' or 'initial_state', it is used only by the counter-based generator
+  def define_random_number_generator(self):
+    if self.counter_based_random:
+      self.rng = lambda seed, purpose='disorder': Counter_Based_Random(seed, custom_seed=self.custom_seed, purpose=purpose, number_of_threads=self.random_number_of_threads)
+      return
     if self.use_mkl_random:
       try:
         import mkl_random
@@ -62,9 +71,9 @@ class Geometry:
         self.use_mkl_random=False
         print('No mkl_random found; Fallback to Numpy random')
     if self.use_mkl_random:
-      self.rng = lambda seed: mkl_random.RandomState(seed, brng='SFMT19937')
+      self.rng = lambda seed, purpose='disorder': mkl_random.RandomState(seed, brng='SFMT19937')
     else:
-      self.rng = lambda seed: np.random.default_rng(seed)
+      self.rng = lambda seed, purpose='disorder': np.random.default_rng(seed)
     return
   
 """
@@ -74,4 +83,59 @@ def mkl_rng(seed):
   
 def np_rng(seed):
   return np.random.default_rng(seed)
-"""
\ No newline at end of file
+"""
+
+"""
+Counter-based random number generator (Philox4x64), keyed by (custom_seed, seed, purpose)
+The seed identifies the disorder realization (e.g. i+1234+custom_seed) and purpose is 'disorder' or 'initial_state',
+so that the random numbers of a realization depend neither on the number of processes nor on the order in which
+the realizations are computed, and the streams for the disorder and the initial state never overlap.
+The k-th random word of a stream is a function of the key and k only, without any jump: a large array is
+filled in chunks by number_of_threads threads, with exactly the same result for any number of threads.
+Only the methods used in the code (uniform and standard_normal) are provided, with the Numpy signatures.
+Each draw starts on a new Philox block (4 words), at the position following the previous draw.
+Gaussian numbers are obtained by inversion of the cumulative distribution, one uniform number each.
+"""
+class Counter_Based_Random:
+  dict_of_purposes = {'disorder':0,'initial_state':1}
+# Number of random words per chunk, must be a multiple of 4
+  chunk_size = 1<<18
+
+  def __init__(self, seed, custom_seed=0, purpose='disorder', number_of_threads=1):
+# With seed=None (non reproducible randomness), the key is taken from the OS entropy
+    if seed is None:
+      entropy = None
+    else:
+      entropy = [custom_seed & 0xFFFFFFFFFFFFFFFF, seed & 0xFFFFFFFFFFFFFFFF, self.dict_of_purposes[purpose]]
+    self.key = np.random.SeedSequence(entropy).generate_state(2,dtype=np.uint64)
+    self.position = 0
+    self.number_of_threads = number_of_threads
+    return
+
+  def fill(self, size, transform):
+# Returns an array of shape size, transform being applied to each chunk of 64-bit random words
+    n = int(np.prod(size))
+    first_position = self.position
+    self.position += 4*((n+3)//4)
+    output = np.empty(n)
+    def fill_chunk(start):
+      stop = min(start+self.chunk_size,n)
+      bit_generator = np.random.Philox(key=self.key,counter=[(first_position+start)//4,0,0,0])
+      output[start:stop] = transform(bit_generator.random_raw(stop-start))
+      return
+    tab_start = range(0,n,self.chunk_size)
+    if self.number_of_threads>1 and len(tab_start)>1:
+      with ThreadPoolExecutor(max_workers=self.number_of_threads) as executor:
+        list(executor.map(fill_chunk,tab_start))
+    else:
+      for start in tab_start:
+        fill_chunk(start)
+    return output.reshape(size)
+
+  def uniform(self, low=0.0, high=1.0, size=1):
+# Uniform in [low,high), from the 53 upper bits of each word
+    return self.fill(size, lambda words: low+(high-low)*(2.0**-53*(words>>np.uint64(11)).astype(np.float64)))
+
+  def standard_normal(self, size=1):
+# The uniform number in the open interval (0,1) never gives an infinite value
+    return self.fill(size, lambda words: scipy.special.ndtri(2.0**-53*((words>>np.uint64(11)).astype(np.float64)+0.5)))
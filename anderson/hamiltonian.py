@@ -9,6 +9,7 @@ Created on Sun Nov 22 19:27:50 2020
 import numpy as np
 import scipy.sparse as ssparse
 import sys
+import functools
 #import ctypes
 #import numpy.ctypeslib as ctl
 #import anderson
@@ -39,7 +40,7 @@ They are used in the rescaling of the Hamiltonian to bring its spectrum between
 
 class Hamiltonian(Geometry):
   def __init__(self, geometry, tab_boundary_condition, disorder_type='anderson_gaussian', randomize_hamiltonian=True, one_over_mass=1.0,  correlation_length=0.0, disorder_strength=0.0, non_diagonal_disorder_strength=0.0, b=1, interaction=0.0, wavelength_laser=1.0, diameter_diaphragm = 1.0, waist_lense = 1.0, focal_length = 1.0):
-    super().__init__(geometry.dimension,geometry.tab_dim,geometry.tab_delta,use_mkl_random=geometry.use_mkl_random,use_mkl_fft=geometry.use_mkl_fft,spin_one_half=geometry.spin_one_half, reproducible_randomness=geometry.reproducible_randomness, custom_seed=geometry.custom_seed)
+    super().__init__(geometry.dimension,geometry.tab_dim,geometry.tab_delta,use_mkl_random=geometry.use_mkl_random,use_mkl_fft=geometry.use_mkl_fft,spin_one_half=geometry.spin_one_half, reproducible_randomness=geometry.reproducible_randomness, custom_seed=geometry.custom_seed, counter_based_random=geometry.counter_based_random, random_number_of_threads=geometry.random_number_of_threads)
 # seed is set to zero to recognize a generic Hamiltonian where the disorder has not been yet set
     self.seed = 0
     dimension = self.dimension
@@ -49,6 +50,8 @@ class Hamiltonian(Geometry):
     if self.spin_one_half:
       self.is_real = False
     self.disorder_strength = disorder_strength
+# List of disorder strengths for a sweep (see generate_normalized_disorder), None if no sweep
+    self.tab_disorder_strength = None
     self.non_diagonal_disorder_strength = non_diagonal_disorder_strength
     self.one_over_mass = one_over_mass
     self.tab_tunneling = list()
@@ -61,12 +64,18 @@ class Hamiltonian(Geometry):
       self.diagonal += one_over_mass/tab_delta[i]**2
       if tab_boundary_condition[i]=='periodic':
         self.array_boundary_condition[i] = 1
+# Same data as tab_dim and tab_tunneling, in the form expected by the C routines, built once for all
+    self.array_tab_dim = np.asarray(tab_dim,dtype=np.intc)
+    self.array_tunneling = np.asarray(self.tab_tunneling,dtype=np.float64)
     self.interaction = interaction
     self.tab_boundary_condition = tab_boundary_condition
     self.disorder_type = disorder_type
     self.randomize_hamiltonian = randomize_hamiltonian
     self.correlation_length = correlation_length
     self.sparse_matrix = None
+# The hopping part of the sparse matrix does not depend on the disorder realization
+# It is computed once, when first needed, see generate_hopping_matrix
+    self.hopping_matrix = None
 #    self.diagonal_term = np.zeros(tab_dim)
 #    self.script_tunneling = 0.
 #    self.script_disorder = np.zeros(tab_dim)
@@ -89,10 +98,13 @@ class Hamiltonian(Geometry):
     if self.dimension == 1 and not self.spin_one_half:
       self.has_specific_apply_h_routine = True
       self.apply_h = self.apply_h_1d
-# Standard 2d system
-#    if self.dimension == 2 and not self.spin_one_half:
-#      self.has_specific_apply_h_routine = True
-#      self.apply_h = self.apply_h_2d
+# Standard 2d and 3d systems, using a fused stencil (requires at least 2 sites along each direction)
+    if self.dimension == 2 and not self.spin_one_half and min(self.tab_dim)>1:
+      self.has_specific_apply_h_routine = True
+      self.apply_h = self.apply_h_2d
+    if self.dimension == 3 and not self.spin_one_half and min(self.tab_dim)>1:
+      self.has_specific_apply_h_routine = True
+      self.apply_h = self.apply_h_3d
 # 1d system with spin-orbit
     if self.dimension == 1 and self.spin_one_half:
       self.has_specific_apply_h_routine = True
@@ -107,10 +119,14 @@ class Hamiltonian(Geometry):
       self.generate='direct'
       return
 # Build mask for correlated potentials
+# For the regensburg and konstanz disorders, the Gaussian mask is the product of 1D factors along the various directions:
+# only these factors are stored in self.tab_mask, self.mask (the full mask) being then None
+    self.mask = None
+    self.tab_mask = None
+    self.choose_disorder_fft()
     if disorder_type=='regensburg':
       self.generate = 'simple mask'
-      self.mask = np.zeros(tab_dim)
-      tab_k = list()
+      self.tab_mask = list()
       for i in range(dimension):
         toto = np.zeros(tab_dim[i])
         half_size = tab_dim[i]//2+1
@@ -119,30 +135,25 @@ class Hamiltonian(Geometry):
 #        toto[tab_dim[i]+1-half_size:tab_dim[i]] = toto[half_size-1:0:-1]
         toto[0:half_size] = -0.5*(np.arange(half_size)*self.tab_delta[i]/self.correlation_length)**2
         toto[tab_dim[i]+1-half_size:tab_dim[i]] = toto[half_size-1:0:-1]
-        tab_k.append(toto)
-      tab_distance = np.meshgrid(*tab_k,indexing='ij')
-      for i in range(dimension):
-         self.mask += tab_distance[i]
-      self.mask = np.exp(self.mask)
-      self.mask = np.sqrt(np.fft.fftn(self.mask))
-      self.mask *= np.sqrt(self.ntot/np.sum(self.mask**2))
-#      print(self.mask)
+# The FT of an even real function is even and real. It may however have negative values, which are not small
+# when the Gaussian does not decay within half the system size (aliasing, e.g. -0.028 for 8 points, delta=0.7, sigma=1.1).
+# They are clipped to zero, which removes these aliasing artefacts: on such small grids, the disorder thus differs from
+# the one obtained with the square root of the full (non-separable) mask
+        toto = np.sqrt(np.maximum(np.real(np.fft.fft(np.exp(toto))),0.0))
+        toto *= np.sqrt(tab_dim[i]/np.sum(toto**2))
+        self.tab_mask.append(toto)
       return
     if disorder_type=='konstanz':
       self.generate = 'field mask'
-      self.mask = np.zeros(tab_dim)
-      tab_k = list()
+      self.tab_mask = list()
       for i in range(dimension):
         toto = np.zeros(tab_dim[i])
         half_size = tab_dim[i]//2+1
         toto[0:half_size] = -0.5*(np.arange(half_size)*2.0*np.pi*self.correlation_length/(self.tab_dim[i]*self.tab_delta[i]))**2
         toto[tab_dim[i]+1-half_size:tab_dim[i]] = toto[half_size-1:0:-1]
-        tab_k.append(toto)
-      tab_distance = np.meshgrid(*tab_k,indexing='ij')
-      for i in range(dimension):
-         self.mask += tab_distance[i]
-      self.mask = np.exp(self.mask)
-      self.mask *= np.sqrt(self.ntot/np.sum(self.mask**2))
+        toto = np.exp(toto)
+        toto *= np.sqrt(tab_dim[i]/np.sum(toto**2))
+        self.tab_mask.append(toto)
       return
 # added by JPB    
     if disorder_type=='palaiseau':
@@ -213,6 +224,40 @@ class Hamiltonian(Geometry):
 #      self.mask[0]=dim_x
     """
 
+  """
+  Chooses the FFT routines used to generate the correlated disorder, once for all realizations:
+  those of mkl_fft if use_mkl_fft is set and mkl_fft is available, otherwise those of scipy.fft,
+  which keeps the plans of the last transforms in a cache and uses random_number_of_threads threads.
+  The potential generated with a simple mask being real, real-to-complex transforms are used.
+  """
+  def choose_disorder_fft(self):
+    if self.use_mkl_fft:
+      try:
+        import mkl_fft
+        self.disorder_rfftn = mkl_fft.rfftn
+        self.disorder_irfftn = mkl_fft.irfftn
+        self.disorder_ifftn = mkl_fft.ifftn
+        return
+      except (ImportError, AttributeError):
+        pass
+    import scipy.fft
+    self.disorder_rfftn = functools.partial(scipy.fft.rfftn,overwrite_x=True,workers=self.random_number_of_threads)
+    self.disorder_irfftn = functools.partial(scipy.fft.irfftn,overwrite_x=True,workers=self.random_number_of_threads)
+    self.disorder_ifftn = functools.partial(scipy.fft.ifftn,overwrite_x=True,workers=self.random_number_of_threads)
+    return
+
+  """
+  Multiplies in place the array (in momentum space) by the separable mask, each 1D factor of tab_mask
+  being broadcast along its direction. The factor along the last direction is truncated to the size
+  of this direction in array, i.e. to its non-negative frequencies after a real-to-complex transform.
+  """
+  def apply_separable_mask(self,array):
+    for i in range(self.dimension):
+      shape = [1]*self.dimension
+      shape[i] = array.shape[i]
+      array *= self.tab_mask[i][0:array.shape[i]].reshape(shape)
+    return array
+
   def add_spin_one_half(self, spin_orbit_interaction=0.0, sigma_x=0.0, sigma_y=0.0, sigma_z=0.0, alpha=0.0):
     self.spin_orbit_interaction = spin_orbit_interaction
     self.scaled_spin_orbit_interaction = spin_orbit_interaction/self.tab_delta[0]
@@ -253,14 +298,20 @@ class Hamiltonian(Geometry):
 #      print(self.disorder)
       return
     if self.generate=='simple mask':
-      self.disorder =  np.add(self.disorder_strength*np.real(np.fft.ifftn(self.mask*np.fft.fftn(my_rng.standard_normal(self.ntot).reshape(self.tab_dim)))),self.diagonal,order='C')
+      field = self.apply_separable_mask(self.disorder_rfftn(my_rng.standard_normal(self.ntot).reshape(self.tab_dim)))
+      self.disorder =  np.add(self.disorder_strength*self.disorder_irfftn(field,s=self.tab_dim),self.diagonal,order='C')
 #      self.print_potential()
       return
     if self.generate=='field mask':
 # When a field_mask is used, the initial data is a complex uncorrelated set of Gaussian distributed random numbers in configuration space
 # The Fourier transform in momentum space is also a complex uncorrelated set of Gaussian distributed random numbers
 # Thus the first FT is useless and can be short circuited
-      self.disorder =  np.add(0.5*self.disorder_strength*self.ntot*np.abs(np.fft.ifftn(self.mask*my_rng.standard_normal(2*self.ntot).view(np.complex128).reshape(self.tab_dim)))**2,self.diagonal,order='C')
+      field = my_rng.standard_normal(2*self.ntot).view(np.complex128).reshape(self.tab_dim)
+      if self.mask is None:
+        self.apply_separable_mask(field)
+      else:
+        field *= self.mask
+      self.disorder =  np.add(0.5*self.disorder_strength*self.ntot*np.abs(self.disorder_ifftn(field))**2,self.diagonal,order='C')
 # Alternatively (slower)
 #      self.disorder =  self.diagonal + 0.5*self.disorder_strength*np.abs(np.fft.ifftn(self.mask*np.fft.fftn(my_random_normal(2*self.ntot).view(np.complex128).reshape(self.tab_dim))))**2
 #      self.print_potential()
@@ -284,6 +335,82 @@ class Hamiltonian(Geometry):
       sys.exit('Disorder '+self.disorder_type+' not yet implemented!')
     return
 
+  def generate_normalized_disorder(self,seed):
+# Generates the disorder configuration for a unit disorder strength, without the constant diagonal term,
+# and stores it in self.normalized_disorder. All disorder types (except palaiseau) are linear in disorder_strength,
+# so that set_disorder_strength can then build the configuration for any disorder strength
+# without drawing new random numbers nor computing new FFTs
+    disorder_strength = self.disorder_strength
+    diagonal = self.diagonal
+    self.disorder_strength = 1.0
+    self.diagonal = 0.0
+    self.generate_disorder(seed)
+    self.disorder_strength = disorder_strength
+    self.diagonal = diagonal
+    self.normalized_disorder = self.disorder
+    self.set_disorder_strength(disorder_strength)
+    return
+
+  def set_disorder_strength(self,disorder_strength):
+# Rescales the configuration generated by generate_normalized_disorder for a new disorder strength
+    self.disorder_strength = disorder_strength
+    self.disorder = np.add(disorder_strength*self.normalized_disorder,self.diagonal,order='C')
+    self.sparse_matrix = None
+    return
+
+  def generate_disorder_batched(self,tab_seed,normalized=False):
+# Generates len(tab_seed) disorder configurations at once, as interleaved arrays of shape (ntot,len(tab_seed)),
+# the realization index being the fastest one. Used by the batched Lyapounov kernels in dimension 1.
+# By default, generate_disorder is called for each seed, so that each configuration depends only on its seed,
+# not on the batch size nor on the distribution of the realizations among processes.
+# Only without reproducible_randomness (and without the counter-based random generator), the configurations
+# of uncorrelated disorder (anderson_uniform, anderson_gaussian, nice with b=1) are drawn in bulk
+# from a single random stream seeded by tab_seed[0]: they are statistically equivalent, but not identical,
+# to the ones generated one by one by generate_disorder.
+# If normalized is True, the configurations are generated for a unit disorder strength, without the diagonal term,
+# as in generate_normalized_disorder
+# Returns disorder and non_diagonal_disorder, the latter being None except for the nice disorder type
+    batch_size = len(tab_seed)
+    non_diagonal_disorder = None
+    if normalized:
+      disorder_strength = 1.0
+      diagonal = 0.0
+    else:
+      disorder_strength = self.disorder_strength
+      diagonal = self.diagonal
+    if (self.disorder_type in ['anderson_uniform','anderson_gaussian'] or (self.disorder_type=='nice' and self.b==1)) and not (self.reproducible_randomness or self.counter_based_random):
+      self.seed = tab_seed[0]
+      my_rng = self.rng(tab_seed[0])
+      self.sparse_matrix = None
+      if self.disorder_type=='anderson_gaussian':
+        disorder = diagonal+disorder_strength*my_rng.standard_normal((self.ntot,batch_size))/np.sqrt(self.delta_vol)
+      else:
+        disorder = diagonal+disorder_strength*my_rng.uniform(-0.5,0.5,(self.ntot,batch_size))/np.sqrt(self.delta_vol)
+      if self.disorder_type=='nice':
+        non_diagonal_disorder = self.non_diagonal_disorder_strength*my_rng.uniform(-1.0,1.0,(self.ntot+1,batch_size))
+      return disorder, non_diagonal_disorder
+    disorder = np.empty((self.ntot,batch_size))
+# With b=1, the non-diagonal disorder is an interleaved (ntot+1,batch_size) array, as in the bulk draw above,
+# which is the layout expected by the batched Lyapounov kernels
+    if self.disorder_type=='nice':
+      if self.b==1:
+        non_diagonal_disorder = np.empty((self.ntot+1,batch_size))
+      else:
+        non_diagonal_disorder = np.empty((self.ntot+self.b,self.b,batch_size))
+    for k in range(batch_size):
+      if normalized:
+        self.generate_normalized_disorder(tab_seed[k])
+        disorder[:,k] = self.normalized_disorder.ravel()
+      else:
+        self.generate_disorder(tab_seed[k])
+        disorder[:,k] = self.disorder.ravel()
+      if self.disorder_type=='nice':
+        if self.b==1:
+          non_diagonal_disorder[:,k] = self.non_diagonal_disorder[:,0]
+        else:
+          non_diagonal_disorder[:,:,k] = self.non_diagonal_disorder
+    return disorder, non_diagonal_disorder
+
   def print_potential(self,filename='potential.dat'):
     print(self.tab_dim)
     print(self.tab_delta)
@@ -298,37 +425,11 @@ class Hamiltonian(Geometry):
     if self.spin_one_half:
       matrix = self.generate_full_matrix_spin_one_half()
       return matrix
-    tab_index = np.zeros(self.dimension,dtype=int)
-    matrix = np.diag(self.disorder.ravel())
-    ntot = self.ntot
-    sub_diagonal= np.zeros((2*self.dimension,ntot))
-    tab_offset = np.zeros(2*self.dimension,dtype=int)
-    for j in range(self.dimension):
-# Offsets for the regulat hoppings
-      tab_offset[j] = self.tab_dim_cumulative[j+1]
-# Offsets for the periodic hoppings
-      tab_offset[j+self.dimension] = self.tab_dim_cumulative[j+1]*(self.tab_dim[j]-1)
-#    print(tab_offset)
-    for i in range(ntot):
-      index = i
-      for j in range(self.dimension-1,-1,-1):
-        index,tab_index[j] = divmod(index,self.tab_dim[j])
-#      print(i,tab_index)
-# Hopping along the various dimensions
-      for j in range(self.dimension):
-# Regular hopping
-        if tab_index[j]<self.tab_dim[j]-1:
-          sub_diagonal[j,i] = -self.tab_tunneling[j]
-        else:
-# Only if periodic boundary condition
-          if self.tab_boundary_condition[j]=='periodic':
-            sub_diagonal[j+self.dimension,i-(self.tab_dim[j]-1)*self.tab_dim_cumulative[j+1]] = -self.tab_tunneling[j]
-    for j in range(self.dimension):
-      np.fill_diagonal(matrix[tab_offset[j]:,:],sub_diagonal[j,:])
-      np.fill_diagonal(matrix[:,tab_offset[j]:],sub_diagonal[j,:])
-      if self.tab_boundary_condition[j]=='periodic':
-        np.fill_diagonal(matrix[tab_offset[j+self.dimension]:,:],sub_diagonal[j+self.dimension,:])
-        np.fill_diagonal(matrix[:,tab_offset[j+self.dimension]:],sub_diagonal[j+self.dimension,:])
+    if self.hopping_matrix is None:
+      self.generate_hopping_matrix()
+# The hopping matrix contains placeholders on the diagonal, overwritten by the actual diagonal
+    matrix = self.hopping_matrix.toarray()
+    np.fill_diagonal(matrix,self.hopping_diagonal+self.disorder.ravel())
 #    print(matrix)
     return matrix
 
@@ -456,44 +557,47 @@ class Hamiltonian(Geometry):
     if self.spin_one_half:
       self.generate_sparse_matrix_spin_one_half()
       return
-    tab_index = np.zeros(self.dimension,dtype=int)
-    diagonal = self.disorder.ravel()
+    if self.hopping_matrix is None:
+      self.generate_hopping_matrix()
+# Only the diagonal changes from one disorder realization to the next
+# The new matrix shares the indices of the hopping matrix, only the data array is new
+    data = self.hopping_matrix.data.copy()
+    data[self.hopping_matrix_diagonal_positions] = self.hopping_diagonal+self.disorder.ravel()
+    self.sparse_matrix = ssparse.csr_matrix((data,self.hopping_matrix.indices,self.hopping_matrix.indptr),shape=self.hopping_matrix.shape,copy=False)
+#    print('Sparse matrix computed',self.sparse_matrix.dtype)
+#    print(matrix.toarray())
+    return
+
+  """
+  Computes the disorder independent part of the sparse matrix, i.e. the hopping terms
+  The diagonal is filled with placeholders (1), so that it is present in the CSR structure
+  The positions of the diagonal elements in the data array are stored in hopping_matrix_diagonal_positions
+  hopping_diagonal contains the hopping contribution to the diagonal, non zero only for periodic dimensions of size 1
+  """
+  def generate_hopping_matrix(self):
     ntot = self.ntot
-    sub_diagonal= np.zeros((2*self.dimension,ntot))
-    tab_offset = np.zeros(2*self.dimension,dtype=int)
-    for j in range(self.dimension):
-# Offsets for the regulat hoppings
-      tab_offset[j] = self.tab_dim_cumulative[j+1]
-# Offsets for the periodic hoppings
-      tab_offset[j+self.dimension] = self.tab_dim_cumulative[j+1]*(self.tab_dim[j]-1)
-#    print(tab_offset)
-    for i in range(ntot):
-      index = i
-      for j in range(self.dimension-1,-1,-1):
-        index,tab_index[j] = divmod(index,self.tab_dim[j])
-#      print(i,tab_index)
-# Hopping along the various dimensions
-      for j in range(self.dimension):
-# Regular hopping
-        if tab_index[j]<self.tab_dim[j]-1:
-          sub_diagonal[j,i] = -self.tab_tunneling[j]
-        else:
-# Only if periodic boundary condition
-          if self.tab_boundary_condition[j]=='periodic':
-            sub_diagonal[j+self.dimension,i-(self.tab_dim[j]-1)*self.tab_dim_cumulative[j+1]] = -self.tab_tunneling[j]
-    diagonals = [diagonal]
-    offsets = [0]
+    site = np.arange(ntot)
+# Diagonals are indexed by their offset, so that coinciding offsets (small periodic dimensions) are summed
+    diagonals = {0:np.zeros(ntot)}
     for j in range(self.dimension):
-      diagonals.extend([sub_diagonal[j,:],sub_diagonal[j,:]])
-      offsets.extend([tab_offset[j],-tab_offset[j]])
+      coordinate = (site//self.tab_dim_cumulative[j+1])%self.tab_dim[j]
+# Regular hopping between site i and site i+tab_dim_cumulative[j+1], except on the last layer along dimension j
+# The matrix is symmetric, the same diagonal is used for the positive and negative offsets
+      offset = self.tab_dim_cumulative[j+1]
+      sub_diagonal = np.where(coordinate<self.tab_dim[j]-1,-self.tab_tunneling[j],0.0)
+      diagonals[offset] = diagonals.get(offset,0.0)+sub_diagonal
+      diagonals[-offset] = diagonals.get(-offset,0.0)+sub_diagonal
+# Periodic hopping between the first and last layers along dimension j
       if self.tab_boundary_condition[j]=='periodic':
-        diagonals.extend([sub_diagonal[j+self.dimension,:],sub_diagonal[j+self.dimension,:]])
-        offsets.extend([tab_offset[j+self.dimension],-tab_offset[j+self.dimension]])
-#    print(diagonals)
-#    print(offsets)
-    self.sparse_matrix = ssparse.diags(diagonals,offsets,format='csr')
-#    print('Sparse matrix computed',self.sparse_matrix.dtype)
-#    print(matrix.toarray())
+        offset = self.tab_dim_cumulative[j+1]*(self.tab_dim[j]-1)
+        sub_diagonal = np.where(coordinate==0,-self.tab_tunneling[j],0.0)
+        diagonals[offset] = diagonals.get(offset,0.0)+sub_diagonal
+        diagonals[-offset] = diagonals.get(-offset,0.0)+sub_diagonal
+    self.hopping_diagonal = diagonals[0]
+    diagonals[0] = np.ones(ntot)
+    self.hopping_matrix = ssparse.diags(list(diagonals.values()),list(diagonals.keys()),format='csr')
+    row = np.repeat(site,np.diff(self.hopping_matrix.indptr))
+    self.hopping_matrix_diagonal_positions = np.flatnonzero(self.hopping_matrix.indices==row)
     return
 
   def generate_sparse_matrix_spin_one_half(self):
@@ -533,7 +637,8 @@ class Hamiltonian(Geometry):
   Converts Hamiltonian to a complex sparse matrix for sparse diagonalization
   """
   def generate_sparse_complex_matrix(self,pivot):
-    matrix = self.generate_sparse_matrix().astype(np.complex128)
+    self.generate_sparse_matrix()
+    matrix = self.sparse_matrix.astype(np.complex128)
     matrix.setdiag(matrix.diagonal()-pivot)
 #    print(matrix.toarray())
     return matrix
@@ -571,12 +676,15 @@ class Hamiltonian(Geometry):
     return apply_h_2d_numba(self.tab_dim[0], self.tab_dim[1], self.tab_tunneling[0], self.tab_tunneling[1], self.tab_boundary_condition[0], self.tab_boundary_condition[1], self.disorder, wfc)
 #    print('apply_h_2d')
 
+  def apply_h_3d(self, wfc):
+    return apply_h_3d_numba(self.tab_dim[0], self.tab_dim[1], self.tab_dim[2], self.tab_tunneling[0], self.tab_tunneling[1], self.tab_tunneling[2], self.tab_boundary_condition[0], self.tab_boundary_condition[1], self.tab_boundary_condition[2], self.disorder, wfc)
+
   def apply_h_generic(self,wfc):
 #    print('inside generic_apply_h')
 # This routines uses a sparse matrix-vector product
 # If the Hamiltonian has not been computed as a sparse matrix, do it now
 # It should be done only once per disorder realization
-    if self.sparse_matrix == None:
+    if self.sparse_matrix is None:
       self.generate_sparse_matrix()
     return self.sparse_matrix.dot(wfc.ravel())
 
@@ -799,57 +907,50 @@ def apply_h_1d_so_numba(dim_x, tunneling, boundary, disorder, scaled_spin_orbit_
 
 @numba_decorator
 def apply_h_2d_numba(dim_x, dim_y, tunneling_x, tunneling_y, b_x, b_y, disorder, wfc):
-#    print('apply_h_2d')
-    local_wfc = wfc.ravel()
-    rhs = np.empty_like(local_wfc)
-#    if wfc.dtype==np.float64:
-#      rhs = np.empty(dim_x*dim_y,dtype=np.float64)
-#    else:
-#      rhs = np.empty(dim_x*dim_y,dtype=np.complex128)
-  # The code propagates along the x axis, computing one vector (along y) at each iteration
-  # To decrase the number of memory accesses, 3 temporary vectors are used, containing the current x row, the previous and the next rows
-  # To simplify the code, the temporary vectors have 2 additional components, set to zero for fixed boundary conditions and to the wrapped values for periodic boundary conditions
-  # Create the 3 temporary vectors
-    p_old=np.zeros(dim_y+2,dtype=wfc.dtype)
-    p_current=np.zeros(dim_y+2,dtype=wfc.dtype)
-    p_new=np.zeros(dim_y+2,dtype=wfc.dtype)
-#   if wfc.dtype==np.float64:
-#     p_old=np.zeros(dim_y+2,dtype=np.float64)
-#      p_current=np.zeros(dim_y+2,dtype=np.float64)
-#      p_new=np.zeros(dim_y+2,dtype=np.float64)
-#    else:
-#      p_old=np.zeros(dim_y+2,dtype=np.complex128)
-#      p_current=np.zeros(dim_y+2,dtype=np.complex128)
-#      p_new=np.zeros(dim_y+2,dtype=np.complex128)
-  # If periodic boundary conditions along x, initialize p_current to the last row, otherwise 0
-    if b_x=='periodic':
-      p_current[1:dim_y+1]=local_wfc[(dim_x-1)*dim_y:dim_x*dim_y]
-  # Initialize the next row, which will become the current row in the first iteration of the loop
-    p_new[1:dim_y+1]=local_wfc[0:dim_y]
-  # If periodic boundary condition along y, copy the first and last components
-    if b_y=='periodic':
-      p_new[0]=p_new[dim_y]
-      p_new[dim_y+1]=p_new[1]
-    for i in range(dim_x):
-      p_temp=p_old
-      p_old=p_current
-      p_current=p_new
-      p_new=p_temp
-      if i<dim_x-1:
-  # The generic row
-        p_new[1:dim_y+1]=local_wfc[(i+1)*dim_y:(i+2)*dim_y]
-      else:
-  # If in last row, put in p_new the first row if periodic along x, 0 otherwise )
-        if b_x=='periodic':
-          p_new[1:dim_y+1]=local_wfc[0:dim_y]
-        else:
-          p_new[1:dim_y+1]=0.0
-  # If periodic boundary condition along y, copy the first and last components
-      if b_y=='periodic':
-        p_new[0]=p_new[dim_y]
-        p_new[dim_y+1]=p_new[1]
-      i_low=i*dim_y
-      i_high=i_low+dim_y
-  # Ready to treat the current row
-      rhs[i_low:i_high] = disorder[i,0:dim_y]*p_current[1:dim_y+1] - tunneling_y*(p_current[2:dim_y+2]+ p_current[0:dim_y]) - tunneling_x*(p_old[1:dim_y+1]+p_new[1:dim_y+1])
-    return rhs
+# Fused stencil: the diagonal and hopping terms are computed in a single pass, without building the sparse matrix
+# wfc may be a non-contiguous slice (e.g. real or imaginary part in the complex data layout), it is made contiguous first
+# The result is a 1d array, like the one returned by apply_h_generic
+  local_wfc = np.ascontiguousarray(wfc).reshape((dim_x,dim_y))
+  rhs = np.empty_like(local_wfc)
+  f_x = 1.0 if b_x=='periodic' else 0.0
+  f_y = 1.0 if b_y=='periodic' else 0.0
+  for i in range(dim_x):
+# Neighbouring rows along x, wrapped and multiplied by 0 for open boundary conditions
+    i_minus = i-1 if i>0 else dim_x-1
+    i_plus = i+1 if i<dim_x-1 else 0
+    f_minus = 1.0 if i>0 else f_x
+    f_plus = 1.0 if i<dim_x-1 else f_x
+    for j in range(dim_y):
+      rhs[i,j] = disorder[i,j]*local_wfc[i,j] - tunneling_x*(f_minus*local_wfc[i_minus,j]+f_plus*local_wfc[i_plus,j])
+    rhs[i,0] -= tunneling_y*(local_wfc[i,1]+f_y*local_wfc[i,dim_y-1])
+    for j in range(1,dim_y-1):
+      rhs[i,j] -= tunneling_y*(local_wfc[i,j-1]+local_wfc[i,j+1])
+    rhs[i,dim_y-1] -= tunneling_y*(local_wfc[i,dim_y-2]+f_y*local_wfc[i,0])
+  return rhs.ravel()
+
+@numba_decorator
+def apply_h_3d_numba(dim_x, dim_y, dim_z, tunneling_x, tunneling_y, tunneling_z, b_x, b_y, b_z, disorder, wfc):
+# Same as apply_h_2d_numba, in dimension 3
+  local_wfc = np.ascontiguousarray(wfc).reshape((dim_x,dim_y,dim_z))
+  rhs = np.empty_like(local_wfc)
+  f_x = 1.0 if b_x=='periodic' else 0.0
+  f_y = 1.0 if b_y=='periodic' else 0.0
+  f_z = 1.0 if b_z=='periodic' else 0.0
+  for i in range(dim_x):
+    i_minus = i-1 if i>0 else dim_x-1
+    i_plus = i+1 if i<dim_x-1 else 0
+    f_x_minus = 1.0 if i>0 else f_x
+    f_x_plus = 1.0 if i<dim_x-1 else f_x
+    for j in range(dim_y):
+      j_minus = j-1 if j>0 else dim_y-1
+      j_plus = j+1 if j<dim_y-1 else 0
+      f_y_minus = 1.0 if j>0 else f_y
+      f_y_plus = 1.0 if j<dim_y-1 else f_y
+      for k in range(dim_z):
+        rhs[i,j,k] = disorder[i,j,k]*local_wfc[i,j,k] - tunneling_x*(f_x_minus*local_wfc[i_minus,j,k]+f_x_plus*local_wfc[i_plus,j,k])\
+          - tunneling_y*(f_y_minus*local_wfc[i,j_minus,k]+f_y_plus*local_wfc[i,j_plus,k])
+      rhs[i,j,0] -= tunneling_z*(local_wfc[i,j,1]+f_z*local_wfc[i,j,dim_z-1])
+      for k in range(1,dim_z-1):
+        rhs[i,j,k] -= tunneling_z*(local_wfc[i,j,k-1]+local_wfc[i,j,k+1])
+      rhs[i,j,dim_z-1] -= tunneling_z*(local_wfc[i,j,dim_z-2]+f_z*local_wfc[i,j,0])
+  return rhs.ravel()
@@ -10,7 +10,9 @@ import numpy as np
 import copy
 import configparser
 import sys
+import os
 import math
+import hashlib
 import anderson
 #from anderson import geometry
 
@@ -31,9 +33,9 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
     if not config.has_section('Averaging'):
       my_abort(mpi_version,comm,'Parameter file does not have an Averaging section, I stop!\n')
     Averaging = config['Averaging']
+# Exactly n_config realizations are computed, distributed among the processes (see scheduler.py)
     n_config = Averaging.getint('n_config',1)
-    n_config = (n_config+nprocs-1)//nprocs
-    print("Total number of disorder realizations: {}".format(n_config*nprocs))
+    print("Total number of disorder realizations: {}".format(n_config))
     print("Number of processes: {}".format(nprocs))
     print()
 
@@ -47,6 +49,11 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
     use_mkl_random = System.getboolean('use_mkl_random',True)
     reproducible_randomness = System.getboolean('reproducible_randomness',True)
     custom_seed = System.getint('custom_seed', 0)
+# The counter-based random generator gives the same random numbers for any number of processes or threads,
+# and can fill large arrays using random_number_of_threads threads
+# random_number_of_threads is also the number of threads of the FFTs generating correlated disorder (without mkl_fft)
+    counter_based_random = System.getboolean('counter_based_random',False)
+    random_number_of_threads = System.getint('random_number_of_threads',1)
     tab_size = list()
     tab_delta = list()
     tab_boundary_condition = list()
@@ -87,6 +94,19 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
     correlation_length = Disorder.getfloat('sigma',0.0)
     V0 = Disorder.getfloat('V0',0.0)
     disorder_strength = V0
+# Optional sweep over several disorder strengths, e.g. V0_list = 0.5, 1.0, 2.0
+# The random field of each configuration is then generated once and rescaled for each V0 (V0 is ignored)
+    tab_disorder_strength = None
+    if 'V0_list' in Disorder:
+      try:
+        tab_disorder_strength = [float(x) for x in Disorder.get('V0_list').replace(',',' ').split()]
+      except ValueError:
+        my_abort(mpi_version,comm,'In the Disorder section of the parameter file, V0_list must be a list of numbers, I stop!\n')
+      if len(tab_disorder_strength)==0:
+        my_abort(mpi_version,comm,'In the Disorder section of the parameter file, V0_list is empty, I stop!\n')
+      if disorder_type=='palaiseau':
+        my_abort(mpi_version,comm,'A sweep over V0 is not possible with the palaiseau disorder, I stop!\n')
+      disorder_strength = tab_disorder_strength[0]
     non_diagonal_disorder_strength = Disorder.getfloat('non_diagonal_disorder_strength',0.0)
     b = Disorder.getint('b',1)
     
@@ -220,6 +240,8 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
       data_layout = Propagation.get('data_layout','complex')
       t_max = Propagation.getfloat('t_max','0.0')
       delta_t = Propagation.getfloat('delta_t','0.0')
+      batch_size = Propagation.getint('batch_size',1)
+      number_of_threads = Propagation.getint('number_of_threads',1)
 #      if spin_one_half and method=='che':
 #        my_abort(mpi_version,comm,'Chebyshev propagation is not supported for spin_one_half, I stop!\n')
       if spin_one_half and data_layout=='real':
@@ -255,6 +277,9 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
       if measure_spectral_function and not 'Spectral' in my_list_of_sections:
         my_abort(mpi_version,comm,'Measurement section requires to measure the spectral function, but there is no Spectral section in the parameter file, I stop!\n')
       remove_hot_pixel = Measurement.getboolean('remove_hot_pixel',False)
+      output_format = Measurement.get('output_format','text')
+      if output_format not in ['text','hdf5','npz']:
+        my_abort(mpi_version,comm,'Measurement output_format should be text, hdf5 or npz, I stop!\n')
 
 # Optional Diagonalization section
     if 'Diagonalization' in my_list_of_sections:
@@ -262,11 +287,28 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
         my_abort(mpi_version,comm,'Parameter file does not have a Diagonalization section, I stop!\n')
       Diagonalization = config['Diagonalization']
       diagonalization_method = Diagonalization.get('method','sparse')
+      if diagonalization_method not in ['lapack','sparse','banded','chebyshev']:
+        my_abort(mpi_version,comm,'Diagonalization method should be lapack, sparse, banded or chebyshev, I stop!\n')
       targeted_energy = Diagonalization.getfloat('targeted_energy')
+# Optional list of targeted energies, e.g. targeted_energy_list = -1.0, 0.0, 1.0
+# All of them are then processed for each disorder configuration (targeted_energy is ignored)
+      tab_targeted_energy = None
+      if 'targeted_energy_list' in Diagonalization:
+        try:
+          tab_targeted_energy = [float(x) for x in Diagonalization.get('targeted_energy_list').replace(',',' ').split()]
+        except ValueError:
+          my_abort(mpi_version,comm,'In the Diagonalization section of the parameter file, targeted_energy_list must be a list of numbers, I stop!\n')
+        if len(tab_targeted_energy)==0:
+          my_abort(mpi_version,comm,'In the Diagonalization section of the parameter file, targeted_energy_list is empty, I stop!\n')
+        targeted_energy = tab_targeted_energy[0]
       IPR_min = Diagonalization.getfloat('IPR_min',0.0)
       IPR_max = Diagonalization.getfloat('IPR_max',1.0)
       number_of_bins = Diagonalization.getint('number_of_bins',1)
       number_of_eigenvalues = Diagonalization.getint('number_of_eigenvalues',1)
+# Degree of the polynomial filter for the chebyshev method, 0 for an automatic choice
+      chebyshev_degree = Diagonalization.getint('chebyshev_degree',0)
+# Pivot used for the landscape, for the iterative solver it must be real and below the spectrum
+      pivot = Diagonalization.getfloat('pivot_real',0.0)+1j*Diagonalization.getfloat('pivot_imag',0.0)
 
 # Optional Spectral section
 # Default values (should never be used, only to ensure they are defined for MPI broadcasting)
@@ -277,6 +319,11 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
     want_ctypes_for_spectral_function = True
     allow_unsafe_energy_bounds = False
     multiplicative_factor_for_interaction_in_spectral_function = 0.0
+    number_of_random_vectors = 1
+    kpm_kernel = 'jackson'
+    lorentz_parameter = 4.0
+    moments_file = None
+    kpm_reconstruction = 'recursion'
     if ('Measurement' in my_list_of_sections and measure_spectral_function) or ('Measurement' not in my_list_of_sections and 'Spectral' in my_list_of_sections):
       if not config.has_section('Spectral'):
         my_abort(mpi_version,comm,'Parameter file does not have a Spectral section, I stop!\n')
@@ -300,6 +347,24 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
         n_kpm=int(0.5*(spectre_max-spectre_min)/spectre_resolution)
       want_ctypes_for_spectral_function = Spectral.getboolean('want_ctypes_for_spectral_function',True)
       allow_unsafe_energy_bounds = Spectral.getboolean('allow_unsafe_energy_bounds',False)
+# Number of random vectors processed together (block KPM) for each disorder realization
+# Used only for random or multi_point initial states
+      number_of_random_vectors = Spectral.getint('number_of_random_vectors',1)
+      if number_of_random_vectors<1:
+        my_abort(mpi_version,comm,'In the Spectral section of the parameter file, number_of_random_vectors must be at least 1, I stop!\n')
+# Damping kernel used to reconstruct the spectrum from the Chebyshev moments
+      kpm_kernel = Spectral.get('kernel','jackson')
+      if kpm_kernel not in ['jackson','lorentz']:
+        my_abort(mpi_version,comm,'In the Spectral section of the parameter file, kernel must be either jackson or lorentz, I stop!\n')
+      lorentz_parameter = Spectral.getfloat('lorentz_parameter',4.0)
+# If moments_file is given, the averaged Chebyshev moments are saved in it,
+# and reused (without any new KPM calculation) if compatible with the current parameters
+      moments_file = Spectral.get('moments_file',None)
+# Method used to build the spectrum from the moments, either recursion (Chebyshev recursion at each energy)
+# or dct (discrete cosine transform followed by interpolation, much faster when n_kpm is large)
+      kpm_reconstruction = Spectral.get('reconstruction','recursion')
+      if kpm_reconstruction not in ['recursion','dct']:
+        my_abort(mpi_version,comm,'In the Spectral section of the parameter file, reconstruction must be either recursion or dct, I stop!\n')
       if not all_options_ok:
         my_abort(mpi_version,comm,'In the Spectral section of the parameter file, there must be a resolution and either an energy interval [e_min,e_max] or an energy range e_range, I stop!\n')
 
@@ -309,10 +374,14 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
       if not config.has_section('Lyapounov'):
         my_abort(mpi_version,comm,'Parameter file does not have a Lyapounov section, I stop!\n')
       Lyapounov = config['Lyapounov']
-#      e_min = Lyapounov.getfloat('e_min',0.0)
-#      e_max = Lyapounov.getfloat('e_max',0.0)
-#      number_of_e_steps = Lyapounov.getint('number_of_e_steps',0)
       energy = Lyapounov.getfloat('energy',0.0)
+# If number_of_e_steps>0, the Lyapounov exponent is computed for number_of_e_steps+1 energies in [e_min,e_max]
+# using the same disorder configuration for all energies, and energy is ignored
+      number_of_e_steps = Lyapounov.getint('number_of_e_steps',0)
+      e_min = Lyapounov.getfloat('e_min',energy)
+      e_max = Lyapounov.getfloat('e_max',energy)
+      if number_of_e_steps<0:
+        my_abort(mpi_version,comm,'In the Lyapounov section of the parameter file, number_of_e_steps must be non-negative, I stop!\n')
       i0 = Lyapounov.getint('number_of_skipped_layers',10)
       nrescale = Lyapounov.getint('nrescale',10)
       if i0%nrescale!=0:
@@ -323,6 +392,17 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
 #      lyapounov_max = Lyapounov.getfloat('lyapounov_max',0.0)
 #      number_of_bins = Lyapounov.getint('number_of_bins',0)
       want_ctypes_for_lyapounov = Lyapounov.getboolean('want_ctypes',True)
+# In dimension 2 and 3, either 'green' (smallest exponent only) or 'qr' (QR-stabilized transfer matrix, all exponents)
+      lyapounov_method = Lyapounov.get('method','green')
+      if lyapounov_method not in ['green','qr']:
+        my_abort(mpi_version,comm,'In the Lyapounov section of the parameter file, method must be green or qr, I stop!\n')
+# In dimension 1, number of disorder realizations processed together by the vectorized kernel
+      lyapounov_batch_size = Lyapounov.getint('batch_size',1)
+      if lyapounov_batch_size<1:
+        my_abort(mpi_version,comm,'In the Lyapounov section of the parameter file, batch_size must be positive, I stop!\n')
+      if lyapounov_batch_size>1 and dimension>1:
+        print('\nWarning, batched computation of the Lyapounov exponent is only available in dimension 1, batch_size is reset to 1\n')
+        lyapounov_batch_size = 1
       tab_boundary_condition[0] = 'open'
 
 
@@ -336,10 +416,13 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
     tab_boundary_condition = None
     reproducible_randomness = None
     custom_seed = None
+    counter_based_random = None
+    random_number_of_threads = None
     disorder_type = None
     randomize_hamiltonian = None
     correlation_length = None
     disorder_strength = None
+    tab_disorder_strength = None
     non_diagonal_disorder_strength = None
     b = None
     use_mkl_random = None
@@ -368,6 +451,8 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
     data_layout = None
     t_max = None
     delta_t = None
+    batch_size = None
+    number_of_threads = None
     delta_t_dispersion = None
     delta_t_density = None
     delta_t_spectral_function = None
@@ -387,12 +472,16 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
     measure_overlap = None
     measure_spectral_function = None
     remove_hot_pixel = None
+    output_format = None
     diagonalization_method = None
     targeted_energy = None
+    tab_targeted_energy = None
     IPR_min = None
     IPR_max = None
     number_of_bins = None
     number_of_eigenvalues = None
+    chebyshev_degree = None
+    pivot = None
     spectre_min = None
     spectre_max = None
     spectre_resolution = None
@@ -400,9 +489,14 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
     n_kpm = None
     want_ctypes_for_spectral_function = None
     allow_unsafe_energy_bounds = None
-#    e_min = None
-#    e_max = None
-#    number_of_e_steps = None
+    number_of_random_vectors = None
+    kpm_kernel = None
+    lorentz_parameter = None
+    moments_file = None
+    kpm_reconstruction = None
+    e_min = None
+    e_max = None
+    number_of_e_steps = None
 #    e_histogram = None
 #    lyapounov_min = None
 #    lyapounov_max = None
@@ -410,13 +504,15 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
     want_ctypes_for_lyapounov = None
     i0 = None
     nrescale = None
+    lyapounov_method = None
+    lyapounov_batch_size = None
 
 
   if mpi_version:
-    n_config, dimension, one_over_mass, tab_size, tab_delta, tab_dim, tab_boundary_condition, use_mkl_random, use_mkl_fft, reproducible_randomness, custom_seed  = \
-      comm.bcast((n_config, dimension, one_over_mass, tab_size,tab_delta, tab_dim, tab_boundary_condition, use_mkl_random, use_mkl_fft, reproducible_randomness, custom_seed))
-    disorder_type, randomize_hamiltonian, correlation_length, disorder_strength, non_diagonal_disorder_strength, b, interaction_strength = \
-      comm.bcast((disorder_type, randomize_hamiltonian, correlation_length, disorder_strength, non_diagonal_disorder_strength, b, interaction_strength))
+    n_config, dimension, one_over_mass, tab_size, tab_delta, tab_dim, tab_boundary_condition, use_mkl_random, use_mkl_fft, reproducible_randomness, custom_seed, counter_based_random, random_number_of_threads  = \
+      comm.bcast((n_config, dimension, one_over_mass, tab_size,tab_delta, tab_dim, tab_boundary_condition, use_mkl_random, use_mkl_fft, reproducible_randomness, custom_seed, counter_based_random, random_number_of_threads))
+    disorder_type, randomize_hamiltonian, correlation_length, disorder_strength, tab_disorder_strength, non_diagonal_disorder_strength, b, interaction_strength = \
+      comm.bcast((disorder_type, randomize_hamiltonian, correlation_length, disorder_strength, tab_disorder_strength, non_diagonal_disorder_strength, b, interaction_strength))
     if 'Spin' in my_list_of_sections:
       spin_one_half, spin_orbit_interaction, sigma_x, sigma_y, sigma_z, alpha = \
         comm.bcast((spin_one_half, spin_orbit_interaction, sigma_x, sigma_y, sigma_z, alpha))
@@ -424,34 +520,36 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
       initial_state_type, minimum_distance, randomize_initial_state, tab_k_0, tab_sigma_0, tab_chirp, wfc_correlation_length, epsilon_speckle, teta, teta_measurement = \
         comm.bcast((initial_state_type, minimum_distance, randomize_initial_state, tab_k_0, tab_sigma_0, tab_chirp, wfc_correlation_length, epsilon_speckle, teta, teta_measurement))
     if 'Propagation' in my_list_of_sections:
-      method, accuracy, accurate_bounds, want_ctypes, data_layout, t_max, delta_t = comm.bcast((method, accuracy, accurate_bounds, want_ctypes, data_layout, t_max, delta_t))
+      method, accuracy, accurate_bounds, want_ctypes, data_layout, t_max, delta_t, batch_size, number_of_threads = comm.bcast((method, accuracy, accurate_bounds, want_ctypes, data_layout, t_max, delta_t, batch_size, number_of_threads))
     if 'Measurement' in my_list_of_sections:
       delta_t_dispersion, delta_t_density, delta_t_spectral_function, teta_measurement, measure_potential, measure_potential_correlation, \
         measure_density, measure_density_momentum, measure_autocorrelation, measure_dispersion_position, measure_dispersion_position2, \
         measure_dispersion_momentum, measure_dispersion_energy, measure_wavefunction, measure_wavefunction_momentum, \
-        measure_extended, measure_g1, measure_overlap, measure_spectral_function, remove_hot_pixel = \
+        measure_extended, measure_g1, measure_overlap, measure_spectral_function, remove_hot_pixel, output_format = \
       comm.bcast((delta_t_dispersion, delta_t_density, delta_t_spectral_function, teta_measurement, measure_potential, measure_potential_correlation, \
         measure_density, measure_density_momentum, measure_autocorrelation, measure_dispersion_position,  measure_dispersion_position2, \
         measure_dispersion_momentum, measure_dispersion_energy, measure_wavefunction, measure_wavefunction_momentum, \
-        measure_extended, measure_g1, measure_overlap, measure_spectral_function, remove_hot_pixel))
+        measure_extended, measure_g1, measure_overlap, measure_spectral_function, remove_hot_pixel, output_format))
     if 'Diagonalization' in my_list_of_sections:
-      diagonalization_method, targeted_energy, IPR_min, IPR_max, number_of_bins, number_of_eigenvalues  = \
-        comm.bcast((diagonalization_method, targeted_energy, IPR_min, IPR_max, number_of_bins, number_of_eigenvalues))
+      diagonalization_method, targeted_energy, tab_targeted_energy, IPR_min, IPR_max, number_of_bins, number_of_eigenvalues, chebyshev_degree, pivot  = \
+        comm.bcast((diagonalization_method, targeted_energy, tab_targeted_energy, IPR_min, IPR_max, number_of_bins, number_of_eigenvalues, chebyshev_degree, pivot))
     if 'Spectral' in my_list_of_sections:
-      spectre_min, spectre_max, spectre_resolution, multiplicative_factor_for_interaction_in_spectral_function, n_kpm, want_ctypes_for_spectral_function, allow_unsafe_energy_bounds = \
-        comm.bcast((spectre_min, spectre_max, spectre_resolution,multiplicative_factor_for_interaction_in_spectral_function, n_kpm, want_ctypes_for_spectral_function, allow_unsafe_energy_bounds))
+      spectre_min, spectre_max, spectre_resolution, multiplicative_factor_for_interaction_in_spectral_function, n_kpm, want_ctypes_for_spectral_function, allow_unsafe_energy_bounds, number_of_random_vectors, kpm_kernel, lorentz_parameter, moments_file, kpm_reconstruction = \
+        comm.bcast((spectre_min, spectre_max, spectre_resolution,multiplicative_factor_for_interaction_in_spectral_function, n_kpm, want_ctypes_for_spectral_function, allow_unsafe_energy_bounds, number_of_random_vectors, kpm_kernel, lorentz_parameter, moments_file, kpm_reconstruction))
     if 'Lyapounov' in my_list_of_sections:
 #      e_min, e_max, number_of_e_steps, e_histogram, lyapounov_min, lyapounov_max, number_of_bins, want_ctypes_for_lyapounov, i0, nrescale = \
 #        comm.bcast((e_min, e_max, number_of_e_steps, e_histogram, lyapounov_min, lyapounov_max, number_of_bins, want_ctypes_for_lyapounov, i0, nrescale))
-      energy, want_ctypes_for_lyapounov, i0, nrescale = \
-        comm.bcast((energy, want_ctypes_for_lyapounov, i0, nrescale))
+      energy, e_min, e_max, number_of_e_steps, want_ctypes_for_lyapounov, i0, nrescale, lyapounov_method, lyapounov_batch_size = \
+        comm.bcast((energy, e_min, e_max, number_of_e_steps, want_ctypes_for_lyapounov, i0, nrescale, lyapounov_method, lyapounov_batch_size))
 
 
-  geometry = anderson.geometry.Geometry(dimension, tab_dim, tab_delta, use_mkl_random=use_mkl_random, use_mkl_fft=use_mkl_fft, spin_one_half=spin_one_half, reproducible_randomness=reproducible_randomness, custom_seed=custom_seed )
+  geometry = anderson.geometry.Geometry(dimension, tab_dim, tab_delta, use_mkl_random=use_mkl_random, use_mkl_fft=use_mkl_fft, spin_one_half=spin_one_half, reproducible_randomness=reproducible_randomness, custom_seed=custom_seed, counter_based_random=counter_based_random, random_number_of_threads=random_number_of_threads)
 # Prepare Hamiltonian structure (the disorder is NOT computed, as it is specific to each realization)
   H = anderson.hamiltonian.Hamiltonian(geometry, tab_boundary_condition=tab_boundary_condition, one_over_mass=one_over_mass, \
       disorder_type=disorder_type, randomize_hamiltonian=randomize_hamiltonian, correlation_length=correlation_length, disorder_strength=disorder_strength, non_diagonal_disorder_strength=non_diagonal_disorder_strength, \
       b=b, interaction=interaction_strength)
+  if tab_disorder_strength is not None:
+    H.tab_disorder_strength = np.array(tab_disorder_strength)
 #  print(H.randomize_hamiltonian)
   if spin_one_half:
     H.add_spin_one_half(spin_orbit_interaction=spin_orbit_interaction, sigma_x=sigma_x, sigma_y=sigma_y, sigma_z=sigma_z, alpha=alpha)
@@ -480,7 +578,7 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
  # if 'Spectral' in my_list_of_sections:
 #    measure_spectral_function_local = not 'Measurement' in my_list_of_sections
 #    measure_spectral_function_local = True
-    spectral_function = anderson.propagation.Spectral_function(spectre_min,spectre_max,spectre_resolution,multiplicative_factor_for_interaction_in_spectral_function, n_kpm, want_ctypes_for_spectral_function, allow_unsafe_energy_bounds, H)
+    spectral_function = anderson.propagation.Spectral_function(spectre_min,spectre_max,spectre_resolution,multiplicative_factor_for_interaction_in_spectral_function, n_kpm, want_ctypes_for_spectral_function, allow_unsafe_energy_bounds, H, number_of_random_vectors=number_of_random_vectors, kernel=kpm_kernel, lorentz_parameter=lorentz_parameter, moments_file=moments_file, reconstruction=kpm_reconstruction)
 #    propagation_spectral = anderson.propagation.Temporal_Propagation(spectral_function.t_max,spectral_function.delta_t,method=method, accuracy=accuracy, accurate_bounds=accurate_bounds, data_layout=data_layout,want_ctypes=want_ctypes, H=H)
 #    return_list.append(propagation_spectral)
 #    measurement_spectral = anderson.measurement.Measurement(geometry, spectral_function.delta_t, spectral_function.t_max, spectral_function.t_max, \
@@ -502,7 +600,7 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
 # Define the structure of measurements
   if 'Measurement' in my_list_of_sections:
 # Define the structure of the temporal integration
-    propagation = anderson.propagation.Temporal_Propagation(t_max, delta_t, method=method, accuracy=accuracy, accurate_bounds=accurate_bounds, data_layout=data_layout,want_ctypes=want_ctypes, H=H)
+    propagation = anderson.propagation.Temporal_Propagation(t_max, delta_t, method=method, accuracy=accuracy, accurate_bounds=accurate_bounds, data_layout=data_layout,want_ctypes=want_ctypes, H=H, batch_size=batch_size, number_of_threads=number_of_threads)
     return_list.append(propagation)
     measurement = anderson.measurement.Measurement(geometry, delta_t_dispersion, delta_t_density, delta_t_spectral_function, \
       teta_measurement=teta_measurement, measure_potential=measure_potential, measure_potential_correlation=measure_potential_correlation, \
@@ -511,7 +609,7 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
       measure_dispersion_momentum=measure_dispersion_momentum, measure_dispersion_energy=measure_dispersion_energy, \
       measure_wavefunction=measure_wavefunction, measure_wavefunction_momentum=measure_wavefunction_momentum, \
       measure_extended=measure_extended,measure_g1=measure_g1, measure_overlap=measure_overlap, measure_spectral_function=measure_spectral_function, \
-      use_mkl_fft=use_mkl_fft, remove_hot_pixel=remove_hot_pixel)
+      use_mkl_fft=use_mkl_fft, remove_hot_pixel=remove_hot_pixel, output_format=output_format)
     measurement_global = copy.deepcopy(measurement)
 #  print(measurement.measure_density,measurement.measure_autocorrelation,measurement.measure_dispersion,measurement.measure_dispersion_momentum)
 #    print(delta_t,propagation.delta_t)
@@ -523,12 +621,12 @@ def parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,my_list_of_
 
 # Define the structure of diagonalization
   if 'Diagonalization' in my_list_of_sections:
-    diagonalization = anderson.diag.Diagonalization(targeted_energy,method=diagonalization_method, IPR_min= IPR_min, IPR_max=IPR_max, number_of_bins=number_of_bins, number_of_eigenvalues=number_of_eigenvalues)
+    diagonalization = anderson.diag.Diagonalization(targeted_energy,method=diagonalization_method, IPR_min= IPR_min, IPR_max=IPR_max, number_of_bins=number_of_bins, number_of_eigenvalues=number_of_eigenvalues, chebyshev_degree=chebyshev_degree, tab_targeted_energy=tab_targeted_energy, pivot=pivot, mpi_version=mpi_version, comm=comm)
     return_list.append(diagonalization)
 
 # Define the structure of lyapounov
   if 'Lyapounov' in my_list_of_sections:
-    lyapounov = anderson.lyapounov.Lyapounov(energy=energy,want_ctypes=want_ctypes_for_lyapounov, i0=i0, nrescale=nrescale)
+    lyapounov = anderson.lyapounov.Lyapounov(energy=energy,want_ctypes=want_ctypes_for_lyapounov, i0=i0, nrescale=nrescale, e_min=e_min, e_max=e_max, number_of_e_steps=number_of_e_steps, method=lyapounov_method, batch_size=lyapounov_batch_size)
     return_list.append(lyapounov)
 
   return_list.append(n_config)
@@ -568,9 +666,13 @@ def output_string(H,n_config,nprocs=1,propagation=None,initial_state=None,measur
     params_string += \
                   'Custom seed for random number generator = '+str(H.custom_seed)+'\n'\
                  +'use MKL random number generator         = '+str(H.use_mkl_random)+'\n'\
+                 +'use counter-based random generator      = '+str(H.counter_based_random)+'\n'\
                  +'use MKL FFT                             = '+str(H.use_mkl_fft)+'\n'
   params_string += \
                   'V0                                      = '+str(H.disorder_strength)+'\n'
+  if H.tab_disorder_strength is not None:
+    params_string += \
+                  'V0 values in the sweep                  = '+' '.join(str(x) for x in H.tab_disorder_strength)+'\n'
   if H.disorder_type not in ['anderson_gaussian','anderson_uniform','anderson_cauchy','nice']:
     params_string += \
                   'Correlation length                      = '+str(H.correlation_length)+'\n'
@@ -581,9 +683,8 @@ def output_string(H,n_config,nprocs=1,propagation=None,initial_state=None,measur
   params_string += \
                   'g                                       = '+str(H.interaction)+'\n'\
                  +'g_over_volume                           = '+str(H.interaction/volume)+'\n'\
-                 +'Number of disorder realizations         = '+str(n_config*nprocs)+'\n'\
-                 +'Number of processes                     = '+str(nprocs)+'\n'\
-                 +'Number of realizations per process      = '+str(n_config)+'\n'
+                 +'Number of disorder realizations         = '+str(n_config)+'\n'\
+                 +'Number of processes                     = '+str(nprocs)+'\n'
   if not initial_state == None:
 #    print(initial_state.type)
     params_string += \
@@ -623,7 +724,12 @@ def output_string(H,n_config,nprocs=1,propagation=None,initial_state=None,measur
                  +'use ctypes implementation               = '+str(propagation.use_ctypes)+'\n'\
                  +'use specific full Chebyshev routine     = '+str(propagation.has_specific_full_chebyshev_routine)+'\n'\
                  +'use specific Chebyshev step routine     = '+str(propagation.has_specific_chebyshev_step_routine)+'\n'\
-                 +'use specific H|psi> routine             = '+str(H.has_specific_apply_h_routine)+'\n'
+                 +'use specific H|psi> routine             = '+str(H.has_specific_apply_h_routine)+'\n'\
+                 +'number of threads in C kernels          = '+str(propagation.number_of_threads)+'\n'
+      if propagation.batch_size>1:
+        params_string += \
+                  'number of realizations per batch        = '+str(propagation.batch_size)+'\n'\
+                 +'use ctypes batched routine              = '+str(propagation.has_specific_batched_chebyshev_routine)+'\n'
       if not timing==None:
         params_string += \
                   'maximum Chebyshev order                 = '+str(timing.MAX_CHE_ORDER)+'\n'\
@@ -639,6 +745,8 @@ def output_string(H,n_config,nprocs=1,propagation=None,initial_state=None,measur
     if measurement.measure_spectral_function:
       params_string +=\
                   'time step for spectral function         = '+str(measurement.delta_t_spectral_function)+'\n'
+    params_string += \
+                  'output format for measurements          = '+measurement.output_format+'\n'
     if initial_state.type=='plane_wave':
       params_string += \
                   'remove hot pixel in momentum density    = '+str(measurement.remove_hot_pixel)+'\n'
@@ -652,24 +760,51 @@ def output_string(H,n_config,nprocs=1,propagation=None,initial_state=None,measur
                  +'energy resolution                       = '+str(spectral_function.e_resolution)+'\n'\
                  +'multiplicative factor for interaction   = '+str(spectral_function.multiplicative_factor_for_interaction)+'\n'\
                  +'kpm order                               = '+str(spectral_function.n_kpm)+'\n'\
+                 +'number of random vectors per config.    = '+str(spectral_function.number_of_random_vectors)+'\n'\
+                 +'kpm damping kernel                      = '+spectral_function.kernel+'\n'\
+                 +'spectrum reconstruction method          = '+spectral_function.reconstruction+'\n'\
                  +'use ctypes implementation               = '+str(spectral_function.use_ctypes)+'\n'
   if not diagonalization == None:
+    if diagonalization.multi_energy:
+      params_string += \
+                  'targeted energies                       = '+' '.join(str(x) for x in diagonalization.tab_targeted_energy)+'\n'
+    else:
+      params_string += \
+                  'targeted_energy                         = '+str(diagonalization.targeted_energy)+'\n'
     params_string += \
-                  'targeted_energy                         = '+str(diagonalization.targeted_energy)+'\n'\
-                 +'diagonalization method                  = '+diagonalization.method+'\n'\
+                  'diagonalization method                  = '+diagonalization.method+'\n'\
                  +'number of computed eigenvalues          = '+str(diagonalization.number_of_eigenvalues)+'\n'
+    if diagonalization.method=='chebyshev':
+      params_string += \
+                  'degree of the Chebyshev filter          = '+(str(diagonalization.chebyshev_degree) if diagonalization.chebyshev_degree>0 else 'automatic')+'\n'
+    if diagonalization.pivot!=0.0:
+      params_string += \
+                  'pivot for the landscape                 = '+str(diagonalization.pivot)+'\n'
   if not lyapounov == None:
+    if lyapounov.multi_energy:
+      params_string += \
+                  'minimum energy                          = '+str(lyapounov.e_min)+'\n'\
+                 +'maximum energy                          = '+str(lyapounov.e_max)+'\n'\
+                 +'number of energy steps                  = '+str(lyapounov.number_of_e_steps)+'\n'
+    else:
+      params_string += \
+                  'energy                                  = '+str(lyapounov.energy)+'\n'
     params_string += \
-                  'energy                                  = '+str(lyapounov.energy)+'\n'\
-                 +'use ctypes implementation               = '+str(lyapounov.use_ctypes)+'\n'\
+                  'use ctypes implementation               = '+str(lyapounov.use_ctypes)+'\n'\
                  +'number of skipped layers                = '+str(lyapounov.i0)+'\n'\
                  +'nrescale                                = '+str(lyapounov.nrescale)+'\n'
+    if H.dimension>1:
+      params_string += \
+                  'transfer matrix method                  = '+lyapounov.method+'\n'
+    else:
+      params_string += \
+                  'number of realizations per batch        = '+str(lyapounov.batch_size)+'\n'
   params_string += '\n'
   return params_string
 
 
 
-def output_density(file,data,geometry,header_string='Origin of data not specified',data_type='density',tab_abscissa=[],file_type='savetxt'):
+def output_density(file,data,geometry,header_string='Origin of data not specified',data_type='density',tab_abscissa=[],file_type='savetxt',tab_time=None):
 #  print(data.shape)
 #  print(tab_abscissa)
   if file_type=='savetxt':
@@ -677,6 +812,10 @@ def output_density(file,data,geometry,header_string='Origin of data not specifie
       column_1='Position'
       column_2='Disordered potential'
       specific_string='Disordered potential\n'
+    if data_type=='landscape':
+      column_1='Position'
+      column_2='Effective potential 1/u'
+      specific_string='Effective potential 1/u, where u is the landscape function\n'
     if data_type=='potential_correlation':
       column_1='Relative position'
       column_2='Disordered potential correlation function'
@@ -730,6 +869,11 @@ def output_density(file,data,geometry,header_string='Origin of data not specifie
       specific_string='Inverse participation ratio for the eigenstate closer to the targeted energy\n'\
                    +'Average IPR           = '+str(np.mean(data))+'\n'\
                    +'Std. deviation of IPR = '+str(np.std(data))+'\n'
+# With several targeted energies, data has one column per targeted energy (given in tab_abscissa)
+      if data.ndim==2:
+        specific_string='Inverse participation ratio for the eigenstates closer to the targeted energies, one column per targeted energy\n'\
+                     +'Average IPR           = '+' '.join(str(x) for x in np.mean(data,axis=0))+'\n'\
+                     +'Std. deviation of IPR = '+' '.join(str(x) for x in np.std(data,axis=0))+'\n'
     if data_type=='histogram_IPR':
       column_1 = 'Right bin edge'
       column_2 = 'Normalized distribution'
@@ -750,16 +894,19 @@ def output_density(file,data,geometry,header_string='Origin of data not specifie
       column_5 = 'Localization length for wavefunction (halve it for intensity)'
       column_6 = 'Std. deviation of localization length'
       specific_string='Lyapounov and localization length\n'
+    if data_type=='lyapounov_spectrum':
+      column_1 = 'Energy'
+      specific_string='All positive Lyapounov exponents, in decreasing order, one line per energy\n'
     list_of_columns = []
     tab_strings = []
 #    print(specific_string)
     next_column = 1
     dimension = geometry.dimension
-    if data_type in ['potential','potential_correlation','density','density_momentum']:
+    if data_type in ['potential','landscape','potential_correlation','density','density_momentum']:
 #      print(data.ndim,data.shape)
 # The simple case where there is only 1d data
       if dimension==1:
-        if data_type=='potential':
+        if data_type in ['potential','landscape']:
           header_string=str(geometry.tab_dim[0])+' '+str(geometry.tab_delta[0])+'\n'+header_string
         if data_type=='potential_correlation':
           header_string=str(geometry.tab_dim[0])+' '+str(geometry.tab_delta[0])+'\n'+header_string
@@ -803,7 +950,7 @@ def output_density(file,data,geometry,header_string='Origin of data not specifie
           header_string=str(geometry.tab_dim[0])+' '+str(geometry.tab_delta[0])+'\n'\
                        +str(geometry.tab_dim[1])+' '+str(geometry.tab_delta[1])+'\n'\
                        +header_string
-        if data_type=='potential':
+        if data_type in ['potential','landscape']:
           header_string=str(geometry.tab_dim[0])+' '+str(geometry.tab_delta[0])+'\n'\
                        +str(geometry.tab_dim[1])+' '+str(geometry.tab_delta[1])+'\n'\
                        +header_string
@@ -821,7 +968,7 @@ def output_density(file,data,geometry,header_string='Origin of data not specifie
           array_to_print=data[0,:,:]
       if dimension==3:
  # Add at the beginning of the file minimal info describing the data
-        if data_type in ['density','potential','potential_correlation']:
+        if data_type in ['density','potential','landscape','potential_correlation']:
           header_string=str(geometry.tab_dim[0])+' '+str(geometry.tab_delta[0])+'\n'\
                        +str(geometry.tab_dim[1])+' '+str(geometry.tab_delta[1])+'\n'\
                        +str(geometry.tab_dim[2])+' '+str(geometry.tab_delta[2])+'\n'\
@@ -906,7 +1053,17 @@ def output_density(file,data,geometry,header_string='Origin of data not specifie
       tab_strings.append('Column '+str(next_column)+': '+column_3)
       next_column += 1
       array_to_print=np.column_stack(list_of_columns)
-    if data_type in ['spectral_function','density_of_states','histogram_IPR','rbar','histogram_r']:
+    if data_type in ['histogram_IPR','histogram_r'] and data.ndim==2:
+# One histogram per targeted energy, tab_abscissa[0] being the bin edges and tab_abscissa[1] the targeted energies
+      list_of_columns.append(tab_abscissa[0])
+      tab_strings.append('Column '+str(next_column)+': '+column_1)
+      next_column += 1
+      for j in range(data.shape[0]):
+        list_of_columns.append(data[j])
+        tab_strings.append('Column '+str(next_column)+': '+column_2+' for targeted energy '+str(tab_abscissa[1][j]))
+        next_column += 1
+      array_to_print=np.column_stack(list_of_columns)
+    elif data_type in ['spectral_function','density_of_states','histogram_IPR','rbar','histogram_r']:
       list_of_columns.append(tab_abscissa)
       tab_strings.append('Column '+str(next_column)+': '+column_1)
       next_column += 1
@@ -915,15 +1072,27 @@ def output_density(file,data,geometry,header_string='Origin of data not specifie
       next_column += 1
       array_to_print=np.column_stack(list_of_columns)
     if data_type in ['IPR']:
-      list_of_columns.append(data)
-      tab_strings.append('Column '+str(next_column)+': '+column_1)
-      next_column += 1
+      if data.ndim==2:
+        for j in range(data.shape[1]):
+          list_of_columns.append(data[:,j])
+          tab_strings.append('Column '+str(next_column)+': '+column_1+' for targeted energy '+str(tab_abscissa[j]))
+          next_column += 1
+      else:
+        list_of_columns.append(data)
+        tab_strings.append('Column '+str(next_column)+': '+column_1)
+        next_column += 1
       array_to_print=np.column_stack(list_of_columns)
     if data_type in ['lyapounov']:
-      list_of_columns.append(tab_abscissa[0])
+# tab_abscissa[1] may be either a single energy or an array of energies, one line per energy
+# tab_abscissa[0] may be either a single V0 or an array of V0 (sweep), data having then shape (2,number of V0,number of energies)
+# with one line per (V0,energy) pair, energy varying fastest
+      tab_energy = np.atleast_1d(tab_abscissa[1])
+      tab_V0 = np.atleast_1d(tab_abscissa[0])
+      data = data.reshape(2,tab_V0.size*tab_energy.size)
+      list_of_columns.append(np.repeat(tab_V0,tab_energy.size))
       tab_strings.append('Column '+str(next_column)+': '+column_1)
       next_column += 1
-      list_of_columns.append(tab_abscissa[1])
+      list_of_columns.append(np.tile(tab_energy,tab_V0.size))
       tab_strings.append('Column '+str(next_column)+': '+column_2)
       next_column += 1
       list_of_columns.append(data[0])
@@ -939,6 +1108,20 @@ def output_density(file,data,geometry,header_string='Origin of data not specifie
       tab_strings.append('Column '+str(next_column)+': '+column_6)
       next_column += 1
 
+      array_to_print=np.column_stack(list_of_columns)
+    if data_type in ['lyapounov_spectrum']:
+# data[0] is the mean, data[1] the std. deviation, each of shape (number of energies, number of exponents)
+      tab_energy = np.atleast_1d(tab_abscissa)
+      list_of_columns.append(tab_energy)
+      tab_strings.append('Column '+str(next_column)+': '+column_1)
+      next_column += 1
+      number_of_exponents = data.shape[-1]
+      list_of_columns.append(data[0].reshape(tab_energy.size,number_of_exponents))
+      tab_strings.append('Columns '+str(next_column)+' to '+str(next_column+number_of_exponents-1)+': Lyapounov exponents')
+      next_column += number_of_exponents
+      list_of_columns.append(data[1].reshape(tab_energy.size,number_of_exponents))
+      tab_strings.append('Columns '+str(next_column)+' to '+str(next_column+number_of_exponents-1)+': Std. deviations of Lyapounov exponents')
+      next_column += number_of_exponents
       array_to_print=np.column_stack(list_of_columns)
  #   print(list_of_columns,len(list_of_columns))
  #   if len(list_of_columns) == 1:
@@ -950,8 +1133,81 @@ def output_density(file,data,geometry,header_string='Origin of data not specifie
 #    print(tab_strings)
     my_save_routine(file,array_to_print,header=header_string+specific_string+'\n'.join(tab_strings)+'\n')
 #    np.savetxt(file,array_to_print,header=header_string+specific_string+'\n'.join(tab_strings)+'\n')
+  if file_type in ['hdf5','npz']:
+    output_density_binary(file,data,geometry,header_string=header_string,data_type=data_type,tab_abscissa=tab_abscissa,tab_time=tab_time,file_type=file_type)
+  return
+
+# Binary output: the raw data array is stored without reformatting into columns,
+# so that arrays of any dimension can be saved. If tab_time is given, the first axis of data
+# is the time axis, and each time is a separate chunk of a compressed dataset.
+# The geometry and header are stored as attributes (hdf5) or additional entries (npz).
+def output_density_binary(file,data,geometry,header_string='Origin of data not specified',data_type='density',tab_abscissa=[],tab_time=None,file_type='hdf5'):
+  data = np.ascontiguousarray(data)
+  attributes = {'header':header_string, 'data_type':data_type, 'dimension':geometry.dimension,\
+                'tab_dim':np.asarray(geometry.tab_dim), 'tab_delta':np.asarray(geometry.tab_delta)}
+  if data_type in ['density_momentum','wavefunction_momentum']:
+    attributes['tab_delta'] = 2.0*np.pi/(np.asarray(geometry.tab_dim)*np.asarray(geometry.tab_delta))
+# tab_abscissa is either a list of arrays (one per spatial direction) or a single array
+  if tab_abscissa is None or len(tab_abscissa)==0:
+    list_of_abscissa = []
+  elif isinstance(tab_abscissa,np.ndarray) and tab_abscissa.ndim==1:
+    list_of_abscissa = [tab_abscissa]
+  else:
+    list_of_abscissa = [np.asarray(x) for x in tab_abscissa]
+  if file_type=='hdf5':
+    import h5py
+    if tab_time is None:
+      chunks = True
+    else:
+      chunks = (1,)+data.shape[1:]
+    with h5py.File(file,'w') as f:
+      dataset = f.create_dataset('data',data=data,chunks=chunks,compression='gzip',compression_opts=4,shuffle=True)
+      for key in attributes:
+        dataset.attrs[key] = attributes[key]
+      if not tab_time is None:
+        f.create_dataset('time',data=np.asarray(tab_time))
+      for i,x in enumerate(list_of_abscissa):
+        f.create_dataset('abscissa_'+str(i),data=x)
+  if file_type=='npz':
+    dict_of_arrays = {'data':data}
+    if not tab_time is None:
+      dict_of_arrays['time'] = np.asarray(tab_time)
+    for i,x in enumerate(list_of_abscissa):
+      dict_of_arrays['abscissa_'+str(i)] = x
+    for key in attributes:
+      dict_of_arrays['attribute_'+key] = attributes[key]
+    np.savez_compressed(file,**dict_of_arrays)
   return
 
+# Reads back a file written by output_density_binary
+# Returns the data array, the array of times (None if absent), the list of abscissa and a dictionary of attributes
+def read_density_binary(file):
+  tab_abscissa = []
+  attributes = {}
+  if file.endswith('.npz'):
+    with np.load(file) as f:
+      data = f['data']
+      tab_time = f['time'] if 'time' in f.files else None
+      i = 0
+      while 'abscissa_'+str(i) in f.files:
+        tab_abscissa.append(f['abscissa_'+str(i)])
+        i += 1
+      for key in f.files:
+        if key.startswith('attribute_'):
+          attributes[key[10:]] = f[key][()]
+  else:
+    import h5py
+    with h5py.File(file,'r') as f:
+      data = f['data'][()]
+      tab_time = f['time'][()] if 'time' in f else None
+      i = 0
+      while 'abscissa_'+str(i) in f:
+        tab_abscissa.append(f['abscissa_'+str(i)][()])
+        i += 1
+      for key in f['data'].attrs:
+        attributes[key] = f['data'].attrs[key]
+  return data, tab_time, tab_abscissa, attributes
+
 def my_save_routine(file,array_to_print,header='\n'):
   dimension = array_to_print.ndim
   if dimension>3:
@@ -975,12 +1231,83 @@ def my_save_routine(file,array_to_print,header='\n'):
         i_header+=1
   return
 
+# The --workers option of the drivers distributes the realizations among local processes,
+# without MPI (see anderson.scheduler.run_workers). It is ignored when launched by MPI.
+# Checkpoints are not supported with local workers, hence switched off.
+def get_number_of_workers(args,mpi_version,rank):
+  number_of_workers = max(args.workers,1)
+  if number_of_workers>1 and mpi_version:
+    if rank==0:
+      print('Warning, --workers is ignored when launched by MPI\n')
+    return 1
+  if number_of_workers>1 and hasattr(args,'checkpoint_interval'):
+    if args.resume:
+      print('Warning, checkpoints are not supported with --workers, --resume is ignored\n')
+    args.resume = False
+    args.checkpoint_interval = 0.0
+  return number_of_workers
+
+# Checkpointing of long disorder-averaging runs
+# Each MPI process saves its own partial sums, the indices of the realizations it has computed
+# and its Timing counters. As the seeds depend only on the realization index, a run restarted with
+# the same parameters and the same number of processes computes exactly the missing realizations.
+def checkpoint_file_name(base_name,rank):
+  return base_name+'_rank'+str(rank)+'.npz'
+
+# The fingerprint identifies the calculation, a checkpoint is used only if it matches
+def checkpoint_fingerprint(parameter_file,nprocs,n_config):
+  with open(parameter_file,'rb') as f:
+    parameter_string = f.read()
+  return hashlib.sha256(parameter_string+repr((nprocs,n_config)).encode()).hexdigest()
+
+# elapsed_time is the wallclock time spent since the start (or the restart) of the run,
+# it is added to timing.TOTAL_TIME in the checkpoint
+def save_checkpoint(file_name,tab_done_config,fingerprint,accumulators,timing,elapsed_time=0.0):
+  dict_of_arrays = {'done_config':np.array(tab_done_config,dtype=int), 'fingerprint':fingerprint}
+  for key in accumulators:
+    dict_of_arrays['accumulator_'+key] = accumulators[key]
+  for key,value in vars(timing).items():
+    dict_of_arrays['timing_'+key] = value
+  dict_of_arrays['timing_TOTAL_TIME'] = timing.TOTAL_TIME+elapsed_time
+# Write in a temporary file and rename it, so that a job killed while writing leaves the previous checkpoint intact
+  temporary_file_name = file_name[:-4]+'_tmp.npz'
+  np.savez(temporary_file_name,**dict_of_arrays)
+  os.replace(temporary_file_name,file_name)
+  return
+
+# Returns the indices of the realizations already computed and the dictionary of accumulators,
+# and restores the Timing counters. If there is no usable checkpoint, returns an empty list and None.
+def load_checkpoint(file_name,fingerprint,timing):
+  if not os.path.isfile(file_name):
+    return [], None
+  with np.load(file_name) as data:
+    if str(data['fingerprint'])!=fingerprint or 'done_config' not in data.files:
+      print('Checkpoint file '+file_name+' does not match the current calculation, I ignore it')
+      return [], None
+    tab_done_config = list(data['done_config'])
+    accumulators = {}
+    for key in data.files:
+      if key.startswith('accumulator_'):
+        accumulators[key[12:]] = data[key]
+      if key.startswith('timing_'):
+        setattr(timing,key[7:],data[key][()].item())
+  return tab_done_config, accumulators
+
+def remove_checkpoint(file_name):
+  if os.path.isfile(file_name):
+    os.remove(file_name)
+  return
+
 def output_dispersion(file,tab_data,tab_strings,general_string='Origin of data not specified'):
 #  print('\n'.join(tab_strings))
   np.savetxt(file,tab_data,header=general_string+'\n'.join(tab_strings)+'\n')
   return
 
 def print_measurements_final(measurement,initial_state=None,header_string='Origin of data not specified'):
+# With a binary output format, all intermediate times of an observable go in a single file
+  binary_output = measurement.output_format in ['hdf5','npz']
+  if binary_output:
+    extension = {'hdf5':'.h5','npz':'.npz'}[measurement.output_format]
   if (measurement.measure_potential):
 #    print(measurement.potential)
     anderson.io.output_density('potential.dat',measurement.potential,measurement,header_string=header_string,tab_abscissa=measurement.grid_position,data_type='potential')
@@ -990,16 +1317,26 @@ def print_measurements_final(measurement,initial_state=None,header_string='Origi
   if (measurement.measure_density):
 #      print(measurement.grid_position)
 #    anderson.io.output_density('density_final.dat',measurement.density_final,measurement,header_string=header_string,tab_abscissa=measurement.grid_position,data_type='density')
-    for i in range(measurement.tab_t_measurement_density.size):
-      anderson.io.output_density('density_intermediate_'+str(i)+'.dat',measurement.density_intermediate[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.grid_position,data_type='density')
+    if binary_output:
+      anderson.io.output_density('density'+extension,measurement.density_intermediate,measurement,header_string=header_string,tab_abscissa=measurement.grid_position,data_type='density',file_type=measurement.output_format,tab_time=measurement.tab_t_measurement_density)
       if measurement.spin_one_half:
-        anderson.io.output_density('density_intermediate2_'+str(i)+'.dat',measurement.density_intermediate2[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.grid_position,data_type='density')
+        anderson.io.output_density('density2'+extension,measurement.density_intermediate2,measurement,header_string=header_string,tab_abscissa=measurement.grid_position,data_type='density',file_type=measurement.output_format,tab_time=measurement.tab_t_measurement_density)
+    else:
+      for i in range(measurement.tab_t_measurement_density.size):
+        anderson.io.output_density('density_intermediate_'+str(i)+'.dat',measurement.density_intermediate[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.grid_position,data_type='density')
+        if measurement.spin_one_half:
+          anderson.io.output_density('density_intermediate2_'+str(i)+'.dat',measurement.density_intermediate2[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.grid_position,data_type='density')
   if (measurement.measure_density_momentum):
 #    anderson.io.output_density('density_momentum_final.dat',measurement.density_momentum_final,measurement,header_string=header_string,tab_abscissa=measurement.frequencies,data_type='density_momentum')
-    for i in range(measurement.tab_t_measurement_density.size):
-      anderson.io.output_density('density_momentum_intermediate_'+str(i)+'.dat',measurement.density_momentum_intermediate[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.frequencies,data_type='density_momentum')
+    if binary_output:
+      anderson.io.output_density('density_momentum'+extension,measurement.density_momentum_intermediate,measurement,header_string=header_string,tab_abscissa=measurement.frequencies,data_type='density_momentum',file_type=measurement.output_format,tab_time=measurement.tab_t_measurement_density)
       if measurement.spin_one_half:
-        anderson.io.output_density('density_momentum_intermediate2_'+str(i)+'.dat',measurement.density_momentum_intermediate2[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.frequencies,data_type='density_momentum')
+        anderson.io.output_density('density_momentum2'+extension,measurement.density_momentum_intermediate2,measurement,header_string=header_string,tab_abscissa=measurement.frequencies,data_type='density_momentum',file_type=measurement.output_format,tab_time=measurement.tab_t_measurement_density)
+    else:
+      for i in range(measurement.tab_t_measurement_density.size):
+        anderson.io.output_density('density_momentum_intermediate_'+str(i)+'.dat',measurement.density_momentum_intermediate[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.frequencies,data_type='density_momentum')
+        if measurement.spin_one_half:
+          anderson.io.output_density('density_momentum_intermediate2_'+str(i)+'.dat',measurement.density_momentum_intermediate2[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.frequencies,data_type='density_momentum')
   if (measurement.measure_wavefunction):
     anderson.io.output_density('wavefunction_initial.dat',initial_state.wfc,measurement,header_string=header_string,tab_abscissa=measurement.grid_position,data_type='wavefunction')
     anderson.io.output_density('wavefunction_final.dat',measurement.wfc,measurement,header_string=header_string,tab_abscissa=measurement.grid_position,data_type='wavefunction')
@@ -1015,8 +1352,11 @@ def print_measurements_final(measurement,initial_state=None,header_string='Origi
       anderson.io.output_dispersion('dispersion2.dat',measurement.tab_dispersion_2,measurement.tab_strings,header_string)
   if (measurement.measure_g1):
 #    anderson.io.output_density('g1_final.dat',measurement.g1,measurement,header_string=header_string,tab_abscissa=measurement.grid_position,data_type='g1')
-    for i in range(measurement.tab_t_measurement_density.size):
-      anderson.io.output_density('g1_intermediate_'+str(i)+'.dat',measurement.g1_intermediate[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.grid_position,data_type='g1')
+    if binary_output:
+      anderson.io.output_density('g1'+extension,measurement.g1_intermediate,measurement,header_string=header_string,tab_abscissa=measurement.grid_position,data_type='g1',file_type=measurement.output_format,tab_time=measurement.tab_t_measurement_density)
+    else:
+      for i in range(measurement.tab_t_measurement_density.size):
+        anderson.io.output_density('g1_intermediate_'+str(i)+'.dat',measurement.g1_intermediate[i],measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_density[i])+' \n',tab_abscissa=measurement.grid_position,data_type='g1')
 #    print("c'est fini")
   if measurement.measure_spectral_function:
 #    print(measurement.tab_t_measurement_spectral_function.size)
@@ -1027,7 +1367,10 @@ def print_measurements_final(measurement,initial_state=None,header_string='Origi
     else:
       base_string='spectral_function'
       data_type='spectral_function'
-    if measurement.tab_t_measurement_spectral_function.size==1:
+    if binary_output:
+# The time axis is the second one in tab_spectrum
+      anderson.io.output_density(base_string+extension,measurement.tab_spectrum.T, measurement,header_string=header_string,tab_abscissa=measurement.tab_energies,data_type=data_type,file_type=measurement.output_format,tab_time=measurement.tab_t_measurement_spectral_function)
+    elif measurement.tab_t_measurement_spectral_function.size==1:
       anderson.io.output_density(base_string+'.dat',measurement.tab_spectrum, measurement,header_string=header_string,tab_abscissa=measurement.tab_energies,data_type=data_type)
     else:
 #      anderson.io.output_density(base_string+'_initial.dat',measurement.tab_spectrum[:,0], measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_spectral_function[0])+' \n',tab_abscissa=measurement.tab_energies,data_type=data_type)
@@ -1039,14 +1382,14 @@ def print_measurements_final(measurement,initial_state=None,header_string='Origi
 #      anderson.io.output_density(base_string+'_final.dat',measurement.tab_spectrum[:,i], measurement,header_string=header_string+'Time = '+str(measurement.tab_t_measurement_spectral_function[i])+' \n',tab_abscissa=measurement.tab_energies,data_type=data_type)
   return
 
-def print_spectral_function(spectral_function,geometry,initial_state=None,header_string='Origin of data not specified'):
+def print_spectral_function(spectral_function,geometry,initial_state=None,header_string='Origin of data not specified',postfix=''):
   if initial_state.type in ['point','multi_point','random']:
     base_string='density_of_states'
     data_type='density_of_states'
   else:
     base_string='spectral_function'
     data_type='spectral_function'
-  anderson.io.output_density(base_string+'.dat',spectral_function.tab_spectrum,geometry,header_string=header_string,tab_abscissa=spectral_function.tab_energies,data_type=data_type)
+  anderson.io.output_density(base_string+postfix+'.dat',spectral_function.tab_spectrum,geometry,header_string=header_string,tab_abscissa=spectral_function.tab_energies,data_type=data_type)
   return
 
 """
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registry of the native kernels (C routines in the ctypes subdirectory)
+
+Each shared library is loaded at most once per process, and the argtypes/restype
+of each routine are declared only once, the first time the routine is requested.
+Afterwards, get_kernel simply returns the already prepared ctypes function,
+so that it can be called for each disorder realization at no extra cost.
+"""
+
+import numpy as np
+import anderson
+try:
+  import ctypes
+  import numpy.ctypeslib as ctl
+  ctypes_available = True
+except ImportError:
+  ctypes_available = False
+
+__all__ = ["get_library","get_kernel","has_kernel"]
+
+# Loaded libraries, indexed by name (e.g. 'chebyshev'), None if the library could not be loaded
+_libraries = {}
+# Prepared routines, indexed by (library name, routine name), None if not available
+_kernels = {}
+
+def _prototypes():
+# Signatures (argtypes, restype) of the routines called from Python
+  c_int = ctypes.c_int
+  c_double = ctypes.c_double
+  p_int = ctl.ndpointer(np.intc)
+  p_double = ctl.ndpointer(np.float64)
+  p_complex = ctl.ndpointer(np.complex128)
+  p_complex_c = ctl.ndpointer(np.complex128,flags='C')
+  p_c = ctl.ndpointer(flags='C')
+  return {
+    ('chebyshev','chebyshev_real'): ([c_int, p_int, c_int, p_int, p_double, p_double, p_double, p_double, p_double, p_double,\
+      c_double, c_double, c_double, c_double], c_double),
+    ('chebyshev','chebyshev_complex'): ([c_int, p_int, c_int, p_int, p_complex, p_complex, p_complex, p_double, p_double, p_double,\
+      c_double, c_double, c_double, c_double], c_double),
+    ('chebyshev','chebyshev_complex_batched'): ([c_int, p_int, c_int, p_int, c_int, p_complex, p_complex, p_complex, p_double, p_double, p_double,\
+      c_double, c_double, c_double, c_double], c_double),
+    ('chebyshev','chebyshev_kpm_step'): ([c_int, p_int, p_int, p_complex, p_complex, p_double, p_double, c_double, c_double], None),
+    ('chebyshev','chebyshev_kpm_step_block'): ([c_int, p_int, p_int, c_int, p_complex_c, p_complex_c, p_double, p_double, c_double, c_double], None),
+    ('chebyshev','chebyshev_set_number_of_threads'): ([c_int], c_int),
+    ('lyapounov','core_lyapounov'): ([c_int, c_int, p_double, c_double, c_double], c_double),
+    ('lyapounov','core_lyapounov_multi_energy'): ([c_int, c_int, p_double, c_int, p_double, c_double, p_double], None),
+    ('lyapounov','core_lyapounov_non_diagonal_disorder'): ([c_int, c_int, p_double, c_int, p_double, c_double, c_double], c_double),
+    ('lyapounov','core_lyapounov_batched'): ([c_int, c_int, c_int, p_c, c_double, c_double, p_double], None),
+    ('lyapounov','core_lyapounov_non_diagonal_disorder_batched'): ([c_int, c_int, c_int, p_c, p_c, c_double, c_double, p_double], None),
+    ('lyapounov','update_A_2d'): ([c_int, p_c, c_double, c_double, c_double, c_int, c_int, p_c, p_c], None),
+    ('lyapounov','update_A_3d'): ([c_int, c_int, p_c, c_double, c_double, c_double, c_double, c_int, c_int, p_c, p_c], None),
+  }
+
+def get_library(name):
+# Returns the shared library anderson/ctypes/name.so, loaded on first request
+# Returns None if ctypes is not available or the library cannot be loaded
+  if name not in _libraries:
+    library = None
+    if ctypes_available:
+      try:
+        library = ctypes.CDLL(anderson.__path__[0]+"/ctypes/"+name+".so")
+      except OSError:
+        library = None
+    _libraries[name] = library
+  return _libraries[name]
+
+def has_kernel(library_name, routine_name):
+# Checks whether a routine is exported by the library, without preparing it
+# Used to detect the routines specialized for a given dimension or data layout
+  library = get_library(library_name)
+  return library is not None and hasattr(library, routine_name)
+
+def get_kernel(library_name, routine_name):
+# Returns the ctypes function for the routine, with argtypes and restype declared,
+# or None if the library or the routine is not available
+  key = (library_name, routine_name)
+  if key not in _kernels:
+    kernel = None
+    if has_kernel(library_name, routine_name):
+      kernel = getattr(get_library(library_name), routine_name)
+      prototype = _prototypes().get(key)
+      if prototype is not None:
+        kernel.argtypes, kernel.restype = prototype
+    _kernels[key] = kernel
+  return _kernels[key]
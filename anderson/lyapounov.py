@@ -13,6 +13,7 @@ import anderson
 import scipy.linalg.lapack as lapack
 import scipy.sparse
 import scipy.sparse.linalg
+from anderson import kernels
 
 def numba_decorator(x):
   try:
@@ -44,94 +45,184 @@ def core_lyapounov(dim_x, loop_step, disorder, energy, inv_tunneling):
 #  gamma+=math.log(abs(psi_cur))
   return gamma
 
+# Same as core_lyapounov, but for several energies simultaneously, on the same disorder configuration
+# The innermost loop is over energies, so that it can be vectorized
+@numba_decorator
+def core_lyapounov_multi_energy(dim_x, loop_step, disorder, tab_energy, inv_tunneling):
+  number_of_energies = tab_energy.size
+  psi_cur = np.ones(number_of_energies)
+  psi_old = np.full(number_of_energies,math.pi/math.sqrt(13.0))
+  scaled_energy = inv_tunneling*tab_energy
+  tab_gamma = np.zeros(number_of_energies)
+  for i in range(0, dim_x, loop_step):
+    jmax=min(i+loop_step,dim_x)
+    for j in range(i,jmax):
+      local_disorder = inv_tunneling*disorder[j]
+      for m in range(number_of_energies):
+        psi_new = psi_cur[m]*(local_disorder-scaled_energy[m])-psi_old[m]
+        psi_old[m] = psi_cur[m]
+        psi_cur[m] = psi_new
+    for m in range(number_of_energies):
+      tab_gamma[m] += math.log(abs(psi_cur[m]))
+      psi_old[m] /= psi_cur[m]
+      psi_cur[m] = 1.0
+  return tab_gamma
+
+
+# Same as core_lyapounov, but for several disorder realizations simultaneously
+# disorder is an interleaved (dim_x,batch_size) array, the innermost loop is over realizations, so that it can be vectorized
+@numba_decorator
+def core_lyapounov_batched(dim_x, loop_step, disorder, energy, inv_tunneling):
+  batch_size = disorder.shape[1]
+  psi_cur = np.ones(batch_size)
+  psi_old = np.full(batch_size,math.pi/math.sqrt(13.0))
+  scaled_energy = inv_tunneling*energy
+  tab_gamma = np.zeros(batch_size)
+  for i in range(0, dim_x, loop_step):
+    jmax=min(i+loop_step,dim_x)
+    for j in range(i,jmax):
+      for k in range(batch_size):
+        psi_new = psi_cur[k]*(inv_tunneling*disorder[j,k]-scaled_energy)-psi_old[k]
+        psi_old[k] = psi_cur[k]
+        psi_cur[k] = psi_new
+    for k in range(batch_size):
+      tab_gamma[k] += math.log(abs(psi_cur[k]))
+      psi_old[k] /= psi_cur[k]
+      psi_cur[k] = 1.0
+  return tab_gamma
+
+# The transverse hopping part of -H_local/tunneling_x, for a slice at fixed x, in dimension 2 or 3
+# The diagonal part depends on the energy and must be added separately
+def transverse_hopping_over_tx(H):
+  inv_tunneling_x = 1.0/H.tab_tunneling[0]
+  tunneling_y = H.tab_tunneling[1]
+  dim_y = H.tab_dim[1]
+  if H.dimension==2:
+    if dim_y==2:
+      tunneling_y *= 0.5
+    hopping_over_tx = scipy.sparse.dia_array((dim_y,dim_y))
+    non_diagonal_element = -tunneling_y*inv_tunneling_x
+    hopping_over_tx.setdiag(non_diagonal_element,-1)
+    hopping_over_tx.setdiag(non_diagonal_element,1)
+    hopping_over_tx.setdiag(non_diagonal_element,dim_y-1)
+    hopping_over_tx.setdiag(non_diagonal_element,1-dim_y)
+  else:
+    tunneling_z = H.tab_tunneling[2]
+    dim_z = H.tab_dim[2]
+    dim_trans = dim_y*dim_z
+    hopping_over_tx = scipy.sparse.dia_array((dim_trans,dim_trans))
+    non_diagonal_element_y = -tunneling_y*inv_tunneling_x
+    non_diagonal_element_z = -tunneling_z*inv_tunneling_x
+    hopping_over_tx.setdiag(non_diagonal_element_y,-dim_z)
+    hopping_over_tx.setdiag(non_diagonal_element_y,dim_z)
+    hopping_over_tx.setdiag(non_diagonal_element_y,-dim_z*(dim_y-1))
+    hopping_over_tx.setdiag(non_diagonal_element_y,dim_z*(dim_y-1))
+    non_diagonal_vector = non_diagonal_element_z*np.ones(dim_z)
+    non_diagonal_vector[dim_z-1] = 0.0
+    non_diagonal_vector = np.tile(non_diagonal_vector,dim_y)
+#    print('non_diagonal_vector_1',non_diagonal_vector)
+    hopping_over_tx.setdiag(non_diagonal_vector,1)
+    hopping_over_tx.setdiag(non_diagonal_vector,-1)
+    non_diagonal_vector = np.zeros(dim_z)
+    non_diagonal_vector[0] = non_diagonal_element_z
+    non_diagonal_vector = np.tile(non_diagonal_vector,dim_y)
+#    print('non_diagonal_vector_2',non_diagonal_vector)
+    hopping_over_tx.setdiag(non_diagonal_vector,dim_z-1)
+    hopping_over_tx.setdiag(non_diagonal_vector,1-dim_z)
+  hopping_over_tx.setdiag(0.0)
+  return hopping_over_tx
 
 def core_lyapounov_2d(H, energy, i0, nrescale, timing, use_ctypes, debug=False):
 # Propagation is along the x direction
+# energy can be either a single energy or an array of energies
+# In the latter case, all energies are propagated together on the same disorder configuration,
+# the hopping part of the transfer matrix being applied to all energies at once,
+# and an array of Lyapounov exponents (one per energy) is returned
+  tab_energy = np.atleast_1d(np.asarray(energy,dtype=np.float64))
+  number_of_energies = tab_energy.size
   dim_x = H.tab_dim[0]
   dim_y = H.tab_dim[1]
 #    print('dim_y=',dim_y)
   if dim_y==1:
-    energy += 4.0
+    tab_energy = tab_energy+4.0
   tunneling_x = H.tab_tunneling[0]
   inv_tunneling_x = 1.0/tunneling_x
   tunneling_y = H.tab_tunneling[1]
   if dim_y==2:
     tunneling_y *= 0.5
   if debug:
-    tab_log_trans = np.zeros((dim_x-1-i0)//nrescale+1)
+    tab_log_trans = np.zeros(((dim_x-1-i0)//nrescale+1,number_of_energies))
     tab_x = H.tab_delta[0]*nrescale*np.arange((dim_x-1-i0)//nrescale+1)
 #  print('Disorder',H.disorder)
 #  print(H.disorder.dtype,H.disorder.shape,H.disorder.flags)
-  x = 0.0
-  g1n = np.identity(dim_y)
-  An = np.identity(dim_y)
-  An_old = np.zeros((dim_y,dim_y))
+  x = np.zeros(number_of_energies)
+  identity = np.identity(dim_y)
+  g1n = np.empty((number_of_energies,dim_y,dim_y))
+  g1n[:] = identity
+  An = np.empty((number_of_energies,dim_y,dim_y))
+  An[:] = identity
+  An_old = np.zeros((number_of_energies,dim_y,dim_y))
   if use_ctypes:
-    import ctypes
-    import numpy.ctypeslib as ctl
-    lyapounov_ctypes_lib=ctypes.CDLL(anderson.__path__[0]+"/ctypes/lyapounov.so")
-    lyapounov_ctypes_lib.update_A_2d.argtypes = [ctypes.c_int, ctl.ndpointer(flags='C'), ctypes.c_double, ctypes.c_double, ctypes.c_double,ctypes.c_int, ctypes.c_int, ctl.ndpointer(flags='C'), ctl.ndpointer(flags='C')]
-    lyapounov_ctypes_lib.update_A_2d.restype = None
+    update_A_2d = kernels.get_kernel('lyapounov','update_A_2d')
   else:
-    e_minus_H_local_over_tx = scipy.sparse.dia_array((dim_y,dim_y))
-#    e_minus_H_local_over_tx.setdiag(0.0)
-    non_diagonal_element = -tunneling_y*inv_tunneling_x
-    e_minus_H_local_over_tx.setdiag(non_diagonal_element,-1)
-    e_minus_H_local_over_tx.setdiag(non_diagonal_element,1)
-    e_minus_H_local_over_tx.setdiag(non_diagonal_element,dim_y-1)
-    e_minus_H_local_over_tx.setdiag(non_diagonal_element,1-dim_y)
-#    print(e_minus_H_local_over_tx)
-#    offsets = np.array([1-dim_y,-1,0,1,dim_y-1])
-#    sub_diagonals = -tunneling_y*inv_tunneling_x*np.ones(dim_y)
-#    data = np.array([sub_diagonals,sub_diagonals,sub_diagonals,sub_diagonals,sub_diagonals])
-#    e_minus_H_local_over_tx = scipy.sparse.dia_array((data,offsets), shape=(dim_y,dim_y))
-    e_minus_H_local_over_tx_linear_operator= scipy.sparse.linalg.aslinearoperator(e_minus_H_local_over_tx)
+# The hopping part of -H_local/tunneling_x, identical for all energies
+    hopping_over_tx = transverse_hopping_over_tx(H)
+    dense_hopping_over_tx = hopping_over_tx.toarray()
+    hopping_over_tx_linear_operator= scipy.sparse.linalg.aslinearoperator(hopping_over_tx)
+    diagonal_indices = np.arange(dim_y)
 # Here starts the main loop for propagation along the x direction
   for i in range(((dim_x-1)//nrescale)*nrescale+1):
     start_scalar_time = timeit.default_timer()
     if use_ctypes:
-      lyapounov_ctypes_lib.update_A_2d(dim_y, H.disorder, tunneling_x, tunneling_y, energy, nrescale, i, An, An_old)
+      for m in range(number_of_energies):
+        update_A_2d(dim_y, H.disorder, tunneling_x, tunneling_y, tab_energy[m], nrescale, i, An[m], An_old[m])
     else:
-      e_minus_H_local_over_tx.setdiag(inv_tunneling_x*(energy-H.disorder[i,:]))
+      e_minus_V_over_tx = inv_tunneling_x*(tab_energy[:,np.newaxis]-H.disorder[i,:])
       if i%nrescale==1:
-        An_old += e_minus_H_local_over_tx
-# The code in the previous line should be equivalent to the following 4 lines
+        An_old += dense_hopping_over_tx
+        An_old[:,diagonal_indices,diagonal_indices] += e_minus_V_over_tx
+# The code in the previous lines should be equivalent to the following 4 lines (for each energy)
 #         for j in range(dim_y):
 #           An_old[j,j] += inv_tunneling_x*(energy-H.disorder[i,j])
 #           An_old[j,(j+1)%dim_y] -= tunneling_y*inv_tunneling_x
 #           An_old[j,(j+dim_y-1)%dim_y] -= tunneling_y*inv_tunneling_x
       else:
-        An_old += e_minus_H_local_over_tx_linear_operator.matmat(An)
-# The code in the previous line should be equivalent to the following 4 lines
+# The hopping is applied to the matrices for all energies in a single call, stacked side by side
+        An_old += hopping_over_tx_linear_operator.matmat(An.transpose(1,0,2).reshape(dim_y,number_of_energies*dim_y)).reshape(dim_y,number_of_energies,dim_y).transpose(1,0,2)
+        An_old += e_minus_V_over_tx[:,:,np.newaxis]*An
+# The code in the previous lines should be equivalent to the following 4 lines (for each energy)
 #        for j in range(dim_y):
 #          An_old[j,0:dim_y] += inv_tunneling_x*((energy-H.disorder[i,j])*An[j,0:dim_y] - tunneling_y*(An[(j+1)%dim_y,0:dim_y] + An[(j+dim_y-1)%dim_y,0:dim_y]))
     An, An_old = An_old, -An
-#      print('False ener i=',i,energy-H.disorder[i,:])
-#      print('False Hamitonian i=',i,e_minus_H_local_over_tx)
-#      print('False i=',i,An,An_old)
     timing.LYAPOUNOV_SCALAR_TIME+=(timeit.default_timer() - start_scalar_time)
     if i%nrescale==0:
-      start_factorization_time = timeit.default_timer()
-      b, piv, info = lapack.dgetrf(An)
-      timing.LYAPOUNOV_MATRIX_FACTORIZATION_TIME+=(timeit.default_timer() - start_factorization_time)
+      for m in range(number_of_energies):
+        start_factorization_time = timeit.default_timer()
+        b, piv, info = lapack.dgetrf(An[m])
+        timing.LYAPOUNOV_MATRIX_FACTORIZATION_TIME+=(timeit.default_timer() - start_factorization_time)
+        if i>=i0:
+          start_solution_time = timeit.default_timer()
+          g1n[m], info = lapack.dgetrs(b, piv, g1n[m], 1, 0)
+          timing.LYAPOUNOV_MATRIX_SOLUTION_TIME+=(timeit.default_timer() - start_solution_time)
+          one_over_small_b = 1.0/np.linalg.norm(g1n[m])
+          g1n[m] *= one_over_small_b
+          if i>i0:
+            x[m] += math.log(one_over_small_b)
+          start_solution_time = timeit.default_timer()
+          An_old[m] = lapack.dgetrs(b, piv, An_old[m].T, 1, 0)[0].T
+          timing.LYAPOUNOV_MATRIX_SOLUTION_TIME+=(timeit.default_timer() - start_solution_time)
       if i>=i0:
-        start_solution_time = timeit.default_timer()
-        g1n, info = lapack.dgetrs(b, piv, g1n, 1, 0)
-        timing.LYAPOUNOV_MATRIX_SOLUTION_TIME+=(timeit.default_timer() - start_solution_time)
-        one_over_small_b = 1.0/np.linalg.norm(g1n)
-        g1n *= one_over_small_b
-        if i>i0:
-          x += math.log(one_over_small_b)
         if debug:
           tab_log_trans[(i-i0)//nrescale] = -2.0*x
-        start_solution_time = timeit.default_timer()
-        An_old = lapack.dgetrs(b, piv, An_old.T, 1, 0)[0].T
-        timing.LYAPOUNOV_MATRIX_SOLUTION_TIME+=(timeit.default_timer() - start_solution_time)
-        An = np.identity(dim_y)
+        An[:] = identity
   x /= H.tab_delta[0]*((dim_x-i0-1)//nrescale)*nrescale
-  timing.LYAPOUNOV_MATRIX_FACTORIZATION_NOPS += 2*((dim_x-1)//nrescale)*dim_y**3/3
-  timing.LYAPOUNOV_MATRIX_SOLUTION_NOPS += 4*((dim_x-1)//nrescale)*dim_y**3
-  timing.LYAPOUNOV_SCALAR_NOPS += 4*dim_y*((dim_x-1)//nrescale) + 5*dim_y**2*((dim_x-1)//nrescale)*(nrescale-1) + dim_y**2*((dim_x-1)//nrescale)*nrescale
+  timing.LYAPOUNOV_MATRIX_FACTORIZATION_NOPS += number_of_energies*2*((dim_x-1)//nrescale)*dim_y**3/3
+  timing.LYAPOUNOV_MATRIX_SOLUTION_NOPS += number_of_energies*4*((dim_x-1)//nrescale)*dim_y**3
+  timing.LYAPOUNOV_SCALAR_NOPS += number_of_energies*(4*dim_y*((dim_x-1)//nrescale) + 5*dim_y**2*((dim_x-1)//nrescale)*(nrescale-1) + dim_y**2*((dim_x-1)//nrescale)*nrescale)
+  if np.ndim(energy)==0:
+    x = x[0]
+    if debug:
+      tab_log_trans = tab_log_trans[:,0]
   if debug:
     return x, tab_x, tab_log_trans
   else:
@@ -139,6 +230,9 @@ def core_lyapounov_2d(H, energy, i0, nrescale, timing, use_ctypes, debug=False):
 
 def core_lyapounov_3d(H, energy, i0, nrescale, timing, use_ctypes, debug=False):
 # Propagation is along the x direction
+# energy can be either a single energy or an array of energies, see core_lyapounov_2d
+  tab_energy = np.atleast_1d(np.asarray(energy,dtype=np.float64))
+  number_of_energies = tab_energy.size
   dim_x = H.tab_dim[0]
   dim_y = H.tab_dim[1]
   dim_z = H.tab_dim[2]
@@ -148,94 +242,168 @@ def core_lyapounov_3d(H, energy, i0, nrescale, timing, use_ctypes, debug=False):
   tunneling_y = H.tab_tunneling[1]
   tunneling_z = H.tab_tunneling[2]
   if debug:
-    tab_log_trans = np.zeros((dim_x-1-i0)//nrescale+1)
+    tab_log_trans = np.zeros(((dim_x-1-i0)//nrescale+1,number_of_energies))
     tab_x = H.tab_delta[0]*nrescale*np.arange((dim_x-1-i0)//nrescale+1)
 #  print('Disorder',H.disorder)
 #  print(H.disorder.dtype,H.disorder.shape,H.disorder.flags)
-  x = 0.0
-  g1n = np.identity(dim_trans)
-  An = np.identity(dim_trans)
-  An_old = np.zeros((dim_trans,dim_trans))
+  x = np.zeros(number_of_energies)
+  identity = np.identity(dim_trans)
+  g1n = np.empty((number_of_energies,dim_trans,dim_trans))
+  g1n[:] = identity
+  An = np.empty((number_of_energies,dim_trans,dim_trans))
+  An[:] = identity
+  An_old = np.zeros((number_of_energies,dim_trans,dim_trans))
   if use_ctypes:
-    import ctypes
-    import numpy.ctypeslib as ctl
-    lyapounov_ctypes_lib=ctypes.CDLL(anderson.__path__[0]+"/ctypes/lyapounov.so")
-    lyapounov_ctypes_lib.update_A_3d.argtypes = [ctypes.c_int, ctypes.c_int, ctl.ndpointer(flags='C'), ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_int, ctypes.c_int, ctl.ndpointer(flags='C'), ctl.ndpointer(flags='C')]
-    lyapounov_ctypes_lib.update_A_3d.restype = None
+    update_A_3d = kernels.get_kernel('lyapounov','update_A_3d')
   else:
-    e_minus_H_local_over_tx = scipy.sparse.dia_array((dim_trans,dim_trans))
-#    e_minus_H_local_over_tx.setdiag(0.0)
-    non_diagonal_element_y = -tunneling_y*inv_tunneling_x
-    non_diagonal_element_z = -tunneling_z*inv_tunneling_x
-    e_minus_H_local_over_tx.setdiag(non_diagonal_element_y,-dim_z)
-    e_minus_H_local_over_tx.setdiag(non_diagonal_element_y,dim_z)
-    e_minus_H_local_over_tx.setdiag(non_diagonal_element_y,-dim_z*(dim_y-1))
-    e_minus_H_local_over_tx.setdiag(non_diagonal_element_y,dim_z*(dim_y-1))
-    non_diagonal_vector = non_diagonal_element_z*np.ones(dim_z)
-    non_diagonal_vector[dim_z-1] = 0.0
-    non_diagonal_vector = np.tile(non_diagonal_vector,dim_y)
-#    print('non_diagonal_vector_1',non_diagonal_vector)
-    e_minus_H_local_over_tx.setdiag(non_diagonal_vector,1)
-    e_minus_H_local_over_tx.setdiag(non_diagonal_vector,-1)
-    non_diagonal_vector = np.zeros(dim_z)
-    non_diagonal_vector[0] = non_diagonal_element_z
-    non_diagonal_vector = np.tile(non_diagonal_vector,dim_y)
-#    print('non_diagonal_vector_2',non_diagonal_vector)
-    e_minus_H_local_over_tx.setdiag(non_diagonal_vector,dim_z-1)
-    e_minus_H_local_over_tx.setdiag(non_diagonal_vector,1-dim_z)
-#    print(e_minus_H_local_over_tx)
-    e_minus_H_local_over_tx_linear_operator= scipy.sparse.linalg.aslinearoperator(e_minus_H_local_over_tx)
+# The hopping part of -H_local/tunneling_x, identical for all energies
+    hopping_over_tx = transverse_hopping_over_tx(H)
+    dense_hopping_over_tx = hopping_over_tx.toarray()
+    hopping_over_tx_linear_operator= scipy.sparse.linalg.aslinearoperator(hopping_over_tx)
+    diagonal_indices = np.arange(dim_trans)
 # Here starts the main loop for propagation along the x direction
   for i in range(((dim_x-1)//nrescale)*nrescale+1):
     start_scalar_time = timeit.default_timer()
     if use_ctypes:
-      lyapounov_ctypes_lib.update_A_3d(dim_y,dim_z, H.disorder, tunneling_x, tunneling_y, tunneling_z, energy, nrescale, i, An, An_old)
+      for m in range(number_of_energies):
+        update_A_3d(dim_y,dim_z, H.disorder, tunneling_x, tunneling_y, tunneling_z, tab_energy[m], nrescale, i, An[m], An_old[m])
     else:
-      e_minus_H_local_over_tx.setdiag(inv_tunneling_x*(energy-H.disorder[i,:,:].reshape(dim_trans)))
+      e_minus_V_over_tx = inv_tunneling_x*(tab_energy[:,np.newaxis]-H.disorder[i,:,:].reshape(dim_trans))
       if i%nrescale==1:
-        An_old += e_minus_H_local_over_tx
-# The code in the previous line should be equivalent to the following 4 lines
-#         for j in range(dim_y):
-#           An_old[j,j] += inv_tunneling_x*(energy-H.disorder[i,j])
-#           An_old[j,(j+1)%dim_y] -= tunneling_y*inv_tunneling_x
-#           An_old[j,(j+dim_y-1)%dim_y] -= tunneling_y*inv_tunneling_x
+        An_old += dense_hopping_over_tx
+        An_old[:,diagonal_indices,diagonal_indices] += e_minus_V_over_tx
       else:
-        An_old += e_minus_H_local_over_tx_linear_operator.matmat(An)
-# The code in the previous line should be equivalent to the following 4 lines
-#        for j in range(dim_y):
-#          An_old[j,0:dim_y] += inv_tunneling_x*((energy-H.disorder[i,j])*An[j,0:dim_y] - tunneling_y*(An[(j+1)%dim_y,0:dim_y] + An[(j+dim_y-1)%dim_y,0:dim_y]))
+# The hopping is applied to the matrices for all energies in a single call, stacked side by side
+        An_old += hopping_over_tx_linear_operator.matmat(An.transpose(1,0,2).reshape(dim_trans,number_of_energies*dim_trans)).reshape(dim_trans,number_of_energies,dim_trans).transpose(1,0,2)
+        An_old += e_minus_V_over_tx[:,:,np.newaxis]*An
     An, An_old = An_old, -An
-#      print('False ener i=',i,energy-H.disorder[i,:])
-#      print('False Hamitonian i=',i,e_minus_H_local_over_tx)
-#      print('False i=',i,An,An_old)
     timing.LYAPOUNOV_SCALAR_TIME+=(timeit.default_timer() - start_scalar_time)
     if i%nrescale==0:
-      start_factorization_time = timeit.default_timer()
-      b, piv, info = lapack.dgetrf(An)
-      timing.LYAPOUNOV_MATRIX_FACTORIZATION_TIME+=(timeit.default_timer() - start_factorization_time)
+      for m in range(number_of_energies):
+        start_factorization_time = timeit.default_timer()
+        b, piv, info = lapack.dgetrf(An[m])
+        timing.LYAPOUNOV_MATRIX_FACTORIZATION_TIME+=(timeit.default_timer() - start_factorization_time)
+        if i>=i0:
+          start_solution_time = timeit.default_timer()
+          g1n[m], info = lapack.dgetrs(b, piv, g1n[m], 1, 0)
+          timing.LYAPOUNOV_MATRIX_SOLUTION_TIME+=(timeit.default_timer() - start_solution_time)
+          one_over_small_b = 1.0/np.linalg.norm(g1n[m])
+          g1n[m] *= one_over_small_b
+          if i>i0:
+            x[m] += math.log(one_over_small_b)
+          start_solution_time = timeit.default_timer()
+          An_old[m] = lapack.dgetrs(b, piv, An_old[m].T, 1, 0)[0].T
+          timing.LYAPOUNOV_MATRIX_SOLUTION_TIME+=(timeit.default_timer() - start_solution_time)
       if i>=i0:
-        start_solution_time = timeit.default_timer()
-        g1n, info = lapack.dgetrs(b, piv, g1n, 1, 0)
-        timing.LYAPOUNOV_MATRIX_SOLUTION_TIME+=(timeit.default_timer() - start_solution_time)
-        one_over_small_b = 1.0/np.linalg.norm(g1n)
-        g1n *= one_over_small_b
-        if i>i0:
-          x += math.log(one_over_small_b)
         if debug:
           tab_log_trans[(i-i0)//nrescale] = -2.0*x
-        start_solution_time = timeit.default_timer()
-        An_old = lapack.dgetrs(b, piv, An_old.T, 1, 0)[0].T
-        timing.LYAPOUNOV_MATRIX_SOLUTION_TIME+=(timeit.default_timer() - start_solution_time)
-        An = np.identity(dim_trans)
+        An[:] = identity
   x /= H.tab_delta[0]*((dim_x-i0-1)//nrescale)*nrescale
-  timing.LYAPOUNOV_MATRIX_FACTORIZATION_NOPS += 2*((dim_x-1)//nrescale)*dim_trans**3/3
-  timing.LYAPOUNOV_MATRIX_SOLUTION_NOPS += 4*((dim_x-1)//nrescale)*dim_trans**3
-  timing.LYAPOUNOV_SCALAR_NOPS += 4*dim_trans*((dim_x-1)//nrescale) + 5*dim_trans**2*((dim_x-1)//nrescale)*(nrescale-1) + dim_trans**2*((dim_x-1)//nrescale)*nrescale
+  timing.LYAPOUNOV_MATRIX_FACTORIZATION_NOPS += number_of_energies*2*((dim_x-1)//nrescale)*dim_trans**3/3
+  timing.LYAPOUNOV_MATRIX_SOLUTION_NOPS += number_of_energies*4*((dim_x-1)//nrescale)*dim_trans**3
+  timing.LYAPOUNOV_SCALAR_NOPS += number_of_energies*(4*dim_trans*((dim_x-1)//nrescale) + 5*dim_trans**2*((dim_x-1)//nrescale)*(nrescale-1) + dim_trans**2*((dim_x-1)//nrescale)*nrescale)
+  if np.ndim(energy)==0:
+    x = x[0]
+    if debug:
+      tab_log_trans = tab_log_trans[:,0]
   if debug:
     return x, tab_x, tab_log_trans
   else:
     return x
 
+def core_lyapounov_qr(H, energy, i0, nrescale, timing, use_ctypes, debug=False):
+# Transfer matrix method in dimension 2 or 3, propagation along the x direction
+# The block [psi_n ; -psi_{n-1}] of dim_trans vectors (dim_trans is the transverse size) is propagated
+# slice by slice, and orthonormalized every nrescale slices by a Householder QR decomposition.
+# The logarithms of the diagonal elements of R accumulate the dim_trans positive Lyapounov exponents.
+# There is no matrix inversion, so that the LU factorization/solutions of core_lyapounov_2d/3d are not needed.
+# Returns the smallest positive exponent (same quantity as core_lyapounov_2d/3d) and the full set of exponents,
+# sorted in decreasing order.
+# energy can be either a single energy or an array of energies, see core_lyapounov_2d
+  tab_energy = np.atleast_1d(np.asarray(energy,dtype=np.float64))
+  number_of_energies = tab_energy.size
+  dim_x = H.tab_dim[0]
+  tunneling_x = H.tab_tunneling[0]
+  inv_tunneling_x = 1.0/tunneling_x
+  if H.dimension==2:
+    dim_y = H.tab_dim[1]
+    dim_trans = dim_y
+    if dim_y==1:
+      tab_energy = tab_energy+4.0
+    tunneling_y = H.tab_tunneling[1]
+    if dim_y==2:
+      tunneling_y *= 0.5
+  else:
+    dim_y = H.tab_dim[1]
+    dim_z = H.tab_dim[2]
+    dim_trans = dim_y*dim_z
+    tunneling_y = H.tab_tunneling[1]
+    tunneling_z = H.tab_tunneling[2]
+  if debug:
+    tab_log_trans = np.zeros(((dim_x-1-i0)//nrescale+1,number_of_energies))
+    tab_x = H.tab_delta[0]*nrescale*np.arange((dim_x-1-i0)//nrescale+1)
+  tab_exponents = np.zeros((number_of_energies,dim_trans))
+  An = np.empty((number_of_energies,dim_trans,dim_trans))
+  An[:] = np.identity(dim_trans)
+  An_old = np.zeros((number_of_energies,dim_trans,dim_trans))
+  if use_ctypes:
+    update_A = kernels.get_kernel('lyapounov','update_A_'+str(H.dimension)+'d')
+  else:
+    hopping_over_tx_linear_operator = scipy.sparse.linalg.aslinearoperator(transverse_hopping_over_tx(H))
+# Optimal workspaces, so that LAPACK uses the blocked (BLAS-3) Householder algorithms
+  block = np.zeros((2*dim_trans,dim_trans))
+  lwork_geqrf = int(lapack.dgeqrf(block,lwork=-1)[2][0])
+  lwork_orgqr = int(lapack.dorgqr(block,np.zeros(dim_trans),lwork=-1)[1][0])
+# Here starts the main loop for propagation along the x direction
+  for i in range(((dim_x-1)//nrescale)*nrescale+1):
+    start_scalar_time = timeit.default_timer()
+    if use_ctypes:
+# The current slice is passed as a separate array, with (i,nrescale)=(0,2) selecting
+# the generic update An_old += (E-H_n)*An/tunneling_x in update_A_2d/3d
+      for m in range(number_of_energies):
+        if H.dimension==2:
+          update_A(dim_y, H.disorder[i], tunneling_x, tunneling_y, tab_energy[m], 2, 0, An[m], An_old[m])
+        else:
+          update_A(dim_y, dim_z, H.disorder[i], tunneling_x, tunneling_y, tunneling_z, tab_energy[m], 2, 0, An[m], An_old[m])
+    else:
+      e_minus_V_over_tx = inv_tunneling_x*(tab_energy[:,np.newaxis]-H.disorder[i].reshape(dim_trans))
+      An_old += hopping_over_tx_linear_operator.matmat(An.transpose(1,0,2).reshape(dim_trans,number_of_energies*dim_trans)).reshape(dim_trans,number_of_energies,dim_trans).transpose(1,0,2)
+      An_old += e_minus_V_over_tx[:,:,np.newaxis]*An
+    An, An_old = An_old, -An
+    timing.LYAPOUNOV_SCALAR_TIME+=(timeit.default_timer() - start_scalar_time)
+    if i%nrescale==0:
+      for m in range(number_of_energies):
+        start_factorization_time = timeit.default_timer()
+        block[:dim_trans] = An[m]
+        block[dim_trans:] = An_old[m]
+        qr, tau, work, info = lapack.dgeqrf(block, lwork=lwork_geqrf, overwrite_a=1)
+        timing.LYAPOUNOV_MATRIX_FACTORIZATION_TIME+=(timeit.default_timer() - start_factorization_time)
+        if i>i0:
+          tab_exponents[m] += np.log(np.abs(np.diagonal(qr)))
+        start_solution_time = timeit.default_timer()
+        q, work, info = lapack.dorgqr(qr, tau, lwork=lwork_orgqr, overwrite_a=1)
+        timing.LYAPOUNOV_MATRIX_SOLUTION_TIME+=(timeit.default_timer() - start_solution_time)
+        An[m] = q[:dim_trans]
+        An_old[m] = q[dim_trans:]
+      if debug and i>=i0:
+# The smallest exponent governs the transmission
+        tab_log_trans[(i-i0)//nrescale] = -2.0*np.min(tab_exponents,axis=1)
+  tab_exponents /= H.tab_delta[0]*((dim_x-i0-1)//nrescale)*nrescale
+  tab_exponents = -np.sort(-tab_exponents,axis=1)
+  x = tab_exponents[:,-1]
+  timing.LYAPOUNOV_MATRIX_FACTORIZATION_NOPS += number_of_energies*(10*((dim_x-1)//nrescale+1)*dim_trans**3)/3
+  timing.LYAPOUNOV_MATRIX_SOLUTION_NOPS += number_of_energies*(10*((dim_x-1)//nrescale+1)*dim_trans**3)/3
+  timing.LYAPOUNOV_SCALAR_NOPS += number_of_energies*5*dim_trans**2*(((dim_x-1)//nrescale)*nrescale+1)
+  if np.ndim(energy)==0:
+    x = x[0]
+    tab_exponents = tab_exponents[0]
+    if debug:
+      tab_log_trans = tab_log_trans[:,0]
+  if debug:
+    return x, tab_exponents, tab_x, tab_log_trans
+  else:
+    return x, tab_exponents
+
 def core_lyapounov_non_diagonal_disorder(dim_x, loop_step, disorder, b, non_diagonal_disorder, energy, tunneling):
   if b==1:
 #    psi_temp = np.zeros(loop_step+2)
@@ -278,24 +446,58 @@ def core_lyapounov_non_diagonal_disorder(dim_x, loop_step, disorder, b, non_diag
       psi_temp[0:2*b]=psi_temp[loop_step:loop_step+2*b]/psi_temp[2*b+jmax-i-1]
   return gamma
 
+# Same as core_lyapounov_non_diagonal_disorder (b=1 only), but for several disorder realizations simultaneously
+# disorder is an interleaved (dim_x,batch_size) array, non_diagonal_disorder an interleaved (dim_x+1,batch_size) array
+@numba_decorator
+def core_lyapounov_non_diagonal_disorder_batched(dim_x, loop_step, disorder, non_diagonal_disorder, energy, tunneling):
+  batch_size = disorder.shape[1]
+  psi_cur = np.ones(batch_size)
+  psi_old = np.full(batch_size,math.pi/math.sqrt(13.0))
+  tab_gamma = np.zeros(batch_size)
+  for i in range(0, dim_x, loop_step):
+    jmax=min(i+loop_step,dim_x)
+    for j in range(i,jmax):
+      for k in range(batch_size):
+        psi_new = (psi_cur[k]*(disorder[j,k]-energy)+psi_old[k]*(non_diagonal_disorder[j,k]-tunneling))/(tunneling-non_diagonal_disorder[j+1,k])
+        psi_old[k] = psi_cur[k]
+        psi_cur[k] = psi_new
+    for k in range(batch_size):
+      tab_gamma[k] += math.log(abs(psi_cur[k]))
+      psi_old[k] /= psi_cur[k]
+      psi_cur[k] = 1.0
+  return tab_gamma
+
 class Lyapounov:
-  def __init__(self, energy, want_ctypes=True, i0=10, nrescale=10):
+  def __init__(self, energy, want_ctypes=True, i0=10, nrescale=10, e_min=None, e_max=None, number_of_e_steps=0, method='green', batch_size=1):
     self.energy = energy
     self.want_ctypes = want_ctypes
     self.use_ctypes = want_ctypes
     self.i0 = i0
     self.nrescale = nrescale
-#    self.tab_energy = np.zeros(number_of_e_steps+1)
-#    if number_of_e_steps==0:
-#      self.e_step = 0.0
-#    else:
-#      self.e_step = (e_max - e_min)/number_of_e_steps
-#    for i_e in range(number_of_e_steps+1):
-#      e = e_min + self.e_step*i_e
-#      self.tab_energy[i_e] = e
+# In dimension 2 and 3, method is either 'green' (recursive computation of the Green function, smallest exponent only)
+# or 'qr' (QR-stabilized transfer matrix, all positive exponents, stored in self.tab_exponents after each call)
+    self.method = method
+    self.tab_exponents = None
+# In dimension 1, batch_size disorder realizations are processed together by compute_lyapounov_batched
+    self.batch_size = batch_size
+# If number_of_e_steps>0, the Lyapounov exponent is computed for number_of_e_steps+1 energies
+# regularly spaced in [e_min,e_max], all on the same disorder configuration
+# Otherwise, only for energy
+    self.number_of_e_steps = number_of_e_steps
+    self.multi_energy = number_of_e_steps>0
+    if self.multi_energy:
+      self.e_min = e_min
+      self.e_max = e_max
+      self.e_step = (e_max - e_min)/number_of_e_steps
+      self.tab_energy = e_min + self.e_step*np.arange(number_of_e_steps+1)
+    else:
+      self.e_min = energy
+      self.e_max = energy
+      self.e_step = 0.0
+      self.tab_energy = np.array([energy],dtype=np.float64)
     return
 
-  def compute_lyapounov(self, i_seed, H, timing, debug=False):
+  def compute_lyapounov(self, i_seed, H, timing, debug=False, build_disorder=True):
     """
     try:
       from anderson._lyapounov import ffi,lib
@@ -307,7 +509,9 @@ class Lyapounov:
     """
     start_lyapounov_time = timeit.default_timer()
 
-    H.generate_disorder(seed=i_seed+1234)
+# If build_disorder is False, the disorder configuration already in H is used (e.g. in a sweep over disorder strengths)
+    if build_disorder:
+      H.generate_disorder(seed=i_seed+1234)
 #    np.random.seed(i_seed+1234)
 #    psi_cur=np.random.standard_normal(1)
 #    psi_old=np.random.standard_normal(1)
@@ -316,45 +520,27 @@ class Lyapounov:
     tunneling = H.tab_tunneling[0]
     inv_tunneling = 1.0/H.tab_tunneling[0]
 #    print(tunneling)
+# The C routines are obtained from the kernel registry, which loads the library and declares the prototypes only once per process
+    self.use_ctypes = False
+    lyapounov_kernel = None
     if self.want_ctypes:
-      try:
-        import ctypes
-        import numpy.ctypeslib as ctl
-        lyapounov_ctypes_lib=ctypes.CDLL(anderson.__path__[0]+"/ctypes/lyapounov.so")
-#        print(lyapounov_ctypes_lib)
-        if H.dimension == 1:
-          if H.disorder_type=='nice':
-            self.use_ctypes =hasattr(lyapounov_ctypes_lib,'core_lyapounov_non_diagonal_disorder')
-            if self.use_ctypes:
-              lyapounov_ctypes_lib.core_lyapounov_non_diagonal_disorder.argtypes = [ctypes.c_int, ctypes.c_int, ctl.ndpointer(np.float64), ctypes.c_int, ctl.ndpointer(np.float64), ctypes.c_double, ctypes.c_double]
-              lyapounov_ctypes_lib.core_lyapounov_non_diagonal_disorder.restype = ctypes.c_double
-          else:
-            self.use_ctypes =hasattr(lyapounov_ctypes_lib,'core_lyapounov')
-            if self.use_ctypes:
-              lyapounov_ctypes_lib.core_lyapounov.argtypes = [ctypes.c_int, ctypes.c_int, ctl.ndpointer(np.float64), ctypes.c_double, ctypes.c_double]
-              lyapounov_ctypes_lib.core_lyapounov.restype = ctypes.c_double
-          if self.use_ctypes == False:
-            lyapounov_ctypes_lib = None
-            if H.seed == 1234:
-              print("\nWarning, lyapounov C library found, but without routine core_lyapounov or core_lyapounov_non_diagonal_disorder, this uses the slow Python version!\n")
-        if H.dimension ==2:
-          self.use_ctypes =hasattr(lyapounov_ctypes_lib,'update_A_2d')
-          if not(self.use_ctypes):
-            if H.seed == 1234:
-              print("\nWarning, lyapounov C library found, but without routine update_A_2d, this uses the slow Python version!\n")
-        if H.dimension ==3:
-          self.use_ctypes =hasattr(lyapounov_ctypes_lib,'update_A_3d')
-          if not(self.use_ctypes):
-            if H.seed == 1234:
-              print("\nWarning, lyapounov C library found, but without routine update_A_3d, this uses the slow Python version!\n")
-      except:
-        self.use_ctypes = False
-        lyapounov_ctypes_lib = None
+      if kernels.get_library('lyapounov') is None:
         if H.seed == 1234:
           print("\nWarning, no lyapounov C library found, this uses the slow Python version!\n")
-    else:
-      self.use_ctypes = False
-      lyapounov_ctypes_lib = None
+      elif H.dimension == 1:
+        if H.disorder_type=='nice':
+          lyapounov_kernel = kernels.get_kernel('lyapounov','core_lyapounov_non_diagonal_disorder')
+        elif self.multi_energy:
+          lyapounov_kernel = kernels.get_kernel('lyapounov','core_lyapounov_multi_energy')
+        else:
+          lyapounov_kernel = kernels.get_kernel('lyapounov','core_lyapounov')
+        self.use_ctypes = lyapounov_kernel is not None
+        if not self.use_ctypes and H.seed == 1234:
+          print("\nWarning, lyapounov C library found, but without routine core_lyapounov, core_lyapounov_multi_energy or core_lyapounov_non_diagonal_disorder, this uses the slow Python version!\n")
+      else:
+        self.use_ctypes = kernels.get_kernel('lyapounov','update_A_'+str(H.dimension)+'d') is not None
+        if not self.use_ctypes and H.seed == 1234:
+          print("\nWarning, lyapounov C library found, but without routine update_A_"+str(H.dimension)+"d, this uses the slow Python version!\n")
 
     start_lyapounov_time = timeit.default_timer()
     """
@@ -371,53 +557,51 @@ class Lyapounov:
       if r<0.0: h+=1.0
     """
 
-    """
     loop_step=16
+# In multi-energy mode, all energies in self.tab_energy are computed on the same disorder configuration
+# and gamma is an array. Otherwise, gamma is a scalar for the single energy self.energy
+    if self.multi_energy:
+      energy = self.tab_energy
+    else:
+      energy = self.energy
     number_of_energies = self.tab_energy.size
-    tab_gamma = np.zeros(number_of_energies)
-  #  tab_h = np.zeros(number_of_energies)
-    for i_energy in range(number_of_energies):
-      if H.dimension == 1:
-        if self.use_ctypes:
-          if H.disorder_type=='nice':
-            tab_gamma[i_energy] = lyapounov_ctypes_lib.core_lyapounov_non_diagonal_disorder(dim_x, loop_step, H.disorder, H.b, H.non_diagonal_disorder, self.tab_energy[i_energy], tunneling)
+    if H.dimension == 1:
+      if H.disorder_type=='nice':
+# No vectorized version for non-diagonal disorder, simply loop over energies
+        gamma = np.zeros(number_of_energies)
+        for i_energy in range(number_of_energies):
+          if self.use_ctypes:
+            gamma[i_energy] = lyapounov_kernel(dim_x, loop_step, H.disorder, H.b, H.non_diagonal_disorder, self.tab_energy[i_energy], tunneling)
           else:
-            tab_gamma[i_energy] = lyapounov_ctypes_lib.core_lyapounov(dim_x, loop_step, H.disorder, self.tab_energy[i_energy], inv_tunneling)
-        else:
-          if H.disorder_type=='nice':
-            tab_gamma[i_energy] = core_lyapounov_non_diagonal_disorder(dim_x, loop_step, H.disorder, H.b, H.non_diagonal_disorder, self.tab_energy[i_energy], tunneling)
-      if H.dimension == 2:
-        if debug:
-          tab_gamma[i_energy], tab_x, tab_log_trans = core_lyapounov_2d(H, self.tab_energy[i_energy], self.i0, self.nrescale, timing, self.use_ctypes, debug=True)
-        else:
-          tab_gamma[i_energy] = core_lyapounov_2d(H, self.tab_energy[i_energy], self.i0, self.nrescale, timing, self.use_ctypes)
-      if H.dimension == 3:
-        if debug:
-          tab_gamma[i_energy], tab_x, tab_log_trans = core_lyapounov_3d(H, self.tab_energy[i_energy], self.i0, self.nrescale, timing, self.use_ctypes, debug=True)
+            gamma[i_energy] = core_lyapounov_non_diagonal_disorder(dim_x, loop_step, H.disorder, H.b, H.non_diagonal_disorder, self.tab_energy[i_energy], tunneling)
+        if not self.multi_energy:
+          gamma = gamma[0]
+      elif self.multi_energy:
+        if self.use_ctypes:
+          gamma = np.zeros(number_of_energies)
+          lyapounov_kernel(dim_x, loop_step, H.disorder, number_of_energies, self.tab_energy, inv_tunneling, gamma)
         else:
-          tab_gamma[i_energy] = core_lyapounov_3d(H, self.tab_energy[i_energy], self.i0, self.nrescale, timing, self.use_ctypes)
-    """
-
-    loop_step=16
-    if H.dimension == 1:
-      if self.use_ctypes:
-        if H.disorder_type=='nice':
-          gamma= lyapounov_ctypes_lib.core_lyapounov_non_diagonal_disorder(dim_x, loop_step, H.disorder, H.b, H.non_diagonal_disorder, self.energy, tunneling)
+          gamma = core_lyapounov_multi_energy(dim_x, loop_step, H.disorder, self.tab_energy, inv_tunneling)
+      else:
+        if self.use_ctypes:
+          gamma = lyapounov_kernel(dim_x, loop_step, H.disorder, self.energy, inv_tunneling)
         else:
-          gamma = lyapounov_ctypes_lib.core_lyapounov(dim_x, loop_step, H.disorder, self.energy, inv_tunneling)
+          gamma = core_lyapounov(dim_x, loop_step, H.disorder, self.energy, inv_tunneling)
+    if H.dimension>1 and self.method=='qr':
+      if debug:
+        gamma, self.tab_exponents, tab_x, tab_log_trans = core_lyapounov_qr(H, energy, self.i0, self.nrescale, timing, self.use_ctypes, debug=True)
       else:
-        if H.disorder_type=='nice':
-          gamma = core_lyapounov_non_diagonal_disorder(dim_x, loop_step, H.disorder, H.b, H.non_diagonal_disorder, self.energy, tunneling)
-    if H.dimension == 2:
+        gamma, self.tab_exponents = core_lyapounov_qr(H, energy, self.i0, self.nrescale, timing, self.use_ctypes)
+    elif H.dimension == 2:
       if debug:
-        gamma, tab_x, tab_log_trans = core_lyapounov_2d(H, self.energy, self.i0, self.nrescale, timing, self.use_ctypes, debug=True)
+        gamma, tab_x, tab_log_trans = core_lyapounov_2d(H, energy, self.i0, self.nrescale, timing, self.use_ctypes, debug=True)
       else:
-        gamma = core_lyapounov_2d(H, self.energy, self.i0, self.nrescale, timing, self.use_ctypes)
-    if H.dimension == 3:
+        gamma = core_lyapounov_2d(H, energy, self.i0, self.nrescale, timing, self.use_ctypes)
+    elif H.dimension == 3:
       if debug:
-        gamma, tab_x, tab_log_trans = core_lyapounov_3d(H, self.energy, self.i0, self.nrescale, timing, self.use_ctypes, debug=True)
+        gamma, tab_x, tab_log_trans = core_lyapounov_3d(H, energy, self.i0, self.nrescale, timing, self.use_ctypes, debug=True)
       else:
-        gamma = core_lyapounov_3d(H, self.energy, self.i0, self.nrescale, timing, self.use_ctypes)
+        gamma = core_lyapounov_3d(H, energy, self.i0, self.nrescale, timing, self.use_ctypes)
 
 #    print(2.0*new_core_lyapounov(H, 0.0)/(dim_x*H.tab_delta[0]))
 
@@ -425,9 +609,9 @@ class Lyapounov:
     timing.LYAPOUNOV_TIME += timeit.default_timer() - start_lyapounov_time
     if H.dimension==1:
       if H.disorder_type=='nice':
-        timing.LYAPOUNOV_NOPS += 10*dim_x
+        timing.LYAPOUNOV_NOPS += 10*dim_x*number_of_energies
       else:
-        timing.LYAPOUNOV_NOPS += 5*dim_x
+        timing.LYAPOUNOV_NOPS += 5*dim_x*number_of_energies
     if H.dimension==2:
       timing.LYAPOUNOV_NOPS += timing.LYAPOUNOV_MATRIX_FACTORIZATION_NOPS+timing.LYAPOUNOV_MATRIX_SOLUTION_NOPS+timing.LYAPOUNOV_SCALAR_NOPS
   #  lyapounov = gamma/(dim_x*H.delta_x)
@@ -443,6 +627,80 @@ class Lyapounov:
       else:
         return gamma
 
+  def compute_lyapounov_batched(self, tab_i_seed, H, timing, tab_disorder_strength=None):
+# Same as compute_lyapounov, for several disorder realizations (one per element of tab_i_seed), in dimension 1 only
+# The disorder realizations are generated by H.generate_disorder_batched, in interleaved arrays
+# (the realization index is the fastest one), and processed together by a vectorized kernel
+# Returns an array of shape (len(tab_i_seed),) or (len(tab_i_seed),number of energies) in multi-energy mode
+# If tab_disorder_strength is given, the same configurations are used for all disorder strengths in it
+# and the returned array has an additional first axis, one entry per disorder strength
+# The non-diagonal disorder with b>1 and higher dimensions simply fall back to a loop over compute_lyapounov
+    nice = H.disorder_type=='nice'
+    if H.dimension>1 or (nice and H.b>1):
+      if tab_disorder_strength is None:
+        return np.array([self.compute_lyapounov(i_seed, H, timing) for i_seed in tab_i_seed])
+      tab_lyapounov = []
+      for i_seed in tab_i_seed:
+        H.generate_normalized_disorder(i_seed+1234)
+        tab_lyapounov_one_seed = []
+        for disorder_strength in tab_disorder_strength:
+          H.set_disorder_strength(disorder_strength)
+          tab_lyapounov_one_seed.append(self.compute_lyapounov(i_seed, H, timing, build_disorder=False))
+        tab_lyapounov.append(tab_lyapounov_one_seed)
+      return np.swapaxes(np.array(tab_lyapounov),0,1)
+    batch_size = len(tab_i_seed)
+    dim_x = H.tab_dim[0]
+    if tab_disorder_strength is None:
+      disorder, non_diagonal_disorder = H.generate_disorder_batched([i_seed+1234 for i_seed in tab_i_seed])
+    else:
+      normalized_disorder, non_diagonal_disorder = H.generate_disorder_batched([i_seed+1234 for i_seed in tab_i_seed],normalized=True)
+    start_lyapounov_time = timeit.default_timer()
+    if nice:
+      kernel_name = 'core_lyapounov_non_diagonal_disorder_batched'
+    else:
+      kernel_name = 'core_lyapounov_batched'
+    lyapounov_kernel = None
+    if self.want_ctypes:
+      lyapounov_kernel = kernels.get_kernel('lyapounov',kernel_name)
+      if lyapounov_kernel is None and tab_i_seed[0]==0:
+        print("\nWarning, no lyapounov C library found or no routine "+kernel_name+" in it, this uses the slow Python version!\n")
+    self.use_ctypes = lyapounov_kernel is not None
+    loop_step = 16
+    tunneling = H.tab_tunneling[0]
+    inv_tunneling = 1.0/tunneling
+    number_of_energies = self.tab_energy.size
+    if tab_disorder_strength is None:
+      number_of_disorder_strengths = 1
+    else:
+      number_of_disorder_strengths = len(tab_disorder_strength)
+    gamma = np.zeros((number_of_disorder_strengths,batch_size,number_of_energies))
+    tab_gamma = np.zeros(batch_size)
+    for i_strength in range(number_of_disorder_strengths):
+      if tab_disorder_strength is not None:
+        disorder = np.add(tab_disorder_strength[i_strength]*normalized_disorder,H.diagonal,order='C')
+      for i_energy in range(number_of_energies):
+        if nice:
+          if self.use_ctypes:
+            lyapounov_kernel(dim_x, loop_step, batch_size, disorder, non_diagonal_disorder, self.tab_energy[i_energy], tunneling, tab_gamma)
+          else:
+            tab_gamma = core_lyapounov_non_diagonal_disorder_batched(dim_x, loop_step, disorder, non_diagonal_disorder, self.tab_energy[i_energy], tunneling)
+        else:
+          if self.use_ctypes:
+            lyapounov_kernel(dim_x, loop_step, batch_size, disorder, self.tab_energy[i_energy], inv_tunneling, tab_gamma)
+          else:
+            tab_gamma = core_lyapounov_batched(dim_x, loop_step, disorder, self.tab_energy[i_energy], inv_tunneling)
+        gamma[i_strength,:,i_energy] = tab_gamma
+    timing.LYAPOUNOV_TIME += timeit.default_timer() - start_lyapounov_time
+    if nice:
+      timing.LYAPOUNOV_NOPS += 10*dim_x*number_of_energies*batch_size*number_of_disorder_strengths
+    else:
+      timing.LYAPOUNOV_NOPS += 5*dim_x*number_of_energies*batch_size*number_of_disorder_strengths
+    if not self.multi_energy:
+      gamma = gamma[:,:,0]
+    if tab_disorder_strength is None:
+      gamma = gamma[0]
+    return 0.5*gamma/(dim_x*H.tab_delta[0])
+
 """
 Old stuff
 def core_lyapounov_2d(dim_x, dim_y, disorder, energy, nrescale, i0, timing):
@@ -11,12 +11,45 @@ import timeit
 import copy
 from anderson.geometry import Geometry
 
+# Arrays larger than this size (in bytes) are reduced in place on their own, smaller ones are packed together
+mpi_packing_threshold = 1<<20
+
+def mpi_reduce_arrays(comm, list_of_arrays):
+# Sums the arrays over all MPI processes, the result being available on process 0
+# Small arrays are packed in a single contiguous buffer per data type, so that all of them are
+# reduced with a single collective operation. Large arrays are reduced in place, without any copy.
+# Returns the list of reduced arrays (on the other processes, they contain the local contributions)
+  from mpi4py import MPI
+  list_of_arrays = [np.ascontiguousarray(x) for x in list_of_arrays]
+  list_of_buffers = []
+  dict_of_packed = {}
+  for k,x in enumerate(list_of_arrays):
+    if x.nbytes>mpi_packing_threshold:
+      list_of_buffers.append(x)
+    else:
+      dict_of_packed.setdefault(x.dtype,[]).append(k)
+  for list_of_k in dict_of_packed.values():
+    buffer = np.concatenate([list_of_arrays[k].ravel() for k in list_of_k])
+    offset = 0
+    for k in list_of_k:
+      size = list_of_arrays[k].size
+      list_of_arrays[k] = buffer[offset:offset+size].reshape(list_of_arrays[k].shape)
+      offset += size
+    list_of_buffers.append(buffer)
+  for buffer in list_of_buffers:
+    if comm.Get_rank()==0:
+      send_buffer, receive_buffer = MPI.IN_PLACE, buffer
+    else:
+      send_buffer, receive_buffer = buffer, None
+    comm.Reduce(send_buffer,receive_buffer,op=MPI.SUM,root=0)
+  return list_of_arrays
+
 class Measurement(Geometry):
   def __init__(self, geometry, delta_t_dispersion, delta_t_density, delta_t_spectral_function, teta_measurement=0.0,\
                measure_potential=False, measure_potential_correlation=False, measure_density=False, measure_density_momentum=False, measure_autocorrelation=False,\
                measure_dispersion_position=False, measure_dispersion_position2=False,\
                measure_dispersion_momentum=False, measure_dispersion_energy=False,measure_wavefunction=False, measure_wavefunction_momentum=False,\
-               measure_extended=False, measure_g1=False, measure_overlap=False, measure_spectral_function=False, use_mkl_fft=True, remove_hot_pixel=False):
+               measure_extended=False, measure_g1=False, measure_overlap=False, measure_spectral_function=False, use_mkl_fft=True, remove_hot_pixel=False, output_format='text'):
     super().__init__(geometry.dimension,geometry.tab_dim,geometry.tab_delta, spin_one_half=geometry.spin_one_half)
     self.delta_t_dispersion = delta_t_dispersion
     self.delta_t_density = delta_t_density
@@ -45,6 +78,15 @@ class Measurement(Geometry):
     self.measure_spectral_function = measure_spectral_function
     self.use_mkl_fft = use_mkl_fft
     self.remove_hot_pixel = remove_hot_pixel
+# Binary output stores all intermediate times of an observable in a single file
+# If h5py is not available, fallback to compressed Numpy archives
+    self.output_format = output_format
+    if self.output_format=='hdf5':
+      try:
+        import h5py
+      except ImportError:
+        self.output_format='npz'
+        print('No h5py found; Fallback to npz output')
     return
 
   def prepare_measurement(self,propagation,spectral_function=None, global_measurement=False):
@@ -266,100 +308,70 @@ class Measurement(Geometry):
       self.tab_spectrum += measurement.tab_spectrum
     return
 
-  def mpi_merge_measurement(self,comm,timing):
-    start_mpi_time = timeit.default_timer()
-    try:
-      from mpi4py import MPI
-    except ImportError:
-      print("mpi4py is not found!")
-      return
+# Names of the arrays accumulated by merge_measurement, used for checkpointing
+  def list_of_accumulators(self):
+    list_of_names = []
     if self.measure_potential:
-      toto = np.empty_like(self.potential)
-      comm.Reduce(self.potential,toto)
-      self.potential = np.copy(toto)
+      list_of_names.append('potential')
     if self.measure_potential_correlation:
-      toto = np.empty_like(self.potential_correlation)
-      comm.Reduce(self.potential_correlation,toto)
-      self.potential_correlation = np.copy(toto)
+      list_of_names.append('potential_correlation')
     if self.measure_density:
-#      toto = np.empty_like(self.density_final)
-#      comm.Reduce(self.density_final,toto)
-#      self.density_final = np.copy(toto)
-      toto = np.empty_like(self.density_intermediate)
-      comm.Reduce(self.density_intermediate,toto)
-      self.density_intermediate = np.copy(toto)
+      list_of_names.append('density_intermediate')
       if self.spin_one_half:
-        toto = np.empty_like(self.density_intermediate2)
-        comm.Reduce(self.density_intermediate2,toto)
-        self.density_intermediate2 = np.copy(toto)
+        list_of_names.append('density_intermediate2')
     if self.measure_density_momentum:
-#      toto = np.empty_like(self.density_momentum_final)
-#      comm.Reduce(self.density_momentum_final,toto)
-#      self.density_momentum_final = np.copy(toto)
-      toto = np.empty_like(self.density_momentum_intermediate)
-      comm.Reduce(self.density_momentum_intermediate,toto)
-      self.density_momentum_intermediate = np.copy(toto)
+      list_of_names.append('density_momentum_intermediate')
       if self.spin_one_half:
-        toto = np.empty_like(self.density_momentum_intermediate2)
-        comm.Reduce(self.density_momentum_intermediate2,toto)
-        self.density_momentum_intermediate2 = np.copy(toto)
+        list_of_names.append('density_momentum_intermediate2')
     if self.measure_autocorrelation:
-      toto = np.empty_like(self.tab_autocorrelation)
-      comm.Reduce(self.tab_autocorrelation,toto)
-      self.tab_autocorrelation = np.copy(toto)
+      list_of_names.append('tab_autocorrelation')
     if self.measure_dispersion_position:
-      toto = np.empty_like(self.tab_position)
-      comm.Reduce(self.tab_position,toto)
-      self.tab_position = np.copy(toto)
+      list_of_names.append('tab_position')
       if self.spin_one_half:
-        toto = np.empty_like(self.tab_position_2)
-        comm.Reduce(self.tab_position_2,toto)
-        self.tab_position_2 = np.copy(toto)
+        list_of_names.append('tab_position_2')
     if self.measure_dispersion_position2:
-      toto = np.empty_like(self.tab_position2)
-      comm.Reduce(self.tab_position2,toto)
-      self.tab_position2 =  np.copy(toto)
+      list_of_names.append('tab_position2')
       if self.spin_one_half:
-        toto = np.empty_like(self.tab_position2_2)
-        comm.Reduce(self.tab_position2_2,toto)
-        self.tab_position2_2 = np.copy(toto)
+        list_of_names.append('tab_position2_2')
     if self.measure_dispersion_momentum:
-      toto = np.empty_like(self.tab_momentum)
-      comm.Reduce(self.tab_momentum,toto)
-      self.tab_momentum = np.copy(toto)
+      list_of_names.append('tab_momentum')
       if self.spin_one_half:
-        toto = np.empty_like(self.tab_momentum_2)
-        comm.Reduce(self.tab_momentum_2,toto)
-        self.tab_momentum_2 = np.copy(toto)
+        list_of_names.append('tab_momentum_2')
     if self.measure_dispersion_energy:
-      toto = np.empty_like(self.tab_energy)
-      comm.Reduce(self.tab_energy,toto)
-      self.tab_energy =  np.copy(toto)
-      comm.Reduce(self.tab_nonlinear_energy,toto)
-      self.tab_nonlinear_energy = np.copy(toto)
+      list_of_names += ['tab_energy','tab_nonlinear_energy']
     if self.measure_wavefunction:
-      toto = np.empty_like(self.wfc)
-      comm.Reduce(self.wfc,toto)
-      self.wfc = np.copy(toto)
+      list_of_names.append('wfc')
     if self.measure_wavefunction_momentum:
-      toto = np.empty_like(self.wfc_momentum)
-      comm.Reduce(self.wfc_momentum,toto)
-      self.wfc_momentum = np.copy(toto)
+      list_of_names.append('wfc_momentum')
     if self.measure_g1:
-      toto = np.empty_like(self.g1)
-      comm.Reduce(self.g1,toto)
-      self.g1 = np.copy(toto)
-      toto = np.empty_like(self.g1_intermediate)
-      comm.Reduce(self.g1_intermediate,toto)
-      self.g1_intermediate = np.copy(toto)
+      list_of_names += ['g1','g1_intermediate']
     if self.measure_overlap:
-      toto = np.zeros(1,dtype=np.complex128)
-      comm.Reduce(self.overlap,toto)
-      self.overlap = toto[0]
+      list_of_names.append('overlap')
     if self.measure_spectral_function:
-      toto = np.empty_like(self.tab_spectrum)
-      comm.Reduce(self.tab_spectrum,toto)
-      self.tab_spectrum = np.copy(toto)
+      list_of_names.append('tab_spectrum')
+    return list_of_names
+
+  def get_accumulators(self):
+    return {name:np.asarray(getattr(self,name)) for name in self.list_of_accumulators()}
+
+  def set_accumulators(self,accumulators):
+    for name in self.list_of_accumulators():
+      if name=='overlap':
+        self.overlap = accumulators[name][()]
+      else:
+        setattr(self,name,np.copy(accumulators[name]))
+    return
+
+  def mpi_merge_measurement(self,comm,timing):
+# Sums all accumulators over the MPI processes, the result being available on process 0
+    start_mpi_time = timeit.default_timer()
+    list_of_names = self.list_of_accumulators()
+    list_of_arrays = mpi_reduce_arrays(comm,[np.asarray(getattr(self,name)) for name in list_of_names])
+    for name,array in zip(list_of_names,list_of_arrays):
+      if name=='overlap':
+        self.overlap = array[()]
+      else:
+        setattr(self,name,array)
     timing.MPI_TIME+=(timeit.default_timer() - start_mpi_time)
     return
 
@@ -10,10 +10,13 @@ import math
 import numpy as np
 from scipy.integrate import ode
 import scipy.special as sp
+import scipy.fft
 import timeit
 import anderson
 import copy
 import sys
+import os
+import hashlib
 
 def numba_decorator(x):
   try:
@@ -25,9 +28,10 @@ def numba_decorator(x):
   pass
 
 from anderson.wavefunction import Wavefunction
+from anderson import kernels
 
 class Temporal_Propagation:
-  def __init__(self, t_max, delta_t, method='che', accuracy=1.e-6, accurate_bounds=False, data_layout='real', want_ctypes=True, H=None):
+  def __init__(self, t_max, delta_t, method='che', accuracy=1.e-6, accurate_bounds=False, data_layout='real', want_ctypes=True, H=None, batch_size=1, number_of_threads=1):
     self.t_max = t_max
     self.method = method
     self.want_ctypes = want_ctypes
@@ -38,38 +42,18 @@ class Temporal_Propagation:
     self.accuracy = accuracy
     self.accurate_bounds = accurate_bounds
 # Is there a full specific Chebyshev implementation?
+# The C routines are obtained from the kernel registry, which loads the library only once per process
     self.has_specific_full_chebyshev_routine = False
+    self.chebyshev_kernel = None
     if not H.spin_one_half and self.want_ctypes:
-      try:
-        import ctypes
-        import numpy.ctypeslib as ctl
-        self.has_specific_full_chebyshev_routine = True
-        self.chebyshev_ctypes_lib=ctypes.CDLL(anderson.__path__[0]+"/ctypes/chebyshev.so")
-        if self.data_layout=='real':
-          self.chebyshev_ctypes_lib.chebyshev_real.argtypes = [ctypes.c_int, ctl.ndpointer(np.intc), ctypes.c_int, ctl.ndpointer(np.intc),\
-            ctl.ndpointer(np.float64), ctl.ndpointer(np.float64), ctl.ndpointer(np.float64), ctl.ndpointer(np.float64), ctl.ndpointer(np.float64), ctl.ndpointer(np.float64),\
-            ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double]
-          self.chebyshev_ctypes_lib.chebyshev_real.restype = ctypes.c_double
-          if not (hasattr(self.chebyshev_ctypes_lib,'chebyshev_real') and    hasattr(self.chebyshev_ctypes_lib,'elementary_clenshaw_step_real_'+str(H.dimension)+'d')):
-            self.has_specific_full_chebyshev_routine = False
-            self.chebyshev_ctypes_lib = None
-            if H.seed == 0 :
-              print("\nWarning, chebyshev C library found, but without routine for real data layout and dimension "+str(H.dimension)+", this uses the slow Python version\n")
-        if self.data_layout=='complex':
-          self.chebyshev_ctypes_lib.chebyshev_complex.argtypes = [ctypes.c_int, ctl.ndpointer(np.intc), ctypes.c_int, ctl.ndpointer(np.intc),\
-            ctl.ndpointer(np.complex128), ctl.ndpointer(np.complex128), ctl.ndpointer(np.complex128), ctl.ndpointer(np.float64), ctl.ndpointer(np.float64), ctl.ndpointer(np.float64),\
-            ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double]
-          self.chebyshev_ctypes_lib.chebyshev_complex.restype = ctypes.c_double
-          if not (hasattr(self.chebyshev_ctypes_lib,'chebyshev_real') and    hasattr(self.chebyshev_ctypes_lib,'elementary_clenshaw_step_complex_'+str(H.dimension)+'d')):
-            self.has_specific_full_chebyshev_routine = False
-            self.chebyshev_ctypes_lib = None
-            if H.seed == 0 :
-              print("\nWarning, chebyshev C library found, but without routine for complex data layout and dimension "+str(H.dimension)+", this uses the slow Python version\n")
-      except:
-        self.has_specific_full_chebyshev_routine = False
-        self.chebyshev_ctypes_lib = None
+      if kernels.get_library('chebyshev') is None:
         if H.seed == 0 :
           print("\nWarning, no ctypes module, no numpy.ctypeslib module or no chebyshev C library found, this uses the slow Python version!\n")
+      elif kernels.has_kernel('chebyshev','elementary_clenshaw_step_'+self.data_layout+'_'+str(H.dimension)+'d'):
+        self.chebyshev_kernel = kernels.get_kernel('chebyshev','chebyshev_'+self.data_layout)
+        self.has_specific_full_chebyshev_routine = self.chebyshev_kernel is not None
+      if kernels.get_library('chebyshev') is not None and not self.has_specific_full_chebyshev_routine and H.seed == 0 :
+        print("\nWarning, chebyshev C library found, but without routine for "+self.data_layout+" data layout and dimension "+str(H.dimension)+", this uses the slow Python version\n")
     self.use_ctypes = self.has_specific_full_chebyshev_routine and self.want_ctypes
     if self.use_ctypes:
       self.chebyshev_propagation = chebyshev_propagation_ctypes
@@ -92,6 +76,43 @@ class Temporal_Propagation:
     if H.dimension == 3 and not H.spin_one_half:
       self.has_specific_chebyshev_step_routine = True
       self.chebyshev_step = eval("chebyshev_step_3d_"+self.data_layout)
+# Batched propagation of several disorder realizations at once
+# Only available for the Chebyshev method, in dimension 1 and 2, without spin
+# It always uses the complex data layout internally, whatever data_layout is
+    self.batch_size = batch_size
+    self.has_specific_batched_chebyshev_routine = False
+    if self.batch_size>1 and (self.method!='che' or H.spin_one_half or H.dimension>2):
+      if H.seed == 0 :
+        print("\nWarning, batched propagation is only available for the Chebyshev method in dimension 1 and 2 without spin, batch_size is reset to 1\n")
+      self.batch_size = 1
+    if self.batch_size>1:
+      self.chebyshev_step_batched = eval("chebyshev_step_batched_"+str(H.dimension)+"d_complex")
+      self.chebyshev_batched_kernel = None
+      if self.want_ctypes:
+        if kernels.get_library('chebyshev') is None:
+          if H.seed == 0 :
+            print("\nWarning, no ctypes module, no numpy.ctypeslib module or no chebyshev C library found, batched propagation uses the numba version!\n")
+        else:
+          if kernels.has_kernel('chebyshev','elementary_clenshaw_step_complex_batched_'+str(H.dimension)+'d'):
+            self.chebyshev_batched_kernel = kernels.get_kernel('chebyshev','chebyshev_complex_batched')
+          self.has_specific_batched_chebyshev_routine = self.chebyshev_batched_kernel is not None
+          if not self.has_specific_batched_chebyshev_routine and H.seed == 0 :
+            print("\nWarning, chebyshev C library found, but without batched routine for dimension "+str(H.dimension)+", this uses the numba version\n")
+      if self.has_specific_batched_chebyshev_routine:
+        self.chebyshev_propagation_batched = chebyshev_propagation_batched_ctypes
+      else:
+        self.chebyshev_propagation_batched = chebyshev_propagation_batched_generic
+# Number of OpenMP threads used by the C Chebyshev kernels
+# number_of_threads<=0 means all available processors
+# It is effective only if the C library has been compiled with OpenMP, otherwise a single thread is used
+    self.number_of_threads = 1
+    if self.use_ctypes or self.has_specific_batched_chebyshev_routine:
+      set_number_of_threads = kernels.get_kernel('chebyshev','chebyshev_set_number_of_threads')
+      if set_number_of_threads is not None:
+        self.number_of_threads = set_number_of_threads(number_of_threads)
+# Without ctypes (want_ctypes False), the C kernels are not used and the thread count is irrelevant
+    if self.want_ctypes and number_of_threads!=1 and self.number_of_threads==1 and H.seed == 0 :
+      print("\nWarning, number_of_threads = "+str(number_of_threads)+" requested, but the chebyshev C library is not available or not compiled with OpenMP, a single thread is used\n")
     return
 
   def compute_chebyshev_coefficients(self,accuracy,timing):
@@ -494,6 +515,112 @@ def chebyshev_step_3d_complex_numba(dim_x, dim_y, dim_z, b_x, b_y, b_z, disorder
 #  print('psi_old',psi_old)
   return
 
+def chebyshev_step_3d_real(wfc, H, psi, psi_old, c_coef, add_real, c1, c2, tab_c3):
+  chebyshev_step_3d_real_numba(H.tab_dim[0], H.tab_dim[1], H.tab_dim[2], H.tab_boundary_condition[0], H.tab_boundary_condition[1],  H.tab_boundary_condition[2], H.disorder, wfc, psi, psi_old, c_coef, add_real, c1, c2, tab_c3)
+  return
+
+@numba_decorator
+def chebyshev_step_3d_real_numba(dim_x, dim_y, dim_z, b_x, b_y, b_z, disorder, wfc, psi, psi_old, c_coef, add_real, c1, c2, tab_c3):
+# Specific code for dimension 3, real data layout
+# The real part is stored in [0:ntot], the imaginary part in [ntot:2*ntot]
+# Both parts obey the same recursion, only the source term c_coef*wfc (add_real) or 1j*c_coef*wfc mixes them
+# Neighbours are accessed directly, with wrapped indices multiplied by 0 for open boundary conditions
+  c3_x=tab_c3[0]
+  c3_y=tab_c3[1]
+  c3_z=tab_c3[2]
+  ntot = dim_x*dim_y*dim_z
+  f_x = 1.0 if b_x=='periodic' else 0.0
+  f_y = 1.0 if b_y=='periodic' else 0.0
+  f_z = 1.0 if b_z=='periodic' else 0.0
+  for component in range(2):
+    local_psi = psi[component*ntot:(component+1)*ntot].reshape((dim_x,dim_y,dim_z))
+    local_psi_old = psi_old[component*ntot:(component+1)*ntot].reshape((dim_x,dim_y,dim_z))
+    if add_real:
+      local_wfc = wfc[component*ntot:(component+1)*ntot].reshape((dim_x,dim_y,dim_z))
+      source_coef = c_coef
+    else:
+      local_wfc = wfc[(1-component)*ntot:(2-component)*ntot].reshape((dim_x,dim_y,dim_z))
+      source_coef = -c_coef if component==0 else c_coef
+    for i in range(dim_x):
+      i_minus = i-1 if i>0 else dim_x-1
+      i_plus = i+1 if i<dim_x-1 else 0
+      f_x_minus = 1.0 if i>0 else f_x
+      f_x_plus = 1.0 if i<dim_x-1 else f_x
+      for j in range(dim_y):
+        j_minus = j-1 if j>0 else dim_y-1
+        j_plus = j+1 if j<dim_y-1 else 0
+        f_y_minus = 1.0 if j>0 else f_y
+        f_y_plus = 1.0 if j<dim_y-1 else f_y
+        for k in range(dim_z):
+          k_minus = k-1 if k>0 else dim_z-1
+          k_plus = k+1 if k<dim_z-1 else 0
+          f_z_minus = 1.0 if k>0 else f_z
+          f_z_plus = 1.0 if k<dim_z-1 else f_z
+          local_psi_old[i,j,k] = (c1*disorder[i,j,k]-c2)*local_psi[i,j,k]\
+            - c3_z*(f_z_plus*local_psi[i,j,k_plus]+f_z_minus*local_psi[i,j,k_minus])\
+            - c3_y*(f_y_plus*local_psi[i,j_plus,k]+f_y_minus*local_psi[i,j_minus,k])\
+            - c3_x*(f_x_plus*local_psi[i_plus,j,k]+f_x_minus*local_psi[i_minus,j,k])\
+            + source_coef*local_wfc[i,j,k] - local_psi_old[i,j,k]
+  return
+
+# Batched Chebyshev steps, propagating several disorder realizations at once
+# All arrays are interleaved, with shape (ntot,batch_size): the realization index is the fastest one
+# so that each neighbour is loaded once for all realizations
+# Only the complex data layout is supported
+def chebyshev_step_batched_1d_complex(wfc, H, disorder, psi, psi_old, c_coef, add_real, c1, c2, tab_c3):
+  chebyshev_step_batched_1d_complex_numba(H.tab_dim[0], H.array_boundary_condition[0], disorder, wfc, psi, psi_old, c_coef, add_real, c1, c2, tab_c3)
+  return
+
+@numba_decorator
+def chebyshev_step_batched_1d_complex_numba(dim_x, b_x, disorder, wfc, psi, psi_old, c_coef, add_real, c1, c2, tab_c3):
+  if add_real:
+    complex_coef = c_coef+0j
+  else:
+    complex_coef = 1j*c_coef
+  c3=tab_c3[0]
+  batch_size = psi.shape[1]
+# For open boundary conditions, the missing neighbour is replaced by the wrapped one, multiplied by 0
+  for i in range(dim_x):
+    i_minus = i-1 if i>0 else dim_x-1
+    i_plus = i+1 if i<dim_x-1 else 0
+    b_minus = 1.0 if i>0 else float(b_x)
+    b_plus = 1.0 if i<dim_x-1 else float(b_x)
+    for k in range(batch_size):
+      psi_old[i,k] = (c1*disorder[i,k]-c2)*psi[i,k]-c3*(b_plus*psi[i_plus,k]+b_minus*psi[i_minus,k])+complex_coef*wfc[i,k]-psi_old[i,k]
+  return
+
+def chebyshev_step_batched_2d_complex(wfc, H, disorder, psi, psi_old, c_coef, add_real, c1, c2, tab_c3):
+  chebyshev_step_batched_2d_complex_numba(H.tab_dim[0], H.tab_dim[1], H.array_boundary_condition[0], H.array_boundary_condition[1], disorder, wfc, psi, psi_old, c_coef, add_real, c1, c2, tab_c3)
+  return
+
+@numba_decorator
+def chebyshev_step_batched_2d_complex_numba(dim_x, dim_y, b_x, b_y, disorder, wfc, psi, psi_old, c_coef, add_real, c1, c2, tab_c3):
+  if add_real:
+    complex_coef = c_coef+0j
+  else:
+    complex_coef = 1j*c_coef
+  c3_x=tab_c3[0]
+  c3_y=tab_c3[1]
+  batch_size = psi.shape[1]
+# For open boundary conditions, the missing neighbours are replaced by the wrapped ones, multiplied by 0
+  for i in range(dim_x):
+    i_minus = (i-1 if i>0 else dim_x-1)*dim_y
+    i_plus = (i+1 if i<dim_x-1 else 0)*dim_y
+    b_x_minus = 1.0 if i>0 else float(b_x)
+    b_x_plus = 1.0 if i<dim_x-1 else float(b_x)
+    for j in range(dim_y):
+      j_minus = j-1 if j>0 else dim_y-1
+      j_plus = j+1 if j<dim_y-1 else 0
+      b_y_minus = 1.0 if j>0 else float(b_y)
+      b_y_plus = 1.0 if j<dim_y-1 else float(b_y)
+      i_low = i*dim_y+j
+      for k in range(batch_size):
+        psi_old[i_low,k] = (c1*disorder[i_low,k]-c2)*psi[i_low,k]\
+          - c3_y*(b_y_plus*psi[i*dim_y+j_plus,k]+b_y_minus*psi[i*dim_y+j_minus,k])\
+          - c3_x*(b_x_plus*psi[i_plus+j,k]+b_x_minus*psi[i_minus+j,k])\
+          + complex_coef*wfc[i_low,k]-psi_old[i_low,k]
+  return
+
 def chebyshev_propagation_ctypes(wfc, H, propagation, timing):
   local_wfc = wfc.ravel()
   ntot = H.hs_dim
@@ -507,14 +634,14 @@ def chebyshev_propagation_ctypes(wfc, H, propagation, timing):
 #      print('psi_old',psi_old.shape,psi_old.dtype)
 #      print('disorder',H.disorder.shape,H.disorder.dtype)
 #      print('tab_coef',propagation.tab_coef.shape,propagation.tab_coef.dtype)
-    nonlinear_phase = propagation.chebyshev_ctypes_lib.chebyshev_real(H.dimension, np.asarray(H.tab_dim,dtype=np.intc), max_order, H.array_boundary_condition,\
-        local_wfc, psi, psi_old, H.disorder.ravel(), propagation.tab_coef, np.asarray(H.tab_tunneling),\
+    nonlinear_phase = propagation.chebyshev_kernel(H.dimension, H.array_tab_dim, max_order, H.array_boundary_condition,\
+        local_wfc, psi, psi_old, H.disorder.ravel(), propagation.tab_coef, H.array_tunneling,\
         H.two_over_delta_e, H.two_e0_over_delta_e, H.interaction*propagation.delta_t, H.medium_energy*propagation.delta_t)
   else:
     psi_old = np.zeros(ntot,dtype=np.complex128)
     psi     = np.zeros(ntot,dtype=np.complex128)
-    nonlinear_phase = propagation.chebyshev_ctypes_lib.chebyshev_complex(H.dimension, np.asarray(H.tab_dim,dtype=np.intc), max_order, H.array_boundary_condition,\
-        local_wfc, psi, psi_old, H.disorder.ravel(), propagation.tab_coef, np.asarray(H.tab_tunneling),\
+    nonlinear_phase = propagation.chebyshev_kernel(H.dimension, H.array_tab_dim, max_order, H.array_boundary_condition,\
+        local_wfc, psi, psi_old, H.disorder.ravel(), propagation.tab_coef, H.array_tunneling,\
         H.two_over_delta_e, H.two_e0_over_delta_e, H.interaction*propagation.delta_t, H.medium_energy*propagation.delta_t)
 #    print(nonlinear_phase[0])
   timing.MAX_NONLINEAR_PHASE = max(nonlinear_phase,timing.MAX_NONLINEAR_PHASE)
@@ -569,6 +696,45 @@ def chebyshev_propagation_generic(wfc, H, propagation,timing):
   return
 
 
+def chebyshev_propagation_batched_ctypes(wfc, disorder, H, propagation, timing):
+# wfc and disorder are interleaved arrays of shape (ntot,batch_size)
+  max_order = propagation.tab_coef.size-1
+  assert max_order%2==0,"Max order {} must be an even number".format(max_order)
+  psi_old = np.zeros_like(wfc)
+  psi     = np.zeros_like(wfc)
+  nonlinear_phase = propagation.chebyshev_batched_kernel(H.dimension, H.array_tab_dim, max_order, H.array_boundary_condition,\
+      wfc.shape[1], wfc, psi, psi_old, disorder, propagation.tab_coef, H.array_tunneling,\
+      H.two_over_delta_e, H.two_e0_over_delta_e, H.interaction*propagation.delta_t, H.medium_energy*propagation.delta_t)
+  timing.MAX_NONLINEAR_PHASE = max(nonlinear_phase,timing.MAX_NONLINEAR_PHASE)
+  return
+
+def chebyshev_propagation_batched_generic(wfc, disorder, H, propagation, timing):
+# wfc and disorder are interleaved arrays of shape (ntot,batch_size)
+  max_order = propagation.tab_coef.size-1
+  assert max_order%2==0,"Max order {} must be an even number".format(max_order)
+  psi_old = np.zeros_like(wfc)
+  psi = propagation.tab_coef[-1] * wfc
+  c1 = 2.0*H.two_over_delta_e
+  c2 = 2.0*H.two_e0_over_delta_e
+  tab_c3 = 2.0*np.asarray(H.tab_tunneling)*H.two_over_delta_e
+  propagation.chebyshev_step_batched(wfc,H,disorder,psi,psi_old,propagation.tab_coef[-2],False,c1,c2,tab_c3)
+  for order in range(propagation.tab_coef.size-3,0,-2):
+    propagation.chebyshev_step_batched(wfc,H,disorder,psi_old,psi,propagation.tab_coef[order],True,c1,c2,tab_c3)
+    propagation.chebyshev_step_batched(wfc,H,disorder,psi,psi_old,propagation.tab_coef[order-1],False,c1,c2,tab_c3)
+  c1 = H.two_over_delta_e
+  c2 = H.two_e0_over_delta_e
+  tab_c3 = np.asarray(H.tab_tunneling)*H.two_over_delta_e
+  propagation.chebyshev_step_batched(wfc,H,disorder,psi_old,psi,propagation.tab_coef[0],True,c1,c2,tab_c3)
+  if H.interaction==0.0:
+    phase = propagation.delta_t*H.medium_energy
+  else:
+    nonlinear_phase = propagation.delta_t*H.interaction*(np.real(psi)**2+np.imag(psi)**2)
+    timing.MAX_NONLINEAR_PHASE = max(timing.MAX_NONLINEAR_PHASE,np.amax(nonlinear_phase))
+    phase=propagation.delta_t*H.medium_energy+nonlinear_phase
+  wfc[:] = psi * (np.cos(phase)-1j*np.sin(phase))
+  return
+
+
 
 def gross_pitaevskii(t, wfc, H, data_layout, rhs, timing):
     """Returns rhs of Gross-Pitaevskii equation with discretized space
@@ -599,7 +765,7 @@ def gross_pitaevskii(t, wfc, H, data_layout, rhs, timing):
 
 
 class Spectral_function:
-  def __init__(self,e_min,e_max,e_resolution,multiplicative_factor_for_interaction_in_spectral_function, n_kpm, want_ctypes_for_spectral_function, allow_unsafe_energy_bounds, H):
+  def __init__(self,e_min,e_max,e_resolution,multiplicative_factor_for_interaction_in_spectral_function, n_kpm, want_ctypes_for_spectral_function, allow_unsafe_energy_bounds, H, number_of_random_vectors=1, kernel='jackson', lorentz_parameter=4.0, moments_file=None, reconstruction='recursion'):
     e_range = e_max - e_min
     e_middle = 0.5*(e_max+e_min)
     self.n_pts = int(e_range/e_resolution+1.5)
@@ -617,6 +783,22 @@ class Spectral_function:
     self.multiplicative_factor_for_interaction = multiplicative_factor_for_interaction_in_spectral_function
     self.n_kpm = n_kpm
     self.want_ctypes_for_spectral_function = want_ctypes_for_spectral_function
+# For random or multi_point initial states, number_of_random_vectors stochastic vectors
+# are processed together (block KPM) for each disorder realization
+    self.number_of_random_vectors = number_of_random_vectors
+# Damping kernel used to reconstruct the spectrum from the Chebyshev moments, either 'jackson' or 'lorentz'
+    self.kernel = kernel
+    self.lorentz_parameter = lorentz_parameter
+# The KPM calculation is performed in the interval [kpm_e_lower,kpm_e_upper]
+# It may be changed if moments computed on a larger interval are loaded from moments_file
+    self.kpm_e_lower = self.e_min-e_resolution
+    self.kpm_e_upper = self.e_max+e_resolution
+# Sum of the Chebyshev moments over all calls to compute_spectral_function
+    self.tab_mu = np.zeros(n_kpm+1)
+    self.moments_file = moments_file
+# Method used to build the spectrum from the moments: 'recursion' (Chebyshev recursion at each energy)
+# or 'dct' (discrete cosine transform on Chebyshev nodes followed by interpolation), much faster for large n_kpm
+    self.reconstruction = reconstruction
 # Check whether the energy bounds are sufficient to enclose all the energy spectrum
 # This is a simple, not sufficient test, which only wants to avoid simple mistakes
 # A more accurate test would require to call H.energy_range for each disorder realization
@@ -632,30 +814,30 @@ class Spectral_function:
         sys.exit()
 # Is there a ctypes implementation?
     self.has_chebyshev_kpm_routine = False
+    self.chebyshev_kpm_kernel = None
+    self.chebyshev_kpm_block_kernel = None
     if not H.spin_one_half and self.want_ctypes_for_spectral_function:
-      try:
-        import ctypes
-        import numpy.ctypeslib as ctl
-        self.has_chebyshev_kpm_routine = True
-        self.chebyshev_ctypes_lib=ctypes.CDLL(anderson.__path__[0]+"/ctypes/chebyshev.so")
-        self.chebyshev_ctypes_lib.chebyshev_kpm_step.argtypes = [ctypes.c_int, ctl.ndpointer(np.intc), ctl.ndpointer(np.intc),\
-          ctl.ndpointer(np.complex128), ctl.ndpointer(np.complex128), ctl.ndpointer(np.float64), ctl.ndpointer(np.float64), ctypes.c_double, ctypes.c_double]
-        self.chebyshev_ctypes_lib.chebyshev_kpm_step.restype = None
-        if not hasattr(self.chebyshev_ctypes_lib,'chebyshev_kpm_step'):
-          self.has_chebyshev_kpm_routine = False
-          self.chebyshev_ctypes_lib = None
-          if H.seed == 0 :
-            print("\nWarning, chebyshev C library found, but without routine for KPM computation of the spectral function, this uses the slow Python version\n")
-      except:
-        self.has_chebyshev_kpm_routine = False
-        self.chebyshev_ctypes_lib = None
+      if kernels.get_library('chebyshev') is None:
         if H.seed == 0 :
           print("\nWarning, no ctypes module, no numpy.ctypeslib module or no chebyshev C library found, this uses the slow Python version!\n")
+      else:
+        self.chebyshev_kpm_kernel = kernels.get_kernel('chebyshev','chebyshev_kpm_step')
+        self.chebyshev_kpm_block_kernel = kernels.get_kernel('chebyshev','chebyshev_kpm_step_block')
+        self.has_chebyshev_kpm_routine = self.chebyshev_kpm_kernel is not None
+        if not self.has_chebyshev_kpm_routine and H.seed == 0 :
+          print("\nWarning, chebyshev C library found, but without routine for KPM computation of the spectral function, this uses the slow Python version\n")
     self.use_ctypes = self.has_chebyshev_kpm_routine and self.want_ctypes_for_spectral_function
     if self.use_ctypes:
       self.chebyshev_kpm_routine = self.chebyshev_kpm_step_ctypes
     else:
       self.chebyshev_kpm_routine = self.chebyshev_kpm_step
+# Block version, used when several random vectors are processed together
+    if self.use_ctypes and self.chebyshev_kpm_block_kernel is not None:
+      self.chebyshev_kpm_block_routine = self.chebyshev_kpm_step_block_ctypes
+    else:
+      if self.use_ctypes and self.number_of_random_vectors>1 and H.seed == 0:
+        print("\nWarning, chebyshev C library found, but without routine chebyshev_kpm_step_block, this uses a loop over the random vectors!\n")
+      self.chebyshev_kpm_block_routine = self.chebyshev_kpm_step_block
     return
 
 
@@ -667,12 +849,27 @@ class Spectral_function:
     return
 
   def chebyshev_kpm_step_ctypes(self, H, psi, psi_old, c1, c2):
-    self.chebyshev_ctypes_lib.chebyshev_kpm_step(H.dimension, np.asarray(H.tab_dim,dtype=np.intc), H.array_boundary_condition,\
-      psi.ravel(), psi_old.ravel(), H.disorder.ravel(), np.asarray(H.tab_tunneling), c1, c2)
+    self.chebyshev_kpm_kernel(H.dimension, H.array_tab_dim, H.array_boundary_condition,\
+      psi.ravel(), psi_old.ravel(), H.disorder.ravel(), H.array_tunneling, c1, c2)
+    return
+
+# psi and psi_old are (ntot,number of vectors) arrays, each column being processed as in chebyshev_kpm_step
+  def chebyshev_kpm_step_block(self, H, psi, psi_old, c1, c2):
+    for r in range(psi.shape[1]):
+# The columns are copied to contiguous vectors for apply_h
+      psi_old_r = psi_old[:,r].copy()
+      self.chebyshev_kpm_step(H, psi[:,r].copy(), psi_old_r, c1, c2)
+      psi_old[:,r] = psi_old_r
+    return
+
+  def chebyshev_kpm_step_block_ctypes(self, H, psi, psi_old, c1, c2):
+    self.chebyshev_kpm_block_kernel(H.dimension, H.array_tab_dim, H.array_boundary_condition,\
+      psi.shape[1], psi, psi_old, H.disorder.ravel(), H.array_tunneling, c1, c2)
     return
 
   def normalize(self, n):
     self.tab_spectrum /= n
+    self.tab_mu /= n
     return
 
   def mpi_merge(self, comm, timing):
@@ -682,14 +879,73 @@ class Spectral_function:
     except ImportError:
       print("mpi4py is not found!")
       return
-    toto = np.empty_like(self.tab_spectrum)
-    comm.Reduce(self.tab_spectrum,toto)
-    self.tab_spectrum = np.copy(toto)
+    self.tab_spectrum, self.tab_mu = anderson.measurement.mpi_reduce_arrays(comm,[self.tab_spectrum,self.tab_mu])
     timing.MPI_TIME+=(timeit.default_timer() - start_mpi_time)
     return
 
+  def moments_key(self, geometry, initial_state, H, number_of_realizations):
+# Builds a hash of all parameters the averaged moments depend on
+# The KPM interval and the number of moments are not included, they are stored alongside the moments
+    parameters = [geometry.dimension, list(geometry.tab_dim), list(geometry.tab_delta), list(H.tab_boundary_condition), H.one_over_mass,\
+                  geometry.spin_one_half, geometry.reproducible_randomness, geometry.custom_seed, geometry.use_mkl_random, geometry.counter_based_random,\
+                  H.disorder_type, H.disorder_strength, H.correlation_length, H.non_diagonal_disorder_strength, getattr(H,'b',None),\
+                  H.randomize_hamiltonian, getattr(H,'scaled_spin_orbit_interaction',None), getattr(H,'scaled_alpha',None),\
+                  H.interaction, self.multiplicative_factor_for_interaction,\
+                  initial_state.type, initial_state.randomize_initial_state, getattr(initial_state,'tab_k_0',None), getattr(initial_state,'tab_sigma_0',None),\
+                  getattr(initial_state,'tab_chirp',None), getattr(initial_state,'minimum_distance',None),\
+                  self.number_of_random_vectors, number_of_realizations]
+    return hashlib.sha256(repr(parameters).encode()).hexdigest()
+
+  def save_moments(self, key, number_of_realizations):
+# Saves the averaged moments (after normalize) in the compressed binary file moments_file
+    np.savez_compressed(self.moments_file, key=key, tab_mu=self.tab_mu, kpm_e_lower=self.kpm_e_lower, kpm_e_upper=self.kpm_e_upper,\
+                        number_of_realizations=number_of_realizations)
+    return
+
+  def load_moments(self, key):
+# Tries to load averaged moments from moments_file. They are used only if they have been computed
+# with the same parameters, on a KPM interval containing [e_min,e_max] and with enough moments
+# to reach the energy resolution corresponding to n_kpm. Returns True if they are used
+    if self.moments_file is None or not os.path.isfile(self.moments_file):
+      return False
+    with np.load(self.moments_file) as data:
+      if str(data['key']) != key:
+        return False
+      kpm_e_lower = float(data['kpm_e_lower'])
+      kpm_e_upper = float(data['kpm_e_upper'])
+      tab_mu = data['tab_mu']
+    if kpm_e_lower>=self.e_min or kpm_e_upper<=self.e_max:
+      return False
+# The energy resolution of KPM is proportional to the width of the interval divided by the number of moments
+    n_kpm = int(math.ceil(self.n_kpm*(kpm_e_upper-kpm_e_lower)/(self.kpm_e_upper-self.kpm_e_lower)-1.e-9))
+    if n_kpm>tab_mu.size-1:
+      return False
+    self.tab_mu = tab_mu[:n_kpm+1]
+    self.kpm_e_lower = kpm_e_lower
+    self.kpm_e_upper = kpm_e_upper
+    return True
+
+  def reconstruct_spectrum(self, tab_mu, e_lower, e_upper, timing):
+# Spectrum at energies self.tab_energies, built from the Chebyshev moments tab_mu computed on [e_lower,e_upper]
+    start_spectrum_time = timeit.default_timer()
+    n_kpm = tab_mu.size-1
+    tab_spectrum = spectrum_from_moments(tab_mu, self.tab_energies, e_lower, e_upper, kernel=self.kernel, lorentz_parameter=self.lorentz_parameter, reconstruction=self.reconstruction)
+    timing.SPECTRUM_TIME += (timeit.default_timer() - start_spectrum_time)
+    if self.reconstruction=='dct':
+      timing.SPECTRUM_NOPS += 5.0*DCT_OVERSAMPLING*(n_kpm+1)*math.log2(DCT_OVERSAMPLING*(n_kpm+1))+10.0*self.n_pts
+    else:
+      timing.SPECTRUM_NOPS += 7.0*self.n_pts*n_kpm
+    return tab_spectrum
+
+  def spectrum_from_moments(self, timing):
+# Rebuilds self.tab_spectrum from the averaged moments self.tab_mu
+    self.tab_spectrum = self.reconstruct_spectrum(self.tab_mu, self.kpm_e_lower, self.kpm_e_upper, timing)
+    return
+
 
-  def compute_spectral_function(self, i_seed, geometry, initial_state, H, timing, debug=False, build_disorder=True, build_initial_state=True):
+# If accumulate_moments is True, the Chebyshev moments are added to self.tab_mu (used by the spectral_function driver,
+# where all calls are for independent realizations of the same system, averaged at the end)
+  def compute_spectral_function(self, i_seed, geometry, initial_state, H, timing, debug=False, build_disorder=True, build_initial_state=True, accumulate_moments=False):
     start_dummy_time=timeit.default_timer()
     if build_disorder and (H.randomize_hamiltonian or H.seed==0):
       if geometry.reproducible_randomness:
@@ -700,7 +956,22 @@ class Spectral_function:
       H.generate_disorder(seed)
 #      H.energy_range(accurate=propagation.accurate_bounds)
 #    print(H.disorder)
-    if build_initial_state and (initial_state.randomize_initial_state or initial_state.seed==0):
+# Block KPM is used only for stochastic initial states built here, and when the disorder does not depend on the state
+    if build_initial_state and initial_state.type in ['random','multi_point'] and H.interaction*self.multiplicative_factor_for_interaction == 0.0:
+      block_size = self.number_of_random_vectors
+    else:
+      block_size = 1
+    if block_size>1:
+# The random vectors are stored as the columns of psi, so that the components of all vectors on a given site are contiguous
+      psi = np.empty((initial_state.wfc.size,block_size),dtype=np.complex128)
+      for r in range(block_size):
+        if geometry.reproducible_randomness:
+          seed = i_seed*block_size+r+2345+H.custom_seed
+        else:
+          seed = None
+        initial_state.prepare_initial_state(seed)
+        psi[:,r] = initial_state.wfc.ravel()
+    elif build_initial_state and (initial_state.randomize_initial_state or initial_state.seed==0):
       if geometry.reproducible_randomness:
         seed = i_seed+2345+H.custom_seed
       else:
@@ -716,29 +987,26 @@ class Spectral_function:
 #    if not H.has_specific_apply_h_routine:
 #      H.generate_sparse_matrix()
 #  psi_0 = initial_state.wfc.ravel()
-    psi = copy.deepcopy(initial_state.wfc.ravel())
+    if block_size>1:
+      chebyshev_kpm_routine = self.chebyshev_kpm_block_routine
+    else:
+      psi = copy.deepcopy(initial_state.wfc.ravel())
+      chebyshev_kpm_routine = self.chebyshev_kpm_routine
     psi_old = np.zeros_like(psi)
+# As np.vdot flattens its arguments, the moments below are summed over all vectors of the block
+# Dividing by block_size gives the average over the random vectors
+    mu_factor = H.delta_vol/block_size
     n_kpm = self.n_kpm
 # The calculation is performed in the interval [e_min-e_resolution, e_max+e_resolution]
 # This avoids the divergence of the denominator at edges
     c1 = 2.0/(self.e_max-self.e_min+2.0*self.e_resolution)
     c2 = 0.5*c1*(self.e_max+self.e_min)
     tab_mu = np.zeros(n_kpm+1)
-# Jackson damping
-# tab_g = np.ones(n_kpm+1)
-    tab_g = (np.linspace(n_kpm+2,1,num=n_kpm+1)*np.cos(np.pi*np.linspace(0,n_kpm+1,num=n_kpm+1)/(n_kpm+2))\
-           +np.sin(np.pi*np.linspace(0,n_kpm+1,num=n_kpm+1)/(n_kpm+2))/np.tan(np.pi/(n_kpm+2)))/(n_kpm+2)
-#  print(tab_g)
-    tab_mu[0] = np.vdot(psi,psi).real*H.delta_vol
-    self.chebyshev_kpm_routine(H, psi, psi_old, c1, c2)
+    tab_mu[0] = np.vdot(psi,psi).real*mu_factor
+    chebyshev_kpm_routine(H, psi, psi_old, c1, c2)
     c1 *= 2.0
     c2 *= 2.0
-    tab_mu[1] = np.vdot(psi,psi_old).real*H.delta_vol
-# The various Chebyshev polynomials are computed by recursion
-# Initialize T_0 and T_1
-    tab_T_old = np.ones(self.n_pts)
-    tab_T = self.tab_x*tab_T_old
-    tab_spectrum = tab_mu[0]*tab_T_old+2.0*tab_mu[1]*tab_T*tab_g[1]
+    tab_mu[1] = np.vdot(psi,psi_old).real*mu_factor
     """
 # Range for the old method
     for i in range(2,n_kpm+1):
@@ -750,39 +1018,29 @@ class Spectral_function:
 
     """
 # The improved method which saves a factor 2
-    tab_mu[2] = 2.0*np.vdot(psi_old,psi_old).real*H.delta_vol-tab_mu[0]
+    tab_mu[2] = 2.0*np.vdot(psi_old,psi_old).real*mu_factor-tab_mu[0]
 # Range for the improved method
     for i in range(2,(n_kpm+1)//2+1):
       psi_old, psi = psi, psi_old
-      self.chebyshev_kpm_routine(H, psi, psi_old, c1, c2)
-      tab_mu[2*i-1] = 2.0*np.vdot(psi,psi_old).real*H.delta_vol-tab_mu[1]
+      chebyshev_kpm_routine(H, psi, psi_old, c1, c2)
+      tab_mu[2*i-1] = 2.0*np.vdot(psi,psi_old).real*mu_factor-tab_mu[1]
 #      print(2*i-1,tab_mu[2*i-1])
       if 2*i<n_kpm+1:
-        tab_mu[2*i] = 2.0*np.vdot(psi_old,psi_old).real*H.delta_vol-tab_mu[0]
+        tab_mu[2*i] = 2.0*np.vdot(psi_old,psi_old).real*mu_factor-tab_mu[0]
 #        print(2*i,tab_mu[2*i])
 # print(tab_mu)
     timing.KPM_TIME += (timeit.default_timer() - start_kpm_time)
 # Count of operations: (8+7*H.dimension)*H.hs_dim comes from each kpm routine (assuming it is the ctypes version)
 # 8*H.hs_dim comes from each scalar product (vdot operation)
-    timing.KPM_NOPS += n_kpm*(12.0+3.5*H.dimension)*H.hs_dim
+    timing.KPM_NOPS += n_kpm*(12.0+3.5*H.dimension)*H.hs_dim*block_size
+    if accumulate_moments:
+      self.tab_mu += tab_mu
     start_dummy_time = timeit.default_timer()
 # Restore the initial disorder
     if H.interaction*self.multiplicative_factor_for_interaction != 0.0:
       H.disorder = H.disorder - H.interaction*self.multiplicative_factor_for_interaction*(np.abs(initial_state.wfc)**2)
     timing.DUMMY_TIME+=(timeit.default_timer() - start_dummy_time)
-    start_spectrum_time = timeit.default_timer()
-# If the number of operations is large enough, use the numba version
-# Otherwise, stick to the simple Python version
-    if self.n_pts*n_kpm>1.e6:
-      tab_spectrum = compute_spectral_function_from_mu(n_kpm,tab_T,tab_T_old,self.tab_x,tab_mu,tab_g,tab_spectrum)
-    else:
-      for i in range(2,n_kpm+1):
-        tab_T_old = 2.0*self.tab_x*tab_T-tab_T_old
-        tab_spectrum += 2.0*tab_mu[i]*tab_T_old*tab_g[i]
-        tab_T, tab_T_old = tab_T_old, tab_T
-    timing.SPECTRUM_TIME += (timeit.default_timer() - start_spectrum_time)
-    timing.SPECTRUM_NOPS += 7.0*self.n_pts*n_kpm
-    return 2.0*tab_spectrum/(np.pi*np.sqrt(1.0-self.tab_x**2)*(self.e_max-self.e_min+2.0*self.e_resolution))
+    return self.reconstruct_spectrum(tab_mu, self.e_min-self.e_resolution, self.e_max+self.e_resolution, timing)
 
 
 @numba_decorator
@@ -793,6 +1051,65 @@ def compute_spectral_function_from_mu(n_kpm,tab_T,tab_T_old,tab_x,tab_mu,tab_g,t
     tab_T, tab_T_old = tab_T_old, tab_T
   return tab_spectrum
 
+# Number of Chebyshev nodes per moment used in the DCT reconstruction
+# The interpolation error decreases like DCT_OVERSAMPLING**(-4)
+DCT_OVERSAMPLING = 16
+
+def compute_spectral_function_from_mu_dct(tab_x,tab_mu,tab_g):
+# Same result as the Chebyshev recursion, i.e. mu_0+2*sum_n g_n*mu_n*T_n(x), but using a DCT:
+# on the Chebyshev nodes x_k=cos(theta_k), theta_k=pi*(k+1/2)/n_nodes, the sum is a type-III DCT of the damped moments
+# The result is then interpolated (cubic Lagrange interpolation) in theta, where the nodes are equally spaced
+# and the function is smooth (a trigonometric polynomial of degree n_kpm)
+  n_kpm = tab_mu.size-1
+  n_nodes = scipy.fft.next_fast_len(DCT_OVERSAMPLING*(n_kpm+1))
+  tab_coef = np.zeros(n_nodes)
+  tab_coef[0] = tab_mu[0]
+  tab_coef[1:n_kpm+1] = tab_mu[1:]*tab_g[1:]
+  tab_f = scipy.fft.dct(tab_coef,type=3)
+# Position of each theta in units of the node spacing, node k being at k+1/2
+  tab_t = np.arccos(tab_x)*(n_nodes/np.pi)-0.5
+  tab_i = np.floor(tab_t).astype(np.int64)
+  u = tab_t-tab_i
+# f is even around theta=0 and theta=pi, nodes outside [0,n_nodes-1] are obtained by reflection
+  def node_value(i):
+    i = np.where(i<0,-i-1,i)
+    i = np.where(i>=n_nodes,2*n_nodes-1-i,i)
+    return tab_f[i]
+  return -u*(u-1.0)*(u-2.0)/6.0*node_value(tab_i-1)+(u+1.0)*(u-1.0)*(u-2.0)/2.0*node_value(tab_i)\
+         -(u+1.0)*u*(u-2.0)/2.0*node_value(tab_i+1)+(u+1.0)*u*(u-1.0)/6.0*node_value(tab_i+2)
+
+def kpm_damping_kernel(n_kpm, kernel='jackson', lorentz_parameter=4.0):
+# Damping factors for the n_kpm+1 Chebyshev moments, see Weisse et al, Rev. Mod. Phys. 78, 275 (2006)
+  if kernel=='lorentz':
+    return np.sinh(lorentz_parameter*(1.0-np.arange(n_kpm+1)/(n_kpm+1)))/np.sinh(lorentz_parameter)
+# Jackson damping
+# tab_g = np.ones(n_kpm+1)
+  return (np.linspace(n_kpm+2,1,num=n_kpm+1)*np.cos(np.pi*np.linspace(0,n_kpm+1,num=n_kpm+1)/(n_kpm+2))\
+         +np.sin(np.pi*np.linspace(0,n_kpm+1,num=n_kpm+1)/(n_kpm+2))/np.tan(np.pi/(n_kpm+2)))/(n_kpm+2)
+
+def spectrum_from_moments(tab_mu, tab_energies, e_lower, e_upper, kernel='jackson', lorentz_parameter=4.0, reconstruction='recursion'):
+# Reconstructs the spectrum at energies tab_energies (strictly inside [e_lower,e_upper])
+# from the Chebyshev moments tab_mu computed on the interval [e_lower,e_upper]
+  n_kpm = tab_mu.size-1
+  tab_g = kpm_damping_kernel(n_kpm, kernel, lorentz_parameter)
+  half_width = 0.5*(e_upper-e_lower)
+  tab_x = (tab_energies-0.5*(e_upper+e_lower))/half_width
+  tab_T_old = np.ones(tab_x.size)
+  tab_T = tab_x*tab_T_old
+  tab_spectrum = tab_mu[0]*tab_T_old+2.0*tab_mu[1]*tab_T*tab_g[1]
+# If the number of operations is large enough, use the numba version
+# Otherwise, stick to the simple Python version
+  if reconstruction=='dct':
+    tab_spectrum = compute_spectral_function_from_mu_dct(tab_x,tab_mu,tab_g)
+  elif tab_x.size*n_kpm>1.e6:
+    tab_spectrum = compute_spectral_function_from_mu(n_kpm,tab_T,tab_T_old,tab_x,tab_mu,tab_g,tab_spectrum)
+  else:
+    for i in range(2,n_kpm+1):
+      tab_T_old = 2.0*tab_x*tab_T-tab_T_old
+      tab_spectrum += 2.0*tab_mu[i]*tab_T_old*tab_g[i]
+      tab_T, tab_T_old = tab_T_old, tab_T
+  return tab_spectrum/(np.pi*np.sqrt(1.0-tab_x**2)*half_width)
+
 
 def gpe_evolution(i_seed, geometry, initial_state, H, propagation, measurement, timing, debug=False, spectral_function=None):
 
@@ -963,6 +1280,132 @@ def gpe_evolution(i_seed, geometry, initial_state, H, propagation, measurement,
   return
 
 
+def gpe_evolution_batched(tab_i_seed, geometry, initial_state, H, propagation, tab_measurement, timing, debug=False, spectral_function=None):
+# Same as gpe_evolution, but for several disorder realizations (one per element of tab_i_seed) propagated simultaneously
+# using the batched Chebyshev routine. tab_measurement must contain one Measurement object per realization.
+# All realizations are propagated with common energy bounds (the union of the individual bounds), so that they share
+# the same Chebyshev coefficients. The results are thus identical to the ones of gpe_evolution within the requested accuracy.
+  start_dummy_time=timeit.default_timer()
+  batch_size = len(tab_i_seed)
+  tab_extended_dim = geometry.tab_extended_dim
+  hs_dim = geometry.hs_dim
+  accuracy = propagation.accuracy
+# The disorder and the sparse matrix (if any) of each realization are kept, in order to perform the measurements
+  tab_disorder = []
+  tab_sparse_matrix = []
+  tab_init_state_autocorr = []
+# Interleaved arrays, the realization index is the fastest one
+  y = np.zeros((hs_dim,batch_size),dtype=np.complex128)
+  disorder = np.zeros((hs_dim,batch_size))
+  e_min = np.inf
+  e_max = -np.inf
+  for k in range(batch_size):
+    if H.randomize_hamiltonian or H.seed==0:
+      if geometry.reproducible_randomness:
+        seed = tab_i_seed[k]+1234+H.custom_seed
+      else:
+        seed = None
+      H.generate_disorder(seed)
+      tab_measurement[k].perform_measurement_potential(H)
+    if initial_state.randomize_initial_state or initial_state.seed==0:
+      if geometry.reproducible_randomness:
+        seed = tab_i_seed[k]+2345+H.custom_seed
+      else:
+        seed = None
+      initial_state.prepare_initial_state(seed)
+    H.energy_range(accurate=propagation.accurate_bounds)
+    e_min = min(e_min,H.e_min)
+    e_max = max(e_max,H.e_max)
+    tab_disorder.append(H.disorder)
+    tab_sparse_matrix.append(H.sparse_matrix)
+    disorder[:,k] = H.disorder.ravel()
+    y[:,k] = initial_state.wfc.ravel()
+# Keeping the initial state is needed when the autocorrelation <psi(0)|psi(t)> is measured
+    if tab_measurement[k].measure_autocorrelation or tab_measurement[k].measure_overlap:
+      tab_init_state_autocorr.append(copy.deepcopy(initial_state))
+    else:
+      tab_init_state_autocorr.append(None)
+# Common energy bounds for all realizations
+  H.e_min = e_min
+  H.e_max = e_max
+  H.medium_energy = 0.5*(e_max+e_min)
+  H.two_over_delta_e = 2.0/(e_max-e_min)
+  H.two_e0_over_delta_e = H.medium_energy*H.two_over_delta_e
+  psi = Wavefunction(geometry)
+  timing.DUMMY_TIME+=(timeit.default_timer() - start_dummy_time)
+
+  def select_realization(k):
+    H.disorder = tab_disorder[k]
+    H.sparse_matrix = tab_sparse_matrix[k]
+    psi.wfc[:] = y[:,k].reshape(tab_extended_dim)
+    return
+
+  def store_realization(k):
+# The sparse matrix may have been built during the measurement
+    tab_sparse_matrix[k] = H.sparse_matrix
+    return
+
+  start_expect_time = timeit.default_timer()
+  for k in range(batch_size):
+    select_realization(k)
+    tab_measurement[k].perform_measurement_dispersion(0, H, psi, psi)
+    if tab_measurement[k].tab_time[0,2]==1:
+      tab_measurement[k].perform_measurement_density(0, psi)
+    store_realization(k)
+  timing.EXPECT_TIME+=(timeit.default_timer() - start_expect_time)
+  if tab_measurement[0].tab_time[0,3]==1:
+    for k in range(batch_size):
+      select_realization(k)
+      tab_measurement[k].tab_spectrum[:,0] = spectral_function.compute_spectral_function(\
+        tab_i_seed[k], geometry, psi, H, timing, build_disorder=False, build_initial_state=False)
+      store_realization(k)
+  j_dispersion = 0
+  j_density = 1 if tab_measurement[0].tab_time[0,2]==1 else 0
+  j_spectral_function = 1 if tab_measurement[0].tab_time[0,3]==1 else 0
+  delta_t_old = -1.0
+  tiny = 1.e-12
+  tab_time = tab_measurement[0].tab_time
+#time evolution
+  for i in range(1,tab_time.shape[0]):
+    start_che_time = timeit.default_timer()
+    delta_t=tab_time[i,0]-tab_time[i-1,0]
+    if abs(delta_t-delta_t_old)>tiny:
+# time step has changed
+# recompute the coefficients of the Chebyshev series
+      propagation.delta_t = delta_t
+      propagation.script_delta_t = 0.5*propagation.delta_t*(H.e_max-H.e_min)
+      propagation.compute_chebyshev_coefficients(accuracy,timing)
+    delta_t_old=delta_t
+    propagation.chebyshev_propagation_batched(y, disorder, H, propagation, timing)
+    timing.CHE_TIME+=(timeit.default_timer() - start_che_time)
+    timing.CHE_NOPS+=(12.0+7.0*H.dimension)*hs_dim*propagation.tab_coef.size*batch_size
+    if tab_time[i,1]==1 or tab_time[i,2]==1 or tab_time[i,3]==1:
+      if tab_time[i,1]==1:
+        j_dispersion+=1
+      for k in range(batch_size):
+        start_expect_time = timeit.default_timer()
+        select_realization(k)
+        if tab_time[i,1]==1:
+          tab_measurement[k].perform_measurement_dispersion(j_dispersion, H, psi, tab_init_state_autocorr[k])
+        if tab_time[i,2]==1:
+          tab_measurement[k].perform_measurement_density(j_density, psi)
+        timing.EXPECT_TIME+=(timeit.default_timer() - start_expect_time)
+        if tab_time[i,3]==1:
+          tab_measurement[k].tab_spectrum[:,j_spectral_function] = spectral_function.compute_spectral_function(\
+            tab_i_seed[k], geometry, psi, H, timing, build_disorder=False, build_initial_state=False)
+        store_realization(k)
+      if tab_time[i,2]==1:
+        j_density+=1
+      if tab_time[i,3]==1:
+        j_spectral_function+=1
+  for k in range(batch_size):
+# A new wavefunction for each realization, as perform_measurement_final may keep a reference to it
+    psi = Wavefunction(geometry)
+    select_realization(k)
+    tab_measurement[k].perform_measurement_final(psi, tab_init_state_autocorr[k])
+  return
+
+
 """
 def apply_minus_i_h_gpe_complex(wfc, H, rhs):
   dim_x = H.dim_x
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Distribution of the disorder realizations among the MPI processes
+
+The n_config realizations are numbered 0..n_config-1, and the seed of each realization
+depends only on its index. Instead of a static split (n_config/nprocs consecutive
+realizations per process), each process pulls the index of its next realization from a
+shared counter hosted by process 0, incremented with an atomic MPI one-sided operation.
+A process which gets cheap realizations simply computes more of them, exactly n_config
+realizations are computed, and process 0 does not have to stop its own calculation
+to serve the other processes.
+As each realization depends only on its index (with reproducible_randomness), the
+averaged results are the same as with a static split, up to the order of the floating point sums.
+This order depends on the assignment of the realizations, which changes from run to run, hence
+the results are not bit-reproducible. Thus, with static=True (--static option of the drivers),
+process rank computes the realizations rank, rank+nprocs, rank+2*nprocs... in increasing order:
+the results are then bit-reproducible for a given number of processes, also after a restart from a checkpoint.
+
+Without MPI, run_workers distributes the realizations in the same way among local processes
+(--workers option of the drivers), the shared counter being then a multiprocessing.Value.
+"""
+
+import numpy as np
+
+__all__ = ["Scheduler","run_workers","sum_accumulators"]
+
+class Scheduler:
+# tab_done_config lists the realizations already computed by this process in a previous run (see io.load_checkpoint)
+# The realizations computed by any process are not distributed again
+# counter is the shared counter of the local worker processes (see run_workers), None otherwise
+# static is True for the static split described above, which needs no communication at all
+  def __init__(self,mpi_version,comm,nprocs,rank,n_config,tab_done_config=[],counter=None,static=False):
+    self.n_config = n_config
+    self.tab_my_config = [int(i) for i in tab_done_config]
+    self.window = None
+    self.counter = counter
+    self.static = static
+    if static:
+      self.counter = None
+# The realizations of this process still to be computed, in increasing order
+      self.tab_config = np.setdiff1d(np.arange(rank,n_config,nprocs),np.asarray(tab_done_config,dtype=int))
+      self.next_position = 0
+      self.exhausted = False
+      return
+    if mpi_version and nprocs>1:
+      from mpi4py import MPI
+      self.MPI = MPI
+      tab_done_config = np.concatenate([np.asarray(x,dtype=int) for x in comm.allgather(self.tab_my_config)])
+# The shared counter, a single 64-bit integer in the memory of process 0
+      self.window = MPI.Win.Allocate(8 if rank==0 else 0,8,comm=comm)
+      if rank==0:
+        self.window.Lock(0,MPI.LOCK_EXCLUSIVE)
+        self.window.Put(np.zeros(1,dtype=np.int64),0)
+        self.window.Unlock(0)
+      comm.Barrier()
+# The realizations still to be computed, in increasing order
+    self.tab_config = np.setdiff1d(np.arange(n_config),tab_done_config)
+    self.next_position = 0
+    self.exhausted = False
+
+  """
+  Returns the indices of the next (at most batch_size) realizations to be computed by this process,
+  or an empty list when all realizations have been distributed.
+  In the MPI version, the shared counter is released when it is exhausted, which is a collective operation.
+  """
+  def next_batch(self,batch_size=1):
+    if self.exhausted:
+      return []
+    if self.counter is not None:
+      with self.counter.get_lock():
+        position = self.counter.value
+        self.counter.value += batch_size
+    elif self.window is None:
+      position = self.next_position
+      self.next_position += batch_size
+    else:
+      increment = np.array([batch_size],dtype=np.int64)
+      result = np.zeros(1,dtype=np.int64)
+      self.window.Lock(0,self.MPI.LOCK_SHARED)
+      self.window.Fetch_and_op(increment,result,0,0,self.MPI.SUM)
+      self.window.Unlock(0)
+      position = int(result[0])
+    tab_i = [int(i) for i in self.tab_config[position:position+batch_size]]
+    if len(tab_i)==0:
+      self.exhausted = True
+      if self.window is not None:
+        self.window.Free()
+        self.window = None
+    self.tab_my_config += tab_i
+    return tab_i
+
+# Iterates over the indices of the realizations computed by this process, one at a time
+  def __iter__(self):
+    tab_i = self.next_batch()
+    while len(tab_i)>0:
+      yield tab_i[0]
+      tab_i = self.next_batch()
+
+"""
+Runs worker(scheduler) in number_of_workers local processes, the realizations being distributed
+dynamically through a counter in shared memory, exactly as among MPI processes
+(or statically, worker k computing the realizations k, k+number_of_workers... if static is True).
+The processes are forked, so that they inherit everything prepared before the call (Hamiltonian,
+grids, masks...) as shared read-only memory, without any pickling. Only the values returned by worker,
+typically the accumulated sums and the timing, are sent back to the calling process.
+Returns the list of these values, in the order of the workers.
+"""
+def run_workers(number_of_workers,worker,n_config,static=False):
+  import multiprocessing
+  import multiprocessing.connection
+  import pickle
+  import traceback
+  context = multiprocessing.get_context('fork')
+  counter = context.Value('q',0)
+  def target(k,connection):
+    try:
+      if static:
+        scheduler = Scheduler(False,None,number_of_workers,k,n_config,static=True)
+      else:
+        scheduler = Scheduler(False,None,1,0,n_config,counter=counter)
+      message = pickle.dumps(worker(scheduler))
+    except BaseException:
+      message = pickle.dumps(RuntimeError('Worker '+str(k)+' failed:\n'+traceback.format_exc()))
+    connection.send_bytes(message)
+    connection.close()
+  list_of_connections = []
+  list_of_processes = []
+  for k in range(number_of_workers):
+    receiver, sender = context.Pipe(duplex=False)
+    list_of_connections.append(receiver)
+    list_of_processes.append(context.Process(target=target,args=(k,sender)))
+    list_of_processes[k].start()
+    sender.close()
+# The results are read as soon as they arrive, otherwise a large result would block its sender
+# A worker which dies without sending anything (e.g. killed) is detected through its sentinel
+  list_of_results = [None]*number_of_workers
+  pending = set(range(number_of_workers))
+  while len(pending)>0:
+    multiprocessing.connection.wait([list_of_connections[k] for k in pending]+[list_of_processes[k].sentinel for k in pending])
+    for k in list(pending):
+      message = None
+      if list_of_connections[k].poll():
+        try:
+          message = list_of_connections[k].recv_bytes()
+        except EOFError:
+          pass
+      if message is not None:
+        list_of_results[k] = pickle.loads(message)
+        pending.remove(k)
+      elif list_of_processes[k].exitcode is not None:
+        for process in list_of_processes:
+          process.terminate()
+        list_of_processes[k].join()
+        raise RuntimeError('Worker '+str(k)+' died with exit code '+str(list_of_processes[k].exitcode))
+  for process in list_of_processes:
+    process.join()
+  for result in list_of_results:
+    if isinstance(result,RuntimeError):
+      raise result
+  return list_of_results
+
+# Sums dictionaries of accumulators (e.g. returned by the workers of run_workers), key by key
+# None values (nothing accumulated by a worker) are skipped
+def sum_accumulators(list_of_accumulators):
+  total = {}
+  for accumulators in list_of_accumulators:
+    for key,value in accumulators.items():
+      if value is None:
+        total.setdefault(key,None)
+      elif total.get(key) is None:
+        total[key] = np.copy(value)
+      else:
+        total[key] += value
+  return total
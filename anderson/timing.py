@@ -6,6 +6,8 @@ Created on Sun Nov 22 19:25:02 2020
 @author: delande
 """
 
+import numpy as np
+
 class Timing:
   def __init__(self):
     self.GPE_TIME=0.0
@@ -38,36 +40,46 @@ class Timing:
     return
 
   def mpi_merge(self,comm):
-    try:
-      from mpi4py import MPI
-    except ImportError:
-      print("mpi4py is not found!")
-      return
-    self.GPE_TIME       = comm.reduce(self.GPE_TIME)
-    self.GPE_NOPS       = comm.reduce(self.GPE_NOPS)
-    self.CHE_TIME       = comm.reduce(self.CHE_TIME)
-    self.CHE_NOPS       = comm.reduce(self.CHE_NOPS)
-    self.EXPECT_TIME    = comm.reduce(self.EXPECT_TIME)
-    self.EXPECT_NOPS    = comm.reduce(self.EXPECT_NOPS)
-    self.ODE_TIME       = comm.reduce(self.ODE_TIME)
-    self.ODE_NOPS       = comm.reduce(self.ODE_NOPS)
-    self.TOTAL_TIME     = comm.reduce(self.TOTAL_TIME)
-    self.TOTAL_NOPS     = comm.reduce(self.TOTAL_NOPS)
-    self.N_SOLOUT       = comm.reduce(self.N_SOLOUT)
-    self.MAX_CHE_ORDER  = comm.reduce(self.MAX_CHE_ORDER,op=MPI.MAX)
-    self.DUMMY_TIME     = comm.reduce(self.DUMMY_TIME)
-    self.LYAPOUNOV_TIME = comm.reduce(self.LYAPOUNOV_TIME)
-    self.LYAPOUNOV_NOPS = comm.reduce(self.LYAPOUNOV_NOPS)
-    self.LYAPOUNOV_MATRIX_FACTORIZATION_TIME = comm.reduce(self.LYAPOUNOV_MATRIX_FACTORIZATION_TIME)
-    self.LYAPOUNOV_MATRIX_FACTORIZATION_NOPS = comm.reduce(self.LYAPOUNOV_MATRIX_FACTORIZATION_NOPS)
-    self.LYAPOUNOV_MATRIX_SOLUTION_TIME = comm.reduce(self.LYAPOUNOV_MATRIX_SOLUTION_TIME)
-    self.LYAPOUNOV_MATRIX_SOLUTION_NOPS = comm.reduce(self.LYAPOUNOV_MATRIX_SOLUTION_NOPS)
-    self.LYAPOUNOV_SCALAR_TIME = comm.reduce(self.LYAPOUNOV_SCALAR_TIME)
-    self.LYAPOUNOV_SCALAR_NOPS = comm.reduce(self.LYAPOUNOV_SCALAR_NOPS)
-    self.MAX_NONLINEAR_PHASE = comm.reduce(self.MAX_NONLINEAR_PHASE,op=MPI.MAX)
-    self.MPI_TIME       = comm.reduce(self.MPI_TIME)
-    self.KPM_TIME       = comm.reduce(self.KPM_TIME)
-    self.KPM_NOPS       = comm.reduce(self.KPM_NOPS)
-    self.SPECTRUM_TIME  = comm.reduce(self.SPECTRUM_TIME)
-    self.SPECTRUM_NOPS  = comm.reduce(self.SPECTRUM_NOPS)
+# All counters are gathered on process 0 with a single collective operation, as one structured array
+# with one record per process. On process 0, the counters are then summed (the MAX_ ones are maximized),
+# and the per-process values are kept in self.tab_per_process for the min/mean/max statistics.
+    list_of_names = [name for name in vars(self) if name.isupper()]
+    local_values = np.array([getattr(self,name) for name in list_of_names],dtype=np.float64)
+    rank = comm.Get_rank()
+    if rank==0:
+      all_values = np.empty((comm.Get_size(),len(list_of_names)),dtype=np.float64)
+    else:
+      all_values = None
+    comm.Gather(local_values,all_values,root=0)
+    if rank==0:
+      self.merge_values(list_of_names,all_values)
+    return
+
+  def merge(self,list_of_timings):
+# Same as mpi_merge, for the timings returned by local worker processes (see anderson.scheduler.run_workers)
+    list_of_names = [name for name in vars(self) if name.isupper()]
+    self.merge_values(list_of_names,np.array([[getattr(timing,name) for name in list_of_names] for timing in list_of_timings],dtype=np.float64))
     return
+
+  def merge_values(self,list_of_names,all_values):
+# all_values[k] contains the counters (in the order of list_of_names) of process k
+    self.tab_per_process = all_values.view([(name,np.float64) for name in list_of_names]).ravel()
+    for name in list_of_names:
+      value = float(np.max(self.tab_per_process[name])) if name.startswith('MAX_') else float(np.sum(self.tab_per_process[name]))
+# N_SOLOUT and MAX_CHE_ORDER are integers
+      if isinstance(getattr(self,name),int) and value.is_integer():
+        value = int(value)
+      setattr(self,name,value)
+    return
+
+  def statistics_string(self):
+# Min/mean/max over the processes of the non-zero times, available on process 0 after mpi_merge or merge
+# Useful to check the load balance between processes
+    if not hasattr(self,'tab_per_process'):
+      return ''
+    string = 'Time per process (min/mean/max) over {} processes:\n'.format(self.tab_per_process.size)
+    for name in self.tab_per_process.dtype.names:
+      tab_time = self.tab_per_process[name]
+      if name.endswith('_TIME') and np.max(tab_time)>0.0:
+        string += '  {0:<36s}= {1:.3f} / {2:.3f} / {3:.3f}\n'.format(name,np.min(tab_time),np.mean(tab_time),np.max(tab_time))
+    return string
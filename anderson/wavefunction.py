@@ -13,7 +13,7 @@ from anderson.geometry import Geometry
 
 class Wavefunction(Geometry):
   def __init__(self, geometry):
-    super().__init__(geometry.dimension,geometry.tab_dim,geometry.tab_delta,spin_one_half=geometry.spin_one_half,use_mkl_random=geometry.use_mkl_random,use_mkl_fft=geometry.use_mkl_fft, reproducible_randomness=geometry.reproducible_randomness, custom_seed=geometry.custom_seed)
+    super().__init__(geometry.dimension,geometry.tab_dim,geometry.tab_delta,spin_one_half=geometry.spin_one_half,use_mkl_random=geometry.use_mkl_random,use_mkl_fft=geometry.use_mkl_fft, reproducible_randomness=geometry.reproducible_randomness, custom_seed=geometry.custom_seed, counter_based_random=geometry.counter_based_random, random_number_of_threads=geometry.random_number_of_threads)
     self.wfc = np.zeros(self.tab_extended_dim,dtype=np.complex128)
     self.seed = 0
     return
@@ -172,7 +172,7 @@ class Wavefunction(Geometry):
 # 2. Multiply each component by exp(i*phi) with phi a real random number uniformly distributed in [0,2*pi]
 # The two should be essentially equivalent
 # First select the random number generator
-    my_rng = self.rng(seed)
+    my_rng = self.rng(seed,'initial_state')
 # Comment out at least one of the two methods
 # If both are commented out, we are back to a Gaussian wavepacket with zero momentum      
 # Method 1:      
@@ -215,7 +215,7 @@ class Wavefunction(Geometry):
     mask = np.exp(mask)
     mask *= np.sqrt(self.ntot/np.sum(mask**2))
 #    print('mask',mask)
-    my_rng = self.rng(seed)  
+    my_rng = self.rng(seed,'initial_state')  
 #      my_random_uniform = np.random.uniform
     grid_position = np.meshgrid(*self.grid_position,indexing='ij')
     tab_phase = np.zeros(self.tab_dim)
@@ -310,7 +310,7 @@ class Wavefunction(Geometry):
     if self.spin_one_half:
       sys.exit("random initial state not yet implemented for spin-orbit systems, I stop!")
     self.seed = seed
-    my_rng = self.rng(seed)
+    my_rng = self.rng(seed,'initial_state')
     my_random_sequence = my_rng.standard_normal(2*self.ntot)
 #    print(seed,my_random_sequence[0])
     my_sum = np.sum(my_random_sequence**2)
@@ -330,7 +330,7 @@ class Wavefunction(Geometry):
     if self.spin_one_half:
       sys.exit("muti_point initial state not yet implemented for spin-orbit systems, I stop!")
     self.seed = seed
-    my_rng = self.rng(seed)
+    my_rng = self.rng(seed,'initial_state')
     A = np.empty(self.dimension,dtype=object)
     for i in range(self.dimension):
 # If the minimum distance is too small (=0 when not set), only a single point is used
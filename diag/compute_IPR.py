@@ -45,6 +45,8 @@ import anderson
 def main():
   parser = argparse.ArgumentParser(description='Compute IPR of eigenstates')
   parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing parameters of the calculation')
+  parser.add_argument('--workers', type=int, default=1, help='without MPI, number of local processes among which the disorder configurations are distributed [default=1]')
+  parser.add_argument('--static', action='store_true', help='distribute the disorder configurations statically among the processes, for bit-reproducible results [default=dynamic distribution]')
   args = parser.parse_args()
   parameter_file = args.filename.name
 
@@ -58,6 +60,9 @@ def main():
              +'Name of python script:  {}'.format(os.path.abspath( __file__ ))+'\n'\
              +'Name of parameter file: {}'.format(os.path.abspath(parameter_file))+'\n'\
              +mpi_string+'\n'
+  number_of_workers = anderson.io.get_number_of_workers(args,mpi_version,rank)
+  if number_of_workers>1:
+    environment_string += 'Disorder configurations distributed among '+str(number_of_workers)+' local worker processes\n'
 
   if rank==0:
     initial_time=time.asctime()
@@ -72,7 +77,7 @@ def main():
 # Parse parameter file and prepare the useful objects:
 # H for the Hamiltonian of the system
 # diagonalization for exact (or sparse) diagonalization
-  geometry, H, diagonalization, n_config = anderson.io.parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,['Diagonalization','Spin'])
+  geometry, H, _, diagonalization, n_config = anderson.io.parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,['Diagonalization','Spin'])
 
   t1=time.perf_counter()
   my_timing=anderson.timing.Timing()
@@ -83,28 +88,46 @@ def main():
 # At this point, it it not yet known whether there is a C implementation available
     header_string = environment_string+anderson.io.output_string(H,n_config,nprocs,diagonalization=diagonalization)
 
-  number_of_eigenvalues = diagonalization.number_of_eigenvalues
+# With several targeted energies, the eigenvalues for all targeted energies are computed for each configuration
+  number_of_targeted_energies = diagonalization.tab_targeted_energy.size
+  number_of_eigenvalues = diagonalization.number_of_eigenvalues*number_of_targeted_energies
   tab_IPR = np.zeros(n_config*number_of_eigenvalues)
   tab_energy = np.zeros(n_config*number_of_eigenvalues)
 
   # Here starts the loop over disorder configurations
-  for i in range(n_config):
-    tab_energy[i*number_of_eigenvalues:(i+1)*number_of_eigenvalues], tab_IPR[i*number_of_eigenvalues:(i+1)*number_of_eigenvalues] = diagonalization.compute_IPR(i+rank*n_config, H)
+# The configurations are distributed among the processes (see anderson.scheduler), the results of configuration i
+# are stored at position i, so that the process which computed them does not matter
+  def run_realizations(scheduler):
+    for i in scheduler:
+      tab_energy[i*number_of_eigenvalues:(i+1)*number_of_eigenvalues], tab_IPR[i*number_of_eigenvalues:(i+1)*number_of_eigenvalues] = diagonalization.compute_IPR(i, H)
+# Without MPI, the configurations may be distributed among local worker processes, each returning
+# its tab_energy and tab_IPR (zero for the configurations it did not compute) and its timing
+  if number_of_workers>1:
+    def worker(scheduler):
+      run_realizations(scheduler)
+      my_timing.TOTAL_TIME = time.perf_counter()-t1
+      return {'tab_energy':tab_energy,'tab_IPR':tab_IPR}, my_timing
+    list_of_results = anderson.scheduler.run_workers(number_of_workers,worker,n_config,static=args.static)
+    accumulators = anderson.scheduler.sum_accumulators([result[0] for result in list_of_results])
+    tab_energy = accumulators['tab_energy']
+    tab_IPR = accumulators['tab_IPR']
+    my_timing.merge([result[1] for result in list_of_results])
+  else:
+    run_realizations(anderson.scheduler.Scheduler(mpi_version,comm,nprocs,rank,n_config,static=args.static))
 
 #    H.generate_full_matrix()
 #    print(H.generate_full_complex_matrix(1.0j))
   if mpi_version:
     start_mpi_time = timeit.default_timer()
-    tab_energy_glob = np.zeros(n_config*nprocs*number_of_eigenvalues)
-    tab_IPR_glob = np.zeros(n_config*nprocs*number_of_eigenvalues)
-    comm.Gather(tab_energy,tab_energy_glob)
-    comm.Gather(tab_IPR,tab_IPR_glob)
+    tab_energy_glob, tab_IPR_glob = anderson.measurement.mpi_reduce_arrays(comm,[tab_energy,tab_IPR])
     my_timing.MPI_TIME+=(timeit.default_timer() - start_mpi_time)
   else:
     tab_energy_glob = tab_energy
     tab_IPR_glob = tab_IPR
   t2=time.perf_counter()
-  my_timing.TOTAL_TIME = t2-t1
+# With local workers, TOTAL_TIME is already the sum of the times of the workers
+  if number_of_workers==1:
+    my_timing.TOTAL_TIME = t2-t1
   if mpi_version:
     my_timing.mpi_merge(comm)
   if rank==0:
@@ -112,11 +135,20 @@ def main():
 #    print(tab_IPR_glob)
 #    print(tab_IPR_glob.shape)
     header_string +='Minimum energy = '+str(np.min(tab_energy_glob))+'\nMaximum energy = '+str(np.max(tab_energy_glob))+'\n'
-    anderson.io.output_density('IPR.dat',tab_IPR_glob,H,header_string=header_string,tab_abscissa=None,data_type='IPR')
-    tab_histogram, bin_edges = np.histogram(tab_IPR_glob, bins=diagonalization.number_of_bins, range=(diagonalization.IPR_min,diagonalization.IPR_max), density=True)
+    if diagonalization.multi_energy:
+# One column per targeted energy, and one histogram per targeted energy
+      tab_IPR_glob = tab_IPR_glob.reshape(-1,number_of_targeted_energies,diagonalization.number_of_eigenvalues).transpose(0,2,1).reshape(-1,number_of_targeted_energies)
+      anderson.io.output_density('IPR.dat',tab_IPR_glob,H,header_string=header_string,tab_abscissa=diagonalization.tab_targeted_energy,data_type='IPR')
+      tab_histogram = np.zeros((number_of_targeted_energies,diagonalization.number_of_bins))
+      for j in range(number_of_targeted_energies):
+        tab_histogram[j], bin_edges = np.histogram(tab_IPR_glob[:,j], bins=diagonalization.number_of_bins, range=(diagonalization.IPR_min,diagonalization.IPR_max), density=True)
+      anderson.io.output_density('histogram_IPR.dat',tab_histogram,H,header_string=header_string,tab_abscissa=[bin_edges[1:],diagonalization.tab_targeted_energy],data_type='histogram_IPR')
+    else:
+      anderson.io.output_density('IPR.dat',tab_IPR_glob,H,header_string=header_string,tab_abscissa=None,data_type='IPR')
+      tab_histogram, bin_edges = np.histogram(tab_IPR_glob, bins=diagonalization.number_of_bins, range=(diagonalization.IPR_min,diagonalization.IPR_max), density=True)
 #    print(tab_histogram)
 #    print(bin_edges)
-    anderson.io.output_density('histogram_IPR.dat',tab_histogram,H,header_string=header_string,tab_abscissa=bin_edges[1:],data_type='histogram_IPR')
+      anderson.io.output_density('histogram_IPR.dat',tab_histogram,H,header_string=header_string,tab_abscissa=bin_edges[1:],data_type='histogram_IPR')
     final_time = time.asctime()
     print("Python script ended on: {}".format(final_time))
     print("Wallclock time {0:.3f} seconds".format(t2-t1))
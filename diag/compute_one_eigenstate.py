@@ -45,6 +45,7 @@ import anderson
 def main():
   parser = argparse.ArgumentParser(description='Compute the eigenstate closest to some target energy')
   parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing parameters of the calculation')
+  parser.add_argument('--static', action='store_true', help='distribute the disorder configurations statically among the processes, for bit-reproducible results [default=dynamic distribution]')
   args = parser.parse_args()
   parameter_file = args.filename.name
 
@@ -87,12 +88,25 @@ def main():
 #  print(H.tab_dim)
 #  print(tab_eigenstate)
   # Here starts the loop over disorder configurations
-  for i in range(n_config):
-#    tab_energy[i*number_of_eigenvalues:(i+1)*number_of_eigenvalues], tab_eigenstate[:,i*number_of_eigenvalues:(i+1)*number_of_eigenvalues] = diagonalization.compute_wavefunction(i+rank*n_config, H)
-    a, b = diagonalization.compute_wavefunction(i+rank*n_config, H)
-    energy = a[0]
-    tab_eigenstate = b[:,0].reshape(H.tab_dim)
+# The configurations are distributed among the processes, dynamically, or statically with --static (see anderson.scheduler)
+# The eigenstate printed is the one of the last configuration, n_config-1, whatever the number of processes
+  last_i = -1
+  energy = None
+  tab_eigenstate = None
+  for i in anderson.scheduler.Scheduler(mpi_version,comm,nprocs,rank,n_config,static=args.static):
+#    tab_energy[i*number_of_eigenvalues:(i+1)*number_of_eigenvalues], tab_eigenstate[:,i*number_of_eigenvalues:(i+1)*number_of_eigenvalues] = diagonalization.compute_wavefunction(i, H)
+    a, b = diagonalization.compute_wavefunction(i, H)
+    if i>last_i:
+      last_i = i
+      energy = a[0]
+      tab_eigenstate = b[:,0].reshape(H.tab_dim)
 #    print(energy,tab_eigenstate)
+  if mpi_version:
+    start_mpi_time = timeit.default_timer()
+    list_of_results = comm.gather((last_i,energy,tab_eigenstate),root=0)
+    if rank==0:
+      last_i, energy, tab_eigenstate = max(list_of_results,key=lambda result: result[0])
+    my_timing.MPI_TIME+=(timeit.default_timer() - start_mpi_time)
   t2 = time.perf_counter()
   my_timing.TOTAL_TIME = t2-t1
   if rank==0:
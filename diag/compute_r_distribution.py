@@ -44,6 +44,7 @@ import anderson
 def main():
   parser = argparse.ArgumentParser(description='Compute r distribution at a given energy')
   parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing parameters of the calculation')
+  parser.add_argument('--static', action='store_true', help='distribute the disorder configurations statically among the processes, for bit-reproducible results [default=dynamic distribution]')
   args = parser.parse_args()
   parameter_file = args.filename.name
 
@@ -73,47 +74,48 @@ def main():
 # propagation for the propagation scheme
 # measurement for the measurement scheme
 # measurement_global is used to gather (average) the results for several disorder configurations
-  geometry, H, diagonalization, n_config = anderson.io.parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,['Diagonalization','Spin'])
+  geometry, H, _, diagonalization, n_config = anderson.io.parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,['Diagonalization','Spin'])
   t1=time.perf_counter()
   my_timing=anderson.timing.Timing()
 
   if rank==0:
     header_string = environment_string+anderson.io.output_string(H,n_config,nprocs,diagonalization=diagonalization)
 
-  tab_r = np.zeros((diagonalization.number_of_eigenvalues-2)*n_config)
-  tab_energy = np.zeros((diagonalization.number_of_eigenvalues-2)*n_config)
+# With several targeted energies, the r values for all targeted energies are computed for each configuration
+  number_of_targeted_energies = diagonalization.tab_targeted_energy.size
+  number_of_r = (diagonalization.number_of_eigenvalues-2)*number_of_targeted_energies
+  tab_r = np.zeros(number_of_r*n_config)
+  tab_energy = np.zeros(number_of_r*n_config)
 
   # Here starts the loop over disorder configurations
-  for i in range(n_config):
-    tab_energy[i*(diagonalization.number_of_eigenvalues-2):(i+1)*(diagonalization.number_of_eigenvalues-2)], tab_r[i*(diagonalization.number_of_eigenvalues-2):(i+1)*(diagonalization.number_of_eigenvalues-2)] = diagonalization.compute_tab_r(i+rank*n_config, H)
-  energy_min = np.zeros(1)
-  energy_min[0] = np.min(tab_energy)
-  energy_max = np.zeros(1)
-  energy_max[0] = np.max(tab_energy)
-#  print(energy_min,energy_max)
+# The configurations are distributed among the processes (see anderson.scheduler), the results of configuration i
+# are stored at position i, so that the process which computed them does not matter
+  scheduler = anderson.scheduler.Scheduler(mpi_version,comm,nprocs,rank,n_config,static=args.static)
+  for i in scheduler:
+    tab_energy[i*number_of_r:(i+1)*number_of_r], tab_r[i*number_of_r:(i+1)*number_of_r] = diagonalization.compute_tab_r(i, H)
   if mpi_version:
     start_mpi_time = timeit.default_timer()
-    tab_r_glob = np.zeros((diagonalization.number_of_eigenvalues-2)*n_config*nprocs)
-    comm.Gather(tab_r,tab_r_glob)
-    from mpi4py import MPI
-    energy_glob=np.zeros(1)
-    comm.Reduce(energy_min,energy_glob,op=MPI.MIN)
-    energy_min[0] = energy_glob[0]
-    comm.Reduce(energy_max,energy_glob,op=MPI.MAX)
-    energy_max[0] = energy_glob[0]
- #    comm.Allreduce(MPI.IN_PLACE,energy_max,op=MPI.MAX)
+    tab_r_glob, tab_energy_glob = anderson.measurement.mpi_reduce_arrays(comm,[tab_r,tab_energy])
     my_timing.MPI_TIME+=(timeit.default_timer() - start_mpi_time)
   else:
     tab_r_glob = tab_r
+    tab_energy_glob = tab_energy
   t2=time.perf_counter()
   my_timing.TOTAL_TIME = t2-t1
   if mpi_version:
     my_timing.mpi_merge(comm)
   if rank==0:
-#    print(energy_min[0],energy_max[0])
-    header_string +='Minimum energy = '+str(energy_min[0])+'\nMaximum energy = '+str(energy_max[0])+'\n'
-    tab_histogram, bin_edges = np.histogram(tab_r_glob, bins=diagonalization.number_of_bins, range=(0.,1.0), density=True)
-    anderson.io.output_density('histogram_r.dat',tab_histogram,H,header_string=header_string,tab_abscissa=bin_edges[1:],data_type='histogram_r')
+    header_string +='Minimum energy = '+str(np.min(tab_energy_glob))+'\nMaximum energy = '+str(np.max(tab_energy_glob))+'\n'
+    if diagonalization.multi_energy:
+# One histogram per targeted energy
+      tab_r_glob = tab_r_glob.reshape(-1,number_of_targeted_energies,diagonalization.number_of_eigenvalues-2)
+      tab_histogram = np.zeros((number_of_targeted_energies,diagonalization.number_of_bins))
+      for j in range(number_of_targeted_energies):
+        tab_histogram[j], bin_edges = np.histogram(tab_r_glob[:,j], bins=diagonalization.number_of_bins, range=(0.,1.0), density=True)
+      anderson.io.output_density('histogram_r.dat',tab_histogram,H,header_string=header_string,tab_abscissa=[bin_edges[1:],diagonalization.tab_targeted_energy],data_type='histogram_r')
+    else:
+      tab_histogram, bin_edges = np.histogram(tab_r_glob, bins=diagonalization.number_of_bins, range=(0.,1.0), density=True)
+      anderson.io.output_density('histogram_r.dat',tab_histogram,H,header_string=header_string,tab_abscissa=bin_edges[1:],data_type='histogram_r')
     final_time = time.asctime()
     print("Python script ended on: {}".format(final_time))
     print("Wallclock time {0:.3f} seconds".format(t2-t1))
@@ -45,6 +45,7 @@ import anderson
 def main():
   parser = argparse.ArgumentParser(description='Compute rbar vs. energy')
   parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing parameters of the calculation')
+  parser.add_argument('--static', action='store_true', help='distribute the disorder configurations statically among the processes, for bit-reproducible results [default=dynamic distribution]')
   args = parser.parse_args()
   parameter_file = args.filename.name
 
@@ -74,18 +75,16 @@ def main():
 # propagation for the propagation scheme
 # measurement for the measurement scheme
 # measurement_global is used to gather (average) the results for several disorder configurations
-  H, diagonalization, n_config = anderson.io.parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,['Diagonalization'])
+  geometry, H, _, diagonalization, n_config = anderson.io.parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,['Diagonalization'])
 # Force lapack diagonalization
   diagonalization.method = 'lapack'
   diagonalization.number_of_eigenvalues = H.ntot
   t1=time.perf_counter()
-  timing=anderson.Timing()
-
-  if rank==0:
+  timing=anderson.timing.Timing()
 
 # Print various things for the initial state
 # At this point, it it not yet known whether there is a C implementation available
-    header_string = environment_string+anderson.io.output_string(H,n_config,nprocs,diagonalization=diagonalization)
+  header_string = environment_string+anderson.io.output_string(H,n_config,nprocs,diagonalization=diagonalization)
 
   tab_r = np.zeros(H.ntot-2)
   tab_energy = np.zeros(H.ntot-2)
@@ -100,8 +99,10 @@ def main():
   tab_middle_energy = np.arange(start=emin,stop=emax,step=estep)+0.5*estep
 
   # Here starts the loop over disorder configurations
-  for i in range(n_config):
-    tab_energy, tab_r = diagonalization.compute_tab_r(i+rank*n_config, H)
+# The configurations are distributed among the processes, dynamically, or statically with --static (see anderson.scheduler)
+  scheduler = anderson.scheduler.Scheduler(mpi_version,comm,nprocs,rank,n_config,static=args.static)
+  for i in scheduler:
+    tab_energy, tab_r = diagonalization.compute_tab_r(i, H)
 # accumulate r values in an energy-dependent array
     for j in range(H.ntot-2):
       k = int((tab_energy[j]-emin)/estep)
@@ -109,18 +110,18 @@ def main():
       k = min(k,nsteps-1)
       tab_num[k]+=1
       tab_hist_r[k]+=tab_r[j]
-  for k in range(nsteps):
-    tab_hist_r[k]/=tab_num[k]
 #    H.generate_full_matrix()
 #    print(H.generate_full_complex_matrix(1.0j))
+# The numbers of configurations computed by the processes differ, hence the sums (not the averages) are merged
   if mpi_version:
     start_mpi_time = timeit.default_timer()
-    tab_hist_r_glob = np.empty_like(tab_hist_r)
-    comm.Reduce(tab_hist_r,tab_hist_r_glob)
-    tab_hist_r_glob/=nprocs
+    tab_hist_r_glob, tab_num_glob = anderson.measurement.mpi_reduce_arrays(comm,[tab_hist_r,tab_num])
     timing.MPI_TIME+=(timeit.default_timer() - start_mpi_time)
   else:
     tab_hist_r_glob = tab_hist_r
+    tab_num_glob = tab_num
+  for k in range(nsteps):
+    tab_hist_r_glob[k]/=tab_num_glob[k]
   t2=time.perf_counter()
   timing.TOTAL_TIME = t2-t1
   if mpi_version:
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Aug 16 17:05:10 2019
+
+@author: delande
+
+"""
+__author__ = "Dominique Delande"
+__copyright__ = "Copyright (C) 2020 Dominique Delande"
+__license__ = "GPL version 2 or later"
+__version__ = "1.0"
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+# ____________________________________________________________________
+#
+# compute_landscape_iterative.py
+# Author: Dominique Delande
+# Release date: April, 27, 2020
+# License: GPL2 or later
+
+import os
+import time
+import getpass
+import sys
+import argparse
+sys.path.append('/users/champ/delande/git/and-python')
+sys.path.append('/home/lkb/delande/git/and-python')
+import anderson
+
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Compute the landscape function of large 2d/3d systems with an iterative solver')
+  parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing parameters of the calculation')
+  parser.add_argument('--static', action='store_true', help='distribute the disorder configurations statically among the processes, for bit-reproducible results [default=dynamic distribution]')
+  args = parser.parse_args()
+  parameter_file = args.filename.name
+
+# Determine is the script is ran inside MPI
+# If yes, set the mpi_version to True, the  MPI communicator to comm, the number of
+# MPI processes to nprocs, the rank of the current process to rank, and
+# set mpi_string to something containing minimal MPI information
+# If not run inside MPI, nprocs=1 and rank=0
+  mpi_version, comm, nprocs, rank, mpi_string = anderson.determine_if_launched_by_mpi()
+  environment_string='Script ran by '+getpass.getuser()+' on machine '+os.uname()[1]+'\n'\
+             +'Name of python script:  {}'.format(os.path.abspath( __file__ ))+'\n'\
+             +'Name of parameter file: {}'.format(os.path.abspath(parameter_file))+'\n'\
+             +mpi_string+'\n'
+
+  if rank==0:
+    initial_time=time.asctime()
+    print("Python script runs on machine : "+os.uname()[1])
+    print("Name of python script:  {}".format(os.path.abspath( __file__ )))
+    print("Name of parameter file: {}".format(os.path.abspath(parameter_file)))
+    print()
+    print("Python script started on: {}".format(initial_time))
+    print()
+
+# Parse parameter file and prepare the useful objects:
+# H for the Hamiltonian of the system
+# diagonalization for the pivot and the parameters of the iterative solver
+  geometry, H, _, diagonalization, n_config = anderson.io.parse_parameter_file(mpi_version,comm,nprocs,rank,parameter_file,['Diagonalization'])
+
+  t1=time.perf_counter()
+  my_timing=anderson.timing.Timing()
+
+# Each process writes the landscapes of its own disorder configurations
+  header_string = environment_string+anderson.io.output_string(H,n_config,nprocs,diagonalization=diagonalization)
+
+  # Here starts the loop over disorder configurations, distributed among the processes (see anderson.scheduler)
+# The landscape of each configuration is the initial guess for the next one
+  scheduler = anderson.scheduler.Scheduler(mpi_version,comm,nprocs,rank,n_config,static=args.static)
+  for i in scheduler:
+    landscape = diagonalization.compute_landscape_iterative(i, H, diagonalization.pivot)
+    postfix = '' if n_config==1 else '_'+str(i)
+    local_header_string = header_string+'Disorder configuration = '+str(i)+'\n'\
+                         +'Number of conjugate gradient iterations = '+str(diagonalization.landscape_iterations)+'\n'
+    anderson.io.output_density('landscape'+postfix+'.dat',landscape,H,header_string=local_header_string,data_type='landscape')
+    anderson.io.output_density('potential'+postfix+'.dat',H.disorder-H.diagonal,H,header_string=local_header_string,data_type='potential')
+
+  t2=time.perf_counter()
+  my_timing.TOTAL_TIME = t2-t1
+  if mpi_version:
+    my_timing.mpi_merge(comm)
+  if rank==0:
+    final_time = time.asctime()
+    print("Python script ended on: {}".format(final_time))
+    print("Wallclock time {0:.3f} seconds".format(t2-t1))
+    print()
+    if mpi_version:
+      print("MPI time             = {0:.3f}".format(my_timing.MPI_TIME))
+    print("Total_CPU time       = {0:.3f}".format(my_timing.TOTAL_TIME))
+
+if __name__ == "__main__":
+  main()
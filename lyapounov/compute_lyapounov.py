@@ -44,9 +44,19 @@ import anderson
 
 #import matplotlib.pyplot as plt
 
+# With the dynamic distribution of the disorder configurations, a process may have computed none of them
+# Its accumulator is then still None, and it contributes zeros, with the shape found in the other processes
+def zeros_if_none(comm,x):
+  shape = [y for y in comm.allgather(None if x is None else x.shape) if y is not None][0]
+  return np.zeros(shape) if x is None else x
+
 def main():
   parser = argparse.ArgumentParser(description='Compute the Lyapounov (inverse of localization length) vs. energy')
   parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing parameters of the calculation')
+  parser.add_argument('--resume', action='store_true', help='restart from the last checkpoint, if any')
+  parser.add_argument('--checkpoint_interval', type=float, default=600.0, help='wallclock time (in seconds) between two checkpoints, 0 for no checkpoint [default=600]')
+  parser.add_argument('--workers', type=int, default=1, help='without MPI, number of local processes among which the disorder configurations are distributed [default=1]')
+  parser.add_argument('--static', action='store_true', help='distribute the disorder configurations statically among the processes, for bit-reproducible results [default=dynamic distribution]')
   args = parser.parse_args()
   parameter_file = args.filename.name
 
@@ -60,6 +70,9 @@ def main():
              +'Name of python script:  {}'.format(os.path.abspath( __file__ ))+'\n'\
              +'Name of parameter file: {}'.format(os.path.abspath(parameter_file))+'\n'\
              +mpi_string+'\n'
+  number_of_workers = anderson.io.get_number_of_workers(args,mpi_version,rank)
+  if number_of_workers>1:
+    environment_string += 'Disorder configurations distributed among '+str(number_of_workers)+' local worker processes\n'
 
   if rank==0:
     initial_time=time.asctime()
@@ -90,52 +103,153 @@ def main():
 #  tab_mean_lyapounov = np.zeros(number_of_e_steps+1)
 #  tab_std_lyapounov = np.zeros(number_of_e_steps+1)
 #  tab_lyapounov = np.zeros(number_of_e_steps+1)
-  global_lyapounov = np.zeros(2)
-  debug = True
+# In a sweep over disorder strengths (V0_list in the Disorder section), the random field of each configuration
+# is generated once and rescaled for each V0. Otherwise, there is a single V0
+  sweep = H.tab_disorder_strength is not None
+  if sweep:
+    tab_V0 = H.tab_disorder_strength
+  else:
+    tab_V0 = np.array([H.disorder_strength])
+  number_of_V0 = tab_V0.size
+# One line per V0, one column per energy (a single one unless number_of_e_steps>0 in the Lyapounov section)
+  global_lyapounov = np.zeros((2,number_of_V0,lyapounov.tab_energy.size))
+# The debug mode (evolution of log(transmission) along the system) is available only in dimension 2 and 3
+  debug = H.dimension>1
+# With the QR method, all positive Lyapounov exponents are also averaged
+  all_exponents = H.dimension>1 and lyapounov.method=='qr'
+  global_spectrum = None
 #  debug = False
 #  if mpi_version and debug:
 #    debug = False
 #    if rank==0:
 #      print('Debugging is not supported in the MPI version, I switch it off\n')
 #
-# Here starts the loop over disorder configurations
-  for i in range(n_config):
-    if debug:
-      my_lyapounov, tab_x, tab_log_trans = lyapounov.compute_lyapounov(i+rank*n_config, H, timing, debug=True)
-      if i==0:
-        tab_global_log_trans = np.zeros_like(tab_log_trans)
-      tab_global_log_trans += tab_log_trans
-    else:
-      my_lyapounov = lyapounov.compute_lyapounov(i+rank*n_config, H, timing)
-    global_lyapounov[0] += my_lyapounov
-    global_lyapounov[1] += my_lyapounov**2
+  tab_global_log_trans = None
+  tab_x = None
+# Each process periodically saves its partial sums in a checkpoint file, used by --resume
+  checkpoint_file = anderson.io.checkpoint_file_name('checkpoint_lyapounov',rank)
+  fingerprint = anderson.io.checkpoint_fingerprint(parameter_file,nprocs,n_config)
+  tab_done_config = []
+  if args.resume:
+    tab_done_config, accumulators = anderson.io.load_checkpoint(checkpoint_file,fingerprint,timing)
+    if accumulators is not None:
+      global_lyapounov = accumulators['global_lyapounov']
+      if all_exponents:
+        global_spectrum = accumulators['global_spectrum']
+      if debug:
+        tab_x = accumulators['tab_x']
+        tab_global_log_trans = accumulators['tab_global_log_trans']
+      print('Process '+str(rank)+' resumes after '+str(len(tab_done_config))+' disorder configurations')
+  last_checkpoint_time = t1
+# Here starts the loop over disorder configurations, computing the configurations given by the scheduler
+# In dimension 1, batch_size configurations (1 by default) are processed together by a vectorized kernel
+  def run_realizations(scheduler):
+    nonlocal global_spectrum, tab_global_log_trans, tab_x, last_checkpoint_time
+    tab_i_seed = scheduler.next_batch(lyapounov.batch_size)
+    while len(tab_i_seed)>0:
+      if lyapounov.batch_size>1:
+        if sweep:
+          tab_lyapounov = lyapounov.compute_lyapounov_batched(tab_i_seed, H, timing, tab_disorder_strength=tab_V0)
+        else:
+          tab_lyapounov = lyapounov.compute_lyapounov_batched(tab_i_seed, H, timing)[np.newaxis]
+        global_lyapounov[0] += np.sum(tab_lyapounov,axis=1).reshape(number_of_V0,-1)
+        global_lyapounov[1] += np.sum(tab_lyapounov**2,axis=1).reshape(number_of_V0,-1)
+      else:
+        i = tab_i_seed[0]
+        if sweep:
+          H.generate_normalized_disorder(i+1234)
+        for k in range(number_of_V0):
+          if sweep:
+            H.set_disorder_strength(tab_V0[k])
+          if debug:
+            my_lyapounov, tab_x, tab_log_trans = lyapounov.compute_lyapounov(i, H, timing, debug=True, build_disorder=not sweep)
+            if tab_global_log_trans is None:
+              tab_global_log_trans = np.zeros((number_of_V0,)+tab_log_trans.shape)
+            tab_global_log_trans[k] += tab_log_trans
+          else:
+            my_lyapounov = lyapounov.compute_lyapounov(i, H, timing, build_disorder=not sweep)
+          global_lyapounov[0,k] += my_lyapounov
+          global_lyapounov[1,k] += my_lyapounov**2
+          if all_exponents:
+            if global_spectrum is None:
+              global_spectrum = np.zeros((2,number_of_V0)+lyapounov.tab_exponents.shape)
+            global_spectrum[0,k] += lyapounov.tab_exponents
+            global_spectrum[1,k] += lyapounov.tab_exponents**2
+      if args.checkpoint_interval>0.0 and time.perf_counter()-last_checkpoint_time>args.checkpoint_interval:
+        accumulators = {'global_lyapounov':global_lyapounov}
+        if all_exponents:
+          accumulators['global_spectrum'] = global_spectrum
+        if debug:
+          accumulators['tab_x'] = tab_x
+          accumulators['tab_global_log_trans'] = tab_global_log_trans
+        anderson.io.save_checkpoint(checkpoint_file,scheduler.tab_my_config,fingerprint,accumulators,timing,elapsed_time=time.perf_counter()-t1)
+        last_checkpoint_time = time.perf_counter()
+      tab_i_seed = scheduler.next_batch(lyapounov.batch_size)
+# Without MPI, the disorder configurations may be distributed among local worker processes,
+# each returning its partial sums (as in a checkpoint), its timing and tab_x (debug mode only)
+  if number_of_workers>1:
+    def worker(scheduler):
+      run_realizations(scheduler)
+      timing.TOTAL_TIME += time.perf_counter()-t1
+      return {'global_lyapounov':global_lyapounov,'global_spectrum':global_spectrum,'tab_global_log_trans':tab_global_log_trans}, timing, tab_x
+    list_of_results = anderson.scheduler.run_workers(number_of_workers,worker,n_config,static=args.static)
+    accumulators = anderson.scheduler.sum_accumulators([result[0] for result in list_of_results])
+    global_lyapounov = accumulators['global_lyapounov']
+    global_spectrum = accumulators['global_spectrum']
+    tab_global_log_trans = accumulators['tab_global_log_trans']
+    timing.merge([result[1] for result in list_of_results])
+    tab_x = [result[2] for result in list_of_results if result[2] is not None][0] if debug else None
+  else:
+# The disorder configurations are distributed among the processes, dynamically, or statically with --static (see anderson.scheduler)
+    run_realizations(anderson.scheduler.Scheduler(mpi_version,comm,nprocs,rank,n_config,tab_done_config,static=args.static))
   if mpi_version:
     start_mpi_time = timeit.default_timer()
-    global_lyapounov_glob = np.empty_like(global_lyapounov)
-    comm.Reduce(global_lyapounov,global_lyapounov_glob)
-    global_lyapounov = np.copy(global_lyapounov_glob)
+    if all_exponents:
+      global_spectrum = zeros_if_none(comm,global_spectrum)
     if debug:
-      tab_global_log_trans_glob = np.empty_like(tab_global_log_trans)
-      comm.Reduce(tab_global_log_trans,tab_global_log_trans_glob)
-      tab_global_log_trans = np.copy(tab_global_log_trans_glob)
+      tab_global_log_trans = zeros_if_none(comm,tab_global_log_trans)
+      tab_x = [x for x in comm.allgather(tab_x) if x is not None][0]
+# All sums are reduced together, global_spectrum and tab_global_log_trans being None when not computed
+    list_of_arrays = [global_lyapounov,global_spectrum,tab_global_log_trans]
+    list_of_reduced = anderson.measurement.mpi_reduce_arrays(comm,[x for x in list_of_arrays if x is not None])
+    for k in range(len(list_of_arrays)):
+      if list_of_arrays[k] is not None:
+        list_of_arrays[k] = list_of_reduced.pop(0)
+    global_lyapounov, global_spectrum, tab_global_log_trans = list_of_arrays
     timing.MPI_TIME+=(timeit.default_timer() - start_mpi_time)
   t2 = time.perf_counter()
-  timing.TOTAL_TIME = t2-t1
+# With local workers, TOTAL_TIME is already the sum of the times of the workers
+  if number_of_workers==1:
+    timing.TOTAL_TIME += t2-t1
   if mpi_version:
     timing.mpi_merge(comm)
 
 
 # Compute mean value and standard deviation
   if rank==0:
+# In a sweep, the files other than lyapounov.dat are written for each V0, e.g. log_trans_V0_1.0.dat
+    if sweep:
+      tab_postfix = ['_V0_'+str(V0) for V0 in tab_V0]
+    else:
+      tab_postfix = ['']
     if debug:
-      np.savetxt('log_trans.dat',np.column_stack((tab_x,tab_global_log_trans/(n_config*nprocs))))
-    global_lyapounov /= n_config*nprocs
-    if n_config*nprocs>1:
-      global_lyapounov[1] = np.sqrt(np.abs(global_lyapounov[1]-global_lyapounov[0]**2)/(n_config*nprocs-1))
+      for k in range(number_of_V0):
+        np.savetxt('log_trans'+tab_postfix[k]+'.dat',np.column_stack((tab_x,tab_global_log_trans[k]/n_config)))
+    global_lyapounov /= n_config
+    if n_config>1:
+      global_lyapounov[1] = np.sqrt(np.abs(global_lyapounov[1]-global_lyapounov[0]**2)/(n_config-1))
     else:
       global_lyapounov[1] = 0.0
 #    print(tab_global_lyapounov[0])
-    anderson.io.output_density('lyapounov.dat',global_lyapounov,H,header_string=header_string,tab_abscissa=[H.disorder_strength,lyapounov.energy],data_type='lyapounov')
+    anderson.io.output_density('lyapounov.dat',global_lyapounov,H,header_string=header_string,tab_abscissa=[tab_V0,lyapounov.tab_energy],data_type='lyapounov')
+    if all_exponents:
+      global_spectrum /= n_config
+      if n_config>1:
+        global_spectrum[1] = np.sqrt(np.abs(global_spectrum[1]-global_spectrum[0]**2)/(n_config-1))
+      else:
+        global_spectrum[1] = 0.0
+      for k in range(number_of_V0):
+        anderson.io.output_density('lyapounov_spectrum'+tab_postfix[k]+'.dat',global_spectrum[:,k],H,header_string=header_string,tab_abscissa=lyapounov.tab_energy,data_type='lyapounov_spectrum')
 
     """
 
@@ -167,6 +281,10 @@ def main():
       print("MPI time                            = {0:.3f}".format(timing.MPI_TIME))
     print()
     print("Total time                          = {0:.3f}".format(timing.TOTAL_TIME))
+    if mpi_version or number_of_workers>1:
+      print(timing.statistics_string(),end='')
+# The run is complete, the checkpoint is no longer needed
+  anderson.io.remove_checkpoint(checkpoint_file)
 
 if __name__ == "__main__":
   main()
@@ -60,6 +60,7 @@ Various disorder types can be used, defined by the disorder_type variable:
 
 import os
 import time
+import copy
 import numpy as np
 import getpass
 import sys
@@ -74,6 +75,10 @@ import anderson
 def main():
   parser = argparse.ArgumentParser(description='Compute temporal propagation using the Gross-Pitaevskii or Schoedinger equation')
   parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing parameters of the calculation')
+  parser.add_argument('--resume', action='store_true', help='restart from the last checkpoint, if any')
+  parser.add_argument('--checkpoint_interval', type=float, default=600.0, help='wallclock time (in seconds) between two checkpoints, 0 for no checkpoint [default=600]')
+  parser.add_argument('--workers', type=int, default=1, help='without MPI, number of local processes among which the disorder configurations are distributed [default=1]')
+  parser.add_argument('--static', action='store_true', help='distribute the disorder configurations statically among the processes, for bit-reproducible results [default=dynamic distribution]')
   args = parser.parse_args()
   parameter_file = args.filename.name
 
@@ -87,6 +92,9 @@ def main():
              +'Name of python script:  {}'.format(os.path.abspath( __file__ ))+'\n'\
              +'Name of parameter file: {}'.format(os.path.abspath(parameter_file))+'\n'\
              +mpi_string+'\n'
+  number_of_workers = anderson.io.get_number_of_workers(args,mpi_version,rank)
+  if number_of_workers>1:
+    environment_string += 'Disorder configurations distributed among '+str(number_of_workers)+' local worker processes\n'
 
   if rank==0:
     initial_time=time.asctime()
@@ -116,6 +124,16 @@ def main():
 #  print(initial_state.randomize_initial_state)
   t1=time.perf_counter()
   my_timing=anderson.timing.Timing()
+# Each process periodically saves its partial sums in a checkpoint file, used by --resume
+  checkpoint_file = anderson.io.checkpoint_file_name('checkpoint_prop',rank)
+  fingerprint = anderson.io.checkpoint_fingerprint(parameter_file,nprocs,n_config)
+  tab_done_config = []
+  if args.resume:
+    tab_done_config, accumulators = anderson.io.load_checkpoint(checkpoint_file,fingerprint,my_timing)
+    if accumulators is not None:
+      measurement_global.set_accumulators(accumulators)
+      print('Process '+str(rank)+' resumes after '+str(len(tab_done_config))+' disorder configurations')
+  last_checkpoint_time = t1
 
 #  if rank==0:
 
@@ -126,12 +144,46 @@ def main():
 # Print the initial density and wavefunction
 #  anderson.io.print_measurements_initial(measurement_global,initial_state,header_string=header_string)
 # Here starts the loop over disorder configurations
-  for i in range(n_config):
+# Computes the disorder configurations given by the scheduler, adding the results to measurement_global
+  def run_realizations(scheduler):
+    nonlocal last_checkpoint_time
+    if propagation.batch_size>1:
+# Batched propagation: several realizations of disorder are propagated simultaneously, each with its own measurement
+      tab_measurement = [measurement]+[copy.deepcopy(measurement) for k in range(propagation.batch_size-1)]
+      tab_i_seed = scheduler.next_batch(propagation.batch_size)
+      while len(tab_i_seed)>0:
+        anderson.propagation.gpe_evolution_batched(tab_i_seed, geometry, initial_state, H, propagation, tab_measurement[0:len(tab_i_seed)], my_timing, spectral_function=spectral_function)
+# Add the current contributions to the sum of previous ones
+        for k in range(len(tab_i_seed)):
+          measurement_global.merge_measurement(tab_measurement[k])
+        if args.checkpoint_interval>0.0 and time.perf_counter()-last_checkpoint_time>args.checkpoint_interval:
+          anderson.io.save_checkpoint(checkpoint_file,scheduler.tab_my_config,fingerprint,measurement_global.get_accumulators(),my_timing,elapsed_time=time.perf_counter()-t1)
+          last_checkpoint_time = time.perf_counter()
+        tab_i_seed = scheduler.next_batch(propagation.batch_size)
+    else:
+      for i in scheduler:
 # Propagation for one realization of disorder
 #    print(propagation.delta_t,propagation.t_max,propagation_spectral.delta_t,propagation_spectral.t_max,)
-    anderson.propagation.gpe_evolution(i+rank*n_config, geometry, initial_state, H, propagation,measurement, my_timing,spectral_function=spectral_function)
+        anderson.propagation.gpe_evolution(i, geometry, initial_state, H, propagation,measurement, my_timing,spectral_function=spectral_function)
 # Add the current contribution to the sum of previous ones
-    measurement_global.merge_measurement(measurement)
+        measurement_global.merge_measurement(measurement)
+        if args.checkpoint_interval>0.0 and time.perf_counter()-last_checkpoint_time>args.checkpoint_interval:
+          anderson.io.save_checkpoint(checkpoint_file,scheduler.tab_my_config,fingerprint,measurement_global.get_accumulators(),my_timing,elapsed_time=time.perf_counter()-t1)
+          last_checkpoint_time = time.perf_counter()
+# Without MPI, the disorder configurations may be distributed among local worker processes,
+# each returning its partial sums, its timing and its last initial wavefunction (None if it computed nothing)
+  if number_of_workers>1:
+    def worker(scheduler):
+      run_realizations(scheduler)
+      my_timing.TOTAL_TIME += time.perf_counter()-t1
+      return measurement_global.get_accumulators(), my_timing, initial_state.wfc if len(scheduler.tab_my_config)>0 else None
+    list_of_results = anderson.scheduler.run_workers(number_of_workers,worker,n_config,static=args.static)
+    measurement_global.set_accumulators(anderson.scheduler.sum_accumulators([result[0] for result in list_of_results]))
+    my_timing.merge([result[1] for result in list_of_results])
+    initial_state.wfc = [result[2] for result in list_of_results if result[2] is not None][0]
+  else:
+# The disorder configurations are distributed among the processes, dynamically, or statically with --static (see anderson.scheduler)
+    run_realizations(anderson.scheduler.Scheduler(mpi_version,comm,nprocs,rank,n_config,tab_done_config,static=args.static))
 # The following lines just for generating and printing a single realization of disorder
 #   H.generate_disorder(i+rank*n_config+1234)
 #   print(H.disorder)
@@ -148,7 +200,9 @@ def main():
 # Calculation is essentially finished
 # It remains to output the results
   t2 = time.perf_counter()
-  my_timing.TOTAL_TIME = t2-t1
+# With local workers, TOTAL_TIME is already the sum of the times of the workers
+  if number_of_workers==1:
+    my_timing.TOTAL_TIME += t2-t1
   if mpi_version:
     my_timing.mpi_merge(comm)
 
@@ -157,7 +211,7 @@ def main():
   if rank==0:
 # After the calculation, whether the C implementation has been used is known, hence recompute the header string
     environment_string+='Calculation   ended on: {}'.format(time.asctime())+'\n\n'
-    measurement_global.normalize(n_config*nprocs)
+    measurement_global.normalize(n_config)
 # Remove the hot pixel in momentum distribution if required
     if measurement_global.remove_hot_pixel and measurement_global.measure_density_momentum and initial_state.type=='plane_wave':
       index_to_remove = [0]
@@ -202,6 +256,10 @@ def main():
     my_timing.TOTAL_NOPS = my_timing.CHE_NOPS+my_timing.EXPECT_NOPS+my_timing.GPE_NOPS+my_timing.KPM_NOPS+my_timing.ODE_NOPS+my_timing.SPECTRUM_NOPS
     print("Total number of ops  = {0:.4e}".format(my_timing.TOTAL_NOPS))
     print("Total CPU time       = {0:.3f}".format(my_timing.TOTAL_TIME))
+    if mpi_version or number_of_workers>1:
+      print(my_timing.statistics_string(),end='')
+# The run is complete, the checkpoint is no longer needed
+  anderson.io.remove_checkpoint(checkpoint_file)
 
 if __name__ == "__main__":
   main()
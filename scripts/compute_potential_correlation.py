@@ -74,6 +74,7 @@ import anderson
 def main():
   parser = argparse.ArgumentParser(description='Compute the potential correlation function')
   parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing parameters of the calculation')
+  parser.add_argument('--static', action='store_true', help='distribute the disorder configurations statically among the processes, for bit-reproducible results [default=dynamic distribution]')
   args = parser.parse_args()
   parameter_file = args.filename.name
 
@@ -82,22 +83,21 @@ def main():
 # MPI processes to nprocs, the rank of the current process to rank, and
 # set mpi_string to something containing minimal MPI information
 # If not run inside MPI, nprocs=1 and rank=0
-  mpi_version = False
-  nprocs = 1
-  rank = 0
-  comm = None
+  mpi_version, comm, nprocs, rank, mpi_string = anderson.determine_if_launched_by_mpi()
   environment_string='Script ran by '+getpass.getuser()+' on machine '+os.uname()[1]+'\n'\
              +'Name of python script:  {}'.format(os.path.abspath( __file__ ))+'\n'\
-             +'Name of parameter file: {}'.format(os.path.abspath(parameter_file))+'\n'
+             +'Name of parameter file: {}'.format(os.path.abspath(parameter_file))+'\n'\
+             +mpi_string+'\n'
 
-  initial_time=time.asctime()
+  if rank==0:
+    initial_time=time.asctime()
 #    hostname = os.uname()[1].split('.')[0]
-  print("Python script runs on machine : "+os.uname()[1])
-  print("Name of python script:  {}".format(os.path.abspath( __file__ )))
-  print("Name of parameter file: {}".format(os.path.abspath(parameter_file)))
-  print()
-  print("Python script started on: {}".format(initial_time))
-  print()
+    print("Python script runs on machine : "+os.uname()[1])
+    print("Name of python script:  {}".format(os.path.abspath( __file__ )))
+    print("Name of parameter file: {}".format(os.path.abspath(parameter_file)))
+    print()
+    print("Python script started on: {}".format(initial_time))
+    print()
 
 # Parse parameter file and prepare the useful objects:
 # H for the Hamiltonian of the system
@@ -127,19 +127,23 @@ def main():
 # Print the initial density and wavefunction
 #  anderson.io.print_measurements_initial(measurement_global,initial_state,header_string=header_string)
 # Here starts the loop over disorder configurations
-  for i in range(n_config):
+# The configurations are distributed among the processes, dynamically, or statically with --static (see anderson.scheduler)
+  pot_correl = np.zeros(H.tab_dim)
+  for i in anderson.scheduler.Scheduler(mpi_version,comm,nprocs,rank,n_config,static=args.static):
 # The following lines just for generating and printing a single realization of disorder
-    H.generate_disorder(i+rank*n_config+1234)
+    H.generate_disorder(i+1234)
 #   print(H.disorder)
     if i==0:
       anderson.io.my_save_routine('potential.dat',H.disorder-H.diagonal,header=header_string)
 # The following lines for computing the potential correlation function
-      pot_correl = np.real(anderson.compute_correlation(H.disorder-H.diagonal,H.disorder-H.diagonal,shift_center=True))
-    else:
-      pot_correl += np.real(anderson.compute_correlation(H.disorder-H.diagonal,H.disorder-H.diagonal,shift_center=True))
-  pot_correl /= n_config
+    pot_correl += np.real(anderson.compute_correlation(H.disorder-H.diagonal,H.disorder-H.diagonal,shift_center=True))
+# The numbers of configurations computed by the processes differ, hence the sums (not the averages) are merged
+  if mpi_version:
+    pot_correl, = anderson.measurement.mpi_reduce_arrays(comm,[pot_correl])
+  if rank==0:
+    pot_correl /= n_config
 #  np.savetxt('potential_correlation.dat',pot_correl,header=header_string)
-  anderson.io.my_save_routine('potential_correlation.dat',pot_correl,header=header_string)
+    anderson.io.my_save_routine('potential_correlation.dat',pot_correl,header=header_string)
 
 
 # Calculation is essentially finished
@@ -148,11 +152,12 @@ def main():
   my_timing.TOTAL_TIME = t2-t1
 
 
-  final_time = time.asctime()
-  print("Python script ended on: {}".format(final_time))
-  print("Wallclock time {0:.3f} seconds".format(t2-t1))
-  print()
-  print("Total CPU time       = {0:.3f}".format(my_timing.TOTAL_TIME))
+  if rank==0:
+    final_time = time.asctime()
+    print("Python script ended on: {}".format(final_time))
+    print("Wallclock time {0:.3f} seconds".format(t2-t1))
+    print()
+    print("Total CPU time       = {0:.3f}".format(my_timing.TOTAL_TIME))
 
 if __name__ == "__main__":
   main()
@@ -58,6 +58,28 @@ def determine_unique_postfix(fn):
   return '_XXX'
 
 
+# Binary files (.h5 or .npz, written with output_format = hdf5 or npz) contain all intermediate times
+# of an observable, the grid sizes and discretization steps being stored as attributes
+def read_binary(file_name,time_index):
+  if file_name.endswith('.npz'):
+    with np.load(file_name) as f:
+      arr = f['data']
+      has_time = 'time' in f.files
+      tab_dim = f['attribute_tab_dim']
+      tab_delta = f['attribute_tab_delta']
+  else:
+    import h5py
+    with h5py.File(file_name,'r') as f:
+      arr = f['data'][()]
+      has_time = 'time' in f
+      tab_dim = f['data'].attrs['tab_dim']
+      tab_delta = f['data'].attrs['tab_delta']
+  if has_time:
+    arr = arr[time_index]
+  if arr.ndim>2:
+    arr = arr[0]
+  return arr, int(tab_dim[0]), int(tab_dim[1]), float(tab_delta[0]), float(tab_delta[1])
+
 def main():
   parser = argparse.ArgumentParser(description='Extract data from a 2D (numpy.savetxt format) file, and prints a 1D radial average, after proper smoothing',usage='use "%(prog)s -h" for more information',formatter_class=argparse.RawTextHelpFormatter)
   parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing the 2D data')
@@ -78,6 +100,7 @@ def main():
   parser.add_argument('-m','--r_min', type=float, default=0.0, help='minimum radius [default=0.0]')
   parser.add_argument('-M','--r_max', type=float, default=None, help='maximum radius [default=min(size_x,size_y)/2]')
   parser.add_argument('-i','--interval_width', type=float, default=None, help='width of elementary interval for spline [default=min(size_x,size_y)/2]')
+  parser.add_argument('-t','--time_index', type=int, default=-1, help='for binary .h5 or .npz files, index of the intermediate time [default=-1, the last one]')
   args = parser.parse_args()
   file_name = args.filename.name
   my_choice = args.column
@@ -89,9 +112,17 @@ def main():
   r_min = args.r_min
   r_max = args.r_max
   interval_width = args.interval_width
+  time_index = args.time_index
 
-  try:
-    arr=np.loadtxt(file_name,dtype=np.float64)
+  binary_file = file_name.endswith('.h5') or file_name.endswith('.npz')
+  if binary_file:
+    arr, n1, n2, delta1, delta2 = read_binary(file_name,time_index)
+  else:
+    try:
+      arr=np.loadtxt(file_name,dtype=np.float64)
+    except ValueError:
+      arr=np.loadtxt(file_name,dtype=np.complex128)
+  if not np.iscomplexobj(arr):
     if my_choice==3:
       Z=np.abs(arr)
       specific_string='_modulus'
@@ -105,8 +136,7 @@ def main():
       specific_string=''
     if my_choice>3 or my_choice<0:
       sys.exit('Illegal choice "'+str(my_choice)+'" for -c argument')
-  except ValueError:
-    arr=np.loadtxt(file_name,dtype=np.complex128)
+  else:
     if my_choice==3:
       Z=np.abs(arr)
       specific_string='_modulus'
@@ -122,32 +152,33 @@ def main():
     if my_choice>3 or my_choice<0:
       sys.exit('Illegal choice "'+str(my_choice)+'" for -c argument')
 
-  # Try to extract information from the first four lines
-  try:
-    f = open(file_name,'r')
-    line=(f.readline().lstrip('#')).split()
-    n1=int(line[0])
-    found_delta = False
-    if len(line)>1:
-      delta1=float(line[-1])
-      found_delta = True
-    else:
-      delta1=1.0
-    line=(f.readline().lstrip('#')).split()
-    n2=int(line[0])
-    if len(line)>1:
-      delta2=float(line[-1])
-    else:
-      delta2=1.0
-    if not found_delta:
+  if not binary_file:
+    # Try to extract information from the first four lines
+    try:
+      f = open(file_name,'r')
       line=(f.readline().lstrip('#')).split()
-      delta1=float(line[-1])
+      n1=int(line[0])
+      found_delta = False
+      if len(line)>1:
+        delta1=float(line[-1])
+        found_delta = True
+      else:
+        delta1=1.0
       line=(f.readline().lstrip('#')).split()
-      delta2=float(line[-1])
-  except:
-    n1,n2 = Z.shape
-    delta1=1.0
-    delta2=1.0
+      n2=int(line[0])
+      if len(line)>1:
+        delta2=float(line[-1])
+      else:
+        delta2=1.0
+      if not found_delta:
+        line=(f.readline().lstrip('#')).split()
+        delta1=float(line[-1])
+        line=(f.readline().lstrip('#')).split()
+        delta2=float(line[-1])
+    except:
+      n1,n2 = Z.shape
+      delta1=1.0
+      delta2=1.0
 
   if r_max == None:
     r_max = min(0.5*n1*delta1,0.5*n2*delta2)
@@ -163,6 +194,10 @@ def main():
   print('Maximum value = ',Z.max())
   print('Minimum value = ',Z.min())
   name, ext = os.path.splitext(file_name)
+# The radial data is always written as text, tagged with the time index for binary input files
+  if binary_file:
+    name = name+'_'+str(time_index)
+    ext = '.dat'
   name = name+specific_string
   density_radial_file_name=name+'_radial'+ext
   #g = open(density_radial_file_name,'w')
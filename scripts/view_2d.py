@@ -7,10 +7,28 @@ import matplotlib.cm as cm
 import matplotlib.mlab as mlab
 import matplotlib.pyplot as plt
 
+# Binary files (.h5 or .npz, written with output_format = hdf5 or npz) contain all intermediate times
+# of an observable; time_index selects one of them. If the snapshot carries mean and std. deviation, the mean is used.
+def read_binary(file_name,time_index,dimension):
+  if file_name.endswith('.npz'):
+    with np.load(file_name) as f:
+      arr = f['data']
+      has_time = 'time' in f.files
+  else:
+    import h5py
+    with h5py.File(file_name,'r') as f:
+      arr = f['data'][()]
+      has_time = 'time' in f
+  if has_time:
+    arr = arr[time_index]
+  if arr.ndim>dimension:
+    arr = arr[0]
+  return arr
+
 #for arg in sys.argv:
 #  print arg
-if len(sys.argv)<2 or len(sys.argv)>3:
-  print('Usage: view_2d.py file [argument]')
+if len(sys.argv)<2 or len(sys.argv)>4:
+  print('Usage: view_2d.py file [argument] [time_index]')
   print('       file: a real or complex 2d numpy.savetxt file') 
   print('       argument for complex data:')
   print('         0: real part [default]')
@@ -20,20 +38,30 @@ if len(sys.argv)<2 or len(sys.argv)>3:
   print('       argument for real data:')
   print('         0: data [default]')
   print('         2: data**2')
+  print('       time_index: for binary .h5 or .npz files, index of the intermediate time [default: last]')
   sys.exit()
 
 my_choice=0
-if len(sys.argv)==3:
+if len(sys.argv)>=3:
   my_choice=int(sys.argv[2])
+time_index=-1
+if len(sys.argv)==4:
+  time_index=int(sys.argv[3])
+binary_file = sys.argv[1].endswith('.h5') or sys.argv[1].endswith('.npz')
 
-try:
-  arr=np.loadtxt(sys.argv[1],dtype=np.float64)
+if binary_file:
+  arr=read_binary(sys.argv[1],time_index,2)
+else:
+  try:
+    arr=np.loadtxt(sys.argv[1],dtype=np.float64)
+  except:
+    arr=np.loadtxt(sys.argv[1],dtype=np.complex128)
+if not np.iscomplexobj(arr):
   if my_choice==2:
     Z=np.abs(arr)**2
   else:
     Z=arr
-except:
-  arr=np.loadtxt(sys.argv[1],dtype=np.complex128)
+else:
   if my_choice==3:
     Z=np.abs(arr)
   if my_choice==2:
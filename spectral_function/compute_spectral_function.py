@@ -63,6 +63,7 @@ import time
 import numpy as np
 import getpass
 import sys
+import copy
 import argparse
 sys.path.append('/users/champ/delande/git/and-python')
 sys.path.append('/home/lkb/delande/git/and-python')
@@ -72,6 +73,10 @@ import anderson
 def main():
   parser = argparse.ArgumentParser(description='Compute spectral function using the Gross-Pitaevskii or Schoedinger equation')
   parser.add_argument('filename', type=argparse.FileType('r'), help='name of the file containing parameters of the calculation')
+  parser.add_argument('--resume', action='store_true', help='restart from the last checkpoint, if any')
+  parser.add_argument('--checkpoint_interval', type=float, default=600.0, help='wallclock time (in seconds) between two checkpoints, 0 for no checkpoint [default=600]')
+  parser.add_argument('--workers', type=int, default=1, help='without MPI, number of local processes among which the disorder configurations are distributed [default=1]')
+  parser.add_argument('--static', action='store_true', help='distribute the disorder configurations statically among the processes, for bit-reproducible results [default=dynamic distribution]')
   args = parser.parse_args()
   parameter_file = args.filename.name
 
@@ -85,6 +90,9 @@ def main():
              +'Name of python script:  {}'.format(os.path.abspath( __file__ ))+'\n'\
              +'Name of parameter file: {}'.format(os.path.abspath(parameter_file))+'\n'\
              +mpi_string+'\n'
+  number_of_workers = anderson.io.get_number_of_workers(args,mpi_version,rank)
+  if number_of_workers>1:
+    environment_string += 'Disorder configurations distributed among '+str(number_of_workers)+' local worker processes\n'
 
   if rank==0:
     initial_time=time.asctime()
@@ -120,22 +128,123 @@ def main():
 # If the initial state is not randomized for each disorder configuration, it must be set once before the loop  
 #  if not initial_state.randomize_initial_state:
 #    initial_state.prepare_initial_state(seed=2345)  
+# In a sweep over disorder strengths (V0_list in the Disorder section), one Spectral_function object per V0
+# accumulates the results, and the random field of each configuration is generated only once
+  sweep = H.tab_disorder_strength is not None
+  tab_spectral_function = [spectral_function]
+  if sweep:
+# Shallow copies (the C routines cannot be deep copied), each with its own accumulators
+    for k in range(H.tab_disorder_strength.size-1):
+      my_spectral_function = copy.copy(spectral_function)
+      my_spectral_function.tab_spectrum = np.zeros_like(spectral_function.tab_spectrum)
+      my_spectral_function.tab_mu = np.zeros_like(spectral_function.tab_mu)
+      tab_spectral_function.append(my_spectral_function)
+    if spectral_function.moments_file is not None:
+      if rank==0:
+        print('Warning, the moments file is not used in a sweep over V0\n')
+      for my_spectral_function in tab_spectral_function:
+        my_spectral_function.moments_file = None
+# If a moments file is specified and contains compatible moments, the spectrum is rebuilt from them
+# without any new KPM calculation
+  moments_key = spectral_function.moments_key(geometry, initial_state, H, n_config)
+  use_cached_moments = False
+  if rank==0 and spectral_function.moments_file is not None:
+    use_cached_moments = spectral_function.load_moments(moments_key)
+    if use_cached_moments:
+      print('Chebyshev moments read from',spectral_function.moments_file,'\n')
+  if mpi_version:
+    use_cached_moments = comm.bcast(use_cached_moments)
+# Each process periodically saves its partial sums in a checkpoint file, used by --resume
+  checkpoint_file = anderson.io.checkpoint_file_name('checkpoint_spectral_function',rank)
+  fingerprint = anderson.io.checkpoint_fingerprint(parameter_file,nprocs,n_config)
+# In a sweep, the checkpoint contains one set of accumulators per V0
+  if sweep:
+    tab_key_postfix = ['_'+str(k) for k in range(len(tab_spectral_function))]
+  else:
+    tab_key_postfix = ['']
+# The accumulators of all V0, as saved in a checkpoint
+  def get_accumulators():
+    accumulators = {}
+    for k in range(len(tab_spectral_function)):
+      accumulators['tab_spectrum'+tab_key_postfix[k]] = tab_spectral_function[k].tab_spectrum
+      accumulators['tab_mu'+tab_key_postfix[k]] = tab_spectral_function[k].tab_mu
+    return accumulators
+  def set_accumulators(accumulators):
+    for k in range(len(tab_spectral_function)):
+      tab_spectral_function[k].tab_spectrum = accumulators['tab_spectrum'+tab_key_postfix[k]]
+      tab_spectral_function[k].tab_mu = accumulators['tab_mu'+tab_key_postfix[k]]
+  tab_done_config = []
+  if args.resume and not use_cached_moments:
+    tab_done_config, accumulators = anderson.io.load_checkpoint(checkpoint_file,fingerprint,my_timing)
+    if accumulators is not None:
+      set_accumulators(accumulators)
+      print('Process '+str(rank)+' resumes after '+str(len(tab_done_config))+' disorder configurations')
+  last_checkpoint_time = t1
+# Computes the disorder configurations given by the scheduler, accumulating the results in tab_spectral_function
+  def run_realizations(scheduler):
+    nonlocal last_checkpoint_time
 # Here starts the loop over disorder configurations
-  for i in range(n_config):
-#    print(i,H.randomize_hamiltonian)
+    for i in scheduler:
+#      print(i,H.randomize_hamiltonian)
 # Compute the spectral function and accumulate it
-    spectral_function.tab_spectrum += spectral_function.compute_spectral_function(i+rank*n_config, geometry, initial_state, H, my_timing)
-  if mpi_version:
-    spectral_function.mpi_merge(comm,my_timing)
+      if sweep:
+        start_dummy_time = time.perf_counter()
+        if H.randomize_hamiltonian or H.seed==0:
+          if geometry.reproducible_randomness:
+            seed = i+1234+H.custom_seed
+          else:
+            seed = None
+          H.generate_normalized_disorder(seed)
+        my_timing.DUMMY_TIME += time.perf_counter()-start_dummy_time
+        for k in range(len(tab_spectral_function)):
+          H.set_disorder_strength(H.tab_disorder_strength[k])
+          tab_spectral_function[k].tab_spectrum += tab_spectral_function[k].compute_spectral_function(i, geometry, initial_state, H, my_timing, build_disorder=False, accumulate_moments=True)
+      else:
+        spectral_function.tab_spectrum += spectral_function.compute_spectral_function(i, geometry, initial_state, H, my_timing, accumulate_moments=True)
+      if args.checkpoint_interval>0.0 and time.perf_counter()-last_checkpoint_time>args.checkpoint_interval:
+        anderson.io.save_checkpoint(checkpoint_file,scheduler.tab_my_config,fingerprint,get_accumulators(),my_timing,elapsed_time=time.perf_counter()-t1)
+        last_checkpoint_time = time.perf_counter()
+  if not use_cached_moments:
+# Without MPI, the disorder configurations may be distributed among local worker processes,
+# each returning its partial sums (as in a checkpoint) and its timing
+    if number_of_workers>1:
+      def worker(scheduler):
+        run_realizations(scheduler)
+        my_timing.TOTAL_TIME += time.perf_counter()-t1
+        return get_accumulators(), my_timing
+      list_of_results = anderson.scheduler.run_workers(number_of_workers,worker,n_config,static=args.static)
+      set_accumulators(anderson.scheduler.sum_accumulators([result[0] for result in list_of_results]))
+      my_timing.merge([result[1] for result in list_of_results])
+    else:
+# The disorder configurations are distributed among the processes, dynamically, or statically with --static (see anderson.scheduler)
+      run_realizations(anderson.scheduler.Scheduler(mpi_version,comm,nprocs,rank,n_config,tab_done_config,static=args.static))
+    if mpi_version:
+      for my_spectral_function in tab_spectral_function:
+        my_spectral_function.mpi_merge(comm,my_timing)
   t2 = time.perf_counter()
-  my_timing.TOTAL_TIME = t2-t1
+# With local workers, TOTAL_TIME is already the sum of the times of the workers
+  if number_of_workers==1 or use_cached_moments:
+    my_timing.TOTAL_TIME += t2-t1
   if mpi_version:
     my_timing.mpi_merge(comm)
   if rank==0:
     environment_string+='Calculation   ended on: {}'.format(time.asctime())+'\n\n'
-    spectral_function.normalize(n_config*nprocs)
-    header_string = environment_string+anderson.io.output_string(H,n_config,nprocs,initial_state=initial_state,spectral_function=spectral_function, timing=my_timing)
-    anderson.io.print_spectral_function(spectral_function,geometry,initial_state=initial_state,header_string=header_string)
+    if use_cached_moments:
+      spectral_function.spectrum_from_moments(my_timing)
+    else:
+      for my_spectral_function in tab_spectral_function:
+        my_spectral_function.normalize(n_config)
+      if spectral_function.moments_file is not None:
+        spectral_function.save_moments(moments_key, n_config)
+    if sweep:
+# One file per V0, e.g. density_of_states_V0_1.0.dat
+      for k in range(len(tab_spectral_function)):
+        H.disorder_strength = H.tab_disorder_strength[k]
+        header_string = environment_string+anderson.io.output_string(H,n_config,nprocs,initial_state=initial_state,spectral_function=tab_spectral_function[k], timing=my_timing)
+        anderson.io.print_spectral_function(tab_spectral_function[k],geometry,initial_state=initial_state,header_string=header_string,postfix='_V0_'+str(H.disorder_strength))
+    else:
+      header_string = environment_string+anderson.io.output_string(H,n_config,nprocs,initial_state=initial_state,spectral_function=spectral_function, timing=my_timing)
+      anderson.io.print_spectral_function(spectral_function,geometry,initial_state=initial_state,header_string=header_string)
 
 
     final_time = time.asctime()
@@ -158,6 +267,10 @@ def main():
     my_timing.TOTAL_NOPS = my_timing.KPM_NOPS+my_timing.SPECTRUM_NOPS
     print("Total number of ops  = {0:.4e}".format(my_timing.TOTAL_NOPS))
     print("Total CPU time       = {0:.3f}".format(my_timing.TOTAL_TIME))
+    if mpi_version or number_of_workers>1:
+      print(my_timing.statistics_string(),end='')
+# The run is complete, the checkpoint is no longer needed
+  anderson.io.remove_checkpoint(checkpoint_file)
 
 if __name__ == "__main__":
   main()